@@ -18,6 +18,20 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 DEFAULT_MODEL = "gpt-4o"  # Domyślny model OpenAI
 DALL_E_MODEL = "dall-e-3"  # Model do generowania obrazów
 
+# Pula połączeń HTTP klienta OpenAI
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '100'))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '20'))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '120'))
+OPENAI_HTTP2 = os.getenv('OPENAI_HTTP2', 'true').lower() == 'true'
+# Limity czasu (sekundy): nawiązanie połączenia, odpowiedź niestrumieniowa,
+# przerwa między fragmentami odpowiedzi strumieniowej, oczekiwanie na wolne połączenie z puli
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))
+OPENAI_READ_TIMEOUT = float(os.getenv('OPENAI_READ_TIMEOUT', '120'))
+OPENAI_STREAM_IDLE_TIMEOUT = float(os.getenv('OPENAI_STREAM_IDLE_TIMEOUT', '30'))
+OPENAI_POOL_TIMEOUT = float(os.getenv('OPENAI_POOL_TIMEOUT', '10'))
+# Liczba połączeń otwieranych przy starcie bota (przy HTTP/2 wystarcza jedno)
+OPENAI_WARMUP_CONNECTIONS = int(os.getenv('OPENAI_WARMUP_CONNECTIONS', '4'))
+
 # Predefiniowane szablony promptów
 DEFAULT_SYSTEM_PROMPT = "Jesteś pomocnym asystentem AI."
 
@@ -28,6 +42,39 @@ AVAILABLE_MODELS = {
     "gpt-4o": "GPT-4o"
 }
 
+# Budżet tokenów promptu (system + historia + wiadomość) dla modeli - z zapasem na odpowiedź
+MODEL_CONTEXT_BUDGETS = {
+    "gpt-3.5-turbo": 12000,  # okno 16k
+    "gpt-4": 6000,           # okno 8k
+    "gpt-4o": 24000,         # okno 128k, ograniczone ze względu na koszt
+    "default": 6000
+}
+
+# Limity zapytań (RPM) i tokenów (TPM) na minutę dla modeli - zgodne z limitami konta OpenAI
+# Dla modeli obrazów liczone są tylko zapytania (tpm = None)
+MODEL_RATE_LIMITS = {
+    "gpt-3.5-turbo": {"rpm": 3500, "tpm": 200000},
+    "gpt-4": {"rpm": 500, "tpm": 10000},
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "dall-e-3": {"rpm": 5, "tpm": None},
+    "default": {"rpm": 500, "tpm": 10000}
+}
+# Część limitu wykorzystywana przez bota - zapas na niedokładność szacowania tokenów
+OPENAI_RATE_LIMIT_HEADROOM = float(os.getenv('OPENAI_RATE_LIMIT_HEADROOM', '0.9'))
+# Szacowana długość odpowiedzi rezerwowana przed wywołaniem bez max_tokens
+OPENAI_COMPLETION_TOKENS_ESTIMATE = int(os.getenv('OPENAI_COMPLETION_TOKENS_ESTIMATE', '1000'))
+
+# Ponawianie wywołań OpenAI przy błędach przejściowych (limit zapytań, przekroczenie czasu, 5xx)
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '3'))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv('OPENAI_RETRY_BASE_DELAY', '0.5'))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv('OPENAI_RETRY_MAX_DELAY', '20'))
+# Modele zapasowe używane po wyczerpaniu prób dla wybranego modelu
+OPENAI_MODEL_FALLBACK = os.getenv('OPENAI_MODEL_FALLBACK', 'true').lower() == 'true'
+MODEL_FALLBACK_CHAIN = {
+    "gpt-4": ["gpt-4o", "gpt-3.5-turbo"],
+    "gpt-4o": ["gpt-3.5-turbo"]
+}
+
 # System kredytów
 CREDIT_COSTS = {
     # Koszty wiadomości w zależności od modelu
@@ -45,9 +92,27 @@ CREDIT_COSTS = {
     },
     # Koszty analizy plików
     "document": 5,
-    "photo": 8
+    # Analiza lub tłumaczenie długiego dokumentu częściami - za każdą część ponad pierwszą
+    "document_part": 2,
+    "photo": 8,
+    # Tłumaczenie pliku PDF - za każdą przetłumaczoną stronę z tekstem
+    "pdf_page": 2
 }
 
+# Sposób naliczania opłaty za wiadomość: 'flat' (stała cena z CREDIT_COSTS["message"])
+# lub 'tokens' (według faktycznego zużycia tokenów i stawek z TOKEN_CREDIT_RATES)
+CREDIT_PRICING = os.getenv('CREDIT_PRICING', 'flat').lower()
+# Kredyty za 1000 tokenów promptu i odpowiedzi; modele bez stawki są rozliczane stałą ceną
+TOKEN_CREDIT_RATES = {
+    "gpt-3.5-turbo": {"prompt": 0.1, "completion": 0.3},
+    "gpt-4": {"prompt": 1.5, "completion": 3.0},
+    "gpt-4o": {"prompt": 0.5, "completion": 1.5}
+}
+# Najniższa opłata za wiadomość przy rozliczaniu według tokenów
+TOKEN_CREDIT_MIN_CHARGE = int(os.getenv('TOKEN_CREDIT_MIN_CHARGE', '1'))
+# Czy prosić API o zużycie tokenów w odpowiedzi strumieniowej (stream_options.include_usage)
+OPENAI_STREAM_USAGE = os.getenv('OPENAI_STREAM_USAGE', 'true').lower() == 'true'
+
 # Pakiety kredytów
 CREDIT_PACKAGES = [
     {"id": 1, "name": "Starter", "credits": 100, "price": 4.99},
@@ -183,10 +248,36 @@ CHAT_MODES = {
     }
 }
 
+# Backend bazy danych: "supabase" lub "sqlite" (wbudowana baza dla instalacji na jednym serwerze)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'supabase').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'bot_database.sqlite')
+
 # Konfiguracja Supabase
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
+# Pula połączeń HTTP dla asynchronicznego klienta bazy danych (PostgREST)
+SUPABASE_POOL_SIZE = int(os.getenv('SUPABASE_POOL_SIZE', '20'))
+SUPABASE_TIMEOUT = float(os.getenv('SUPABASE_TIMEOUT', '10'))
+# Limit wierszy w jednej odpowiedzi PostgREST (max_rows w supabase/config.toml)
+SUPABASE_MAX_ROWS = int(os.getenv('SUPABASE_MAX_ROWS', '1000'))
+# Liczba pozycji na stronie historii wiadomości i transakcji
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '10'))
+
+# Pamięć podręczna profili użytkowników (język, kredyty, limity, aktywna konwersacja)
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '10000'))
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', '300'))
+# Saldo może zmienić się poza procesem (webhooki płatności), więc wygasa szybciej
+PROFILE_CACHE_CREDITS_TTL = float(os.getenv('PROFILE_CACHE_CREDITS_TTL', '60'))
+
+# Kolejka zapisu wiadomości w tle (wielowierszowe INSERT-y)
+MESSAGE_QUEUE_BATCH_SIZE = int(os.getenv('MESSAGE_QUEUE_BATCH_SIZE', '50'))
+MESSAGE_QUEUE_FLUSH_INTERVAL = float(os.getenv('MESSAGE_QUEUE_FLUSH_INTERVAL', '0.5'))
+MESSAGE_QUEUE_MAX_PENDING = int(os.getenv('MESSAGE_QUEUE_MAX_PENDING', '10000'))
+# Opóźnienie ponowienia zapisu po błędzie przejściowym - rośnie wykładniczo do wartości maksymalnej
+MESSAGE_QUEUE_RETRY_BASE_DELAY = float(os.getenv('MESSAGE_QUEUE_RETRY_BASE_DELAY', '1'))
+MESSAGE_QUEUE_RETRY_MAX_DELAY = float(os.getenv('MESSAGE_QUEUE_RETRY_MAX_DELAY', '60'))
+
 # Konfiguracja subskrypcji - zmiana na model ilości wiadomości
 MESSAGE_PLANS = {
     100: {"name": "Pakiet Podstawowy", "price": 25.00},
@@ -198,6 +289,101 @@ MESSAGE_PLANS = {
 # Maksymalna długość kontekstu (historia konwersacji)
 MAX_CONTEXT_MESSAGES = 20
 
+# Bufor ostatnich wiadomości aktywnych konwersacji w pamięci
+HISTORY_BUFFER_SIZE = int(os.getenv('HISTORY_BUFFER_SIZE', str(MAX_CONTEXT_MESSAGES)))
+HISTORY_BUFFER_MAX_MESSAGES = int(os.getenv('HISTORY_BUFFER_MAX_MESSAGES', '200000'))
+HISTORY_BUFFER_IDLE_TTL = float(os.getenv('HISTORY_BUFFER_IDLE_TTL', '3600'))
+
+# Pamięć podręczna wyników analizy i tłumaczenia plików
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '1000'))
+# Katalog poziomu dyskowego - pusty wyłącza zapis na dysk
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', '')
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv('RESULT_CACHE_DISK_MAX_BYTES', str(200 * 1024 * 1024)))
+
+# Pamięć podręczna plików pobranych z Telegrama (file_unique_id): limit pamięci, największy
+# zapamiętywany plik, czas przechowywania od ostatniego użycia (s) oraz katalog poziomu
+# dyskowego, do którego trafiają pliki usunięte z pamięci - pusty wyłącza zapis na dysk
+MEDIA_CACHE_MEMORY_BYTES = int(os.getenv('MEDIA_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+MEDIA_CACHE_MAX_FILE_BYTES = int(os.getenv('MEDIA_CACHE_MAX_FILE_BYTES', str(20 * 1024 * 1024)))
+MEDIA_CACHE_TTL = float(os.getenv('MEDIA_CACHE_TTL', '3600'))
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', '')
+MEDIA_CACHE_DISK_MAX_BYTES = int(os.getenv('MEDIA_CACHE_DISK_MAX_BYTES', str(500 * 1024 * 1024)))
+# Dokumenty są pobierane strumieniowo do pliku tymczasowego - do tego rozmiaru trzymane w pamięci
+MEDIA_SPOOL_MEMORY_BYTES = int(os.getenv('MEDIA_SPOOL_MEMORY_BYTES', str(1024 * 1024)))
+# Największa ilość tekstu (bajty UTF-8) z dokumentu tekstowego przekazywana do analizy
+DOCUMENT_TEXT_MAX_BYTES = int(os.getenv('DOCUMENT_TEXT_MAX_BYTES', str(400 * 1024)))
+# Dłuższe dokumenty są analizowane częściami (map-reduce): liczba tokenów tekstu w części
+# (w tłumaczeniu mniejsza, aby tłumaczenie części zmieściło się w odpowiedzi), limit odpowiedzi
+# dla analizy części, limity jednoczesnych wywołań modelu i minimalny odstęp zgłaszania postępu (s)
+DOCUMENT_CHUNK_TOKENS = int(os.getenv('DOCUMENT_CHUNK_TOKENS', '6000'))
+DOCUMENT_TRANSLATE_CHUNK_TOKENS = int(os.getenv('DOCUMENT_TRANSLATE_CHUNK_TOKENS', '1200'))
+DOCUMENT_PARTIAL_MAX_TOKENS = int(os.getenv('DOCUMENT_PARTIAL_MAX_TOKENS', '600'))
+DOCUMENT_GLOBAL_CONCURRENCY = int(os.getenv('DOCUMENT_GLOBAL_CONCURRENCY', '8'))
+DOCUMENT_USER_CONCURRENCY = int(os.getenv('DOCUMENT_USER_CONCURRENCY', '3'))
+DOCUMENT_PROGRESS_INTERVAL = float(os.getenv('DOCUMENT_PROGRESS_INTERVAL', '3'))
+# Tłumaczenie plików PDF: największa liczba stron i liczba zadań tłumaczących jednostki tekstu równolegle
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', '200'))
+PDF_TRANSLATION_WORKERS = int(os.getenv('PDF_TRANSLATION_WORKERS', '4'))
+# Katalog z przetłumaczonymi (opłaconymi) stronami - wznowienie tłumaczenia nie tłumaczy ich i nie pobiera
+# za nie opłaty ponownie, również po usunięciu z pamięci podręcznej lub restarcie bota; pusty wyłącza zapis
+PDF_PROGRESS_DIR = os.getenv('PDF_PROGRESS_DIR', 'pdf_progress')
+PDF_PROGRESS_MAX_BYTES = int(os.getenv('PDF_PROGRESS_MAX_BYTES', str(200 * 1024 * 1024)))
+
+# Pule dla pracy blokującej (utils.executor): wątki dla kodu w C zwalniającego GIL (obrazy, Base64),
+# procesy dla PDF i wykresów; queue - zadania czekające na wolny wątek/proces, timeout - limit czasu zadania (s)
+EXECUTOR_POOLS = {
+    "threads": {
+        "kind": "thread",
+        "workers": int(os.getenv('EXECUTOR_THREAD_WORKERS', '4')),
+        "queue": int(os.getenv('EXECUTOR_THREAD_QUEUE', '64')),
+        "timeout": float(os.getenv('EXECUTOR_THREAD_TIMEOUT', '30'))
+    },
+    "pdf": {
+        "kind": "process",
+        "workers": int(os.getenv('EXECUTOR_PDF_WORKERS', '2')),
+        "queue": int(os.getenv('EXECUTOR_PDF_QUEUE', '8')),
+        "timeout": float(os.getenv('EXECUTOR_PDF_TIMEOUT', '60'))
+    },
+    "charts": {
+        "kind": "process",
+        "workers": int(os.getenv('EXECUTOR_CHART_WORKERS', '1')),
+        "queue": int(os.getenv('EXECUTOR_CHART_QUEUE', '8')),
+        "timeout": float(os.getenv('EXECUTOR_CHART_TIMEOUT', '30'))
+    }
+}
+# Sposób uruchamiania procesów pul ('forkserver', 'spawn' lub 'fork')
+EXECUTOR_START_METHOD = os.getenv('EXECUTOR_START_METHOD', 'forkserver')
+
+# Przygotowanie obrazów przed analizą: szczegółowość ('auto' - według rozmiaru i zadania, 'low', 'high')
+# oraz jakość ponownej kompresji JPEG
+IMAGE_DETAIL = os.getenv('IMAGE_DETAIL', 'auto').lower()
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+
+# Wyświetlanie odpowiedzi strumieniowych - minimalny odstęp edycji (s) w czacie prywatnym i grupowym,
+# liczba edycji na sekundę dzielona między wszystkie odpowiedzi oraz długość jednej wiadomości
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+STREAM_EDIT_INTERVAL_GROUP = float(os.getenv('STREAM_EDIT_INTERVAL_GROUP', '3.0'))
+STREAM_GLOBAL_EDITS_PER_SECOND = float(os.getenv('STREAM_GLOBAL_EDITS_PER_SECOND', '25'))
+STREAM_MESSAGE_LIMIT = int(os.getenv('STREAM_MESSAGE_LIMIT', '4000'))  # limit Telegrama to 4096 znaków
+
+# Limity wysyłania wiadomości przez Bot API (wywołania na sekundę): cały bot, czat prywatny,
+# grupa oraz liczba wywołań, które czat może wysłać od razu
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE', str(20 / 60)))
+TELEGRAM_CHAT_BURST = float(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+
+# Liczba aktualizacji obsługiwanych równolegle (różni użytkownicy nie czekają na siebie)
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '256'))
+# Zadania jednego użytkownika: wykonywane jednocześnie, oczekujące w kolejce
+USER_MAX_CONCURRENT = int(os.getenv('USER_MAX_CONCURRENT', '1'))
+USER_MAX_QUEUED = int(os.getenv('USER_MAX_QUEUED', '5'))
+# Czy nowa wiadomość tekstowa przerywa odpowiedź generowaną dla poprzedniej
+USER_SUPERSEDE_REPLIES = os.getenv('USER_SUPERSEDE_REPLIES', 'false').lower() == 'true'
+
+# Co ile sekund statystyki kolejek, pul i pamięci podręcznych trafiają do logu (0 - wyłączone)
+METRICS_LOG_INTERVAL = float(os.getenv('METRICS_LOG_INTERVAL', '300'))
+
 # Program referencyjny
 REFERRAL_CREDITS = 50  # Kredyty za zaproszenie nowego użytkownika
 REFERRAL_BONUS = 25    # Bonus dla zaproszonego użytkownika
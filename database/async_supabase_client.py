@@ -0,0 +1,781 @@
+"""
+Asynchroniczna warstwa dostępu do danych - odpowiednik database/supabase_client.py
+Rozmawia bezpośrednio z PostgREST przez współdzieloną pulę połączeń httpx,
+dzięki czemu handlery mogą używać `await` i nie blokują pętli zdarzeń
+"""
+import datetime
+import logging
+import httpx
+import pytz
+from config import (
+    SUPABASE_URL, SUPABASE_KEY, SUPABASE_POOL_SIZE, SUPABASE_TIMEOUT, SUPABASE_MAX_ROWS,
+    HISTORY_BUFFER_SIZE, STORAGE_BACKEND
+)
+from database.profile_cache import get_cached, cache_profile, invalidate_profile
+from database.history_buffer import get_buffered_history, hydrate_history, append_history, is_history_loaded
+
+logger = logging.getLogger(__name__)
+
+# Współdzielony klient HTTP - tworzony leniwie przy pierwszym zapytaniu
+_client = None
+# Opcjonalny transport (np. database.postgrest_stub.PostgRESTStub w testach)
+_transport = None
+
+def set_transport(transport):
+    """
+    Podmienia transport HTTP używany przez klienta
+
+    Args:
+        transport: Obiekt httpx.AsyncBaseTransport lub None dla transportu sieciowego
+    """
+    global _client, _transport
+    _transport = transport
+    _client = None
+
+def get_client():
+    """Zwraca współdzielonego klienta httpx z pulą połączeń do PostgREST"""
+    global _client
+    if _client is None:
+        base_url = f"{SUPABASE_URL or 'http://localhost:54321'}/rest/v1"
+        _client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={
+                "apikey": SUPABASE_KEY or "",
+                "Authorization": f"Bearer {SUPABASE_KEY or ''}",
+                "Content-Type": "application/json"
+            },
+            limits=httpx.Limits(
+                max_connections=SUPABASE_POOL_SIZE,
+                max_keepalive_connections=SUPABASE_POOL_SIZE
+            ),
+            timeout=SUPABASE_TIMEOUT,
+            transport=_transport
+        )
+    return _client
+
+async def close_client():
+    """Zamyka pulę połączeń - wywoływane przy zamykaniu aplikacji"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+# Niskopoziomowe operacje PostgREST
+async def _request(method, path, params=None, json=None, prefer=None):
+    """Wykonuje zapytanie do PostgREST i zwraca zdekodowaną odpowiedź"""
+    headers = {"Prefer": prefer} if prefer else None
+    response = await get_client().request(method, path, params=params, json=json, headers=headers)
+    response.raise_for_status()
+
+    if response.status_code == 204 or not response.content:
+        return []
+    return response.json()
+
+async def _select(table, columns='*', filters=None, order=None, limit=None):
+    """SELECT z tabeli; filters to lista krotek (kolumna, 'op.wartość')"""
+    params = [('select', columns)]
+    params.extend(filters or [])
+    if order:
+        params.append(('order', order))
+    if limit is not None:
+        params.append(('limit', str(limit)))
+    return await _request('GET', f"/{table}", params=params)
+
+async def _insert(table, data):
+    """INSERT do tabeli, zwraca wstawione wiersze"""
+    return await _request('POST', f"/{table}", json=data, prefer='return=representation')
+
+async def _update(table, data, filters):
+    """UPDATE wierszy spełniających filtry, zwraca zaktualizowane wiersze"""
+    return await _request('PATCH', f"/{table}", params=filters, json=data, prefer='return=representation')
+
+async def _rpc(function_name, params=None):
+    """Wywołuje funkcję bazy danych (stored procedure) przez /rpc"""
+    return await _request('POST', f"/rpc/{function_name}", json=params or {})
+
+async def _select_page(table, filters=None, cursor=None, direction='older', page_size=10, columns='*'):
+    """
+    Pobiera stronę wierszy metodą keyset (kursor po parze (created_at, id))
+
+    Zamiast OFFSET zapytanie zaczyna od wiersza wskazanego kursorem, więc koszt
+    pobrania strony nie zależy od tego, jak daleko w historii się ona znajduje.
+
+    Args:
+        table (str): Nazwa tabeli
+        filters (list): Dodatkowe filtry (kolumna, 'op.wartość')
+        cursor (tuple, optional): (created_at, id) wiersza granicznego; None oznacza najnowszą stronę
+        direction (str): 'older' - wiersze starsze od kursora, 'newer' - nowsze od kursora
+        page_size (int): Liczba wierszy na stronie
+
+    Returns:
+        dict: items (wiersze od najnowszego), has_older, has_newer,
+              older_cursor i newer_cursor (kursory do sąsiednich stron)
+    """
+    params = list(filters or [])
+    if cursor is not None:
+        params.append(_keyset_filter(cursor, 'lt' if direction == 'older' else 'gt'))
+
+    if direction == 'newer' and cursor is not None:
+        rows = await _select(table, columns, params, order='created_at.asc,id.asc', limit=page_size + 1)
+        if len(rows) <= page_size:
+            # Doszliśmy do końca - pokazujemy pełną najnowszą stronę
+            return await _select_page(table, filters, None, 'older', page_size, columns)
+        rows = rows[:page_size]
+        rows.reverse()
+        has_older, has_newer = True, True
+    else:
+        rows = await _select(table, columns, params, order='created_at.desc,id.desc', limit=page_size + 1)
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        has_older, has_newer = has_more, cursor is not None and bool(rows)
+
+    return {
+        'items': rows,
+        'has_older': has_older,
+        'has_newer': has_newer,
+        'older_cursor': (rows[-1]['created_at'], rows[-1]['id']) if rows else None,
+        'newer_cursor': (rows[0]['created_at'], rows[0]['id']) if rows else None
+    }
+
+async def _select_all(table, filters=None, columns='*'):
+    """
+    Pobiera wszystkie wiersze spełniające filtry (rosnąco po created_at, id),
+    stronami po SUPABASE_MAX_ROWS - odpowiedzi PostgREST są obcinane do max_rows
+    """
+    rows = []
+    cursor = None
+    while True:
+        params = list(filters or [])
+        if cursor is not None:
+            params.append(_keyset_filter(cursor, 'gt'))
+        page = await _select(table, columns, params, order='created_at.asc,id.asc', limit=SUPABASE_MAX_ROWS)
+        rows.extend(page)
+        if len(page) < SUPABASE_MAX_ROWS:
+            return rows
+        cursor = (page[-1]['created_at'], page[-1]['id'])
+
+def _keyset_filter(cursor, operator):
+    """Filtr wierszy leżących za kursorem (created_at, id) w kierunku operatora 'lt' lub 'gt'"""
+    created_at, row_id = cursor
+    return ('or', f'(created_at.{operator}."{created_at}",and(created_at.eq."{created_at}",id.{operator}.{row_id}))')
+
+def _eq(value):
+    """Formatuje wartość dla filtra eq"""
+    if isinstance(value, bool):
+        return f"eq.{str(value).lower()}"
+    return f"eq.{value}"
+
+def _now():
+    return datetime.datetime.now(pytz.UTC).isoformat()
+
+def _cache_user_row(user_id, user):
+    """Zapisuje w pamięci podręcznej pola profilu z wiersza tabeli users"""
+    cache_profile(
+        user_id,
+        language=user.get('language') or user.get('language_code'),
+        messages_limit=user.get('messages_limit'),
+        messages_used=user.get('messages_used')
+    )
+
+def _cache_balance(user_id, balance):
+    """Zapamiętuje saldo zwrócone przez funkcję bazy lub unieważnia je, gdy jest nieznane"""
+    if balance is None:
+        invalidate_profile(user_id, 'credits')
+    else:
+        cache_profile(user_id, credits=balance)
+
+# Funkcje zarządzania użytkownikami
+async def get_or_create_user(user_id, username=None, first_name=None, last_name=None, language_code=None):
+    """Pobierz lub utwórz użytkownika w bazie danych"""
+    try:
+        rows = await _select('users', filters=[('id', _eq(user_id))])
+
+        if rows:
+            _cache_user_row(user_id, rows[0])
+            return rows[0]
+
+        user_data = {
+            'id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name,
+            'language_code': language_code,
+            'language': language_code,
+            'created_at': _now(),
+            'is_active': True,
+            'messages_used': 0,
+            'messages_limit': 0
+        }
+
+        rows = await _insert('users', user_data)
+
+        if rows:
+            _cache_user_row(user_id, rows[0])
+            await init_user_credits(user_id)
+            return rows[0]
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu/tworzeniu użytkownika: {e}")
+
+    return None
+
+async def update_user_language(user_id, language):
+    """Aktualizuje język użytkownika w bazie danych"""
+    try:
+        rows = await _update('users', {'language': language}, [('id', _eq(user_id))])
+        if rows:
+            cache_profile(user_id, language=language)
+        return True if rows else False
+    except Exception as e:
+        logger.error(f"Błąd przy aktualizacji języka użytkownika: {e}")
+        return False
+
+async def get_user_language(user_id):
+    """Pobiera język użytkownika"""
+    cached = get_cached(user_id, 'language')
+    if cached is not None:
+        return cached
+
+    try:
+        rows = await _select('users', 'language,language_code', [('id', _eq(user_id))])
+
+        if rows:
+            language = rows[0].get('language') or rows[0].get('language_code')
+            cache_profile(user_id, language=language)
+            return language or "pl"
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu języka użytkownika: {e}")
+
+    return "pl"
+
+# Funkcje obsługi kredytów
+async def init_user_credits(user_id):
+    """Inicjalizuje rekord kredytów dla użytkownika"""
+    try:
+        rows = await _insert('user_credits', {
+            'user_id': user_id,
+            'credits_amount': 0,
+            'total_credits_purchased': 0,
+            'total_spent': 0
+        })
+        if rows:
+            cache_profile(user_id, credits=0)
+        return True if rows else False
+    except Exception as e:
+        logger.error(f"Błąd przy inicjalizacji kredytów użytkownika: {e}")
+        return False
+
+async def get_user_credits(user_id):
+    """Pobiera liczbę kredytów użytkownika"""
+    cached = get_cached(user_id, 'credits')
+    if cached is not None:
+        return cached
+
+    try:
+        rows = await _select('user_credits', 'credits_amount', [('user_id', _eq(user_id))])
+
+        if rows:
+            cache_profile(user_id, credits=rows[0]['credits_amount'])
+            return rows[0]['credits_amount']
+
+        await init_user_credits(user_id)
+        return 0
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu kredytów użytkownika: {e}")
+        return 0
+
+async def check_user_credits(user_id, amount_needed):
+    """Sprawdza, czy użytkownik ma wystarczającą liczbę kredytów"""
+    current_credits = await get_user_credits(user_id)
+    return current_credits >= amount_needed
+
+async def balance_after(user_id, balance):
+    """
+    Zwraca saldo po operacji kredytowej
+
+    Args:
+        user_id (int): ID użytkownika
+        balance (int): Saldo zwrócone przez ledger_deduct lub None, gdy operacja się nie powiodła
+
+    Returns:
+        int: Saldo z funkcji bazy, a gdy go brak - aktualne saldo pobrane osobno
+    """
+    if balance is None:
+        return await get_user_credits(user_id)
+    return balance
+
+async def ledger_add(user_id, amount, description=None, transaction_type='add', price=0):
+    """
+    Atomowo dodaje kredyty i zapisuje transakcję (funkcja bazy add_credits)
+
+    Returns:
+        int: Nowe saldo lub None w przypadku błędu
+    """
+    try:
+        balance = await _rpc('add_credits', {
+            'p_user_id': user_id,
+            'p_amount': amount,
+            'p_description': description,
+            'p_transaction_type': transaction_type,
+            'p_price': price
+        })
+        _cache_balance(user_id, balance)
+        return balance
+    except Exception as e:
+        logger.error(f"Błąd przy dodawaniu kredytów użytkownika: {e}")
+        invalidate_profile(user_id, 'credits')
+        return None
+
+async def ledger_deduct(user_id, amount, description=None, category='other',
+                        prompt_tokens=None, completion_tokens=None):
+    """
+    Atomowo odejmuje kredyty, jeśli saldo jest wystarczające (funkcja bazy deduct_credits)
+
+    Args:
+        category (str): Kategoria operacji (message, image, document, photo,
+                        translation, pdf_translation, other) - podstawa analityki zużycia
+        prompt_tokens (int, optional): Tokeny promptu zużyte na opłacaną operację
+        completion_tokens (int, optional): Tokeny odpowiedzi zużyte na opłacaną operację
+
+    Returns:
+        int: Nowe saldo lub None, jeśli brakuje kredytów lub wystąpił błąd
+    """
+    try:
+        balance = await _rpc('deduct_credits', {
+            'p_user_id': user_id,
+            'p_amount': amount,
+            'p_description': description,
+            'p_category': category,
+            'p_prompt_tokens': prompt_tokens,
+            'p_completion_tokens': completion_tokens
+        })
+        _cache_balance(user_id, balance)
+        return balance
+    except Exception as e:
+        logger.error(f"Błąd przy odejmowaniu kredytów użytkownika: {e}")
+        invalidate_profile(user_id, 'credits')
+        return None
+
+async def add_user_credits(user_id, amount, description=None):
+    """Dodaje kredyty do konta użytkownika"""
+    return await ledger_add(user_id, amount, description) is not None
+
+async def deduct_user_credits(user_id, amount, description=None, category='other',
+                              prompt_tokens=None, completion_tokens=None):
+    """Odejmuje kredyty z konta użytkownika"""
+    return await ledger_deduct(user_id, amount, description, category, prompt_tokens, completion_tokens) is not None
+
+async def get_credit_transactions(user_id, days=30):
+    """Pobiera historię transakcji kredytowych użytkownika z określonej liczby dni"""
+    try:
+        start_date = (datetime.datetime.now(pytz.UTC) - datetime.timedelta(days=days)).isoformat()
+        return await _select_all(
+            'credit_transactions',
+            filters=[('user_id', _eq(user_id)), ('created_at', f"gte.{start_date}")]
+        )
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu transakcji kredytowych: {e}")
+        return []
+
+async def get_credit_transactions_page(user_id, cursor=None, direction='older', page_size=10):
+    """
+    Pobiera stronę historii transakcji kredytowych użytkownika (od najnowszych)
+
+    Returns:
+        dict: Strona w formacie _select_page lub None w przypadku błędu
+    """
+    try:
+        return await _select_page(
+            'credit_transactions',
+            filters=[('user_id', _eq(user_id))],
+            cursor=cursor,
+            direction=direction,
+            page_size=page_size
+        )
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu strony transakcji kredytowych: {e}")
+        return None
+
+async def get_credit_usage_by_type(user_id, days=30):
+    """Pobiera sumaryczne zużycie kredytów według kategorii operacji (kategoria -> suma kredytów)"""
+    try:
+        rows = await _rpc('credit_usage_by_category', {'p_user_id': user_id, 'p_days': days})
+        return {row['category']: row['amount'] for row in rows or []}
+    except Exception as e:
+        logger.error(f"Błąd przy analizie zużycia kredytów: {e}")
+        return {}
+
+# Funkcje obsługi subskrypcji i limitów wiadomości
+async def check_active_subscription(user_id):
+    """Sprawdza czy użytkownik ma aktywną subskrypcję"""
+    try:
+        rows = await _select('users', 'subscription_end_date', [('id', _eq(user_id))])
+
+        if not rows:
+            return False
+
+        end_date = rows[0].get('subscription_end_date')
+        if end_date:
+            end_date = datetime.datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+            if end_date > datetime.datetime.now(pytz.UTC):
+                return True
+
+        return await check_message_limit(user_id)
+    except Exception as e:
+        logger.error(f"Błąd przy sprawdzaniu subskrypcji: {e}")
+        return False
+
+async def _get_message_quota(user_id):
+    """Zwraca krotkę (messages_limit, messages_used) z pamięci podręcznej lub bazy; None gdy brak użytkownika"""
+    messages_limit = get_cached(user_id, 'messages_limit')
+    messages_used = get_cached(user_id, 'messages_used')
+    if messages_limit is not None and messages_used is not None:
+        return messages_limit, messages_used
+
+    rows = await _select('users', 'messages_limit,messages_used', [('id', _eq(user_id))])
+
+    if not rows:
+        return None
+
+    messages_limit = rows[0].get('messages_limit') or 0
+    messages_used = rows[0].get('messages_used') or 0
+    cache_profile(user_id, messages_limit=messages_limit, messages_used=messages_used)
+    return messages_limit, messages_used
+
+async def check_message_limit(user_id):
+    """Sprawdza czy użytkownik ma dostępne wiadomości"""
+    try:
+        quota = await _get_message_quota(user_id)
+
+        if quota is None:
+            return False
+
+        messages_limit, messages_used = quota
+        return messages_used < messages_limit
+    except Exception as e:
+        logger.error(f"Błąd przy sprawdzaniu limitu wiadomości: {e}")
+        return False
+
+async def increment_messages_used(user_id):
+    """Zwiększa licznik wykorzystanych wiadomości"""
+    try:
+        rows = await _select('users', 'messages_used', [('id', _eq(user_id))])
+
+        if not rows:
+            return False
+
+        messages_used = (rows[0].get('messages_used') or 0) + 1
+        await _update('users', {'messages_used': messages_used}, [('id', _eq(user_id))])
+        cache_profile(user_id, messages_used=messages_used)
+        return True
+    except Exception as e:
+        logger.error(f"Błąd przy aktualizacji licznika wiadomości: {e}")
+        return False
+
+async def get_message_status(user_id):
+    """Pobiera status wiadomości użytkownika"""
+    try:
+        quota = await _get_message_quota(user_id)
+
+        if quota is not None:
+            messages_limit, messages_used = quota
+            return {
+                "messages_limit": messages_limit,
+                "messages_used": messages_used,
+                "messages_left": max(0, messages_limit - messages_used)
+            }
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu statusu wiadomości: {e}")
+
+    return {
+        "messages_limit": 0,
+        "messages_used": 0,
+        "messages_left": 0
+    }
+
+# Funkcje obsługi konwersacji
+async def create_new_conversation(user_id):
+    """Tworzy nową konwersację dla użytkownika"""
+    try:
+        now = _now()
+        rows = await _insert('conversations', {
+            'user_id': user_id,
+            'created_at': now,
+            'last_message_at': now
+        })
+        if rows:
+            cache_profile(user_id, conversation=rows[0])
+            # Nowa konwersacja jest pusta - bufor historii od razu aktualny
+            hydrate_history(rows[0]['id'], [])
+        return rows[0] if rows else None
+    except Exception as e:
+        logger.error(f"Błąd przy tworzeniu nowej konwersacji: {e}")
+        return None
+
+async def get_active_conversation(user_id):
+    """Pobiera aktywną konwersację użytkownika (ostatnią)"""
+    cached = get_cached(user_id, 'conversation')
+    if cached is not None:
+        return dict(cached)
+
+    try:
+        rows = await _select('conversations', filters=[('user_id', _eq(user_id))], order='last_message_at.desc', limit=1)
+
+        if rows:
+            cache_profile(user_id, conversation=rows[0])
+            return rows[0]
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu aktywnej konwersacji: {e}")
+
+    return await create_new_conversation(user_id)
+
+def _track_active_conversation(user_id, conversation_id):
+    """
+    Konwersacja z najnowszą wiadomością staje się aktywna - zapamiętaj ją zamiast innej.
+    Dzięki temu kolejna tura czatu (begin_chat_turn) bierze historię z bufora w pamięci.
+    """
+    cached = get_cached(user_id, 'conversation')
+    if cached is None or cached.get('id') != conversation_id:
+        cache_profile(user_id, conversation={'id': conversation_id, 'user_id': user_id})
+
+async def save_message(conversation_id, user_id, content, is_from_user, model_used=None):
+    """Zapisuje wiadomość w bazie danych"""
+    try:
+        now = _now()
+        message_data = {
+            'conversation_id': conversation_id,
+            'user_id': user_id,
+            'content': content,
+            'is_from_user': is_from_user,
+            'model_used': model_used,
+            'created_at': now
+        }
+        rows = await _insert('messages', message_data)
+
+        await _update('conversations', {'last_message_at': now}, [('id', _eq(conversation_id))])
+        _track_active_conversation(user_id, conversation_id)
+        append_history(conversation_id, rows[0] if rows else message_data)
+
+        return rows[0] if rows else None
+    except Exception as e:
+        logger.error(f"Błąd przy zapisywaniu wiadomości: {e}")
+        return None
+
+async def insert_messages(records):
+    """Wstawia wiele wiadomości jednym zapytaniem (błędy są przekazywane wywołującemu)"""
+    await _request('POST', '/messages', json=records, prefer='return=minimal')
+
+async def touch_conversation(conversation_id, last_message_at):
+    """Ustawia czas ostatniej wiadomości konwersacji (błędy są przekazywane wywołującemu)"""
+    await _request(
+        'PATCH', '/conversations',
+        params=[('id', _eq(conversation_id))],
+        json={'last_message_at': last_message_at},
+        prefer='return=minimal'
+    )
+
+async def get_conversation_history(conversation_id, limit=20):
+    """Pobiera ostatnie `limit` wiadomości konwersacji w kolejności chronologicznej"""
+    buffered = get_buffered_history(conversation_id, limit)
+    if buffered is not None:
+        return buffered
+
+    try:
+        # Najnowsze wiadomości malejąco, potem odwrócenie - tak, aby limit obejmował koniec rozmowy.
+        # Pobieramy co najmniej tyle wiadomości, ile mieści bufor, aby go wypełnić.
+        rows = await _select(
+            'messages',
+            filters=[('conversation_id', _eq(conversation_id))],
+            order='created_at.desc,id.desc',
+            limit=max(limit, HISTORY_BUFFER_SIZE)
+        )
+        rows.reverse()
+        hydrate_history(conversation_id, rows)
+        return rows[-limit:] if limit > 0 else []
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu historii konwersacji: {e}")
+        return []
+
+async def get_messages_page(conversation_id, cursor=None, direction='older', page_size=10):
+    """
+    Pobiera stronę wiadomości konwersacji (od najnowszych)
+
+    Args:
+        conversation_id (int): ID konwersacji
+        cursor (tuple, optional): Kursor (created_at, id) z poprzedniej strony
+        direction (str): 'older' lub 'newer'
+        page_size (int): Liczba wiadomości na stronie
+
+    Returns:
+        dict: Strona w formacie _select_page lub None w przypadku błędu
+    """
+    try:
+        return await _select_page(
+            'messages',
+            filters=[('conversation_id', _eq(conversation_id))],
+            cursor=cursor,
+            direction=direction,
+            page_size=page_size
+        )
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu strony historii konwersacji: {e}")
+        return None
+
+# Funkcje obsługi tury czatu - jedno zapytanie przed i jedno po wywołaniu modelu
+async def begin_chat_turn(user_id, history_limit=20):
+    """
+    Pobiera w jednym zapytaniu dane potrzebne do obsługi wiadomości (funkcja bazy begin_chat_turn)
+
+    Args:
+        user_id (int): ID użytkownika
+        history_limit (int): Liczba ostatnich wiadomości z historii konwersacji
+
+    Returns:
+        dict: Słownik z kluczami credits, language, messages_limit, messages_used,
+              conversation_id i history (lista wiadomości w kolejności chronologicznej)
+              lub None w przypadku błędu
+    """
+    # Jeśli historia aktywnej konwersacji jest w pamięci, nie pobieraj jej z bazy
+    cached_conversation = get_cached(user_id, 'conversation')
+    history_in_memory = (
+        cached_conversation is not None
+        and history_limit <= HISTORY_BUFFER_SIZE
+        and is_history_loaded(cached_conversation['id'])
+    )
+
+    try:
+        turn = await _rpc('begin_chat_turn', {
+            'p_user_id': user_id,
+            'p_history_limit': 0 if history_in_memory else history_limit
+        })
+        cache_profile(
+            user_id,
+            credits=turn['credits'],
+            messages_limit=turn['messages_limit'],
+            messages_used=turn['messages_used']
+        )
+        if get_cached(user_id, 'language') is None:
+            cache_profile(user_id, language=turn['language'])
+        _track_active_conversation(user_id, turn['conversation_id'])
+
+        if history_in_memory:
+            # Aktywna konwersacja mogła się zmienić - wtedy historia pochodzi z bazy
+            turn['history'] = await get_conversation_history(turn['conversation_id'], history_limit)
+        elif history_limit >= HISTORY_BUFFER_SIZE:
+            hydrate_history(turn['conversation_id'], turn['history'])
+        return turn
+    except Exception as e:
+        logger.error(f"Błąd przy rozpoczynaniu tury czatu: {e}")
+        return None
+
+async def commit_chat_turn(user_id, conversation_id, user_message, assistant_message=None,
+                           model_used=None, credit_cost=0, description=None,
+                           prompt_tokens=None, completion_tokens=None):
+    """
+    Zapisuje w jednej transakcji wynik tury czatu (funkcja bazy commit_chat_turn):
+    obie wiadomości, opłatę, licznik wiadomości i last_message_at konwersacji
+
+    Args:
+        user_id (int): ID użytkownika
+        conversation_id (int): ID konwersacji
+        user_message (str): Wiadomość użytkownika
+        assistant_message (str, optional): Odpowiedź modelu; None zapisuje tylko wiadomość użytkownika
+        model_used (str, optional): Nazwa modelu
+        credit_cost (int): Liczba kredytów do pobrania
+        description (str, optional): Opis transakcji kredytowej
+        prompt_tokens (int, optional): Tokeny promptu zużyte na odpowiedź
+        completion_tokens (int, optional): Tokeny odpowiedzi
+
+    Returns:
+        dict: Słownik z kluczami credits (saldo po turze), charged i messages_used
+              lub None w przypadku błędu
+    """
+    try:
+        result = await _rpc('commit_chat_turn', {
+            'p_user_id': user_id,
+            'p_conversation_id': conversation_id,
+            'p_user_message': user_message,
+            'p_assistant_message': assistant_message,
+            'p_model': model_used,
+            'p_credit_cost': credit_cost,
+            'p_description': description,
+            'p_prompt_tokens': prompt_tokens,
+            'p_completion_tokens': completion_tokens
+        })
+        cache_profile(user_id, credits=result['credits'], messages_used=result['messages_used'])
+        _track_active_conversation(user_id, conversation_id)
+
+        now = _now()
+        append_history(conversation_id, {
+            'conversation_id': conversation_id,
+            'user_id': user_id,
+            'content': user_message,
+            'is_from_user': True,
+            'model_used': None,
+            'created_at': now
+        })
+        if assistant_message is not None:
+            append_history(conversation_id, {
+                'conversation_id': conversation_id,
+                'user_id': user_id,
+                'content': assistant_message,
+                'is_from_user': False,
+                'model_used': model_used,
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'created_at': now
+            })
+        return result
+    except Exception as e:
+        logger.error(f"Błąd przy zapisywaniu tury czatu: {e}")
+        invalidate_profile(user_id, 'credits', 'messages_used')
+        return None
+
+# Funkcje obsługi transakcji płatności
+async def get_payment_transactions_page(user_id, cursor=None, direction='older', page_size=10):
+    """
+    Pobiera stronę historii transakcji płatności użytkownika (od najnowszych),
+    uzupełnioną o nazwę i liczbę kredytów pakietu oraz nazwę metody płatności
+
+    Returns:
+        dict: Strona w formacie _select_page lub None w przypadku błędu
+    """
+    try:
+        page = await _select_page(
+            'payment_transactions',
+            filters=[('user_id', _eq(user_id))],
+            cursor=cursor,
+            direction=direction,
+            page_size=page_size
+        )
+
+        # Pakiety i metody płatności tylko dla transakcji z bieżącej strony
+        transactions = page['items']
+        package_ids = {t['credit_package_id'] for t in transactions if t.get('credit_package_id') is not None}
+        method_ids = {t['payment_method_id'] for t in transactions if t.get('payment_method_id') is not None}
+
+        packages = {}
+        if package_ids:
+            rows = await _select('credit_packages', 'id,name,credits', [('id', f"in.({','.join(map(str, package_ids))})")])
+            packages = {p['id']: p for p in rows}
+
+        methods = {}
+        if method_ids:
+            rows = await _select('payment_methods', 'id,name,code', [('id', f"in.({','.join(map(str, method_ids))})")])
+            methods = {m['id']: m for m in rows}
+
+        for t in transactions:
+            t['package_name'] = packages.get(t.get('credit_package_id'), {}).get('name', 'Nieznany pakiet')
+            t['package_credits'] = packages.get(t.get('credit_package_id'), {}).get('credits', 0)
+            t['payment_method_name'] = methods.get(t.get('payment_method_id'), {}).get('name', 'Nieznana metoda')
+            t['payment_method_code'] = methods.get(t.get('payment_method_id'), {}).get('code', '')
+
+        return page
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu strony transakcji płatności: {e}")
+        return None
+
+# Wbudowany backend SQLite (STORAGE_BACKEND=sqlite) - zapytania do lokalnego pliku
+# trwają ułamek milisekundy, więc są wykonywane bezpośrednio w pętli zdarzeń
+if STORAGE_BACKEND == 'sqlite':
+    from database.sqlite_client import async_functions
+    globals().update(async_functions())
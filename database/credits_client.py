@@ -3,10 +3,13 @@ Moduł do zarządzania kredytami użytkowników - adapter dla Supabase
 Przekierowuje wszystkie wywołania do implementacji Supabase
 """
 import logging
+from config import SQLITE_PATH
 from database.supabase_client import (
     get_user_credits as supabase_get_user_credits,
     add_user_credits as supabase_add_user_credits,
     deduct_user_credits as supabase_deduct_user_credits,
+    ledger_add as supabase_ledger_add,
+    ledger_deduct as supabase_ledger_deduct,
     check_user_credits as supabase_check_user_credits,
     get_credit_packages as supabase_get_credit_packages,
     get_package_by_id as supabase_get_package_by_id,
@@ -17,8 +20,8 @@ from database.supabase_client import (
 
 logger = logging.getLogger(__name__)
 
-# Ścieżka do pliku bazy danych - zachowana dla kompatybilności
-DB_PATH = "bot_database.sqlite"
+# Ścieżka do pliku bazy danych backendu SQLite (STORAGE_BACKEND=sqlite)
+DB_PATH = SQLITE_PATH
 
 def get_user_credits(user_id):
     """
@@ -46,7 +49,7 @@ def add_user_credits(user_id, amount, description=None):
     """
     return supabase_add_user_credits(user_id, amount, description)
 
-def deduct_user_credits(user_id, amount, description=None):
+def deduct_user_credits(user_id, amount, description=None, category='other', prompt_tokens=None, completion_tokens=None):
     """
     Odejmuje kredyty z konta użytkownika
     
@@ -54,11 +57,47 @@ def deduct_user_credits(user_id, amount, description=None):
         user_id (int): ID użytkownika
         amount (int): Liczba kredytów do odjęcia
         description (str, optional): Opis transakcji
+        category (str, optional): Kategoria operacji (message, image, document, photo...)
+        prompt_tokens (int, optional): Tokeny promptu zużyte na opłacaną operację
+        completion_tokens (int, optional): Tokeny odpowiedzi zużyte na opłacaną operację
     
     Returns:
         bool: True jeśli operacja się powiodła, False w przeciwnym razie
     """
-    return supabase_deduct_user_credits(user_id, amount, description)
+    return supabase_deduct_user_credits(user_id, amount, description, category, prompt_tokens, completion_tokens)
+
+def ledger_add(user_id, amount, description=None, transaction_type='add', price=0):
+    """
+    Atomowo dodaje kredyty i zapisuje transakcję w jednym zapytaniu
+    
+    Args:
+        user_id (int): ID użytkownika
+        amount (int): Liczba kredytów do dodania
+        description (str, optional): Opis transakcji
+        transaction_type (str, optional): Typ transakcji (add, purchase, subscription...)
+        price (float, optional): Kwota zapłacona za kredyty
+    
+    Returns:
+        int: Nowe saldo lub None w przypadku błędu
+    """
+    return supabase_ledger_add(user_id, amount, description, transaction_type, price)
+
+def ledger_deduct(user_id, amount, description=None, category='other', prompt_tokens=None, completion_tokens=None):
+    """
+    Atomowo odejmuje kredyty i zapisuje transakcję w jednym zapytaniu
+    
+    Args:
+        user_id (int): ID użytkownika
+        amount (int): Liczba kredytów do odjęcia
+        description (str, optional): Opis transakcji
+        category (str, optional): Kategoria operacji (message, image, document, photo...)
+        prompt_tokens (int, optional): Tokeny promptu zużyte na opłacaną operację
+        completion_tokens (int, optional): Tokeny odpowiedzi zużyte na opłacaną operację
+    
+    Returns:
+        int: Nowe saldo lub None, jeśli brakuje kredytów lub wystąpił błąd
+    """
+    return supabase_ledger_deduct(user_id, amount, description, category, prompt_tokens, completion_tokens)
 
 def check_user_credits(user_id, amount_needed):
     """
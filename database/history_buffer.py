@@ -0,0 +1,147 @@
+"""
+Bufor ostatnich wiadomości aktywnych konwersacji
+Dla każdej konwersacji trzyma w pamięci ostatnie HISTORY_BUFFER_SIZE wiadomości,
+dzięki czemu kontekst dla modelu nie wymaga odczytu z bazy przy każdej wiadomości.
+
+Bufor konwersacji jest wypełniany (hydratacja) wynikiem zapytania o ostatnie N wiadomości,
+a następnie uzupełniany przy każdym zapisie wiadomości. Nieużywane konwersacje są usuwane,
+gdy łączna liczba wiadomości w pamięci przekroczy limit lub minie czas bezczynności.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from config import HISTORY_BUFFER_SIZE, HISTORY_BUFFER_MAX_MESSAGES, HISTORY_BUFFER_IDLE_TTL
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+class HistoryBuffer:
+    """
+    Bufory pierścieniowe ostatnich wiadomości konwersacji
+
+    Args:
+        capacity (int): Liczba wiadomości trzymanych dla jednej konwersacji
+        max_messages (int): Łączny limit wiadomości w pamięci (wszystkie konwersacje)
+        idle_ttl (float): Czas bezczynności (sekundy), po którym bufor konwersacji jest usuwany
+    """
+
+    def __init__(self, capacity, max_messages, idle_ttl):
+        self.capacity = capacity
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        # conversation_id -> [deque wiadomości, czas ostatniego użycia]
+        self._buffers = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_recent(self, conversation_id, limit):
+        """
+        Zwraca ostatnie `limit` wiadomości konwersacji w kolejności chronologicznej
+        lub None, jeśli konwersacji nie ma w pamięci albo limit przekracza pojemność bufora
+        """
+        with self._lock:
+            entry = self._buffers.get(conversation_id)
+            if entry is None or limit > self.capacity:
+                self.misses += 1
+                return None
+
+            entry[1] = time.monotonic()
+            self._buffers.move_to_end(conversation_id)
+            self.hits += 1
+            messages = list(entry[0])
+            return [dict(message) for message in messages[-limit:]] if limit > 0 else []
+
+    def hydrate(self, conversation_id, messages):
+        """Wypełnia bufor konwersacji wynikiem zapytania o ostatnie wiadomości (chronologicznie)"""
+        with self._lock:
+            self._drop(conversation_id)
+            buffer = deque((dict(message) for message in messages), maxlen=self.capacity)
+            self._buffers[conversation_id] = [buffer, time.monotonic()]
+            self._size += len(buffer)
+            self._evict()
+
+    def append(self, conversation_id, message):
+        """Dopisuje wiadomość do bufora konwersacji (tylko jeśli konwersacja jest w pamięci)"""
+        with self._lock:
+            entry = self._buffers.get(conversation_id)
+            if entry is None:
+                return
+
+            buffer = entry[0]
+            if len(buffer) < buffer.maxlen:
+                self._size += 1
+            buffer.append(dict(message))
+            entry[1] = time.monotonic()
+            self._buffers.move_to_end(conversation_id)
+            self._evict()
+
+    def is_loaded(self, conversation_id):
+        """Sprawdza, czy bufor konwersacji jest w pamięci"""
+        with self._lock:
+            return conversation_id in self._buffers
+
+    def invalidate(self, conversation_id):
+        """Usuwa bufor konwersacji"""
+        with self._lock:
+            self._drop(conversation_id)
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Zwraca statystyki bufora"""
+        with self._lock:
+            return {
+                "conversations": len(self._buffers),
+                "messages": self._size,
+                "max_messages": self.max_messages,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _drop(self, conversation_id):
+        entry = self._buffers.pop(conversation_id, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+    def _evict(self):
+        """Usuwa najdawniej używane konwersacje - bezczynne oraz ponad łączny limit"""
+        deadline = time.monotonic() - self.idle_ttl
+        while self._buffers:
+            conversation_id, (buffer, last_used) = next(iter(self._buffers.items()))
+            if self._size <= self.max_messages and last_used >= deadline:
+                break
+            self._drop(conversation_id)
+            self.evictions += 1
+
+# Wspólny bufor dla całego procesu
+_buffer = HistoryBuffer(HISTORY_BUFFER_SIZE, HISTORY_BUFFER_MAX_MESSAGES, HISTORY_BUFFER_IDLE_TTL)
+register_stats("history_buffer", _buffer.stats)
+
+def get_buffered_history(conversation_id, limit):
+    """Zwraca ostatnie wiadomości z pamięci lub None, jeśli trzeba odczytać je z bazy"""
+    return _buffer.get_recent(conversation_id, limit)
+
+def hydrate_history(conversation_id, messages):
+    """Wypełnia bufor konwersacji ostatnimi wiadomościami odczytanymi z bazy"""
+    _buffer.hydrate(conversation_id, messages)
+
+def append_history(conversation_id, message):
+    """Dopisuje zapisaną wiadomość do bufora konwersacji"""
+    _buffer.append(conversation_id, message)
+
+def is_history_loaded(conversation_id):
+    """Sprawdza, czy historia konwersacji jest w pamięci"""
+    return _buffer.is_loaded(conversation_id)
+
+def clear_history_buffer():
+    """Czyści bufor historii"""
+    _buffer.clear()
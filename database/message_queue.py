@@ -0,0 +1,275 @@
+"""
+Kolejka zapisu wiadomości w tle (write-behind)
+Handlery dodają wiadomości do kolejki bez czekania na bazę danych, a zadanie w tle
+zapisuje je wielowierszowymi INSERT-ami po osiągnięciu progu rozmiaru lub czasu.
+Aktualizacja conversations.last_message_at jest scalana do jednego zapisu
+na konwersację w ramach jednego opróżnienia kolejki.
+
+Błędy przejściowe (sieć, 5xx, zablokowana baza) wstrzymują zapis z wykładniczo rosnącym
+opóźnieniem. Partia odrzucona z powodu samych danych (4xx, naruszenie ograniczeń) jest
+zapisywana pojedynczo, a odrzucone wiadomości są logowane i pomijane.
+
+Przy zamykaniu bota należy wywołać drain_message_queue(), aby zapisać zaległe wiadomości.
+"""
+import asyncio
+import datetime
+import logging
+import sqlite3
+import time
+import httpx
+import pytz
+from config import (
+    MESSAGE_QUEUE_BATCH_SIZE, MESSAGE_QUEUE_FLUSH_INTERVAL, MESSAGE_QUEUE_MAX_PENDING,
+    MESSAGE_QUEUE_RETRY_BASE_DELAY, MESSAGE_QUEUE_RETRY_MAX_DELAY
+)
+from database.async_supabase_client import insert_messages, touch_conversation
+from database.history_buffer import append_history
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+def _is_permanent(error):
+    """Sprawdza, czy błąd zapisu wynika z samych danych - ponowienie zapisu nic nie zmieni"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return 400 <= status < 500 and status not in (408, 429)
+    if isinstance(error, httpx.HTTPError):
+        return False
+    return isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError, sqlite3.ProgrammingError, ValueError, TypeError))
+
+class MessageQueue:
+    """
+    Kolejka wiadomości zapisywanych w tle
+
+    Args:
+        batch_size (int): Liczba wiadomości, po której kolejka jest opróżniana natychmiast
+        flush_interval (float): Maksymalny czas oczekiwania wiadomości w kolejce (sekundy)
+        max_pending (int): Limit zaległych wiadomości; po przekroczeniu najstarsze są odrzucane
+        retry_base_delay (float): Opóźnienie pierwszego ponowienia po błędzie przejściowym (sekundy)
+        retry_max_delay (float): Maksymalne opóźnienie ponowienia (sekundy)
+    """
+
+    def __init__(self, batch_size, flush_interval, max_pending, retry_base_delay=1.0, retry_max_delay=60.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._retry_at = 0.0
+        self._failures_in_row = 0
+        self._pending = []
+        self._wakeup = None
+        self._flush_lock = None
+        self._worker = None
+        self._closing = False
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def enqueue(self, record):
+        """Dodaje rekord wiadomości do kolejki i w razie potrzeby uruchamia zadanie zapisu"""
+        if len(self._pending) >= self.max_pending:
+            self._pending.pop(0)
+            self.dropped += 1
+            logger.error("Kolejka zapisu wiadomości jest pełna - odrzucono najstarszą wiadomość")
+
+        self._pending.append(record)
+        self.enqueued += 1
+        self._ensure_worker()
+
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            timeout = max(self.flush_interval, self._retry_at - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self, force=False):
+        """
+        Zapisuje wszystkie zaległe wiadomości
+
+        Args:
+            force (bool): Zapisz również przed upływem opóźnienia po błędzie (np. przy zamykaniu)
+
+        Returns:
+            bool: True, jeśli kolejka została opróżniona; False, jeśli zapis się nie powiódł
+                  lub czeka na ponowienie (wiadomości zostają na początku kolejki)
+        """
+        if self._flush_lock is None:
+            return True
+
+        async with self._flush_lock:
+            if not force and time.monotonic() < self._retry_at:
+                return not self._pending
+
+            last_message_at = {}
+            success = True
+
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:len(batch)]
+
+                try:
+                    await insert_messages(batch)
+                    written, remaining = batch, []
+                except Exception as e:
+                    if not _is_permanent(e):
+                        logger.error(f"Błąd przy zapisie partii wiadomości ({len(batch)}): {e}")
+                        written, remaining = [], batch
+                    elif len(batch) > 1:
+                        logger.error(f"Baza odrzuciła partię wiadomości ({len(batch)}): {e} - zapis pojedynczo")
+                        written, remaining = await self._insert_each(batch)
+                    else:
+                        self._reject(batch[0], e)
+                        written, remaining = [], []
+
+                if written:
+                    self.written += len(written)
+                    self.batches += 1
+                    for record in written:
+                        conversation_id = record['conversation_id']
+                        if record['created_at'] > last_message_at.get(conversation_id, ''):
+                            last_message_at[conversation_id] = record['created_at']
+
+                if remaining:
+                    self._pending[:0] = remaining
+                    self._schedule_retry()
+                    success = False
+                    break
+
+            if success:
+                self._failures_in_row = 0
+                self._retry_at = 0.0
+
+            # Jedna aktualizacja last_message_at na konwersację
+            for conversation_id, timestamp in last_message_at.items():
+                try:
+                    await touch_conversation(conversation_id, timestamp)
+                except Exception as e:
+                    logger.error(f"Błąd przy aktualizacji czasu ostatniej wiadomości konwersacji {conversation_id}: {e}")
+
+            return success
+
+    async def _insert_each(self, batch):
+        """
+        Zapisuje wiadomości partii pojedynczo, pomijając odrzucone przez bazę
+
+        Returns:
+            tuple: (zapisane wiadomości, niezapisane wiadomości do ponowienia po błędzie przejściowym)
+        """
+        written = []
+        for index, record in enumerate(batch):
+            try:
+                await insert_messages([record])
+            except Exception as e:
+                if not _is_permanent(e):
+                    logger.error(f"Błąd przy zapisie wiadomości: {e}")
+                    return written, batch[index:]
+                self._reject(record, e)
+                continue
+            written.append(record)
+        return written, []
+
+    def _reject(self, record, error):
+        self.rejected += 1
+        logger.error(
+            f"Pominięto wiadomość użytkownika {record.get('user_id')} w konwersacji {record.get('conversation_id')} "
+            f"odrzuconą przez bazę: {error}"
+        )
+
+    def _schedule_retry(self):
+        """Odkłada kolejny zapis o wykładniczo rosnący czas (do retry_max_delay)"""
+        self.failures += 1
+        self._failures_in_row += 1
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (self._failures_in_row - 1))
+        self._retry_at = time.monotonic() + delay
+        logger.error(f"Ponowienie zapisu {len(self._pending)} wiadomości za {delay:.1f} s")
+
+    async def drain(self):
+        """Zatrzymuje zadanie w tle i zapisuje pozostałe wiadomości"""
+        if self._worker is None:
+            return
+
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await self._worker
+        except Exception as e:
+            logger.error(f"Błąd zadania zapisu wiadomości: {e}")
+        self._worker = None
+
+        if not await self.flush(force=True):
+            logger.error(f"Nie udało się zapisać {len(self._pending)} wiadomości przy zamykaniu")
+
+    def stats(self):
+        """Zwraca statystyki kolejki"""
+        return {
+            "pending": len(self._pending),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "retry_in": round(max(0.0, self._retry_at - time.monotonic()), 1)
+        }
+
+# Wspólna kolejka dla całego procesu
+_queue = MessageQueue(
+    MESSAGE_QUEUE_BATCH_SIZE,
+    MESSAGE_QUEUE_FLUSH_INTERVAL,
+    MESSAGE_QUEUE_MAX_PENDING,
+    MESSAGE_QUEUE_RETRY_BASE_DELAY,
+    MESSAGE_QUEUE_RETRY_MAX_DELAY
+)
+register_stats("message_queue", _queue.stats)
+
+def enqueue_message(conversation_id, user_id, content, is_from_user, model_used=None,
+                    prompt_tokens=None, completion_tokens=None):
+    """
+    Dodaje wiadomość do kolejki zapisu w tle (musi być wywołane z działającej pętli zdarzeń)
+
+    Zużycie tokenów podaje się dla odpowiedzi modelu; rekordy zawsze mają te same kolumny,
+    bo PostgREST wymaga ich przy wstawianiu wielu wierszy jednym zapytaniem.
+
+    Returns:
+        dict: Rekord wiadomości, który zostanie zapisany w bazie
+    """
+    record = {
+        'conversation_id': conversation_id,
+        'user_id': user_id,
+        'content': content,
+        'is_from_user': is_from_user,
+        'model_used': model_used,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'created_at': datetime.datetime.now(pytz.UTC).isoformat()
+    }
+    _queue.enqueue(record)
+    # Historia w pamięci jest aktualna od razu, niezależnie od zapisu w bazie
+    append_history(conversation_id, record)
+    return record
+
+async def flush_message_queue():
+    """Wymusza natychmiastowy zapis zaległych wiadomości (również w czasie opóźnienia po błędzie)"""
+    return await _queue.flush(force=True)
+
+async def drain_message_queue():
+    """Zapisuje zaległe wiadomości i zatrzymuje zadanie w tle - wywoływane przy zamykaniu bota"""
+    await _queue.drain()
@@ -1,12 +1,16 @@
 """
 Moduł do zarządzania płatnościami - adapter dla Supabase
+Metody płatności i subskrypcje są odczytywane przez funkcje database.supabase_client
+(działające również z backendem SQLite); sesje Stripe obsługują Edge Functions Supabase.
 """
 import logging
 import os
-import json
 import requests
-from typing import Dict, List, Optional, Any, Tuple
-from datetime import datetime, timedelta
+from typing import Dict, List, Any, Tuple
+from database.supabase_client import (
+    get_payment_methods, get_payment_method_by_code,
+    get_active_subscriptions, get_subscription_by_id, mark_subscription_cancelled
+)
 
 logger = logging.getLogger(__name__)
 
@@ -25,35 +29,8 @@ def get_available_payment_methods(user_language: str) -> List[Dict[str, Any]]:
     Returns:
         List[Dict]: Lista metod płatności dostępnych dla użytkownika
     """
-    try:
-        # Określ, które metody są dostępne na podstawie języka
-        language_filter = ''
-        if user_language == 'pl':
-            language_filter = 'is_available_pl'
-        elif user_language == 'en':
-            language_filter = 'is_available_en'
-        elif user_language == 'ru':
-            language_filter = 'is_available_ru'
-        else:
-            language_filter = 'is_available_pl'  # domyślnie pl
-            
-        # Pobierz metody płatności z Supabase
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/payment_methods?select=*&{language_filter}=eq.true&is_active=eq.true",
-            headers={
-                "apikey": SUPABASE_KEY,
-                "Authorization": f"Bearer {SUPABASE_KEY}"
-            }
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.error(f"Błąd podczas pobierania metod płatności: {response.text}")
-            return []
-    except Exception as e:
-        logger.error(f"Wyjątek podczas pobierania metod płatności: {e}")
-        return []
+    # Metody dla nieobsługiwanych języków są wybierane jak dla polskiego
+    return get_payment_methods(user_language)
 
 def create_payment_url(
     user_id: int, 
@@ -81,17 +58,10 @@ def create_payment_url(
             return create_stripe_payment(user_id, package_id, is_subscription=True)
         elif payment_method_code in ['allegro', 'russia_payment']:
             # Dla metod zewnętrznych pobierz URL z bazy danych
-            response = requests.get(
-                f"{SUPABASE_URL}/rest/v1/payment_methods?code=eq.{payment_method_code}",
-                headers={
-                    "apikey": SUPABASE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_KEY}"
-                }
-            )
+            payment_method = get_payment_method_by_code(payment_method_code)
             
-            if response.status_code == 200 and response.json():
-                payment_method = response.json()[0]
-                if payment_method['external_url']:
+            if payment_method:
+                if payment_method.get('external_url'):
                     return True, payment_method['external_url']
                 else:
                     return False, "Brak URL dla tej metody płatności."
@@ -161,23 +131,7 @@ def get_user_subscriptions(user_id: int) -> List[Dict[str, Any]]:
     Returns:
         List[Dict]: Lista aktywnych subskrypcji
     """
-    try:
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/subscriptions?user_id=eq.{user_id}&status=eq.active",
-            headers={
-                "apikey": SUPABASE_KEY,
-                "Authorization": f"Bearer {SUPABASE_KEY}"
-            }
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.error(f"Błąd podczas pobierania subskrypcji: {response.text}")
-            return []
-    except Exception as e:
-        logger.error(f"Wyjątek podczas pobierania subskrypcji: {e}")
-        return []
+    return get_active_subscriptions(user_id)
 
 def cancel_subscription(subscription_id: int) -> bool:
     """
@@ -191,19 +145,12 @@ def cancel_subscription(subscription_id: int) -> bool:
     """
     try:
         # Pobierz dane subskrypcji
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/subscriptions?id=eq.{subscription_id}",
-            headers={
-                "apikey": SUPABASE_KEY,
-                "Authorization": f"Bearer {SUPABASE_KEY}"
-            }
-        )
+        subscription = get_subscription_by_id(subscription_id)
         
-        if response.status_code != 200 or not response.json():
+        if not subscription:
             logger.error(f"Nie znaleziono subskrypcji o ID {subscription_id}")
             return False
         
-        subscription = response.json()[0]
         external_subscription_id = subscription['external_subscription_id']
         
         # Anuluj subskrypcję w Stripe
@@ -223,81 +170,7 @@ def cancel_subscription(subscription_id: int) -> bool:
                 return False
         
         # Aktualizuj status subskrypcji w bazie danych
-        update_response = requests.patch(
-            f"{SUPABASE_URL}/rest/v1/subscriptions?id=eq.{subscription_id}",
-            json={
-                "status": "cancelled",
-                "end_date": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
-            },
-            headers={
-                "apikey": SUPABASE_KEY,
-                "Authorization": f"Bearer {SUPABASE_KEY}",
-                "Content-Type": "application/json",
-                "Prefer": "return=minimal"
-            }
-        )
-        
-        return update_response.status_code == 204
+        return mark_subscription_cancelled(subscription_id)
     except Exception as e:
         logger.error(f"Wyjątek podczas anulowania subskrypcji: {e}")
         return False
-
-def get_payment_transactions(user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-    """
-    Pobiera historię transakcji płatności użytkownika
-    
-    Args:
-        user_id (int): ID użytkownika
-        limit (int): Maksymalna liczba transakcji do pobrania
-    
-    Returns:
-        List[Dict]: Lista transakcji
-    """
-    try:
-        # Pobierz transakcje z Supabase
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/payment_transactions?user_id=eq.{user_id}&order=created_at.desc&limit={limit}",
-            headers={
-                "apikey": SUPABASE_KEY,
-                "Authorization": f"Bearer {SUPABASE_KEY}"
-            }
-        )
-        
-        if response.status_code == 200:
-            transactions = response.json()
-            
-            # Pobierz dane pakietów i metod płatności
-            packages_response = requests.get(
-                f"{SUPABASE_URL}/rest/v1/credit_packages",
-                headers={
-                    "apikey": SUPABASE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_KEY}"
-                }
-            )
-            
-            methods_response = requests.get(
-                f"{SUPABASE_URL}/rest/v1/payment_methods",
-                headers={
-                    "apikey": SUPABASE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_KEY}"
-                }
-            )
-            
-            packages = {p['id']: p for p in packages_response.json()} if packages_response.status_code == 200 else {}
-            methods = {m['id']: m for m in methods_response.json()} if methods_response.status_code == 200 else {}
-            
-            # Wzbogać dane transakcji
-            for t in transactions:
-                t['package_name'] = packages.get(t['credit_package_id'], {}).get('name', 'Nieznany pakiet')
-                t['package_credits'] = packages.get(t['credit_package_id'], {}).get('credits', 0)
-                t['payment_method_name'] = methods.get(t['payment_method_id'], {}).get('name', 'Nieznana metoda')
-                t['payment_method_code'] = methods.get(t['payment_method_id'], {}).get('code', '')
-            
-            return transactions
-        else:
-            logger.error(f"Błąd podczas pobierania transakcji: {response.text}")
-            return []
-    except Exception as e:
-        logger.error(f"Wyjątek podczas pobierania transakcji: {e}")
-        return []
\ No newline at end of file
@@ -0,0 +1,392 @@
+"""
+Lokalny zamiennik PostgREST do testów i pracy offline
+Implementuje podzbiór protokołu PostgREST (select, filtry, order, limit, insert,
+update, delete, rpc) na tabelach trzymanych w pamięci i działa jako transport httpx:
+
+    from database import async_supabase_client
+    from database.postgrest_stub import PostgRESTStub
+
+    stub = PostgRESTStub()
+    async_supabase_client.set_transport(stub)
+"""
+import copy
+import datetime
+import json
+import logging
+import re
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Operatory porównania obsługiwane w filtrach
+_OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'neq': lambda a, b: a != b,
+    'gt': lambda a, b: a > b,
+    'gte': lambda a, b: a >= b,
+    'lt': lambda a, b: a < b,
+    'lte': lambda a, b: a <= b,
+}
+
+# Parametry zapytania, które nie są filtrami
+_RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+def _split_top_level(expression):
+    """Dzieli wyrażenie po przecinkach leżących poza nawiasami i cudzysłowami"""
+    parts = []
+    depth = 0
+    quoted = False
+    current = ''
+    for char in expression:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+def _coerce(raw, sample):
+    """Konwertuje wartość z URL do typu wartości zapisanej w tabeli"""
+    raw = raw.strip('"')
+    if isinstance(sample, bool):
+        return raw.lower() == 'true'
+    if isinstance(sample, int):
+        try:
+            return int(raw)
+        except ValueError:
+            return float(raw)
+    if isinstance(sample, float):
+        return float(raw)
+    return raw
+
+def _like_to_regex(pattern):
+    return '^' + re.escape(pattern).replace(r'\*', '.*').replace('%', '.*') + '$'
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+def _credit_row(stub, user_id):
+    for row in stub.table('user_credits'):
+        if row.get('user_id') == user_id:
+            return row
+    return None
+
+def _log_credit_transaction(stub, user_id, transaction_type, amount, before, after, description, category=None,
+                            prompt_tokens=None, completion_tokens=None):
+    stub.insert_row('credit_transactions', {
+        'user_id': user_id,
+        'transaction_type': transaction_type,
+        'amount': amount,
+        'credits_before': before,
+        'credits_after': after,
+        'description': description,
+        'category': category,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'created_at': _now()
+    })
+
+# Odpowiedniki funkcji z supabase/migrations - te same sygnatury i wyniki
+def rpc_deduct_credits(stub, p_user_id, p_amount, p_description=None, p_category='other',
+                       p_prompt_tokens=None, p_completion_tokens=None):
+    row = _credit_row(stub, p_user_id)
+    if row is None or row['credits_amount'] < p_amount:
+        return None
+    row['credits_amount'] -= p_amount
+    after = row['credits_amount']
+    _log_credit_transaction(stub, p_user_id, 'deduct', p_amount, after + p_amount, after, p_description,
+                            p_category or 'other', p_prompt_tokens, p_completion_tokens)
+    return after
+
+def rpc_add_credits(stub, p_user_id, p_amount, p_description=None, p_transaction_type='add', p_price=0):
+    row = _credit_row(stub, p_user_id)
+    if row is None:
+        stub.insert_row('user_credits', {
+            'user_id': p_user_id,
+            'credits_amount': 0,
+            'total_credits_purchased': 0,
+            'total_spent': 0
+        })
+        row = _credit_row(stub, p_user_id)
+    row['credits_amount'] += p_amount
+    row['total_credits_purchased'] = (row.get('total_credits_purchased') or 0) + p_amount
+    row['total_spent'] = float(row.get('total_spent') or 0) + float(p_price or 0)
+    row['last_purchase_date'] = _now()
+    after = row['credits_amount']
+    if p_amount != 0:
+        _log_credit_transaction(stub, p_user_id, p_transaction_type, p_amount, after - p_amount, after, p_description)
+    return after
+
+def _user_row(stub, user_id):
+    for row in stub.table('users'):
+        if row.get('id') == user_id:
+            return row
+    return None
+
+def rpc_begin_chat_turn(stub, p_user_id, p_history_limit=20):
+    user = _user_row(stub, p_user_id) or {}
+    credits = _credit_row(stub, p_user_id) or {}
+
+    conversations = [row for row in stub.table('conversations') if row.get('user_id') == p_user_id]
+    if conversations:
+        conversation = max(conversations, key=lambda row: row.get('last_message_at') or '')
+    else:
+        now = _now()
+        conversation = stub.insert_row('conversations', {'user_id': p_user_id, 'created_at': now, 'last_message_at': now})
+
+    messages = [row for row in stub.table('messages') if row.get('conversation_id') == conversation['id']]
+    messages.sort(key=lambda row: (row.get('created_at') or '', row['id']))
+    history = [copy.deepcopy(row) for row in messages[-p_history_limit:]] if p_history_limit > 0 else []
+
+    return {
+        'credits': credits.get('credits_amount') or 0,
+        'language': user.get('language') or user.get('language_code') or 'pl',
+        'messages_limit': user.get('messages_limit') or 0,
+        'messages_used': user.get('messages_used') or 0,
+        'conversation_id': conversation['id'],
+        'history': history
+    }
+
+def rpc_commit_chat_turn(stub, p_user_id, p_conversation_id, p_user_message, p_assistant_message=None,
+                         p_model=None, p_credit_cost=0, p_description=None,
+                         p_prompt_tokens=None, p_completion_tokens=None):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    stub.insert_row('messages', {
+        'conversation_id': p_conversation_id,
+        'user_id': p_user_id,
+        'content': p_user_message,
+        'is_from_user': True,
+        'model_used': None,
+        'created_at': now.isoformat()
+    })
+
+    credits = None
+    charged = False
+    messages_used = None
+    if p_assistant_message is not None:
+        stub.insert_row('messages', {
+            'conversation_id': p_conversation_id,
+            'user_id': p_user_id,
+            'content': p_assistant_message,
+            'is_from_user': False,
+            'model_used': p_model,
+            'prompt_tokens': p_prompt_tokens,
+            'completion_tokens': p_completion_tokens,
+            'created_at': (now + datetime.timedelta(milliseconds=1)).isoformat()
+        })
+        if p_credit_cost > 0:
+            credits = rpc_deduct_credits(stub, p_user_id, p_credit_cost, p_description, 'message',
+                                         p_prompt_tokens, p_completion_tokens)
+            charged = credits is not None
+        user = _user_row(stub, p_user_id)
+        if user is not None:
+            user['messages_used'] = (user.get('messages_used') or 0) + 1
+            messages_used = user['messages_used']
+
+    if credits is None:
+        credits = (_credit_row(stub, p_user_id) or {}).get('credits_amount')
+
+    for row in stub.table('conversations'):
+        if row.get('id') == p_conversation_id:
+            row['last_message_at'] = now.isoformat()
+
+    return {'credits': credits or 0, 'charged': charged, 'messages_used': messages_used}
+
+def rpc_credit_usage_by_category(stub, p_user_id, p_days=30):
+    since = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=p_days)).isoformat()
+    usage = {}
+    for row in stub.table('credit_transactions'):
+        if row.get('user_id') == p_user_id and row.get('transaction_type') == 'deduct' \
+                and (row.get('created_at') or '') >= since:
+            category = row.get('category') or 'other'
+            usage[category] = usage.get(category, 0) + row['amount']
+    return [{'category': category, 'amount': amount}
+            for category, amount in sorted(usage.items(), key=lambda item: item[1], reverse=True)]
+
+DEFAULT_RPC_HANDLERS = {
+    'deduct_credits': rpc_deduct_credits,
+    'add_credits': rpc_add_credits,
+    'begin_chat_turn': rpc_begin_chat_turn,
+    'commit_chat_turn': rpc_commit_chat_turn,
+    'credit_usage_by_category': rpc_credit_usage_by_category,
+}
+
+class PostgRESTStub(httpx.AsyncBaseTransport, httpx.BaseTransport):
+    """
+    Transport httpx emulujący PostgREST na danych w pamięci
+
+    Args:
+        tables (dict, optional): Początkowa zawartość tabel {nazwa: [wiersze]}
+        defaults (dict, optional): Domyślne wartości kolumn {nazwa_tabeli: {kolumna: wartość}}
+    """
+
+    def __init__(self, tables=None, defaults=None):
+        self.tables = {name: [dict(row) for row in rows] for name, rows in (tables or {}).items()}
+        self.defaults = defaults or {}
+        self.rpc_handlers = dict(DEFAULT_RPC_HANDLERS)
+        self.request_count = 0
+        self._sequences = {}
+        for name, rows in self.tables.items():
+            ids = [row['id'] for row in rows if isinstance(row.get('id'), int)]
+            self._sequences[name] = max(ids, default=0)
+
+    def register_rpc(self, name, handler):
+        """
+        Rejestruje implementację funkcji bazy danych wywoływanej przez /rpc/<name>
+
+        Args:
+            name (str): Nazwa funkcji
+            handler (callable): Funkcja handler(stub, **params) zwracająca wynik JSON
+        """
+        self.rpc_handlers[name] = handler
+
+    def table(self, name):
+        """Zwraca listę wierszy tabeli (tworzy pustą tabelę przy pierwszym użyciu)"""
+        return self.tables.setdefault(name, [])
+
+    def insert_row(self, table_name, row):
+        """Wstawia wiersz, nadając mu kolejne ID, i zwraca kopię zapisanego wiersza"""
+        record = dict(self.defaults.get(table_name, {}))
+        record.update(row)
+        if record.get('id') is None:
+            self._sequences[table_name] = self._sequences.get(table_name, 0) + 1
+            record['id'] = self._sequences[table_name]
+        self.table(table_name).append(record)
+        return dict(record)
+
+    # Obsługa transportu httpx
+    def handle_request(self, request):
+        request.read()
+        return self._dispatch(request)
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        return self._dispatch(request)
+
+    def _dispatch(self, request):
+        self.request_count += 1
+        path = request.url.path
+        if '/rest/v1/' in path:
+            path = path.split('/rest/v1/', 1)[1]
+        path = path.strip('/')
+
+        body = json.loads(request.content) if request.content else None
+        params = list(request.url.params.multi_items())
+        prefer = request.headers.get('prefer', '')
+
+        try:
+            if path.startswith('rpc/'):
+                return self._handle_rpc(path[4:], body or {})
+            if request.method == 'GET':
+                return self._json(200, self._select(path, params))
+            if request.method == 'POST':
+                rows = body if isinstance(body, list) else [body]
+                inserted = [self.insert_row(path, row) for row in rows]
+                return self._write_response(201, inserted, prefer, params)
+            if request.method == 'PATCH':
+                updated = []
+                for row in self._filter(path, params):
+                    row.update(body or {})
+                    updated.append(dict(row))
+                return self._write_response(200, updated, prefer, params)
+            if request.method == 'DELETE':
+                matched = self._filter(path, params)
+                self.tables[path] = [row for row in self.table(path) if row not in matched]
+                return self._write_response(200, [dict(row) for row in matched], prefer, params)
+        except Exception as e:
+            logger.error(f"Błąd stubu PostgREST ({request.method} {path}): {e}")
+            return self._json(400, {"code": "PGRST000", "message": str(e)})
+
+        return self._json(405, {"code": "PGRST105", "message": f"Nieobsługiwana metoda {request.method}"})
+
+    def _handle_rpc(self, name, params):
+        handler = self.rpc_handlers.get(name)
+        if handler is None:
+            return self._json(404, {"code": "PGRST202", "message": f"Could not find the function public.{name}"})
+        return self._json(200, handler(self, **params))
+
+    def _write_response(self, status, rows, prefer, params):
+        if 'return=representation' not in prefer:
+            return httpx.Response(204 if status == 200 else status)
+        return self._json(status, self._project(rows, dict(params).get('select', '*')))
+
+    @staticmethod
+    def _json(status, payload):
+        return httpx.Response(status, content=json.dumps(payload), headers={'Content-Type': 'application/json'})
+
+    # Zapytania
+    def _select(self, table_name, params):
+        rows = self._filter(table_name, params)
+        options = dict(params)
+
+        if 'order' in options:
+            for clause in reversed(options['order'].split(',')):
+                parts = clause.strip().split('.')
+                column = parts[0]
+                descending = 'desc' in parts[1:]
+                rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=descending)
+
+        offset = int(options.get('offset', 0))
+        rows = rows[offset:]
+        if 'limit' in options:
+            rows = rows[:int(options['limit'])]
+
+        return self._project([copy.deepcopy(row) for row in rows], options.get('select', '*'))
+
+    @staticmethod
+    def _project(rows, select):
+        columns = [column.strip() for column in select.split(',') if column.strip()]
+        if not columns or '*' in columns:
+            return rows
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    def _filter(self, table_name, params):
+        conditions = [(key, value) for key, value in params if key not in _RESERVED_PARAMS]
+        return [row for row in self.table(table_name) if all(self._matches(row, key, value) for key, value in conditions)]
+
+    def _matches(self, row, key, expression):
+        if key in ('or', 'and'):
+            items = _split_top_level(expression.strip()[1:-1])
+            results = [self._matches_item(row, item) for item in items]
+            return any(results) if key == 'or' else all(results)
+        return self._evaluate(row.get(key), expression)
+
+    def _matches_item(self, row, item):
+        """Obsługuje element grupy logicznej: 'kolumna.op.wartość' lub zagnieżdżone and(...)/or(...)"""
+        for logical in ('and', 'or'):
+            if item.startswith(f"{logical}("):
+                return self._matches(row, logical, item[len(logical):])
+        column, expression = item.split('.', 1)
+        return self._evaluate(row.get(column), expression)
+
+    def _evaluate(self, value, expression):
+        negate = False
+        if expression.startswith('not.'):
+            negate = True
+            expression = expression[4:]
+
+        operator, _, raw = expression.partition('.')
+
+        if operator == 'is':
+            lowered = raw.lower()
+            result = value is None if lowered == 'null' else value is (lowered == 'true')
+        elif operator == 'in':
+            candidates = _split_top_level(raw.strip()[1:-1])
+            result = value is not None and value in [_coerce(candidate, value) for candidate in candidates]
+        elif operator in ('like', 'ilike'):
+            flags = re.IGNORECASE if operator == 'ilike' else 0
+            result = value is not None and re.match(_like_to_regex(raw), str(value), flags) is not None
+        elif operator in _OPERATORS:
+            result = value is not None and _OPERATORS[operator](value, _coerce(raw, value))
+        else:
+            raise ValueError(f"Nieobsługiwany operator filtra: {operator}")
+
+        return not result if negate else result
@@ -0,0 +1,131 @@
+"""
+Pamięć podręczna profili użytkowników
+Przechowuje w pamięci procesu najczęściej odczytywane dane użytkownika (język, saldo
+kredytów, limit wiadomości, aktywną konwersację, bieżący temat), aby handlery nie
+odpytywały bazy kilka razy w ramach jednej aktualizacji.
+
+Wpisy wygasają po czasie TTL, a liczba użytkowników w pamięci jest ograniczona (LRU).
+Funkcje zapisujące w warstwie bazy danych aktualizują lub unieważniają wpisy.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL, PROFILE_CACHE_CREDITS_TTL
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Pola przechowywane w profilu
+FIELDS = ('language', 'credits', 'messages_limit', 'messages_used', 'conversation', 'theme')
+
+class ProfileCache:
+    """
+    Ograniczona pamięć podręczna profili z czasem wygasania pól
+
+    Args:
+        max_size (int): Maksymalna liczba użytkowników w pamięci
+        ttl (float): Czas życia pola w sekundach
+        field_ttl (dict, optional): Czas życia dla wybranych pól {pole: sekundy}
+    """
+
+    def __init__(self, max_size, ttl, field_ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.field_ttl = field_ttl or {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, field):
+        """
+        Zwraca wartość pola z pamięci lub None, jeśli jej nie ma albo wygasła
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            item = entry.get(field) if entry else None
+
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del entry[field]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return item[0]
+
+    def set(self, user_id, **fields):
+        """Zapisuje podane pola profilu (wartości None są pomijane)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                entry = self._entries[user_id] = {}
+            self._entries.move_to_end(user_id)
+
+            for field, value in fields.items():
+                if value is None:
+                    continue
+                entry[field] = (value, now + self.field_ttl.get(field, self.ttl))
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id, *fields):
+        """Usuwa podane pola profilu lub cały profil, jeśli nie podano pól"""
+        with self._lock:
+            if not fields:
+                self._entries.pop(user_id, None)
+                return
+
+            entry = self._entries.get(user_id)
+            if entry:
+                for field in fields:
+                    entry.pop(field, None)
+
+    def clear(self):
+        """Czyści całą pamięć i liczniki"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Zwraca statystyki trafień"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0
+            }
+
+# Wspólna instancja dla całego procesu
+_cache = ProfileCache(
+    PROFILE_CACHE_SIZE,
+    PROFILE_CACHE_TTL,
+    field_ttl={'credits': PROFILE_CACHE_CREDITS_TTL}
+)
+register_stats("profile_cache", _cache.stats)
+
+def get_cached(user_id, field):
+    """Zwraca pole profilu z pamięci lub None"""
+    return _cache.get(user_id, field)
+
+def cache_profile(user_id, **fields):
+    """Zapisuje pola profilu w pamięci"""
+    _cache.set(user_id, **fields)
+
+def invalidate_profile(user_id, *fields):
+    """Unieważnia pola profilu (lub cały profil)"""
+    _cache.invalidate(user_id, *fields)
+
+def clear_profile_cache():
+    """Czyści pamięć profili"""
+    _cache.clear()
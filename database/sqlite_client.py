@@ -0,0 +1,1153 @@
+"""
+Wbudowany backend SQLite - odpowiednik database/supabase_client.py dla instalacji
+na jednym serwerze i testów bez dostępu do sieci.
+
+Włączany przez STORAGE_BACKEND=sqlite (ścieżka pliku bazy w SQLITE_PATH). Moduł
+udostępnia te same funkcje i te same formaty wyników co klient Supabase; gdy backend
+jest aktywny, database.supabase_client i database.async_supabase_client podmieniają
+swoje funkcje na funkcje z tego modułu, więc handlery nie wymagają zmian.
+
+Baza działa w trybie WAL (odczyty nie blokują zapisu), zapytania są parametryzowane
+(skompilowane polecenia są przechowywane w pamięci podręcznej połączenia),
+a operacje na saldzie i tury czatu wykonywane są w jednej transakcji.
+"""
+import datetime
+import logging
+import random
+import sqlite3
+import string
+import threading
+import uuid
+import pytz
+from contextlib import contextmanager
+from config import SQLITE_PATH, CREDIT_PACKAGES, PAYMENT_METHODS, HISTORY_BUFFER_SIZE
+from database.profile_cache import cache_profile
+from database.history_buffer import get_buffered_history, hydrate_history, append_history
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'get_or_create_user', 'update_user_language', 'get_user_language',
+    'init_user_credits', 'get_user_credits', 'ledger_add', 'ledger_deduct',
+    'add_user_credits', 'deduct_user_credits', 'check_user_credits',
+    'get_credit_packages', 'get_package_by_id', 'purchase_credits',
+    'get_user_credit_stats', 'add_stars_payment_option',
+    'check_active_subscription', 'get_subscription_end_date',
+    'create_license', 'activate_user_license',
+    'check_message_limit', 'increment_messages_used', 'get_message_status',
+    'create_new_conversation', 'get_active_conversation', 'save_message',
+    'get_conversation_history',
+    'save_prompt_template', 'get_prompt_templates', 'get_prompt_template_by_id',
+    'create_conversation_theme', 'get_user_themes', 'get_theme_by_id',
+    'create_themed_conversation', 'get_active_themed_conversation',
+    'create_activation_code', 'use_activation_code',
+    'get_credit_transactions', 'get_credit_usage_by_type',
+    'get_payment_methods', 'get_payment_method_by_code',
+    'get_active_subscriptions', 'get_subscription_by_id', 'mark_subscription_cancelled'
+]
+
+# Funkcje udostępniane w database.async_supabase_client (wywoływane bezpośrednio
+# w pętli zdarzeń - zapytania do lokalnego pliku trwają ułamek milisekundy)
+ASYNC_API = [
+    'get_or_create_user', 'update_user_language', 'get_user_language',
+    'init_user_credits', 'get_user_credits', 'check_user_credits',
+    'ledger_add', 'ledger_deduct', 'add_user_credits', 'deduct_user_credits',
+    'get_credit_transactions', 'get_credit_transactions_page', 'get_credit_usage_by_type',
+    'check_active_subscription', 'check_message_limit', 'increment_messages_used',
+    'get_message_status', 'create_new_conversation', 'get_active_conversation',
+    'save_message', 'insert_messages', 'touch_conversation',
+    'get_conversation_history', 'get_messages_page',
+    'begin_chat_turn', 'commit_chat_turn', 'get_payment_transactions_page'
+]
+
+SCHEMA = """
+create table if not exists users (
+    id integer primary key,
+    username text,
+    first_name text,
+    last_name text,
+    language_code text,
+    language text,
+    created_at text,
+    is_active integer default 1,
+    messages_used integer default 0,
+    messages_limit integer default 0,
+    subscription_end_date text
+);
+
+create table if not exists user_credits (
+    id integer primary key autoincrement,
+    user_id integer not null unique,
+    credits_amount integer not null default 0,
+    total_credits_purchased integer default 0,
+    total_spent real default 0,
+    last_purchase_date text
+);
+
+create table if not exists credit_transactions (
+    id integer primary key autoincrement,
+    user_id integer not null,
+    transaction_type text not null,
+    amount integer not null,
+    credits_before integer,
+    credits_after integer,
+    description text,
+    category text,
+    prompt_tokens integer,
+    completion_tokens integer,
+    created_at text not null
+);
+create index if not exists credit_transactions_user_created_id_idx
+    on credit_transactions (user_id, created_at, id);
+create index if not exists credit_transactions_user_type_created_idx
+    on credit_transactions (user_id, transaction_type, created_at);
+
+create table if not exists credit_packages (
+    id integer primary key,
+    name text not null,
+    credits integer not null,
+    price real not null,
+    is_active integer default 1
+);
+
+create table if not exists payment_methods (
+    id integer primary key autoincrement,
+    code text unique,
+    name text,
+    external_url text,
+    is_available_pl integer default 1,
+    is_available_en integer default 1,
+    is_available_ru integer default 1,
+    is_active integer default 1
+);
+
+create table if not exists subscriptions (
+    id integer primary key autoincrement,
+    user_id integer not null,
+    credit_package_id integer,
+    payment_method_id integer,
+    external_subscription_id text,
+    status text,
+    start_date text,
+    end_date text,
+    created_at text,
+    updated_at text
+);
+create index if not exists subscriptions_user_status_idx
+    on subscriptions (user_id, status);
+
+create table if not exists payment_transactions (
+    id integer primary key autoincrement,
+    user_id integer not null,
+    credit_package_id integer,
+    payment_method_id integer,
+    amount real,
+    status text,
+    external_id text,
+    created_at text not null
+);
+create index if not exists payment_transactions_user_created_id_idx
+    on payment_transactions (user_id, created_at, id);
+
+create table if not exists conversations (
+    id integer primary key autoincrement,
+    user_id integer not null,
+    theme_id integer,
+    created_at text,
+    last_message_at text
+);
+create index if not exists conversations_user_last_message_idx
+    on conversations (user_id, last_message_at);
+create index if not exists conversations_user_theme_last_message_idx
+    on conversations (user_id, theme_id, last_message_at);
+
+create table if not exists messages (
+    id integer primary key autoincrement,
+    conversation_id integer not null,
+    user_id integer,
+    content text,
+    is_from_user integer,
+    model_used text,
+    prompt_tokens integer,
+    completion_tokens integer,
+    created_at text not null
+);
+create index if not exists messages_conversation_created_id_idx
+    on messages (conversation_id, created_at, id);
+
+create table if not exists prompt_templates (
+    id integer primary key autoincrement,
+    name text,
+    description text,
+    prompt_text text,
+    is_active integer default 1,
+    created_at text
+);
+
+create table if not exists conversation_themes (
+    id integer primary key autoincrement,
+    user_id integer not null,
+    theme_name text,
+    is_active integer default 1,
+    created_at text,
+    last_used_at text
+);
+create index if not exists conversation_themes_user_last_used_idx
+    on conversation_themes (user_id, last_used_at);
+
+create table if not exists licenses (
+    id integer primary key autoincrement,
+    license_key text unique,
+    duration_days integer,
+    message_limit integer default 0,
+    price real,
+    is_used integer default 0,
+    used_at text,
+    used_by integer,
+    created_at text
+);
+
+create table if not exists activation_codes (
+    id integer primary key autoincrement,
+    code text unique,
+    credits integer,
+    is_used integer default 0,
+    used_by integer,
+    used_at text,
+    created_at text
+);
+"""
+
+# Kolumny dodane po pierwszej wersji schematu - uzupełniane w istniejących plikach bazy
+ADDED_COLUMNS = {
+    'credit_transactions': {'prompt_tokens': 'integer', 'completion_tokens': 'integer'},
+    'messages': {'prompt_tokens': 'integer', 'completion_tokens': 'integer'},
+    'payment_methods': {
+        'external_url': 'text',
+        'is_available_pl': 'integer default 1',
+        'is_available_en': 'integer default 1',
+        'is_available_ru': 'integer default 1'
+    }
+}
+
+# Kolumny logiczne - SQLite przechowuje je jako 0/1
+BOOLEAN_COLUMNS = {'is_active', 'is_from_user', 'is_used', 'is_available_pl', 'is_available_en', 'is_available_ru'}
+
+_connection = None
+_lock = threading.RLock()
+
+def _row_factory(cursor, row):
+    result = {}
+    for (name, *_), value in zip(cursor.description, row):
+        if name in BOOLEAN_COLUMNS and value is not None:
+            value = bool(value)
+        result[name] = value
+    return result
+
+def get_connection():
+    """Zwraca współdzielone połączenie z bazą, tworząc schemat przy pierwszym użyciu"""
+    global _connection
+    with _lock:
+        if _connection is None:
+            connection = sqlite3.connect(
+                SQLITE_PATH,
+                check_same_thread=False,
+                isolation_level=None,
+                cached_statements=256
+            )
+            connection.row_factory = _row_factory
+            connection.execute("pragma journal_mode=wal")
+            connection.execute("pragma synchronous=normal")
+            connection.execute("pragma busy_timeout=5000")
+            connection.executescript(SCHEMA)
+            _upgrade(connection)
+            _seed(connection)
+            _connection = connection
+            logger.info(f"Pomyślnie zainicjalizowano bazę SQLite: {SQLITE_PATH}")
+        return _connection
+
+def close_connection():
+    """Zamyka połączenie z bazą (wywoływane przy zamykaniu bota)"""
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+def _upgrade(connection):
+    """Dodaje kolumny z ADDED_COLUMNS do tabel utworzonych przez starszą wersję schematu"""
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row['name'] for row in connection.execute(f"pragma table_info({table})").fetchall()}
+        for column, column_type in columns.items():
+            if column not in existing:
+                connection.execute(f"alter table {table} add column {column} {column_type}")
+
+def _seed(connection):
+    """Uzupełnia pustą bazę pakietami kredytów i metodami płatności z konfiguracji"""
+    if connection.execute("select 1 from credit_packages limit 1").fetchone() is None:
+        connection.executemany(
+            "insert into credit_packages (id, name, credits, price, is_active) values (?, ?, ?, ?, 1)",
+            [(p['id'], p['name'], p['credits'], p['price']) for p in CREDIT_PACKAGES]
+        )
+    if connection.execute("select 1 from payment_methods limit 1").fetchone() is None:
+        connection.executemany(
+            "insert into payment_methods (code, name, is_active) values (?, ?, ?)",
+            [(code, method['name'], int(method['enabled'])) for code, method in PAYMENT_METHODS.items()]
+        )
+
+def _query(sql, params=()):
+    with _lock:
+        return get_connection().execute(sql, params).fetchall()
+
+def _query_one(sql, params=()):
+    rows = _query(sql, params)
+    return rows[0] if rows else None
+
+def _execute(sql, params=()):
+    """Wykonuje polecenie zmieniające dane; zwraca ID ostatnio wstawionego wiersza"""
+    with _lock:
+        return get_connection().execute(sql, params).lastrowid
+
+@contextmanager
+def _transaction():
+    """Transakcja z blokadą zapisu od początku (BEGIN IMMEDIATE)"""
+    with _lock:
+        connection = get_connection()
+        connection.execute("begin immediate")
+        try:
+            yield connection
+        except Exception:
+            connection.execute("rollback")
+            raise
+        connection.execute("commit")
+
+def _insert(table, data):
+    """Wstawia wiersz i zwraca go w postaci zapisanej w bazie"""
+    columns = ', '.join(data)
+    placeholders = ', '.join('?' for _ in data)
+    row_id = _execute(f"insert into {table} ({columns}) values ({placeholders})", tuple(data.values()))
+    return _query_one(f"select * from {table} where rowid = ?", (row_id,))
+
+def _now():
+    return datetime.datetime.now(pytz.UTC).isoformat()
+
+# Funkcje zarządzania użytkownikami
+def get_or_create_user(user_id, username=None, first_name=None, last_name=None, language_code=None):
+    """Pobierz lub utwórz użytkownika w bazie danych"""
+    try:
+        user = _query_one("select * from users where id = ?", (user_id,))
+        if user:
+            return user
+
+        user = _insert('users', {
+            'id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name,
+            'language_code': language_code,
+            'language': language_code,
+            'created_at': _now(),
+            'is_active': 1,
+            'messages_used': 0,
+            'messages_limit': 0
+        })
+        init_user_credits(user_id)
+        return user
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu/tworzeniu użytkownika: {e}")
+        return None
+
+def update_user_language(user_id, language):
+    """Aktualizuje język użytkownika w bazie danych"""
+    try:
+        with _lock:
+            updated = get_connection().execute(
+                "update users set language = ? where id = ?", (language, user_id)
+            ).rowcount
+        if updated:
+            # utils.user_utils odczytuje język z pamięci podręcznej profili
+            cache_profile(user_id, language=language)
+        return bool(updated)
+    except Exception as e:
+        logger.error(f"Błąd przy aktualizacji języka użytkownika: {e}")
+        return False
+
+def get_user_language(user_id):
+    """Pobiera język użytkownika"""
+    try:
+        user = _query_one("select language, language_code from users where id = ?", (user_id,))
+        if user:
+            return user['language'] or user['language_code'] or "pl"
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu języka użytkownika: {e}")
+    return "pl"
+
+# Funkcje obsługi kredytów
+def init_user_credits(user_id):
+    """Inicjalizuje rekord kredytów dla użytkownika"""
+    try:
+        _execute(
+            "insert or ignore into user_credits (user_id, credits_amount, total_credits_purchased, total_spent) "
+            "values (?, 0, 0, 0)",
+            (user_id,)
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Błąd przy inicjalizacji kredytów użytkownika: {e}")
+        return False
+
+def get_user_credits(user_id):
+    """Pobiera liczbę kredytów użytkownika"""
+    try:
+        row = _query_one("select credits_amount from user_credits where user_id = ?", (user_id,))
+        if row:
+            return row['credits_amount']
+
+        init_user_credits(user_id)
+        return 0
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu kredytów użytkownika: {e}")
+        return 0
+
+def _log_credit_transaction(connection, user_id, transaction_type, amount, before, after, description, category=None,
+                            prompt_tokens=None, completion_tokens=None):
+    connection.execute(
+        "insert into credit_transactions "
+        "(user_id, transaction_type, amount, credits_before, credits_after, description, category, "
+        "prompt_tokens, completion_tokens, created_at) "
+        "values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (user_id, transaction_type, amount, before, after, description, category,
+         prompt_tokens, completion_tokens, _now())
+    )
+
+def ledger_add(user_id, amount, description=None, transaction_type='add', price=0):
+    """
+    Atomowo dodaje kredyty i zapisuje transakcję
+
+    Returns:
+        int: Nowe saldo lub None w przypadku błędu
+    """
+    try:
+        with _transaction() as connection:
+            connection.execute(
+                "insert into user_credits (user_id, credits_amount, total_credits_purchased, total_spent, last_purchase_date) "
+                "values (?, ?, ?, ?, ?) "
+                "on conflict (user_id) do update set "
+                "credits_amount = credits_amount + excluded.credits_amount, "
+                "total_credits_purchased = coalesce(total_credits_purchased, 0) + excluded.total_credits_purchased, "
+                "total_spent = coalesce(total_spent, 0) + excluded.total_spent, "
+                "last_purchase_date = excluded.last_purchase_date",
+                (user_id, amount, amount, price or 0, _now())
+            )
+            after = connection.execute(
+                "select credits_amount from user_credits where user_id = ?", (user_id,)
+            ).fetchone()['credits_amount']
+            if amount != 0:
+                _log_credit_transaction(connection, user_id, transaction_type, amount, after - amount, after, description)
+        return after
+    except Exception as e:
+        logger.error(f"Błąd przy dodawaniu kredytów użytkownika: {e}")
+        return None
+
+def ledger_deduct(user_id, amount, description=None, category='other', prompt_tokens=None, completion_tokens=None):
+    """
+    Atomowo odejmuje kredyty, jeśli saldo jest wystarczające
+
+    Returns:
+        int: Nowe saldo lub None, jeśli brakuje kredytów lub wystąpił błąd
+    """
+    try:
+        with _transaction() as connection:
+            return _deduct(connection, user_id, amount, description, category, prompt_tokens, completion_tokens)
+    except Exception as e:
+        logger.error(f"Błąd przy odejmowaniu kredytów użytkownika: {e}")
+        return None
+
+def _deduct(connection, user_id, amount, description, category, prompt_tokens=None, completion_tokens=None):
+    """Odejmuje kredyty w ramach otwartej transakcji; None, gdy saldo jest za małe"""
+    updated = connection.execute(
+        "update user_credits set credits_amount = credits_amount - ? where user_id = ? and credits_amount >= ?",
+        (amount, user_id, amount)
+    ).rowcount
+    if not updated:
+        return None
+
+    after = connection.execute(
+        "select credits_amount from user_credits where user_id = ?", (user_id,)
+    ).fetchone()['credits_amount']
+    _log_credit_transaction(connection, user_id, 'deduct', amount, after + amount, after, description, category or 'other',
+                            prompt_tokens, completion_tokens)
+    return after
+
+def add_user_credits(user_id, amount, description=None):
+    """Dodaje kredyty do konta użytkownika"""
+    return ledger_add(user_id, amount, description) is not None
+
+def deduct_user_credits(user_id, amount, description=None, category='other', prompt_tokens=None, completion_tokens=None):
+    """Odejmuje kredyty z konta użytkownika"""
+    return ledger_deduct(user_id, amount, description, category, prompt_tokens, completion_tokens) is not None
+
+def check_user_credits(user_id, amount_needed):
+    """Sprawdza, czy użytkownik ma wystarczającą liczbę kredytów"""
+    return get_user_credits(user_id) >= amount_needed
+
+def get_credit_packages():
+    """Pobiera dostępne pakiety kredytów"""
+    try:
+        return _query("select * from credit_packages where is_active = 1 order by credits")
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu pakietów kredytów: {e}")
+        return []
+
+def get_package_by_id(package_id):
+    """Pobiera informacje o pakiecie kredytów"""
+    try:
+        return _query_one("select * from credit_packages where id = ? and is_active = 1", (package_id,))
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu pakietu kredytów: {e}")
+        return None
+
+def purchase_credits(user_id, package_id):
+    """Dokonuje zakupu kredytów"""
+    package = get_package_by_id(package_id)
+    if not package:
+        return False, None
+
+    description = f"Zakup pakietu {package['name']}"
+    if ledger_add(user_id, package['credits'], description, 'purchase', package['price']) is None:
+        return False, None
+    return True, package
+
+def get_user_credit_stats(user_id):
+    """Pobiera statystyki kredytów użytkownika"""
+    empty = {
+        'credits': 0,
+        'total_purchased': 0,
+        'last_purchase': None,
+        'total_spent': 0.0,
+        'usage_history': []
+    }
+    try:
+        credit_info = _query_one("select * from user_credits where user_id = ?", (user_id,))
+        if not credit_info:
+            return empty
+
+        transactions = _query(
+            "select * from credit_transactions where user_id = ? order by created_at desc, id desc limit 10",
+            (user_id,)
+        )
+        return {
+            'credits': credit_info['credits_amount'],
+            'total_purchased': credit_info['total_credits_purchased'],
+            'last_purchase': credit_info['last_purchase_date'],
+            'total_spent': float(credit_info['total_spent']) if credit_info['total_spent'] else 0.0,
+            'usage_history': [{
+                'type': trans['transaction_type'],
+                'amount': trans['amount'],
+                'balance': trans['credits_after'],
+                'description': trans['description'],
+                'date': trans['created_at']
+            } for trans in transactions]
+        }
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu statystyk kredytów użytkownika: {e}")
+        return empty
+
+def add_stars_payment_option(user_id, stars_amount, credits_amount, description=None):
+    """Dodaje kredyty za płatność gwiazdkami"""
+    if description is None:
+        description = f"Zakup za {stars_amount} gwiazdek Telegram"
+    return add_user_credits(user_id, credits_amount, description)
+
+def get_credit_transactions(user_id, days=30):
+    """Pobiera historię transakcji kredytowych użytkownika z określonej liczby dni"""
+    try:
+        start_date = (datetime.datetime.now(pytz.UTC) - datetime.timedelta(days=days)).isoformat()
+        return _query(
+            "select * from credit_transactions where user_id = ? and created_at >= ? order by created_at, id",
+            (user_id, start_date)
+        )
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu transakcji kredytowych: {e}")
+        return []
+
+def get_credit_transactions_page(user_id, cursor=None, direction='older', page_size=10):
+    """Pobiera stronę historii transakcji kredytowych użytkownika (od najnowszych)"""
+    try:
+        return _select_page('credit_transactions', 'user_id', user_id, cursor, direction, page_size)
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu strony transakcji kredytowych: {e}")
+        return None
+
+def get_credit_usage_by_type(user_id, days=30):
+    """Pobiera sumaryczne zużycie kredytów według kategorii operacji"""
+    try:
+        start_date = (datetime.datetime.now(pytz.UTC) - datetime.timedelta(days=days)).isoformat()
+        rows = _query(
+            "select coalesce(category, 'other') as category, sum(amount) as amount "
+            "from credit_transactions "
+            "where user_id = ? and transaction_type = 'deduct' and created_at >= ? "
+            "group by 1 order by 2 desc",
+            (user_id, start_date)
+        )
+        return {row['category']: row['amount'] for row in rows}
+    except Exception as e:
+        logger.error(f"Błąd przy analizie zużycia kredytów: {e}")
+        return {}
+
+# Funkcje obsługi subskrypcji
+def _parse_timestamp(value):
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def check_active_subscription(user_id):
+    """Sprawdza czy użytkownik ma aktywną subskrypcję"""
+    try:
+        user = _query_one("select subscription_end_date from users where id = ?", (user_id,))
+        if not user:
+            return False
+
+        end_date = user['subscription_end_date']
+        if end_date and _parse_timestamp(end_date) > datetime.datetime.now(pytz.UTC):
+            return True
+
+        return check_message_limit(user_id)
+    except Exception as e:
+        logger.error(f"Błąd przy sprawdzaniu subskrypcji: {e}")
+        return False
+
+def get_subscription_end_date(user_id):
+    """Pobierz datę końca subskrypcji użytkownika"""
+    try:
+        user = _query_one("select subscription_end_date from users where id = ?", (user_id,))
+        if not user or not user['subscription_end_date']:
+            return None
+        return _parse_timestamp(user['subscription_end_date'])
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu daty końca subskrypcji: {e}")
+        return None
+
+def create_license(duration_days, price, message_limit=0):
+    """Tworzy nową licencję"""
+    try:
+        return _insert('licenses', {
+            'license_key': str(uuid.uuid4()),
+            'duration_days': duration_days,
+            'message_limit': message_limit,
+            'price': price,
+            'is_used': 0,
+            'created_at': _now()
+        })
+    except Exception as e:
+        logger.error(f"Błąd przy tworzeniu licencji: {e}")
+        return None
+
+def activate_user_license(user_id, license_key):
+    """Aktywuje licencję dla użytkownika"""
+    try:
+        with _transaction() as connection:
+            license_data = connection.execute(
+                "select * from licenses where license_key = ? and is_used = 0", (license_key,)
+            ).fetchone()
+            if not license_data:
+                return False, None, 0
+
+            user = connection.execute("select messages_limit from users where id = ?", (user_id,)).fetchone()
+            if not user:
+                return False, None, 0
+
+            now = datetime.datetime.now(pytz.UTC)
+            end_date = None
+            if license_data['duration_days'] > 0:
+                end_date = now + datetime.timedelta(days=license_data['duration_days'])
+
+            connection.execute(
+                "update licenses set is_used = 1, used_at = ?, used_by = ? where id = ?",
+                (now.isoformat(), user_id, license_data['id'])
+            )
+
+            new_message_limit = (user['messages_limit'] or 0) + license_data['message_limit']
+            if end_date:
+                connection.execute(
+                    "update users set subscription_end_date = ?, messages_limit = ? where id = ?",
+                    (end_date.isoformat(), new_message_limit, user_id)
+                )
+            else:
+                connection.execute("update users set messages_limit = ? where id = ?", (new_message_limit, user_id))
+
+        return True, end_date, license_data['message_limit']
+    except Exception as e:
+        logger.error(f"Błąd przy aktywacji licencji: {e}")
+        return False, None, 0
+
+# Funkcje obsługi limitów wiadomości
+def _get_message_quota(user_id):
+    user = _query_one("select messages_limit, messages_used from users where id = ?", (user_id,))
+    if not user:
+        return None
+    return user['messages_limit'] or 0, user['messages_used'] or 0
+
+def check_message_limit(user_id):
+    """Sprawdza czy użytkownik ma dostępne wiadomości"""
+    try:
+        quota = _get_message_quota(user_id)
+        if quota is None:
+            return False
+        messages_limit, messages_used = quota
+        return messages_used < messages_limit
+    except Exception as e:
+        logger.error(f"Błąd przy sprawdzaniu limitu wiadomości: {e}")
+        return False
+
+def increment_messages_used(user_id):
+    """Zwiększa licznik wykorzystanych wiadomości"""
+    try:
+        with _lock:
+            updated = get_connection().execute(
+                "update users set messages_used = coalesce(messages_used, 0) + 1 where id = ?", (user_id,)
+            ).rowcount
+        return bool(updated)
+    except Exception as e:
+        logger.error(f"Błąd przy aktualizacji licznika wiadomości: {e}")
+        return False
+
+def get_message_status(user_id):
+    """Pobiera status wiadomości użytkownika"""
+    try:
+        quota = _get_message_quota(user_id)
+        if quota is None:
+            return {"messages_limit": 0, "messages_used": 0, "messages_left": 0}
+
+        messages_limit, messages_used = quota
+        return {
+            "messages_limit": messages_limit,
+            "messages_used": messages_used,
+            "messages_left": max(0, messages_limit - messages_used)
+        }
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu statusu wiadomości: {e}")
+        return {"messages_limit": 0, "messages_used": 0, "messages_left": 0}
+
+# Funkcje obsługi konwersacji
+def create_new_conversation(user_id):
+    """Tworzy nową konwersację dla użytkownika"""
+    try:
+        now = _now()
+        conversation = _insert('conversations', {
+            'user_id': user_id,
+            'created_at': now,
+            'last_message_at': now
+        })
+        # Nowa konwersacja jest pusta - bufor historii od razu aktualny
+        hydrate_history(conversation['id'], [])
+        return conversation
+    except Exception as e:
+        logger.error(f"Błąd przy tworzeniu nowej konwersacji: {e}")
+        return None
+
+def get_active_conversation(user_id):
+    """Pobiera aktywną konwersację użytkownika (ostatnią)"""
+    try:
+        conversation = _query_one(
+            "select * from conversations where user_id = ? order by last_message_at desc limit 1", (user_id,)
+        )
+        if conversation:
+            return conversation
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu aktywnej konwersacji: {e}")
+    return create_new_conversation(user_id)
+
+def _message_record(conversation_id, user_id, content, is_from_user, model_used, created_at):
+    return {
+        'conversation_id': conversation_id,
+        'user_id': user_id,
+        'content': content,
+        'is_from_user': is_from_user,
+        'model_used': model_used,
+        'created_at': created_at
+    }
+
+def _insert_message(connection, record):
+    row_id = connection.execute(
+        "insert into messages "
+        "(conversation_id, user_id, content, is_from_user, model_used, prompt_tokens, completion_tokens, created_at) "
+        "values (?, ?, ?, ?, ?, ?, ?, ?)",
+        (record['conversation_id'], record['user_id'], record['content'],
+         int(bool(record['is_from_user'])), record.get('model_used'),
+         record.get('prompt_tokens'), record.get('completion_tokens'), record['created_at'])
+    ).lastrowid
+    return dict(record, id=row_id)
+
+def save_message(conversation_id, user_id, content, is_from_user, model_used=None):
+    """Zapisuje wiadomość w bazie danych"""
+    try:
+        now = _now()
+        with _transaction() as connection:
+            message = _insert_message(connection, _message_record(conversation_id, user_id, content, is_from_user, model_used, now))
+            connection.execute("update conversations set last_message_at = ? where id = ?", (now, conversation_id))
+        append_history(conversation_id, message)
+        return message
+    except Exception as e:
+        logger.error(f"Błąd przy zapisywaniu wiadomości: {e}")
+        return None
+
+def insert_messages(records):
+    """Zapisuje wiele wiadomości w jednej transakcji (błędy są przekazywane wywołującemu)"""
+    with _transaction() as connection:
+        for record in records:
+            _insert_message(connection, record)
+
+def touch_conversation(conversation_id, last_message_at):
+    """Ustawia czas ostatniej wiadomości konwersacji (błędy są przekazywane wywołującemu)"""
+    _execute("update conversations set last_message_at = ? where id = ?", (last_message_at, conversation_id))
+
+def get_conversation_history(conversation_id, limit=20):
+    """Pobiera ostatnie `limit` wiadomości konwersacji w kolejności chronologicznej"""
+    # Bufor w pamięci zawiera też wiadomości z kolejki zapisu, które nie trafiły jeszcze do bazy
+    buffered = get_buffered_history(conversation_id, limit)
+    if buffered is not None:
+        return buffered
+
+    try:
+        rows = _query(
+            "select * from messages where conversation_id = ? order by created_at desc, id desc limit ?",
+            (conversation_id, max(limit, HISTORY_BUFFER_SIZE))
+        )
+        rows.reverse()
+        hydrate_history(conversation_id, rows)
+        return rows[-limit:] if limit > 0 else []
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu historii konwersacji: {e}")
+        return []
+
+def get_messages_page(conversation_id, cursor=None, direction='older', page_size=10):
+    """Pobiera stronę wiadomości konwersacji (od najnowszych)"""
+    try:
+        return _select_page('messages', 'conversation_id', conversation_id, cursor, direction, page_size)
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu strony historii konwersacji: {e}")
+        return None
+
+def _select_page(table, key_column, key, cursor=None, direction='older', page_size=10, select=None):
+    """
+    Strona wierszy kursorem (created_at, id) - ten sam format wyniku co
+    async_supabase_client._select_page
+    """
+    select = select or f"select * from {table}"
+    if direction == 'newer' and cursor is not None:
+        rows = _query(
+            f"{select} where {table}.{key_column} = ? and ({table}.created_at, {table}.id) > (?, ?) "
+            f"order by {table}.created_at, {table}.id limit ?",
+            (key, cursor[0], cursor[1], page_size + 1)
+        )
+        if len(rows) <= page_size:
+            return _select_page(table, key_column, key, None, 'older', page_size, select)
+        rows = rows[:page_size]
+        rows.reverse()
+        has_older, has_newer = True, True
+    else:
+        if cursor is not None:
+            rows = _query(
+                f"{select} where {table}.{key_column} = ? and ({table}.created_at, {table}.id) < (?, ?) "
+                f"order by {table}.created_at desc, {table}.id desc limit ?",
+                (key, cursor[0], cursor[1], page_size + 1)
+            )
+        else:
+            rows = _query(
+                f"{select} where {table}.{key_column} = ? "
+                f"order by {table}.created_at desc, {table}.id desc limit ?",
+                (key, page_size + 1)
+            )
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        has_older, has_newer = has_more, cursor is not None and bool(rows)
+
+    return {
+        'items': rows,
+        'has_older': has_older,
+        'has_newer': has_newer,
+        'older_cursor': (rows[-1]['created_at'], rows[-1]['id']) if rows else None,
+        'newer_cursor': (rows[0]['created_at'], rows[0]['id']) if rows else None
+    }
+
+# Funkcje obsługi tury czatu
+def begin_chat_turn(user_id, history_limit=20):
+    """Pobiera dane potrzebne do obsługi wiadomości - odpowiednik funkcji bazy begin_chat_turn"""
+    try:
+        user = _query_one(
+            "select language, language_code, messages_limit, messages_used from users where id = ?", (user_id,)
+        ) or {}
+        conversation = get_active_conversation(user_id)
+        return {
+            'credits': get_user_credits(user_id),
+            'language': user.get('language') or user.get('language_code') or 'pl',
+            'messages_limit': user.get('messages_limit') or 0,
+            'messages_used': user.get('messages_used') or 0,
+            'conversation_id': conversation['id'],
+            'history': get_conversation_history(conversation['id'], history_limit)
+        }
+    except Exception as e:
+        logger.error(f"Błąd przy rozpoczynaniu tury czatu: {e}")
+        return None
+
+def commit_chat_turn(user_id, conversation_id, user_message, assistant_message=None,
+                     model_used=None, credit_cost=0, description=None,
+                     prompt_tokens=None, completion_tokens=None):
+    """Zapisuje w jednej transakcji wynik tury czatu - odpowiednik funkcji bazy commit_chat_turn"""
+    try:
+        now = datetime.datetime.now(pytz.UTC)
+        messages = []
+        credits = None
+        charged = False
+        messages_used = None
+
+        with _transaction() as connection:
+            messages.append(_insert_message(connection, _message_record(
+                conversation_id, user_id, user_message, True, None, now.isoformat()
+            )))
+
+            if assistant_message is not None:
+                # Odpowiedź dostaje późniejszy znacznik czasu, aby zachować kolejność w historii
+                messages.append(_insert_message(connection, dict(
+                    _message_record(
+                        conversation_id, user_id, assistant_message, False, model_used,
+                        (now + datetime.timedelta(milliseconds=1)).isoformat()
+                    ),
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens
+                )))
+
+                if credit_cost > 0:
+                    credits = _deduct(connection, user_id, credit_cost, description, 'message',
+                                      prompt_tokens, completion_tokens)
+                    charged = credits is not None
+
+                connection.execute(
+                    "update users set messages_used = coalesce(messages_used, 0) + 1 where id = ?", (user_id,)
+                )
+                row = connection.execute("select messages_used from users where id = ?", (user_id,)).fetchone()
+                messages_used = row['messages_used'] if row else None
+
+            if credits is None:
+                row = connection.execute("select credits_amount from user_credits where user_id = ?", (user_id,)).fetchone()
+                credits = row['credits_amount'] if row else 0
+
+            connection.execute(
+                "update conversations set last_message_at = ? where id = ?", (now.isoformat(), conversation_id)
+            )
+
+        for message in messages:
+            append_history(conversation_id, message)
+        return {'credits': credits, 'charged': charged, 'messages_used': messages_used}
+    except Exception as e:
+        logger.error(f"Błąd przy zapisywaniu tury czatu: {e}")
+        return None
+
+# Funkcje obsługi szablonów promptów
+def save_prompt_template(name, description, prompt_text):
+    """Zapisuje szablon prompta w bazie danych"""
+    try:
+        return _insert('prompt_templates', {
+            'name': name,
+            'description': description,
+            'prompt_text': prompt_text,
+            'is_active': 1,
+            'created_at': _now()
+        })
+    except Exception as e:
+        logger.error(f"Błąd przy zapisywaniu szablonu prompta: {e}")
+        return None
+
+def get_prompt_templates():
+    """Pobiera wszystkie aktywne szablony promptów"""
+    try:
+        return _query("select * from prompt_templates where is_active = 1")
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu szablonów promptów: {e}")
+        return []
+
+def get_prompt_template_by_id(template_id):
+    """Pobiera szablon prompta po ID"""
+    try:
+        return _query_one("select * from prompt_templates where id = ?", (template_id,))
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu szablonu prompta: {e}")
+        return None
+
+# Funkcje obsługi tematów konwersacji
+def create_conversation_theme(user_id, theme_name):
+    """Tworzy nowy temat konwersacji"""
+    try:
+        now = _now()
+        return _insert('conversation_themes', {
+            'user_id': user_id,
+            'theme_name': theme_name,
+            'is_active': 1,
+            'created_at': now,
+            'last_used_at': now
+        })
+    except Exception as e:
+        logger.error(f"Błąd przy tworzeniu tematu konwersacji: {e}")
+        return None
+
+def get_user_themes(user_id):
+    """Pobiera listę tematów konwersacji użytkownika"""
+    try:
+        return _query(
+            "select * from conversation_themes where user_id = ? and is_active = 1 order by last_used_at desc",
+            (user_id,)
+        )
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu tematów konwersacji: {e}")
+        return []
+
+def get_theme_by_id(theme_id):
+    """Pobiera temat konwersacji po ID"""
+    try:
+        return _query_one("select * from conversation_themes where id = ?", (theme_id,))
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu tematu konwersacji: {e}")
+        return None
+
+def create_themed_conversation(user_id, theme_id):
+    """Tworzy nową konwersację dla określonego tematu"""
+    try:
+        now = _now()
+        conversation = _insert('conversations', {
+            'user_id': user_id,
+            'created_at': now,
+            'last_message_at': now,
+            'theme_id': theme_id
+        })
+        _execute("update conversation_themes set last_used_at = ? where id = ?", (now, theme_id))
+        hydrate_history(conversation['id'], [])
+        return conversation
+    except Exception as e:
+        logger.error(f"Błąd przy tworzeniu konwersacji dla tematu: {e}")
+        return None
+
+def get_active_themed_conversation(user_id, theme_id):
+    """Pobiera aktywną konwersację dla określonego tematu"""
+    try:
+        conversation = _query_one(
+            "select * from conversations where user_id = ? and theme_id = ? order by last_message_at desc limit 1",
+            (user_id, theme_id)
+        )
+        if conversation:
+            return conversation
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu aktywnej konwersacji dla tematu: {e}")
+    return create_themed_conversation(user_id, theme_id)
+
+# Funkcje obsługi kodów aktywacyjnych
+def create_activation_code(credits):
+    """Tworzy nowy kod aktywacyjny"""
+    try:
+        characters = string.ascii_uppercase + string.digits
+        return _insert('activation_codes', {
+            'code': ''.join(random.choice(characters) for _ in range(8)),
+            'credits': credits,
+            'is_used': 0,
+            'created_at': _now()
+        })
+    except Exception as e:
+        logger.error(f"Błąd przy tworzeniu kodu aktywacyjnego: {e}")
+        return None
+
+def use_activation_code(user_id, code):
+    """Używa kodu aktywacyjnego"""
+    try:
+        with _lock:
+            code_data = _query_one("select * from activation_codes where code = ? and is_used = 0", (code,))
+            if not code_data:
+                return False, 0
+            _execute(
+                "update activation_codes set is_used = 1, used_by = ?, used_at = ? where id = ?",
+                (user_id, _now(), code_data['id'])
+            )
+
+        add_user_credits(user_id, code_data['credits'], f"Aktywacja kodu {code}")
+        return True, code_data['credits']
+    except Exception as e:
+        logger.error(f"Błąd przy aktywacji kodu: {e}")
+        return False, 0
+
+# Funkcje obsługi transakcji płatności
+def get_payment_transactions_page(user_id, cursor=None, direction='older', page_size=10):
+    """Pobiera stronę historii transakcji płatności użytkownika z danymi pakietu i metody płatności"""
+    try:
+        page = _select_page(
+            'payment_transactions', 'user_id', user_id, cursor, direction, page_size,
+            select="select payment_transactions.*, "
+                   "coalesce(p.name, 'Nieznany pakiet') as package_name, "
+                   "coalesce(p.credits, 0) as package_credits, "
+                   "coalesce(m.name, 'Nieznana metoda') as payment_method_name, "
+                   "coalesce(m.code, '') as payment_method_code "
+                   "from payment_transactions "
+                   "left join credit_packages p on p.id = payment_transactions.credit_package_id "
+                   "left join payment_methods m on m.id = payment_transactions.payment_method_id"
+        )
+        return page
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu strony transakcji płatności: {e}")
+        return None
+
+# Funkcje obsługi metod płatności i subskrypcji
+def get_payment_methods(language):
+    """Pobiera aktywne metody płatności dostępne dla języka użytkownika (pl, en, ru)"""
+    column = f"is_available_{language}" if language in ('pl', 'en', 'ru') else 'is_available_pl'
+    try:
+        return _query(f"select * from payment_methods where {column} = 1 and is_active = 1 order by id")
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu metod płatności: {e}")
+        return []
+
+def get_payment_method_by_code(code):
+    """Pobiera metodę płatności o podanym kodzie"""
+    try:
+        return _query_one("select * from payment_methods where code = ?", (code,))
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu metody płatności: {e}")
+        return None
+
+def get_active_subscriptions(user_id):
+    """Pobiera aktywne subskrypcje użytkownika"""
+    try:
+        return _query("select * from subscriptions where user_id = ? and status = 'active' order by id", (user_id,))
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu subskrypcji: {e}")
+        return []
+
+def get_subscription_by_id(subscription_id):
+    """Pobiera subskrypcję o podanym ID"""
+    try:
+        return _query_one("select * from subscriptions where id = ?", (subscription_id,))
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu subskrypcji: {e}")
+        return None
+
+def mark_subscription_cancelled(subscription_id):
+    """Oznacza subskrypcję jako anulowaną"""
+    try:
+        now = _now()
+        with _lock:
+            updated = get_connection().execute(
+                "update subscriptions set status = 'cancelled', end_date = ?, updated_at = ? where id = ?",
+                (now, now, subscription_id)
+            ).rowcount
+        return bool(updated)
+    except Exception as e:
+        logger.error(f"Błąd przy anulowaniu subskrypcji: {e}")
+        return False
+
+def _coroutine(function):
+    async def wrapper(*args, **kwargs):
+        return function(*args, **kwargs)
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+def async_functions():
+    """Zwraca asynchroniczne odpowiedniki funkcji dla database.async_supabase_client"""
+    functions = {name: _coroutine(globals()[name]) for name in ASYNC_API}
+    functions['close_client'] = _coroutine(close_connection)
+    return functions
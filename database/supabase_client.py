@@ -3,7 +3,9 @@ import uuid
 import datetime
 import pytz
 import logging
-from config import SUPABASE_URL, SUPABASE_KEY
+from config import SUPABASE_URL, SUPABASE_KEY, SUPABASE_MAX_ROWS, HISTORY_BUFFER_SIZE, STORAGE_BACKEND
+from database.profile_cache import get_cached, cache_profile, invalidate_profile
+from database.history_buffer import get_buffered_history, hydrate_history, append_history
 
 logger = logging.getLogger(__name__)
 
@@ -12,7 +14,9 @@ try:
     supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
     logger.info("Pomyślnie zainicjalizowano klienta Supabase")
 except Exception as e:
-    logger.error(f"Błąd inicjalizacji klienta Supabase: {e}")
+    # Przy backendzie SQLite brak konfiguracji Supabase jest oczekiwany
+    if STORAGE_BACKEND != 'sqlite':
+        logger.error(f"Błąd inicjalizacji klienta Supabase: {e}")
     # Fallback - możemy utworzyć pustą klasę, która nie rzuci błędu
     class DummyClient:
         def table(self, *args, **kwargs):
@@ -45,6 +49,7 @@ def get_or_create_user(user_id, username=None, first_name=None, last_name=None,
         response = supabase.table('users').select('*').eq('id', user_id).execute()
         
         if response.data:
+            _cache_user_row(user_id, response.data[0])
             return response.data[0]
         
         # Jeśli nie istnieje, tworzymy nowego
@@ -64,6 +69,7 @@ def get_or_create_user(user_id, username=None, first_name=None, last_name=None,
         response = supabase.table('users').insert(user_data).execute()
         
         if response.data:
+            _cache_user_row(user_id, response.data[0])
             # Inicjalizacja rekordów kredytowych dla nowego użytkownika
             init_user_credits(user_id)
             return response.data[0]
@@ -72,10 +78,21 @@ def get_or_create_user(user_id, username=None, first_name=None, last_name=None,
     
     return None
 
+def _cache_user_row(user_id, user):
+    """Zapisuje w pamięci podręcznej pola profilu z wiersza tabeli users"""
+    cache_profile(
+        user_id,
+        language=user.get('language') or user.get('language_code'),
+        messages_limit=user.get('messages_limit'),
+        messages_used=user.get('messages_used')
+    )
+
 def update_user_language(user_id, language):
     """Aktualizuje język użytkownika w bazie danych"""
     try:
         response = supabase.table('users').update({'language': language}).eq('id', user_id).execute()
+        if response.data:
+            cache_profile(user_id, language=language)
         return True if response.data else False
     except Exception as e:
         logger.error(f"Błąd przy aktualizacji języka użytkownika: {e}")
@@ -93,6 +110,8 @@ def init_user_credits(user_id):
         }
         
         response = supabase.table('user_credits').insert(credit_data).execute()
+        if response.data:
+            cache_profile(user_id, credits=0)
         return True if response.data else False
     except Exception as e:
         logger.error(f"Błąd przy inicjalizacji kredytów użytkownika: {e}")
@@ -100,10 +119,15 @@ def init_user_credits(user_id):
 
 def get_user_credits(user_id):
     """Pobiera liczbę kredytów użytkownika"""
+    cached = get_cached(user_id, 'credits')
+    if cached is not None:
+        return cached
+    
     try:
         response = supabase.table('user_credits').select('credits_amount').eq('user_id', user_id).execute()
         
         if response.data:
+            cache_profile(user_id, credits=response.data[0]['credits_amount'])
             return response.data[0]['credits_amount']
         
         # Jeśli nie znaleziono, zainicjuj rekord
@@ -113,86 +137,69 @@ def get_user_credits(user_id):
         logger.error(f"Błąd przy pobieraniu kredytów użytkownika: {e}")
         return 0
 
-def add_user_credits(user_id, amount, description=None):
-    """Dodaje kredyty do konta użytkownika"""
+def ledger_add(user_id, amount, description=None, transaction_type='add', price=0):
+    """
+    Atomowo dodaje kredyty i zapisuje transakcję (funkcja bazy add_credits)
+    
+    Returns:
+        int: Nowe saldo lub None w przypadku błędu
+    """
     try:
-        now = datetime.datetime.now(pytz.UTC).isoformat()
-        
-        # Pobierz aktualną liczbę kredytów
-        response = supabase.table('user_credits').select('credits_amount').eq('user_id', user_id).execute()
-        
-        if response.data:
-            current_credits = response.data[0]['credits_amount']
-            
-            # Aktualizuj istniejący rekord
-            supabase.table('user_credits').update({
-                'credits_amount': current_credits + amount,
-                'total_credits_purchased': supabase.raw(f'total_credits_purchased + {amount}'),
-                'last_purchase_date': now
-            }).eq('user_id', user_id).execute()
-        else:
-            # Utwórz nowy rekord
-            current_credits = 0
-            init_user_credits(user_id)
-            supabase.table('user_credits').update({
-                'credits_amount': amount,
-                'total_credits_purchased': amount,
-                'last_purchase_date': now
-            }).eq('user_id', user_id).execute()
-        
-        # Zapisz transakcję
-        if amount != 0:  # Nie zapisujemy transakcji inicjalizujących z 0 kredytów
-            supabase.table('credit_transactions').insert({
-                'user_id': user_id,
-                'transaction_type': 'add',
-                'amount': amount,
-                'credits_before': current_credits,
-                'credits_after': current_credits + amount,
-                'description': description,
-                'created_at': now
-            }).execute()
-        
-        return True
+        response = supabase.rpc('add_credits', {
+            'p_user_id': user_id,
+            'p_amount': amount,
+            'p_description': description,
+            'p_transaction_type': transaction_type,
+            'p_price': price
+        }).execute()
+        _cache_balance(user_id, response.data)
+        return response.data
     except Exception as e:
         logger.error(f"Błąd przy dodawaniu kredytów użytkownika: {e}")
-        return False
+        return None
 
-def deduct_user_credits(user_id, amount, description=None):
-    """Odejmuje kredyty z konta użytkownika"""
+def ledger_deduct(user_id, amount, description=None, category='other', prompt_tokens=None, completion_tokens=None):
+    """
+    Atomowo odejmuje kredyty, jeśli saldo jest wystarczające (funkcja bazy deduct_credits)
+    
+    Args:
+        category (str): Kategoria operacji (message, image, document, photo,
+                        translation, pdf_translation, other) - podstawa analityki zużycia
+        prompt_tokens (int, optional): Tokeny promptu zużyte na opłacaną operację
+        completion_tokens (int, optional): Tokeny odpowiedzi zużyte na opłacaną operację
+    
+    Returns:
+        int: Nowe saldo lub None, jeśli brakuje kredytów lub wystąpił błąd
+    """
     try:
-        # Pobierz aktualną liczbę kredytów
-        response = supabase.table('user_credits').select('credits_amount').eq('user_id', user_id).execute()
-        
-        if not response.data:
-            return False
-        
-        current_credits = response.data[0]['credits_amount']
-        
-        # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
-        if current_credits < amount:
-            return False
-        
-        # Odejmij kredyty
-        supabase.table('user_credits').update({
-            'credits_amount': current_credits - amount
-        }).eq('user_id', user_id).execute()
-        
-        # Zapisz transakcję
-        now = datetime.datetime.now(pytz.UTC).isoformat()
-        supabase.table('credit_transactions').insert({
-            'user_id': user_id,
-            'transaction_type': 'deduct',
-            'amount': amount,
-            'credits_before': current_credits,
-            'credits_after': current_credits - amount,
-            'description': description,
-            'created_at': now
+        response = supabase.rpc('deduct_credits', {
+            'p_user_id': user_id,
+            'p_amount': amount,
+            'p_description': description,
+            'p_category': category,
+            'p_prompt_tokens': prompt_tokens,
+            'p_completion_tokens': completion_tokens
         }).execute()
-        
-        return True
+        _cache_balance(user_id, response.data)
+        return response.data
     except Exception as e:
         logger.error(f"Błąd przy odejmowaniu kredytów użytkownika: {e}")
-        return False
+        return None
+
+def _cache_balance(user_id, balance):
+    """Zapamiętuje saldo zwrócone przez funkcję bazy lub unieważnia je, gdy jest nieznane"""
+    if balance is None:
+        invalidate_profile(user_id, 'credits')
+    else:
+        cache_profile(user_id, credits=balance)
+
+def add_user_credits(user_id, amount, description=None):
+    """Dodaje kredyty do konta użytkownika"""
+    return ledger_add(user_id, amount, description) is not None
+
+def deduct_user_credits(user_id, amount, description=None, category='other', prompt_tokens=None, completion_tokens=None):
+    """Odejmuje kredyty z konta użytkownika"""
+    return ledger_deduct(user_id, amount, description, category, prompt_tokens, completion_tokens) is not None
 
 def check_user_credits(user_id, amount_needed):
     """Sprawdza, czy użytkownik ma wystarczającą liczbę kredytów"""
@@ -225,44 +232,12 @@ def purchase_credits(user_id, package_id):
         if not package:
             return False, None
         
-        # Dodaj kredyty użytkownikowi
-        now = datetime.datetime.now(pytz.UTC).isoformat()
+        # Dodaj kredyty użytkownikowi w jednej atomowej operacji
         description = f"Zakup pakietu {package['name']}"
+        new_balance = ledger_add(user_id, package['credits'], description, 'purchase', package['price'])
         
-        # Pobierz aktualny stan kredytów
-        response = supabase.table('user_credits').select('credits_amount').eq('user_id', user_id).execute()
-        
-        if response.data:
-            current_credits = response.data[0]['credits_amount']
-            
-            # Aktualizuj rekord użytkownika
-            supabase.table('user_credits').update({
-                'credits_amount': current_credits + package['credits'],
-                'total_credits_purchased': supabase.raw(f'total_credits_purchased + {package["credits"]}'),
-                'last_purchase_date': now,
-                'total_spent': supabase.raw(f'total_spent + {package["price"]}')
-            }).eq('user_id', user_id).execute()
-        else:
-            # Jeśli rekord nie istnieje, utwórz go
-            current_credits = 0
-            init_user_credits(user_id)
-            supabase.table('user_credits').update({
-                'credits_amount': package['credits'],
-                'total_credits_purchased': package['credits'],
-                'last_purchase_date': now,
-                'total_spent': package['price']
-            }).eq('user_id', user_id).execute()
-        
-        # Zapisz transakcję
-        supabase.table('credit_transactions').insert({
-            'user_id': user_id,
-            'transaction_type': 'purchase',
-            'amount': package['credits'],
-            'credits_before': current_credits,
-            'credits_after': current_credits + package['credits'],
-            'description': description,
-            'created_at': now
-        }).execute()
+        if new_balance is None:
+            return False, None
         
         return True, package
     except Exception as e:
@@ -436,23 +411,41 @@ def activate_user_license(user_id, license_key):
                 'messages_limit': new_message_limit
             }).eq('id', user_id).execute()
         
+        cache_profile(user_id, messages_limit=new_message_limit)
+        
         return True, end_date, license_data['message_limit']
     except Exception as e:
         logger.error(f"Błąd przy aktywacji licencji: {e}")
         return False, None, 0
 
 # Funkcje obsługi limitów wiadomości
+def _get_message_quota(user_id):
+    """Zwraca krotkę (messages_limit, messages_used) z pamięci podręcznej lub bazy; None gdy brak użytkownika"""
+    messages_limit = get_cached(user_id, 'messages_limit')
+    messages_used = get_cached(user_id, 'messages_used')
+    if messages_limit is not None and messages_used is not None:
+        return messages_limit, messages_used
+    
+    response = supabase.table('users').select('messages_limit, messages_used').eq('id', user_id).execute()
+    
+    if not response.data:
+        return None
+    
+    user = response.data[0]
+    messages_limit = user.get('messages_limit') or 0
+    messages_used = user.get('messages_used') or 0
+    cache_profile(user_id, messages_limit=messages_limit, messages_used=messages_used)
+    return messages_limit, messages_used
+
 def check_message_limit(user_id):
     """Sprawdza czy użytkownik ma dostępne wiadomości"""
     try:
-        response = supabase.table('users').select('messages_limit, messages_used').eq('id', user_id).execute()
+        quota = _get_message_quota(user_id)
         
-        if not response.data:
+        if quota is None:
             return False
         
-        user = response.data[0]
-        message_limit = user.get('messages_limit', 0)
-        messages_used = user.get('messages_used', 0)
+        message_limit, messages_used = quota
         
         return messages_used < message_limit
     except Exception as e:
@@ -476,6 +469,8 @@ def increment_messages_used(user_id):
             'messages_used': messages_used
         }).eq('id', user_id).execute()
         
+        cache_profile(user_id, messages_used=messages_used)
+        
         return True
     except Exception as e:
         logger.error(f"Błąd przy aktualizacji licznika wiadomości: {e}")
@@ -484,18 +479,16 @@ def increment_messages_used(user_id):
 def get_message_status(user_id):
     """Pobiera status wiadomości użytkownika"""
     try:
-        response = supabase.table('users').select('messages_limit, messages_used').eq('id', user_id).execute()
+        quota = _get_message_quota(user_id)
         
-        if not response.data:
+        if quota is None:
             return {
                 "messages_limit": 0,
                 "messages_used": 0,
                 "messages_left": 0
             }
         
-        user = response.data[0]
-        messages_limit = user.get('messages_limit', 0)
-        messages_used = user.get('messages_used', 0)
+        messages_limit, messages_used = quota
         messages_left = max(0, messages_limit - messages_used)
         
         return {
@@ -526,6 +519,9 @@ def create_new_conversation(user_id):
         response = supabase.table('conversations').insert(conversation_data).execute()
         
         if response.data:
+            cache_profile(user_id, conversation=response.data[0])
+            # Nowa konwersacja jest pusta - bufor historii od razu aktualny
+            hydrate_history(response.data[0]['id'], [])
             return response.data[0]
         return None
     except Exception as e:
@@ -534,10 +530,15 @@ def create_new_conversation(user_id):
 
 def get_active_conversation(user_id):
     """Pobiera aktywną konwersację użytkownika (ostatnią)"""
+    cached = get_cached(user_id, 'conversation')
+    if cached is not None:
+        return dict(cached)
+    
     try:
         response = supabase.table('conversations').select('*').eq('user_id', user_id).order('last_message_at', desc=True).limit(1).execute()
         
         if response.data:
+            cache_profile(user_id, conversation=response.data[0])
             return response.data[0]
         
         # Jeśli nie ma żadnej konwersacji, utwórz nową
@@ -568,6 +569,13 @@ def save_message(conversation_id, user_id, content, is_from_user, model_used=Non
             'last_message_at': now
         }).eq('id', conversation_id).execute()
         
+        # Konwersacja z najnowszą wiadomością staje się aktywna
+        cached = get_cached(user_id, 'conversation')
+        if cached is not None and cached.get('id') != conversation_id:
+            invalidate_profile(user_id, 'conversation')
+        
+        append_history(conversation_id, message_response.data[0] if message_response.data else message_data)
+        
         if message_response.data:
             return message_response.data[0]
         return None
@@ -576,11 +584,19 @@ def save_message(conversation_id, user_id, content, is_from_user, model_used=Non
         return None
 
 def get_conversation_history(conversation_id, limit=20):
-    """Pobiera historię konwersacji"""
+    """Pobiera ostatnie `limit` wiadomości konwersacji w kolejności chronologicznej"""
+    buffered = get_buffered_history(conversation_id, limit)
+    if buffered is not None:
+        return buffered
+    
     try:
-        response = supabase.table('messages').select('*').eq('conversation_id', conversation_id).order('created_at', desc=False) .limit(limit).execute()
+        # Najnowsze wiadomości malejąco, potem odwrócenie - tak, aby limit obejmował koniec rozmowy.
+        # Pobieramy co najmniej tyle wiadomości, ile mieści bufor, aby go wypełnić.
+        response = supabase.table('messages').select('*').eq('conversation_id', conversation_id).order('created_at', desc=True).order('id', desc=True).limit(max(limit, HISTORY_BUFFER_SIZE)).execute()
         
-        return response.data
+        rows = list(reversed(response.data))
+        hydrate_history(conversation_id, rows)
+        return rows[-limit:] if limit > 0 else []
     except Exception as e:
         logger.error(f"Błąd przy pobieraniu historii konwersacji: {e}")
         return []
@@ -692,6 +708,8 @@ def create_themed_conversation(user_id, theme_id):
         }).eq('id', theme_id).execute()
         
         if conversation_response.data:
+            cache_profile(user_id, conversation=conversation_response.data[0])
+            hydrate_history(conversation_response.data[0]['id'], [])
             return conversation_response.data[0]
         return None
     except Exception as e:
@@ -781,59 +799,55 @@ def get_credit_transactions(user_id, days=30):
     try:
         start_date = (datetime.datetime.now(pytz.UTC) - datetime.timedelta(days=days)).isoformat()
         
-        response = supabase.table('credit_transactions').select('*')\
-            .eq('user_id', user_id)\
-            .gte('created_at', start_date)\
-            .order('created_at', desc=False).execute()
-            
-        return response.data
+        # Odpowiedzi PostgREST są obcinane do max_rows - pobieramy kolejne strony
+        # kursorem (created_at, id), aby nie zgubić transakcji aktywnych użytkowników
+        transactions = []
+        cursor = None
+        while True:
+            query = supabase.table('credit_transactions').select('*')\
+                .eq('user_id', user_id)\
+                .gte('created_at', start_date)
+            if cursor:
+                query = query.or_(f'created_at.gt."{cursor[0]}",and(created_at.eq."{cursor[0]}",id.gt.{cursor[1]})')
+            response = query.order('created_at').order('id').limit(SUPABASE_MAX_ROWS).execute()
+
+            transactions.extend(response.data)
+            if len(response.data) < SUPABASE_MAX_ROWS:
+                return transactions
+            cursor = (response.data[-1]['created_at'], response.data[-1]['id'])
     except Exception as e:
         logger.error(f"Błąd przy pobieraniu transakcji kredytowych: {e}")
         return []
 
 def get_credit_usage_by_type(user_id, days=30):
     """
-    Pobiera sumaryczne zużycie kredytów według typu transakcji
+    Pobiera sumaryczne zużycie kredytów według kategorii operacji
+    (agregacja GROUP BY w funkcji bazy credit_usage_by_category)
     
     Args:
         user_id (int): ID użytkownika
         days (int): Liczba dni wstecz
         
     Returns:
-        dict: Słownik z sumami zużycia według typów
+        dict: Słownik kategoria (message, image, document...) -> suma kredytów
     """
     try:
-        transactions = get_credit_transactions(user_id, days)
+        response = supabase.rpc('credit_usage_by_category', {
+            'p_user_id': user_id,
+            'p_days': days
+        }).execute()
         
-        # Analiza transakcji po stronie klienta
-        usage_breakdown = {}
-        for trans in transactions:
-            if trans['transaction_type'] != 'deduct':
-                continue
-                
-            description = trans.get('description', 'Inne')
-            category = "Inne"
-            
-            if "Wiadomość" in description:
-                category = "Wiadomości"
-            elif "obraz" in description or "DALL-E" in description:
-                category = "Obrazy"
-            elif "dokument" in description:
-                category = "Analiza dokumentów"
-            elif "zdjęci" in description or "zdjęc" in description:
-                category = "Analiza zdjęć"
-            
-            if category not in usage_breakdown:
-                usage_breakdown[category] = 0
-            usage_breakdown[category] += trans['amount']
-            
-        return usage_breakdown
+        return {row['category']: row['amount'] for row in response.data or []}
     except Exception as e:
         logger.error(f"Błąd przy analizie zużycia kredytów: {e}")
         return {}
 
 def get_user_language(user_id):
     """Pobiera język użytkownika"""
+    cached = get_cached(user_id, 'language')
+    if cached is not None:
+        return cached
+    
     try:
         response = supabase.table('users').select('language, language_code').eq('id', user_id).execute()
         
@@ -845,7 +859,64 @@ def get_user_language(user_id):
             if not language:
                 language = user_data.get('language_code')
             
+            cache_profile(user_id, language=language)
             return language or "pl"
     except Exception as e:
         logger.error(f"Błąd przy pobieraniu języka użytkownika: {e}")
-        return "pl"
\ No newline at end of file
+        return "pl"
+
+# Funkcje obsługi metod płatności i subskrypcji
+def get_payment_methods(language):
+    """Pobiera aktywne metody płatności dostępne dla języka użytkownika (pl, en, ru)"""
+    column = f"is_available_{language}" if language in ('pl', 'en', 'ru') else 'is_available_pl'
+    try:
+        response = supabase.table('payment_methods').select('*').eq(column, True).eq('is_active', True).execute()
+        return response.data
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu metod płatności: {e}")
+        return []
+
+def get_payment_method_by_code(code):
+    """Pobiera metodę płatności o podanym kodzie"""
+    try:
+        response = supabase.table('payment_methods').select('*').eq('code', code).execute()
+        return response.data[0] if response.data else None
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu metody płatności: {e}")
+        return None
+
+def get_active_subscriptions(user_id):
+    """Pobiera aktywne subskrypcje użytkownika"""
+    try:
+        response = supabase.table('subscriptions').select('*').eq('user_id', user_id).eq('status', 'active').execute()
+        return response.data
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu subskrypcji: {e}")
+        return []
+
+def get_subscription_by_id(subscription_id):
+    """Pobiera subskrypcję o podanym ID"""
+    try:
+        response = supabase.table('subscriptions').select('*').eq('id', subscription_id).execute()
+        return response.data[0] if response.data else None
+    except Exception as e:
+        logger.error(f"Błąd przy pobieraniu subskrypcji: {e}")
+        return None
+
+def mark_subscription_cancelled(subscription_id):
+    """Oznacza subskrypcję jako anulowaną"""
+    try:
+        now = datetime.datetime.now(pytz.UTC).isoformat()
+        response = supabase.table('subscriptions').update({
+            'status': 'cancelled',
+            'end_date': now,
+            'updated_at': now
+        }).eq('id', subscription_id).execute()
+        return bool(response.data)
+    except Exception as e:
+        logger.error(f"Błąd przy anulowaniu subskrypcji: {e}")
+        return False
+
+# Wbudowany backend SQLite (STORAGE_BACKEND=sqlite) - te same funkcje, lokalny plik bazy
+if STORAGE_BACKEND == 'sqlite':
+    from database.sqlite_client import *  # noqa: F401,F403
@@ -1,8 +1,10 @@
+import html
 import re
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from config import ADMIN_USER_IDS, CREDIT_PACKAGES
+from utils.metrics import collect_stats, format_stats
 
 async def add_package(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -241,4 +243,31 @@ async def add_default_packages(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         
     except Exception as e:
-        await update.message.reply_text(f"❌ Wystąpił błąd: {str(e)}")
\ No newline at end of file
+        await update.message.reply_text(f"❌ Wystąpił błąd: {str(e)}")
+
+async def bot_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Wyświetla statystyki kolejek, pul połączeń i pamięci podręcznych bota
+    Tylko dla administratorów
+    Użycie: /stats
+    """
+    user_id = update.effective_user.id
+    
+    # Sprawdź, czy użytkownik jest administratorem
+    if user_id not in ADMIN_USER_IDS:
+        await update.message.reply_text("Nie masz uprawnień do tej komendy.")
+        return
+    
+    # Wiadomości dzielone po wierszach - limit Telegrama to 4096 znaków
+    chunks = [[]]
+    length = 0
+    for line in format_stats(collect_stats()).splitlines() or ["Brak statystyk"]:
+        if chunks[-1] and length + len(line) > 3500:
+            chunks.append([])
+            length = 0
+        chunks[-1].append(line)
+        length += len(line) + 1
+    
+    for lines in chunks:
+        text = html.escape("\n".join(lines))
+        await update.message.reply_text(f"<pre>{text}</pre>", parse_mode=ParseMode.HTML)
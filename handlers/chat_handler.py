@@ -4,14 +4,19 @@ from telegram.constants import ParseMode, ChatAction
 from config import DEFAULT_MODEL, MAX_CONTEXT_MESSAGES, AVAILABLE_MODELS, CHAT_MODES
 from database.supabase_client import (
     check_active_subscription, get_active_conversation, 
-    save_message, get_conversation_history, check_message_limit,
+    get_conversation_history, check_message_limit,
     increment_messages_used, get_message_status
 )
-from utils.openai_client import chat_completion_stream, prepare_messages_from_history
+from database.message_queue import enqueue_message
+from utils.openai_client import chat_completion_stream
+from utils.context_builder import build_chat_context
 from utils.translations import get_text
 from handlers.menu_handler import get_user_language
+from utils.stream_renderer import StreamRenderer
+from utils.user_lanes import user_lane
 import asyncio
 
+@user_lane()
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obsługa wiadomości tekstowych od użytkownika ze strumieniowaniem odpowiedzi"""
     user_id = update.effective_user.id
@@ -27,15 +32,15 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     conversation = get_active_conversation(user_id)
     conversation_id = conversation['id']
     
-    # Zapisz wiadomość użytkownika do bazy danych
-    save_message(conversation_id, user_id, user_message, is_from_user=True)
-    
     # Wyślij informację, że bot pisze
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
-    # Pobierz historię konwersacji
+    # Pobierz historię konwersacji (przed zapisem bieżącej wiadomości - trafia ona do promptu osobno)
     history = get_conversation_history(conversation_id, limit=MAX_CONTEXT_MESSAGES)
     
+    # Zapisz wiadomość użytkownika w tle
+    enqueue_message(conversation_id, user_id, user_message, is_from_user=True)
+    
     # Określ model do użycia - domyślny lub wybrany przez użytkownika
     model_to_use = DEFAULT_MODEL
     if 'user_data' in context.chat_data and user_id in context.chat_data['user_data']:
@@ -54,42 +59,36 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             system_prompt = get_text(prompt_key, language, default=CHAT_MODES[mode_id]["prompt"])
     
     # Przygotuj wiadomości dla API OpenAI
-    messages = prepare_messages_from_history(history, user_message, system_prompt)
+    messages, prompt_tokens = build_chat_context(history, user_message, system_prompt, model_to_use)
     
     # Wyślij początkową pustą wiadomość, którą będziemy aktualizować
     response_message = await update.message.reply_text(get_text("generating_response", language))
     
-    # Zainicjuj pełną odpowiedź
-    full_response = ""
-    buffer = ""
-    last_update = asyncio.get_event_loop().time()
+    # Renderer edytuje wiadomość w tle, dopasowując tempo edycji do limitów Telegrama
+    renderer = StreamRenderer(response_message)
+    call_info = {}
     
     # Generuj odpowiedź strumieniowo
-    async for chunk in chat_completion_stream(messages, model=model_to_use):
-        full_response += chunk
-        buffer += chunk
-        
-        # Aktualizuj wiadomość co 1 sekundę lub gdy bufor jest wystarczająco duży
-        current_time = asyncio.get_event_loop().time()
-        if current_time - last_update >= 1.0 or len(buffer) > 100:
-            try:
-                # Dodaj migający kursor na końcu wiadomości
-                await response_message.edit_text(full_response + "▌", parse_mode=ParseMode.MARKDOWN)
-                buffer = ""
-                last_update = current_time
-            except Exception as e:
-                # Jeśli wystąpi błąd (np. wiadomość nie została zmieniona), kontynuuj
-                pass
-                
-    # Aktualizuj wiadomość z pełną odpowiedzią bez kursora
     try:
-        await response_message.edit_text(full_response, parse_mode=ParseMode.MARKDOWN)
+        async for chunk in chat_completion_stream(messages, model=model_to_use, call_info=call_info):
+            renderer.feed(chunk)
     except Exception as e:
-        # Jeśli wystąpi błąd formatowania Markdown, wyślij bez formatowania
-        await response_message.edit_text(full_response)
+        # Odpowiedzi nie udało się wygenerować - bez zapisu i bez zwiększania licznika
+        await renderer.fail(get_text("response_error", language, error=str(e)))
+        return
+                
+    # Wyświetl pełną odpowiedź bez kursora
+    await renderer.finish()
+    full_response = renderer.text
     
-    # Zapisz odpowiedź do bazy danych
-    save_message(conversation_id, user_id, full_response, is_from_user=False, model_used=model_to_use)
+    # Zapisz odpowiedź w tle razem ze zużyciem tokenów
+    usage = call_info.get("usage") or {}
+    enqueue_message(
+        conversation_id, user_id, full_response, is_from_user=False,
+        model_used=call_info.get("model", model_to_use),
+        prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens")
+    )
     
     # Zwiększ licznik wykorzystanych wiadomości
     increment_messages_used(user_id)
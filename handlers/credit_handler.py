@@ -1,22 +1,25 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
-from config import BOT_NAME
+from config import BOT_NAME, PAGE_SIZE
 from utils.user_utils import get_user_language
 from utils.translations import get_text
+from utils.pagination import get_page_request, store_page, build_page_navigation
+from database.async_supabase_client import get_credit_transactions_page
 from database.credits_client import (
     get_user_credits, add_user_credits, deduct_user_credits, 
     get_credit_packages, get_package_by_id, purchase_credits,
     get_user_credit_stats
 )
 from utils.credit_analytics import (
-    generate_credit_usage_chart, generate_usage_breakdown_chart, 
+    credit_usage_chart, usage_breakdown_chart, 
     get_credit_usage_breakdown, predict_credit_depletion
 )
 import matplotlib
 matplotlib.use('Agg')  # Required for operation without a graphical interface
 
 from database.credits_client import add_stars_payment_option, get_stars_conversion_rate
+from utils.telegram_scheduler import outbound_priority, PRIORITY_HIGH
 
 async def credits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -126,6 +129,7 @@ async def handle_credit_callback(update: Update, context: ContextTypes.DEFAULT_T
         # Create keyboard
         keyboard = [
             [InlineKeyboardButton(get_text("buy_more_credits", language), callback_data="menu_credits_buy")],
+            [InlineKeyboardButton(get_text("credit_history_all", language), callback_data="credits_history")],
             [InlineKeyboardButton(get_text("credit_stats", language), callback_data="credit_advanced_analytics")],
             [InlineKeyboardButton(get_text("back", language), callback_data="menu_section_credits")]
         ]
@@ -165,6 +169,50 @@ async def handle_credit_callback(update: Update, context: ContextTypes.DEFAULT_T
                 print(f"Second error updating message: {e2}")
         return True
     
+    # Handle paged credit transaction history
+    if query.data in ("credits_history", "credits_history_older", "credits_history_newer"):
+        action = query.data[len("credits_history_"):] if query.data != "credits_history" else None
+        cursor, direction = get_page_request(context, user_id, "credits_history", action)
+        page = await get_credit_transactions_page(user_id, cursor, direction, PAGE_SIZE)
+        
+        message = f"*{get_text('credit_history', language)}*\n"
+        keyboard = []
+        
+        if page and page['items']:
+            store_page(context, user_id, "credits_history", page)
+            for transaction in page['items']:
+                date = transaction['created_at'].split('T')[0]
+                if transaction['transaction_type'] in ["add", "purchase", "subscription", "subscription_renewal"]:
+                    message += f"\n➕ +{transaction['amount']} {get_text('credits', language)} ({date})"
+                else:
+                    message += f"\n➖ -{transaction['amount']} {get_text('credits', language)} ({date})"
+                if transaction.get('description'):
+                    message += f" - {transaction['description']}"
+            
+            navigation = build_page_navigation(page, "credits_history", language)
+            if navigation:
+                keyboard.append(navigation)
+        else:
+            message += f"\n{get_text('no_transactions', language)}"
+        
+        keyboard.append([InlineKeyboardButton(get_text("back", language), callback_data="credits_check")])
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        try:
+            await query.edit_message_text(
+                text=message,
+                reply_markup=reply_markup,
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except Exception as e:
+            print(f"Error updating message: {e}")
+            # Try without markdown formatting
+            await query.edit_message_text(
+                text=message.replace("*", ""),
+                reply_markup=reply_markup
+            )
+        return True
+    
     # Handle credit purchase options
     if query.data == "credits_buy" or query.data == "menu_credits_buy":
         # Get credit packages
@@ -310,7 +358,7 @@ async def handle_credit_callback(update: Update, context: ContextTypes.DEFAULT_T
         
         # Generate and send charts
         # Usage history chart
-        usage_chart = generate_credit_usage_chart(user_id, days)
+        usage_chart = await credit_usage_chart(user_id, days)
         if usage_chart:
             await context.bot.send_photo(
                 chat_id=query.message.chat_id,
@@ -319,7 +367,7 @@ async def handle_credit_callback(update: Update, context: ContextTypes.DEFAULT_T
             )
         
         # Usage breakdown chart
-        breakdown_chart = generate_usage_breakdown_chart(user_id, days)
+        breakdown_chart = await usage_breakdown_chart(user_id, days)
         if breakdown_chart:
             await context.bot.send_photo(
                 chat_id=query.message.chat_id,
@@ -393,10 +441,12 @@ async def handle_credit_callback(update: Update, context: ContextTypes.DEFAULT_T
         
         if success:
             current_credits = get_user_credits(user_id)
-            await query.edit_message_text(
-                get_text("stars_purchase_success", language, default=f"✅ *Zakup zakończony sukcesem!*\n\nWymieniono *{stars_amount}* gwiazdek na *{credits_amount}* kredytów\n\nAktualny stan kredytów: *{current_credits}*\n\nDziękujemy za zakup! 🎉"),
-                parse_mode=ParseMode.MARKDOWN
-            )
+            # Potwierdzenie płatności ma pierwszeństwo w kolejce wiadomości
+            with outbound_priority(PRIORITY_HIGH):
+                await query.edit_message_text(
+                    get_text("stars_purchase_success", language, default=f"✅ *Zakup zakończony sukcesem!*\n\nWymieniono *{stars_amount}* gwiazdek na *{credits_amount}* kredytów\n\nAktualny stan kredytów: *{current_credits}*\n\nDziękujemy za zakup! 🎉"),
+                    parse_mode=ParseMode.MARKDOWN
+                )
         else:
             await query.edit_message_text(
                 get_text("purchase_error", language, default="Wystąpił błąd podczas realizacji płatności. Spróbuj ponownie później."),
@@ -521,7 +571,7 @@ async def credit_analytics_command(update: Update, context: ContextTypes.DEFAULT
     )
     
     # Generate and send usage history chart
-    usage_chart = generate_credit_usage_chart(user_id, days)
+    usage_chart = await credit_usage_chart(user_id, days)
     
     if usage_chart:
         await context.bot.send_photo(
@@ -531,7 +581,7 @@ async def credit_analytics_command(update: Update, context: ContextTypes.DEFAULT
         )
     
     # Generate and send usage breakdown chart
-    breakdown_chart = generate_usage_breakdown_chart(user_id, days)
+    breakdown_chart = await usage_breakdown_chart(user_id, days)
     
     if breakdown_chart:
         await context.bot.send_photo(
@@ -6,6 +6,7 @@ from database.supabase_client import get_active_conversation, get_conversation_h
 from utils.pdf_generator import generate_conversation_pdf
 from config import BOT_NAME
 from utils.translations import get_text
+from utils.executor import run_blocking, ExecutorBusy
 from handlers.menu_handler import get_user_language
 import io
 
@@ -42,9 +43,9 @@ async def export_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Pobierz dane użytkownika
     user_info = get_or_create_user(user_id)
     
-    # Generuj PDF
+    # Generuj PDF w puli procesów - reportlab przy długiej rozmowie blokowałby pozostałe czaty
     try:
-        pdf_buffer = generate_conversation_pdf(history, user_info, BOT_NAME)
+        pdf_buffer = await run_blocking("pdf", generate_conversation_pdf, history, user_info, BOT_NAME, language)
         
         # Przygotuj nazwę pliku
         from datetime import datetime
@@ -62,6 +63,8 @@ async def export_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Usuń wiadomość o statusie
         await status_message.delete()
         
+    except ExecutorBusy:
+        await status_message.edit_text(get_text("server_busy", language))
     except Exception as e:
         print(f"Błąd podczas generowania PDF: {e}")
         await status_message.edit_text(
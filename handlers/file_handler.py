@@ -6,6 +6,7 @@ from telegram.constants import ParseMode, ChatAction
 from config import SUBSCRIPTION_EXPIRED_MESSAGE
 from database.supabase_client import check_active_subscription
 from utils.openai_client import analyze_document, analyze_image
+from utils.media_cache import fetch_file
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -31,8 +32,7 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Wyślij informację o aktywności bota
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
-    file = await context.bot.get_file(document.file_id)
-    file_bytes = await file.download_as_bytearray()
+    file_bytes = await fetch_file(context.bot, document.file_id, document.file_unique_id)
     
     # Analizuj plik
     analysis = analyze_document(file_bytes, file_name)
@@ -61,8 +61,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Wyślij informację o aktywności bota
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
-    file = await context.bot.get_file(photo.file_id)
-    file_bytes = await file.download_as_bytearray()
+    file_bytes = await fetch_file(context.bot, photo.file_id, photo.file_unique_id)
     
     # Analizuj zdjęcie
     analysis = analyze_image(file_bytes, f"photo_{photo.file_unique_id}.jpg")
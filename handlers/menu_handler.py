@@ -1,10 +1,10 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
-from config import CHAT_MODES, AVAILABLE_LANGUAGES, AVAILABLE_MODELS, CREDIT_COSTS, DEFAULT_MODEL, BOT_NAME
+from config import CHAT_MODES, AVAILABLE_LANGUAGES, AVAILABLE_MODELS, CREDIT_COSTS, DEFAULT_MODEL, BOT_NAME, PAGE_SIZE
 from utils.translations import get_text
 from database.credits_client import get_user_credits
-from database.supabase_client import update_user_language
+from database.supabase_client import update_user_language, get_message_status
 from database.credits_client import get_user_credits, get_credit_packages
 from utils.menu_utils import safe_markdown, update_menu
 from config import BOT_NAME
@@ -13,6 +13,7 @@ from utils.menu_utils import menu_state
 from utils.user_utils import get_user_language
 from utils.menu_utils import update_menu
 from utils.error_handler import handle_callback_error
+from utils.pagination import get_page_request, store_page, build_page_navigation
 
 
 
@@ -355,53 +356,10 @@ async def handle_history_callbacks(update, context):
     language = get_user_language(context, user_id)
     
     if query.data == "history_view":
-        # Pobierz aktywną konwersację
-        from database.supabase_client import get_active_conversation, get_conversation_history
-        conversation = get_active_conversation(user_id)
-        
-        if not conversation:
-            await query.answer(get_text("history_no_conversation", language))
-            await update_menu(
-                query,
-                get_text("history_no_conversation", language),
-                InlineKeyboardMarkup([[InlineKeyboardButton(get_text("back", language), callback_data="menu_section_history")]])
-            )
-            return True
-        
-        # Pobierz historię konwersacji
-        history = get_conversation_history(conversation['id'])
-        
-        if not history:
-            await query.answer(get_text("history_empty", language))
-            await update_menu(
-                query,
-                get_text("history_empty", language),
-                InlineKeyboardMarkup([[InlineKeyboardButton(get_text("back", language), callback_data="menu_section_history")]])
-            )
-            return True
-        
-        # Przygotuj tekst z historią
-        message_text = safe_markdown(f"*{get_text('history_title', language)}*\n\n")
-        
-        for i, msg in enumerate(history[-10:]):  # Ostatnie 10 wiadomości
-            sender = get_text("history_user", language) if msg['is_from_user'] else get_text("history_bot", language)
-            
-            # Skróć treść wiadomości, jeśli jest zbyt długa
-            content = msg.get('content', '')
-            if len(content) > 100:
-                content = content[:97] + "..."
-                
-            # Unikaj formatowania Markdown w treści wiadomości
-            content = content.replace("*", "").replace("_", "").replace("`", "").replace("[", "").replace("]", "")
-            
-            message_text += f"{i+1}. **{sender}**: {content}\n\n"
-        
-        # Dodaj przycisk do powrotu
-        keyboard = [[InlineKeyboardButton(get_text("back", language), callback_data="menu_section_history")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update_menu(query, message_text, reply_markup, parse_mode="Markdown")
-        return True
+        return await handle_history_view(update, context)
+    
+    elif query.data in ("history_older", "history_newer"):
+        return await handle_history_view(update, context, action=query.data[len("history_"):])
     
     elif query.data == "history_new":
         # Twórz nową konwersację
@@ -1009,15 +967,20 @@ async def handle_name_settings(update: Update, context: ContextTypes.DEFAULT_TYP
     
     return result
 
-async def handle_history_view(update, context):
-    """Obsługuje wyświetlanie historii"""
+async def handle_history_view(update, context, action=None):
+    """
+    Obsługuje wyświetlanie historii - stronami, od najnowszych wiadomości
+    
+    Args:
+        action (str, optional): 'older' lub 'newer' - przejście do sąsiedniej strony
+    """
     query = update.callback_query
     user_id = query.from_user.id
     language = get_user_language(context, user_id)
     
     # Pobierz aktywną konwersację
-    from database.supabase_client import get_active_conversation, get_conversation_history
-    conversation = get_active_conversation(user_id)
+    from database.async_supabase_client import get_active_conversation, get_messages_page
+    conversation = await get_active_conversation(user_id)
     
     if not conversation:
         # Informacja przez notyfikację
@@ -1036,10 +999,11 @@ async def handle_history_view(update, context):
         )
         return True
     
-    # Pobierz historię konwersacji
-    history = get_conversation_history(conversation['id'])
+    # Pobierz stronę historii konwersacji
+    cursor, direction = get_page_request(context, user_id, "history", action)
+    page = await get_messages_page(conversation['id'], cursor, direction, PAGE_SIZE)
     
-    if not history:
+    if not page or not page['items']:
         # Informacja przez notyfikację
         await query.answer(get_text("history_empty", language))
         
@@ -1056,24 +1020,31 @@ async def handle_history_view(update, context):
         )
         return True
     
-    # Przygotuj tekst z historią
+    store_page(context, user_id, "history", page)
+    
+    # Przygotuj tekst z historią - wiadomości strony w kolejności chronologicznej
     message_text = f"*{get_text('history_title', language)}*\n\n"
     
-    for i, msg in enumerate(history[-10:]):  # Ostatnie 10 wiadomości
+    for msg in reversed(page['items']):
         sender = get_text("history_user", language) if msg['is_from_user'] else get_text("history_bot", language)
         
         # Skróć treść wiadomości, jeśli jest zbyt długa
-        content = msg['content']
+        content = msg['content'] or ""
         if len(content) > 100:
             content = content[:97] + "..."
             
         # Unikaj formatowania Markdown w treści wiadomości, które mogłoby powodować problemy
         content = content.replace("*", "").replace("_", "").replace("`", "").replace("[", "").replace("]", "")
         
-        message_text += f"{i+1}. **{sender}**: {content}\n\n"
+        date = msg['created_at'].split('T')[0]
+        message_text += f"*{sender}* ({date}): {content}\n\n"
     
-    # Dodaj przycisk do powrotu
-    keyboard = [[InlineKeyboardButton(get_text("back", language), callback_data="menu_section_history")]]
+    # Nawigacja między stronami i przycisk powrotu
+    keyboard = []
+    navigation = build_page_navigation(page, "history", language)
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton(get_text("back", language), callback_data="menu_section_history")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     # Spróbuj wysłać z formatowaniem, a jeśli się nie powiedzie, wyślij bez
@@ -1087,7 +1058,7 @@ async def handle_history_view(update, context):
     except Exception as e:
         print(f"Błąd formatowania historii: {e}")
         # Spróbuj bez formatowania
-        plain_message = message_text.replace("*", "").replace("**", "")
+        plain_message = message_text.replace("*", "")
         await update_menu(
             query,
             plain_message,
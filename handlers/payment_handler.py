@@ -6,11 +6,14 @@ from database.credits_client import (
 )
 from database.payment_client import (
     get_available_payment_methods, create_payment_url, 
-    get_user_subscriptions, cancel_subscription,
-    get_payment_transactions
+    get_user_subscriptions, cancel_subscription
 )
+from database.async_supabase_client import get_payment_transactions_page
 from handlers.menu_handler import get_user_language
 from utils.translations import get_text
+from utils.pagination import get_page_request, store_page, build_page_navigation
+from utils.telegram_scheduler import outbound_priority, PRIORITY_HIGH
+from config import PAGE_SIZE
 import logging
 
 logger = logging.getLogger(__name__)
@@ -242,11 +245,13 @@ async def handle_payment_callback(update: Update, context: ContextTypes.DEFAULT_
                     message = get_text("payment_instructions", language, 
                                       default="Kliknij przycisk poniżej, aby przejść do płatności. Po zakończeniu transakcji kredyty zostaną automatycznie dodane do Twojego konta.")
                 
-                await query.edit_message_text(
-                    message,
-                    reply_markup=reply_markup,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                # Link do płatności ma pierwszeństwo w kolejce wiadomości
+                with outbound_priority(PRIORITY_HIGH):
+                    await query.edit_message_text(
+                        message,
+                        reply_markup=reply_markup,
+                        parse_mode=ParseMode.MARKDOWN
+                    )
             else:
                 # Wyświetl błąd, jeśli nie udało się utworzyć URL płatności
                 await query.edit_message_text(
@@ -393,29 +398,51 @@ async def handle_payment_callback(update: Update, context: ContextTypes.DEFAULT_
         )
         return True
     
+    # Obsługa historii transakcji płatności i przechodzenia między jej stronami
+    elif query.data in ("transactions_command", "payment_tx_older", "payment_tx_newer"):
+        action = query.data[len("payment_tx_"):] if query.data.startswith("payment_tx_") else None
+        message, reply_markup = await _build_transactions_page(context, user_id, language, action)
+        
+        await query.edit_message_text(
+            message,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return True
+    
     return False  # Jeśli callback nie został obsłużony
 
-async def transactions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """
-    Obsługuje komendę /transactions
-    Wyświetla historię transakcji płatności
+async def _build_transactions_page(context, user_id, language, action=None):
     """
-    user_id = update.effective_user.id
-    language = get_user_language(context, user_id)
+    Przygotowuje stronę historii transakcji płatności
     
-    # Pobierz historię transakcji
-    transactions = get_payment_transactions(user_id)
+    Args:
+        action (str, optional): 'older' lub 'newer' - przejście do sąsiedniej strony
     
-    if not transactions:
-        await update.message.reply_text(
-            get_text("no_payment_transactions", language, default="Nie masz żadnych transakcji płatności.")
+    Returns:
+        tuple: (tekst wiadomości, klawiatura)
+    """
+    cursor, direction = get_page_request(context, user_id, "payment_tx", action)
+    page = await get_payment_transactions_page(user_id, cursor, direction, PAGE_SIZE)
+    
+    # Przycisk powrotu
+    back_row = [
+        InlineKeyboardButton(
+            get_text("back", language), 
+            callback_data="payment_back_to_credits"
         )
-        return
+    ]
+    
+    if not page or not page['items']:
+        message = get_text("no_payment_transactions", language, default="Nie masz żadnych transakcji płatności.")
+        return message, InlineKeyboardMarkup([back_row])
+    
+    store_page(context, user_id, "payment_tx", page)
     
     # Utwórz wiadomość z historią transakcji
     message = get_text("payment_transactions_history", language, default="*Historia transakcji płatności:*\n\n")
     
-    for i, transaction in enumerate(transactions, 1):
+    for transaction in page['items']:
         status_text = {
             'pending': get_text("transaction_status_pending", language, default="Oczekująca"),
             'completed': get_text("transaction_status_completed", language, default="Zakończona"),
@@ -425,19 +452,29 @@ async def transactions_command(update: Update, context: ContextTypes.DEFAULT_TYP
         
         date = transaction['created_at'].split('T')[0]
         
-        message += f"{i}. *{transaction['package_name']}* - {transaction['package_credits']} {get_text('credits', language)}\n"
+        message += f"*{transaction['package_name']}* - {transaction['package_credits']} {get_text('credits', language)}\n"
         message += f"   {transaction['payment_method_name']} - {transaction['amount']} PLN\n"
         message += f"   {get_text('status', language, default='Status')}: {status_text}, {get_text('date', language, default='Data')}: {date}\n\n"
     
-    # Dodaj przycisk powrotu
-    keyboard.append([
-        InlineKeyboardButton(
-            get_text("back", language), 
-            callback_data="payment_back_to_credits"
-        )
-    ])
+    # Nawigacja między stronami
+    keyboard = []
+    navigation = build_page_navigation(page, "payment_tx", language)
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append(back_row)
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return message, InlineKeyboardMarkup(keyboard)
+
+async def transactions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Obsługuje komendę /transactions
+    Wyświetla historię transakcji płatności
+    """
+    user_id = update.effective_user.id
+    language = get_user_language(context, user_id)
+    
+    # Pobierz pierwszą stronę historii transakcji
+    message, reply_markup = await _build_transactions_page(context, user_id, language)
     
     await update.message.reply_text(
         message,
@@ -1,71 +1,183 @@
-from telegram import Update
+import logging
+import os
+from collections import OrderedDict
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode, ChatAction
 from utils.translations import get_text
-from utils.pdf_translator import translate_pdf_first_paragraph
-from database.credits_client import check_user_credits, deduct_user_credits, get_user_credits
-from handlers.menu_handler import get_user_language
+from utils.pdf_translator import extract_pages, pdf_document_key, pending_pages, translate_pdf_pages
+from utils.pdf_generator import generate_translated_pdf
+from utils.media_cache import open_file
+from utils.telegram_scheduler import outbound_priority, PRIORITY_LOW
+from utils.user_utils import get_user_language
+from utils.executor import run_blocking, ExecutorBusy
+from utils.usage_meter import charged_tokens
+from database.async_supabase_client import check_user_credits, ledger_deduct, balance_after
+from config import CREDIT_COSTS, PDF_MAX_PAGES
+
+logger = logging.getLogger(__name__)
+
+# Pliki PDF, które można przetłumaczyć przyciskiem: file_unique_id -> (file_id, nazwa pliku).
+# file_id jest zbyt długi na callback_data (limit 64 bajtów), więc przycisk niesie file_unique_id
+REMEMBERED_PDFS = 1000
+_remembered = OrderedDict()
+
+def remember_pdf(document):
+    """
+    Zapamiętuje plik PDF dla przycisku tłumaczenia
+
+    Returns:
+        str: Klucz do callback_data (file_unique_id)
+    """
+    _remembered[document.file_unique_id] = (document.file_id, document.file_name)
+    _remembered.move_to_end(document.file_unique_id)
+    while len(_remembered) > REMEMBERED_PDFS:
+        _remembered.popitem(last=False)
+    return document.file_unique_id
+
+def remembered_pdf(key):
+    """Zwraca (file_id, file_unique_id, nazwa pliku) zapamiętanego pliku PDF lub None (np. po restarcie bota)"""
+    entry = _remembered.get(key)
+    if entry is None:
+        return None
+    return entry[0], key, entry[1]
 
 async def handle_pdf_translation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Obsługuje tłumaczenie pierwszego akapitu z pliku PDF
+    Obsługuje tłumaczenie pliku PDF przesłanego z komentarzem /translate
     """
     user_id = update.effective_user.id
     language = get_user_language(context, user_id)
-    
-    # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
-    credit_cost = 8  # Ustalamy koszt operacji tłumaczenia PDF na 8 kredytów
-    if not check_user_credits(user_id, credit_cost):
-        await update.message.reply_text(get_text("subscription_expired", language))
-        return
-    
+
     # Sprawdź, czy wiadomość zawiera plik PDF
     if not update.message.document or not update.message.document.file_name.lower().endswith('.pdf'):
         await update.message.reply_text(get_text("not_pdf_file", language, default="Plik nie jest w formacie PDF."))
         return
-    
+
     document = update.message.document
-    file_name = document.file_name
-    
+
     # Sprawdź rozmiar pliku (limit 25MB)
     if document.file_size > 25 * 1024 * 1024:
         await update.message.reply_text(get_text("file_too_large", language))
         return
-    
+
+    remember_pdf(document)
+    await translate_pdf(
+        context, update.message, user_id, language, document.file_id, document.file_unique_id, document.file_name
+    )
+
+async def translate_pdf(context, message, user_id, language, file_id, file_unique_id, file_name, target_lang="en"):
+    """
+    Tłumaczy cały plik PDF i wysyła przetłumaczony dokument jako nowy plik PDF
+
+    Opłata jest naliczana za każdą stronę przetłumaczoną w tym wywołaniu. Po błędzie strony
+    już przetłumaczone są zapisane, a przycisk "Wznów" tłumaczy tylko pozostałe.
+
+    Args:
+        context: Kontekst handlera
+        message: Wiadomość, na którą bot odpowiada (status i wynik)
+        user_id (int): ID użytkownika
+        language (str): Język interfejsu użytkownika
+        file_id (str): file_id pliku PDF
+        file_unique_id (str): file_unique_id pliku PDF (klucz przycisku wznowienia)
+        file_name (str): Nazwa pliku
+        target_lang (str): Język docelowy (dwuliterowy kod)
+    """
+    page_price = CREDIT_COSTS["pdf_page"]
+
     # Wyślij informację o rozpoczęciu tłumaczenia
-    status_message = await update.message.reply_text(get_text("translating_pdf", language))
-    
-    # Wyślij informację o aktywności bota
-    await update.message.chat.send_action(action=ChatAction.TYPING)
-    
-    # Pobierz plik
-    file = await context.bot.get_file(document.file_id)
-    file_bytes = await file.download_as_bytearray()
-    
-    # Przetłumacz pierwszy akapit
-    result = await translate_pdf_first_paragraph(file_bytes)
-    
-    # Odejmij kredyty
-    deduct_user_credits(user_id, credit_cost, f"Tłumaczenie pliku PDF: {file_name}")
-    
-    # Przygotuj odpowiedź
-    if result["success"]:
-        response = f"*{get_text('pdf_translation_result', language)}*\n\n"
-        response += f"*{get_text('original_text', language)}:*\n{result['original_text']}\n\n"
-        response += f"*{get_text('translated_text', language)}:*\n{result['translated_text']}"
-    else:
-        response = f"*{get_text('pdf_translation_error', language)}*\n\n{result['error']}"
-    
-    # Wyślij wynik tłumaczenia
-    await status_message.edit_text(
-        text=response,
-        parse_mode=ParseMode.MARKDOWN
+    status_message = await message.reply_text(get_text("translating_pdf", language))
+    await message.chat.send_action(action=ChatAction.TYPING)
+
+    # Tekst stron jest wyciągany od razu - plik nie jest potrzebny podczas tłumaczenia
+    try:
+        async with open_file(context.bot, file_id, file_unique_id) as pdf_file:
+            page_count, pages = await extract_pages(pdf_file)
+            document_key = pdf_document_key(pdf_file, target_lang) if pages else None
+    except ExecutorBusy:
+        await status_message.edit_text(get_text("server_busy", language))
+        return
+    except Exception as e:
+        logger.error(f"Błąd odczytu pliku PDF {file_name}: {e!r}")
+        await status_message.edit_text(f"{get_text('pdf_translation_error', language)}\n\n{e!r}")
+        return
+
+    if pages is None:
+        await status_message.edit_text(get_text("pdf_too_many_pages", language, pages=page_count, limit=PDF_MAX_PAGES))
+        return
+    if not any(pages):
+        await status_message.edit_text(get_text("pdf_no_text", language))
+        return
+
+    # Sprawdź, czy użytkownik ma kredyty na strony, które trzeba jeszcze przetłumaczyć
+    pending = len(pending_pages(pages, document_key))
+    if pending and not await check_user_credits(user_id, pending * page_price):
+        await status_message.edit_text(
+            get_text("pdf_credits_needed", language, pages=pending, credits=pending * page_price)
+        )
+        return
+
+    async def report_progress(stage, done, total):
+        # Edycje postępu ustępują w kolejce Bot API odpowiedziom
+        with outbound_priority(PRIORITY_LOW):
+            await status_message.edit_text(get_text("pdf_translation_progress", language, done=done, total=total))
+
+    call_info = {}
+    result = await translate_pdf_pages(
+        pages, document_key, target_lang, user_id, on_progress=report_progress, call_info=call_info
     )
-    
+
+    # Odejmij kredyty za strony przetłumaczone w tym wywołaniu (również przed błędem - są zapisane)
+    charged = len(result["translated"]) * page_price
+    credits = None
+    if charged:
+        credits = await ledger_deduct(
+            user_id, charged, f"Tłumaczenie pliku PDF ({len(result['translated'])} str.): {file_name}", "pdf_translation",
+            **charged_tokens(call_info)
+        )
+
+    if not result["success"]:
+        done = sum(1 for text in result["pages"] if text is not None)
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton(get_text("pdf_resume_button", language), callback_data=f"translate_pdf_{file_unique_id}")
+        ]])
+        await status_message.edit_text(
+            get_text(
+                "pdf_translation_failed", language, page=result["failed_page"] + 1, error=result["error"],
+                done=done, total=len(pages), credits=charged
+            ),
+            reply_markup=keyboard
+        )
+        return
+
+    # Złóż przetłumaczony dokument w puli procesów - reportlab blokuje przy dużych plikach.
+    # Przetłumaczone strony są zapisane, więc po błędzie wystarczy ponowić (bez opłaty)
+    base_name = os.path.splitext(file_name)[0]
+    error_text = None
+    try:
+        pdf_buffer = await run_blocking("pdf", generate_translated_pdf, result["pages"], f"{base_name} ({target_lang})")
+    except ExecutorBusy:
+        error_text = get_text("server_busy", language)
+    except Exception as e:
+        logger.error(f"Błąd generowania przetłumaczonego pliku PDF {file_name}: {e!r}")
+        error_text = f"{get_text('pdf_translation_error', language)}\n\n{e!r}"
+    if error_text is not None:
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton(get_text("pdf_resume_button", language), callback_data=f"translate_pdf_{file_unique_id}")
+        ]])
+        await status_message.edit_text(error_text, reply_markup=keyboard)
+        return
+    await message.reply_document(
+        document=pdf_buffer,
+        filename=f"{base_name}_{target_lang}.pdf",
+        caption=get_text("pdf_translation_result", language)
+    )
+    await status_message.edit_text(get_text("pdf_translation_done", language, pages=len(pages), credits=charged))
+
     # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    credits = await balance_after(user_id, credits)
     if credits < 5:
-        await update.message.reply_text(
+        await message.reply_text(
             f"*{get_text('low_credits_warning', language)}* {get_text('low_credits_message', language, credits=credits)}",
             parse_mode=ParseMode.MARKDOWN
-        )
\ No newline at end of file
+        )
@@ -6,6 +6,7 @@ from database.supabase_client import (
     create_conversation_theme, get_user_themes, 
     get_theme_by_id, get_active_themed_conversation
 )
+from database.profile_cache import get_cached, cache_profile, invalidate_profile
 from utils.translations import get_text
 from handlers.menu_handler import get_user_language
 
@@ -56,6 +57,7 @@ async def create_new_theme(update: Update, context: ContextTypes.DEFAULT_TYPE, t
     
     context.chat_data['user_data'][user_id]['current_theme_id'] = theme['id']
     context.chat_data['user_data'][user_id]['current_theme_name'] = theme['theme_name']
+    cache_profile(user_id, theme={'id': theme['id'], 'name': theme['theme_name']})
     
     # Utwórz konwersację dla tego tematu
     conversation = get_active_themed_conversation(user_id, theme['id'])
@@ -112,6 +114,12 @@ async def show_themes_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if 'user_data' in context.chat_data and user_id in context.chat_data['user_data']:
         current_theme_id = context.chat_data['user_data'][user_id].get('current_theme_id')
         current_theme_name = context.chat_data['user_data'][user_id].get('current_theme_name', "brak")
+    else:
+        # Temat wybrany w innym czacie - z pamięci podręcznej profilu
+        cached_theme = get_cached(user_id, 'theme')
+        if cached_theme:
+            current_theme_id = cached_theme['id']
+            current_theme_name = cached_theme['name']
     
     await update.message.reply_text(
         f"📑 *Tematy konwersacji*\n\n"
@@ -149,6 +157,7 @@ async def handle_theme_callback(update: Update, context: ContextTypes.DEFAULT_TY
                 del context.chat_data['user_data'][user_id]['current_theme_id']
             if 'current_theme_name' in context.chat_data['user_data'][user_id]:
                 del context.chat_data['user_data'][user_id]['current_theme_name']
+        invalidate_profile(user_id, 'theme')
         
         # Utwórz nową konwersację bez tematu
         from database.supabase_client import create_new_conversation
@@ -182,6 +191,7 @@ async def handle_theme_callback(update: Update, context: ContextTypes.DEFAULT_TY
         
         context.chat_data['user_data'][user_id]['current_theme_id'] = theme['id']
         context.chat_data['user_data'][user_id]['current_theme_name'] = theme['theme_name']
+        cache_profile(user_id, theme={'id': theme['id'], 'name': theme['theme_name']})
         
         # Pobierz aktywną konwersację dla tego tematu
         conversation = get_active_themed_conversation(user_id, theme['id'])
@@ -207,6 +217,7 @@ async def notheme_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             del context.chat_data['user_data'][user_id]['current_theme_id']
         if 'current_theme_name' in context.chat_data['user_data'][user_id]:
             del context.chat_data['user_data'][user_id]['current_theme_name']
+    invalidate_profile(user_id, 'theme')
     
     # Utwórz nową konwersację bez tematu
     from database.supabase_client import create_new_conversation
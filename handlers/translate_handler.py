@@ -2,8 +2,12 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode, ChatAction
 from utils.translations import get_text
-from utils.openai_client import analyze_image, analyze_document
-from database.credits_client import check_user_credits, deduct_user_credits, get_user_credits
+from utils.openai_client import analyze_image, analyze_document, prepare_document
+from utils.media_cache import fetch_file, open_file
+from utils.executor import run_blocking, ExecutorBusy
+from utils.document_analysis import message_progress, send_document_result
+from utils.usage_meter import charged_tokens, document_credits
+from database.async_supabase_client import check_user_credits, ledger_deduct, balance_after
 from handlers.menu_handler import get_user_language
 import re
 
@@ -66,7 +70,7 @@ async def translate_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, ph
     
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
     credit_cost = 8  # Koszt tłumaczenia zdjęcia
-    if not check_user_credits(user_id, credit_cost):
+    if not await check_user_credits(user_id, credit_cost):
         await update.message.reply_text(get_text("subscription_expired", language))
         return
     
@@ -79,14 +83,20 @@ async def translate_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, ph
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
     # Pobierz zdjęcie
-    file = await context.bot.get_file(photo.file_id)
-    file_bytes = await file.download_as_bytearray()
+    file_bytes = await fetch_file(context.bot, photo.file_id, photo.file_unique_id)
     
     # Tłumacz tekst ze zdjęcia w określonym kierunku
-    result = await analyze_image(file_bytes, f"photo_{photo.file_unique_id}.jpg", mode="translate", target_language=target_lang)
+    call_info = {}
+    result = await analyze_image(file_bytes, f"photo_{photo.file_unique_id}.jpg", mode="translate", target_language=target_lang, file_id=photo.file_unique_id, call_info=call_info)
     
-    # Odejmij kredyty
-    deduct_user_credits(user_id, credit_cost, f"Tłumaczenie tekstu ze zdjęcia na język {target_lang}")
+    # Odejmij kredyty - atomowo, odmowa oznacza, że saldo zostało w międzyczasie wydane
+    credits = await ledger_deduct(
+        user_id, credit_cost, f"Tłumaczenie tekstu ze zdjęcia na język {target_lang}", "translation",
+        **charged_tokens(call_info)
+    )
+    if credits is None:
+        await message.edit_text(get_text("subscription_expired", language))
+        return
     
     # Wyślij tłumaczenie
     await message.edit_text(
@@ -95,7 +105,7 @@ async def translate_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, ph
     )
     
     # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    credits = await balance_after(user_id, credits)
     if credits < 5:
         await update.message.reply_text(
             f"{get_text('low_credits_warning', language)} {get_text('low_credits_message', language, credits=credits)}",
@@ -108,8 +118,8 @@ async def translate_document(update: Update, context: ContextTypes.DEFAULT_TYPE,
     language = get_user_language(context, user_id)
     
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
-    credit_cost = 8  # Koszt tłumaczenia dokumentu
-    if not check_user_credits(user_id, credit_cost):
+    base_cost = 8  # Koszt tłumaczenia dokumentu
+    if not await check_user_credits(user_id, base_cost):
         await update.message.reply_text(get_text("subscription_expired", language))
         return
     
@@ -129,23 +139,46 @@ async def translate_document(update: Update, context: ContextTypes.DEFAULT_TYPE,
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
     # Pobierz plik
-    file = await context.bot.get_file(document.file_id)
-    file_bytes = await file.download_as_bytearray()
-    
-    # Tłumacz dokument
-    result = await analyze_document(file_bytes, file_name, mode="translate", target_language=target_lang)
+    async with open_file(context.bot, document.file_id, document.file_unique_id) as document_file:
+        # Długi dokument jest tłumaczony częściami - opłata rośnie z liczbą części
+        try:
+            prepared = await run_blocking("threads", prepare_document, document_file, file_name, "translate")
+        except (ExecutorBusy, TimeoutError):
+            await message.edit_text(get_text("server_busy", language))
+            return
+        parts = prepared["parts"]
+        credit_cost = document_credits(base_cost, parts)
+        if parts > 1 and not await check_user_credits(user_id, credit_cost):
+            await message.edit_text(get_text("document_credits_needed", language, parts=parts, credits=credit_cost))
+            return
+        
+        # Tłumacz dokument
+        call_info = {}
+        result = await analyze_document(
+            document_file, file_name, mode="translate", target_language=target_lang, file_id=document.file_unique_id,
+            user_id=user_id, on_progress=message_progress(message, language, translate=True), call_info=call_info,
+            prepared=prepared
+        )
     
-    # Odejmij kredyty
-    deduct_user_credits(user_id, credit_cost, f"Tłumaczenie dokumentu na język {target_lang}: {file_name}")
+    # Wynik z pamięci podręcznej nie wymagał wywołań modelu - obowiązuje cena dokumentu bez części
+    if call_info.get("cached"):
+        credit_cost = base_cost
     
-    # Wyślij tłumaczenie
-    await message.edit_text(
-        f"*{get_text('translation_result', language, default='Wynik tłumaczenia')}*\n\n{result}",
-        parse_mode=ParseMode.MARKDOWN
+    # Odejmij kredyty - atomowo, odmowa oznacza, że saldo zostało w międzyczasie wydane
+    credits = await ledger_deduct(
+        user_id, credit_cost, f"Tłumaczenie dokumentu na język {target_lang}: {file_name}", "translation",
+        **charged_tokens(call_info)
     )
+    if credits is None:
+        await message.edit_text(get_text("subscription_expired", language))
+        return
+    
+    # Wyślij tłumaczenie (dłuższe niż wiadomość - również jako plik tekstowy)
+    header = f"*{get_text('translation_result', language, default='Wynik tłumaczenia')}*\n\n"
+    await send_document_result(message, header, result, file_name)
     
     # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    credits = await balance_after(user_id, credits)
     if credits < 5:
         await update.message.reply_text(
             f"{get_text('low_credits_warning', language)} {get_text('low_credits_message', language, credits=credits)}",
@@ -161,7 +194,7 @@ async def translate_text(update: Update, context: ContextTypes.DEFAULT_TYPE, tex
     
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
     credit_cost = 3  # Koszt tłumaczenia tekstu
-    if not check_user_credits(user_id, credit_cost):
+    if not await check_user_credits(user_id, credit_cost):
         await update.message.reply_text(get_text("subscription_expired", language))
         return
     
@@ -186,10 +219,21 @@ async def translate_text(update: Update, context: ContextTypes.DEFAULT_TYPE, tex
     ]
     
     # Wykonaj tłumaczenie
-    translation = await chat_completion(messages, model="gpt-3.5-turbo")
+    call_info = {}
+    translation = await chat_completion(messages, model="gpt-3.5-turbo", call_info=call_info)
     
-    # Odejmij kredyty
-    deduct_user_credits(user_id, credit_cost, f"Translation to {target_lang}")
+    # Nie pobieraj kredytów, jeśli tłumaczenia nie udało się uzyskać
+    if translation is None:
+        await message.edit_text(get_text("error", language))
+        return
+    
+    # Odejmij kredyty - atomowo, odmowa oznacza, że saldo zostało w międzyczasie wydane
+    credits = await ledger_deduct(
+        user_id, credit_cost, f"Translation to {target_lang}", "translation", **charged_tokens(call_info)
+    )
+    if credits is None:
+        await message.edit_text(get_text("subscription_expired", language))
+        return
     
     # Wyślij tłumaczenie
     source_lang_name = get_language_name(language)
@@ -201,7 +245,7 @@ async def translate_text(update: Update, context: ContextTypes.DEFAULT_TYPE, tex
     )
     
     # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    credits = await balance_after(user_id, credits)
     if credits < 5:
         await update.message.reply_text(
             f"{get_text('low_credits_warning', language)} {get_text('low_credits_message', language, credits=credits)}",
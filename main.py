@@ -6,13 +6,15 @@ os.environ.pop("http_proxy", None)
 os.environ.pop("https_proxy", None)
 os.environ["HTTPX_SKIP_PROXY"] = "true"
 
+import asyncio
 import logging
+import math
 logging.basicConfig(level=logging.DEBUG)
 import re
 import datetime
 import pytz
 from handlers.admin_package_handler import (
-    add_package, list_packages, toggle_package, add_default_packages
+    add_package, list_packages, toggle_package, add_default_packages, bot_stats
 )
 from telegram.ext import Application
 from config import TELEGRAM_TOKEN
@@ -32,7 +34,8 @@ from telegram.constants import ParseMode, ChatAction
 from config import (
     TELEGRAM_TOKEN, DEFAULT_MODEL, AVAILABLE_MODELS, 
     MAX_CONTEXT_MESSAGES, CHAT_MODES, BOT_NAME, CREDIT_COSTS,
-    AVAILABLE_LANGUAGES, ADMIN_USER_IDS
+    AVAILABLE_LANGUAGES, ADMIN_USER_IDS, CONCURRENT_UPDATES, USER_SUPERSEDE_REPLIES,
+    OPENAI_COMPLETION_TOKENS_ESTIMATE
 )
 
 from handlers.payment_handler import (
@@ -43,20 +46,17 @@ from handlers.payment_handler import (
 # Import funkcji z modułu tłumaczeń
 from utils.translations import get_text
 
-# Import funkcji z modułu sqlite_client
-from database.supabase_client import (
+# Import asynchronicznej warstwy dostępu do danych
+from database.async_supabase_client import (
     get_or_create_user, create_new_conversation, 
     get_active_conversation, save_message, 
     get_conversation_history, get_message_status,
     check_active_subscription, check_message_limit,
-    increment_messages_used
-)
-
-# Import funkcji obsługi kredytów
-from database.credits_client import (
-    get_user_credits, add_user_credits, deduct_user_credits, 
-    check_user_credits
+    increment_messages_used, get_user_credits, add_user_credits,
+    deduct_user_credits, check_user_credits, ledger_deduct, close_client,
+    begin_chat_turn, commit_chat_turn, balance_after
 )
+from database.message_queue import enqueue_message, drain_message_queue
 
 # Import handlerów kredytów
 from handlers.credit_handler import (
@@ -86,30 +86,56 @@ from handlers.image_handler import generate_image
 from handlers.mode_handler import handle_mode_selection, show_modes
 
 from utils.openai_client import (
-    chat_completion_stream, prepare_messages_from_history,
-    generate_image_dall_e, analyze_document, analyze_image
+    chat_completion_stream,
+    generate_image_dall_e, analyze_document, analyze_image, prepare_document
 )
 
 # Import handlera eksportu
 from handlers.export_handler import export_conversation
+from utils.context_builder import build_chat_context, count_tokens
+from utils.usage_meter import credits_for_usage, charged_tokens, document_credits
 from utils.credit_analytics import generate_credit_usage_chart, generate_usage_breakdown_chart
+from utils.openai_http import warm_up_openai_pool, close_openai_pool
+from utils.executor import shutdown_executors
+from utils.metrics import start_stats_logging, stop_stats_logging
+from utils.media_cache import fetch_file, open_file
+from utils.executor import run_blocking, ExecutorBusy
+from utils.document_analysis import message_progress, send_document_result
+from handlers.pdf_handler import handle_pdf_translation, remember_pdf, remembered_pdf, translate_pdf
+from utils.stream_renderer import StreamRenderer
+from utils.telegram_scheduler import outbound_scheduler
+from utils.user_lanes import (
+    user_lane, get_cancel_reason, end_interruptible, current_task_id, stop_generation, SUPERSEDED
+)
 
 # Napraw problem z proxy w httpx
 from telegram.request import HTTPXRequest
 
-# Nadpisz metodę _build_client
-original_build_client = HTTPXRequest._build_client
+def patch_httpx_request():
+    """Nadpisuje HTTPXRequest._build_client, aby nie przekazywał do httpx argumentu 'proxies'"""
+    original_build_client = HTTPXRequest._build_client
+
+    def patched_build_client(self):
+        if hasattr(self, '_client_kwargs') and 'proxies' in self._client_kwargs:
+            del self._client_kwargs['proxies']
+        return original_build_client(self)
 
-def patched_build_client(self):
-    if hasattr(self, '_client_kwargs') and 'proxies' in self._client_kwargs:
-        del self._client_kwargs['proxies']
-    return original_build_client(self)
+    # Podmieniamy metodę
+    HTTPXRequest._build_client = patched_build_client
 
-# Podmieniamy metodę
-HTTPXRequest._build_client = patched_build_client
+async def on_startup(application):
+    """Przygotowuje połączenia z OpenAI przed obsługą pierwszych wiadomości"""
+    await warm_up_openai_pool()
+    start_stats_logging()
 
-# Inicjalizacja aplikacji
-application = Application.builder().token(TELEGRAM_TOKEN).build()
+async def on_shutdown(application):
+    """Zwalnia zasoby współdzielone przez handlery przy zamykaniu bota"""
+    await stop_stats_logging()
+    # Najpierw zapisz wiadomości oczekujące w kolejce, dopiero potem zamknij pulę połączeń
+    await drain_message_queue()
+    await close_client()
+    await close_openai_pool()
+    shutdown_executors()
 
 # Funkcje onboardingu
 async def onboarding_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -343,7 +369,7 @@ async def restart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
         
         # Resetowanie konwersacji - tworzymy nową konwersację i czyścimy kontekst
-        conversation = create_new_conversation(user_id)
+        conversation = await create_new_conversation(user_id)
         
         # Zachowujemy wybrane ustawienia użytkownika (język, model)
         user_data = {}
@@ -435,7 +461,7 @@ async def check_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     language = get_user_language(context, user_id)
     
     # Pobierz status kredytów
-    credits = get_user_credits(user_id)
+    credits = await get_user_credits(user_id)
     
     # Pobranie aktualnego trybu czatu
     current_mode = get_text("no_mode", language)
@@ -457,7 +483,7 @@ async def check_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     model_name = AVAILABLE_MODELS.get(current_model, "Unknown Model")
     
     # Pobierz status wiadomości
-    message_status = get_message_status(user_id)
+    message_status = await get_message_status(user_id)
     
     # Stwórz wiadomość o statusie, używając tłumaczeń
     message = f"""
@@ -503,7 +529,7 @@ async def new_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     language = get_user_language(context, user_id)
     
     # Utwórz nową konwersację
-    conversation = create_new_conversation(user_id)
+    conversation = await create_new_conversation(user_id)
     
     if conversation:
         await update.message.reply_text(
@@ -516,11 +542,19 @@ async def new_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode=ParseMode.MARKDOWN
         )
 
+def partial_credit_cost(credit_cost, text, model):
+    """
+    Koszt przerwanej odpowiedzi - proporcjonalny do liczby wygenerowanych tokenów
+    względem typowej długości odpowiedzi (co najmniej 1 kredyt, najwyżej pełny koszt)
+    """
+    produced = count_tokens(text, model)
+    return max(1, math.ceil(credit_cost * min(1.0, produced / OPENAI_COMPLETION_TOKENS_ESTIMATE)))
+
+@user_lane(supersede=USER_SUPERSEDE_REPLIES, supersedable=USER_SUPERSEDE_REPLIES)
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obsługa wiadomości tekstowych od użytkownika ze strumieniowaniem odpowiedzi"""
     user_id = update.effective_user.id
     user_message = update.message.text
-    language = get_user_language(context, user_id)
     
     print(f"Otrzymano wiadomość od użytkownika {user_id}: {user_message}")
     
@@ -536,42 +570,35 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     print(f"Tryb: {current_mode}, koszt kredytów: {credit_cost}")
     
+    # Pobierz saldo, język, aktywną konwersację i historię jednym zapytaniem
+    turn = await begin_chat_turn(user_id, history_limit=MAX_CONTEXT_MESSAGES)
+    
+    if turn is None:
+        await update.message.reply_text(get_text("conversation_error", get_user_language(context, user_id)))
+        return
+    
+    # Język z kontekstu ma pierwszeństwo (zmiana w menu), w przeciwnym razie zapamiętaj język z bazy
+    if 'user_data' not in context.chat_data:
+        context.chat_data['user_data'] = {}
+    if user_id not in context.chat_data['user_data']:
+        context.chat_data['user_data'][user_id] = {}
+    language = context.chat_data['user_data'][user_id].setdefault('language', turn['language'])
+    
+    conversation_id = turn['conversation_id']
+    history = turn['history']
+    print(f"Aktywna konwersacja: {conversation_id}, liczba wiadomości w historii: {len(history)}")
+    
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
-    has_credits = check_user_credits(user_id, credit_cost)
+    has_credits = turn['credits'] >= credit_cost
     print(f"Czy użytkownik ma wystarczająco kredytów: {has_credits}")
     
     if not has_credits:
         await update.message.reply_text(get_text("subscription_expired", language))
         return
     
-    # Pobierz lub utwórz aktywną konwersację
-    try:
-        conversation = get_active_conversation(user_id)
-        conversation_id = conversation['id']
-        print(f"Aktywna konwersacja: {conversation_id}")
-    except Exception as e:
-        print(f"Błąd przy pobieraniu konwersacji: {e}")
-        await update.message.reply_text(get_text("conversation_error", language))
-        return
-    
-    # Zapisz wiadomość użytkownika do bazy danych
-    try:
-        save_message(conversation_id, user_id, user_message, is_from_user=True)
-        print("Wiadomość użytkownika zapisana w bazie")
-    except Exception as e:
-        print(f"Błąd przy zapisie wiadomości użytkownika: {e}")
-    
     # Wyślij informację, że bot pisze
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
-    # Pobierz historię konwersacji
-    try:
-        history = get_conversation_history(conversation_id, limit=MAX_CONTEXT_MESSAGES)
-        print(f"Pobrano historię konwersacji, liczba wiadomości: {len(history)}")
-    except Exception as e:
-        print(f"Błąd przy pobieraniu historii: {e}")
-        history = []
-    
     # Określ model do użycia - domyślny lub z trybu czatu
     model_to_use = CHAT_MODES[current_mode].get("model", DEFAULT_MODEL)
     
@@ -589,60 +616,115 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     system_prompt = CHAT_MODES[current_mode]["prompt"]
     
     # Przygotuj wiadomości dla API OpenAI
-    messages = prepare_messages_from_history(history, user_message, system_prompt)
-    print(f"Przygotowano {len(messages)} wiadomości dla API")
+    messages, prompt_tokens = build_chat_context(history, user_message, system_prompt, model_to_use)
+    print(f"Przygotowano {len(messages)} wiadomości dla API ({prompt_tokens} tokenów)")
+    
+    # Przycisk "Stop" przerywa generowanie - widoczny do zakończenia odpowiedzi
+    stop_markup = None
+    task_id = current_task_id()
+    if task_id is not None:
+        stop_markup = InlineKeyboardMarkup([[
+            InlineKeyboardButton(get_text("stop_generation_btn", language), callback_data=f"stop_gen_{task_id}")
+        ]])
     
     # Wyślij początkową pustą wiadomość, którą będziemy aktualizować
-    response_message = await update.message.reply_text(get_text("generating_response", language))
+    response_message = await update.message.reply_text(get_text("generating_response", language), reply_markup=stop_markup)
+    
+    # Renderer edytuje wiadomość w tle, dopasowując tempo edycji do limitów Telegrama
+    renderer = StreamRenderer(response_message, reply_markup=stop_markup)
+    stopped = False
     
-    # Zainicjuj pełną odpowiedź
-    full_response = ""
-    buffer = ""
-    last_update = datetime.datetime.now().timestamp()
+    # Faktycznie użyty model - może się różnić od wybranego po przełączeniu na model zapasowy
+    call_info = {}
     
     # Spróbuj wygenerować odpowiedź
     try:
         print("Rozpoczynam generowanie odpowiedzi strumieniowej...")
         # Generuj odpowiedź strumieniowo
-        async for chunk in chat_completion_stream(messages, model=model_to_use):
-            full_response += chunk
-            buffer += chunk
-            
-            # Aktualizuj wiadomość co 1 sekundę lub gdy bufor jest wystarczająco duży
-            current_time = datetime.datetime.now().timestamp()
-            if current_time - last_update >= 1.0 or len(buffer) > 100:
-                try:
-                    # Dodaj migający kursor na końcu wiadomości
-                    await response_message.edit_text(full_response + "▌", parse_mode=ParseMode.MARKDOWN)
-                    buffer = ""
-                    last_update = current_time
-                except Exception as e:
-                    # Jeśli wystąpi błąd (np. wiadomość nie została zmieniona), kontynuuj
-                    print(f"Błąd przy aktualizacji wiadomości: {e}")
+        async for chunk in chat_completion_stream(messages, model=model_to_use, call_info=call_info):
+            renderer.feed(chunk)
         
+        # Od tej chwili odpowiedzi nie można przerwać - zapis i opłata muszą się wykonać
+        end_interruptible()
         print("Zakończono generowanie odpowiedzi")
         
-        # Aktualizuj wiadomość z pełną odpowiedzią bez kursora
-        try:
-            await response_message.edit_text(full_response, parse_mode=ParseMode.MARKDOWN)
-        except Exception as e:
-            # Jeśli wystąpi błąd formatowania Markdown, wyślij bez formatowania
-            print(f"Błąd formatowania Markdown: {e}")
-            await response_message.edit_text(full_response)
+        # Wyświetl pełną odpowiedź bez kursora
+        await renderer.finish()
+        full_response = renderer.text
         
-        # Zapisz odpowiedź do bazy danych
-        save_message(conversation_id, user_id, full_response, is_from_user=False, model_used=model_to_use)
+    except asyncio.CancelledError:
+        reason = get_cancel_reason()
+        if reason is None:
+            raise
+        end_interruptible()
+        full_response = renderer.text
+        
+        if reason == SUPERSEDED:
+            # Użytkownik wysłał nowszą wiadomość - zostaw częściową odpowiedź, bez opłaty
+            print("Odpowiedź przerwana przez nowszą wiadomość użytkownika")
+            if full_response.strip():
+                renderer.feed(f"\n\n{get_text('reply_superseded', language)}")
+                await renderer.finish()
+            else:
+                await renderer.fail(get_text("reply_superseded", language))
+            enqueue_message(conversation_id, user_id, user_message, is_from_user=True)
+            return
         
-        # Odejmij kredyty
-        deduct_user_credits(user_id, credit_cost, get_text("message_model", language, model=model_to_use, default=f"Wiadomość ({model_to_use})"))
-        print(f"Odjęto {credit_cost} kredytów za wiadomość")
+        # Zatrzymano przyciskiem "Stop" - zachowaj i rozlicz wygenerowaną część
+        print(f"Generowanie zatrzymane przez użytkownika po {len(full_response)} znakach")
+        if not full_response.strip():
+            await renderer.fail(get_text("reply_stopped", language))
+            enqueue_message(conversation_id, user_id, user_message, is_from_user=True)
+            return
+        renderer.feed(f"\n\n{get_text('reply_stopped', language)}")
+        await renderer.finish()
+        stopped = True
     except Exception as e:
         print(f"Wystąpił błąd podczas generowania odpowiedzi: {e}")
-        await response_message.edit_text(get_text("response_error", language, error=str(e)))
+        await renderer.fail(get_text("response_error", language, error=str(e)))
+        # Zachowaj wiadomość użytkownika w historii, bez opłaty
+        enqueue_message(conversation_id, user_id, user_message, is_from_user=True)
         return
     
-    # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    # Po przełączeniu na model zapasowy pobieramy opłatę tego modelu, jeśli jest niższa
+    used_model = call_info.get("model", model_to_use)
+    if used_model != model_to_use:
+        print(f"Odpowiedź wygenerowana modelem zapasowym {used_model}")
+        credit_cost = min(credit_cost, CREDIT_COSTS["message"].get(used_model, CREDIT_COSTS["message"]["default"]))
+        model_to_use = used_model
+    
+    # Zużycie tokenów z API (dla przerwanej odpowiedzi - szacunek)
+    usage = call_info.get("usage") or {}
+    prompt_used = usage.get("prompt_tokens")
+    completion_used = usage.get("completion_tokens")
+    print(f"Zużycie tokenów: prompt {prompt_used}, odpowiedź {completion_used}")
+    
+    token_cost = credits_for_usage(model_to_use, prompt_used, completion_used) if usage else None
+    if token_cost is not None:
+        # Odpowiedź jest już wysłana - opłata nie przekracza salda sprawdzonego na początku tury
+        credit_cost = min(token_cost, turn['credits'])
+        print(f"Opłata według zużycia tokenów: {credit_cost} kredytów")
+    elif stopped:
+        credit_cost = partial_credit_cost(credit_cost, full_response, model_to_use)
+        print(f"Opłata za przerwaną odpowiedź: {credit_cost} kredytów")
+    
+    # Zapisz obie wiadomości, odejmij kredyty i zwiększ licznik wiadomości jednym zapytaniem
+    result = await commit_chat_turn(
+        user_id, conversation_id, user_message, full_response,
+        model_used=model_to_use,
+        credit_cost=credit_cost,
+        description=get_text("message_model", language, model=model_to_use, default=f"Wiadomość ({model_to_use})"),
+        prompt_tokens=prompt_used,
+        completion_tokens=completion_used
+    )
+    
+    if result is not None:
+        credits = result['credits']
+        if result['charged']:
+            print(f"Odjęto {credit_cost} kredytów za wiadomość")
+    else:
+        credits = await get_user_credits(user_id)
+    
     if credits < 5:
         # Dodaj przycisk doładowania kredytów
         keyboard = [[InlineKeyboardButton(get_text("buy_credits_btn_with_icon", language, default="🛒 Kup kredyty"), callback_data="menu_credits_buy")]]
@@ -653,10 +735,8 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=reply_markup,
             parse_mode=ParseMode.MARKDOWN
         )
-    
-    # Zwiększ licznik wykorzystanych wiadomości
-    increment_messages_used(user_id)
 
+@user_lane()
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obsługa przesłanych dokumentów"""
     user_id = update.effective_user.id
@@ -664,7 +744,7 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
     credit_cost = CREDIT_COSTS["document"]
-    if not check_user_credits(user_id, credit_cost):
+    if not await check_user_credits(user_id, credit_cost):
         await update.message.reply_text(get_text("subscription_expired", language))
         return
     
@@ -688,7 +768,6 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Pobierz plik
     if translate_mode and is_pdf:
-        from handlers.pdf_handler import handle_pdf_translation
         await handle_pdf_translation(update, context)
         return
     elif translate_mode:
@@ -699,31 +778,59 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Wyślij informację o aktywności bota
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
-    file = await context.bot.get_file(document.file_id)
-    file_bytes = await file.download_as_bytearray()
+    # Plik jest pobierany strumieniowo do pliku tymczasowego - pamięć nie zależy od jego rozmiaru
+    async with open_file(context.bot, document.file_id, document.file_unique_id) as document_file:
+        # Długi dokument jest analizowany częściami - opłata rośnie z liczbą części, więc saldo
+        # jest sprawdzane przed wywołaniem modelu. Odczytany tekst trafia do analyze_document.
+        try:
+            prepared = await run_blocking(
+                "threads", prepare_document, document_file, file_name, "translate" if translate_mode else "analyze"
+            )
+        except (ExecutorBusy, asyncio.TimeoutError):
+            await message.edit_text(get_text("server_busy", language))
+            return
+        parts = prepared["parts"]
+        credit_cost = document_credits(CREDIT_COSTS["document"], parts)
+        if parts > 1 and not await check_user_credits(user_id, credit_cost):
+            await message.edit_text(get_text("document_credits_needed", language, parts=parts, credits=credit_cost))
+            return
+        
+        # Analizuj plik - w trybie tłumaczenia lub analizy w zależności od opcji; postęp analizy
+        # długiego dokumentu częściami jest pokazywany w wiadomości o statusie
+        progress = message_progress(message, language, translate=translate_mode)
+        call_info = {}
+        if translate_mode:
+            analysis = await analyze_document(
+                document_file, file_name, mode="translate", file_id=document.file_unique_id,
+                user_id=user_id, on_progress=progress, call_info=call_info, prepared=prepared
+            )
+            header = f"*{get_text('translated_text', language)}:*\n\n"
+        else:
+            analysis = await analyze_document(
+                document_file, file_name, file_id=document.file_unique_id, user_id=user_id, on_progress=progress,
+                call_info=call_info, prepared=prepared
+            )
+            header = f"*{get_text('file_analysis', language)}:* {file_name}\n\n"
     
-    # Analizuj plik - w trybie tłumaczenia lub analizy w zależności od opcji
-    if translate_mode:
-        analysis = await analyze_document(file_bytes, file_name, mode="translate")
-        header = f"*{get_text('translated_text', language)}:*\n\n"
-    else:
-        analysis = await analyze_document(file_bytes, file_name)
-        header = f"*{get_text('file_analysis', language)}:* {file_name}\n\n"
+    # Wynik z pamięci podręcznej nie wymagał wywołań modelu - obowiązuje cena dokumentu bez części
+    if call_info.get("cached"):
+        credit_cost = CREDIT_COSTS["document"]
     
-    # Odejmij kredyty
+    # Odejmij kredyty - atomowo, odmowa oznacza, że saldo zostało w międzyczasie wydane
     description = "Tłumaczenie dokumentu" if translate_mode else "Analiza dokumentu"
-    deduct_user_credits(user_id, credit_cost, f"{description}: {file_name}")
+    category = "translation" if translate_mode else "document"
+    credits = await ledger_deduct(user_id, credit_cost, f"{description}: {file_name}", category, **charged_tokens(call_info))
+    if credits is None:
+        await message.edit_text(get_text("subscription_expired", language))
+        return
     
-    # Wyślij analizę do użytkownika
-    await message.edit_text(
-        f"{header}{analysis}",
-        parse_mode=ParseMode.MARKDOWN
-    )
+    # Wyślij analizę do użytkownika (wynik dłuższy niż wiadomość - również jako plik tekstowy)
+    await send_document_result(message, header, analysis, file_name)
     
     # Dodaj klawiaturę z dodatkowymi opcjami dla plików PDF
     if is_pdf and not translate_mode:
         keyboard = [[
-            InlineKeyboardButton(get_text("pdf_translate_button", language), callback_data=f"translate_pdf_{document.file_id}")
+            InlineKeyboardButton(get_text("pdf_translate_button", language), callback_data=f"translate_pdf_{remember_pdf(document)}")
         ]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -732,14 +839,14 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             print(f"Błąd dodawania klawiatury: {e}")
     
-    # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    credits = await balance_after(user_id, credits)
     if credits < 5:
         await update.message.reply_text(
             f"*{get_text('low_credits_warning', language)}* {get_text('low_credits_message', language, credits=credits)}",
             parse_mode=ParseMode.MARKDOWN
         )
 
+@user_lane()
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obsługa przesłanych zdjęć"""
     user_id = update.effective_user.id
@@ -747,7 +854,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
     credit_cost = CREDIT_COSTS["photo"]
-    if not check_user_credits(user_id, credit_cost):
+    if not await check_user_credits(user_id, credit_cost):
         await update.message.reply_text(get_text("subscription_expired", language))
         return
     
@@ -770,20 +877,24 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Wyślij informację o aktywności bota
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
-    file = await context.bot.get_file(photo.file_id)
-    file_bytes = await file.download_as_bytearray()
+    file_bytes = await fetch_file(context.bot, photo.file_id, photo.file_unique_id)
     
     # Analizuj zdjęcie w odpowiednim trybie
+    call_info = {}
     if translate_mode:
-        result = await analyze_image(file_bytes, f"photo_{photo.file_unique_id}.jpg", mode="translate")
+        result = await analyze_image(file_bytes, f"photo_{photo.file_unique_id}.jpg", mode="translate", file_id=photo.file_unique_id, call_info=call_info)
         header = "*Tłumaczenie tekstu ze zdjęcia:*\n\n"
     else:
-        result = await analyze_image(file_bytes, f"photo_{photo.file_unique_id}.jpg", mode="analyze")
+        result = await analyze_image(file_bytes, f"photo_{photo.file_unique_id}.jpg", mode="analyze", file_id=photo.file_unique_id, call_info=call_info)
         header = "*Analiza zdjęcia:*\n\n"
     
-    # Odejmij kredyty
+    # Odejmij kredyty - atomowo, odmowa oznacza, że saldo zostało w międzyczasie wydane
     description = "Tłumaczenie tekstu ze zdjęcia" if translate_mode else "Analiza zdjęcia"
-    deduct_user_credits(user_id, credit_cost, description)
+    category = "translation" if translate_mode else "photo"
+    credits = await ledger_deduct(user_id, credit_cost, description, category, **charged_tokens(call_info))
+    if credits is None:
+        await message.edit_text(get_text("subscription_expired", language))
+        return
     
     # Wyślij analizę/tłumaczenie do użytkownika
     await message.edit_text(
@@ -803,8 +914,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             print(f"Błąd dodawania klawiatury: {e}")
     
-    # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    credits = await balance_after(user_id, credits)
     if credits < 5:
         await update.message.reply_text(
             f"*Uwaga:* Pozostało Ci tylko *{credits}* kredytów. "
@@ -819,7 +929,7 @@ async def handle_photo_translate(update: Update, context: ContextTypes.DEFAULT_T
     
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
     credit_cost = CREDIT_COSTS["photo"]
-    if not check_user_credits(user_id, credit_cost):
+    if not await check_user_credits(user_id, credit_cost):
         await update.message.reply_text(get_text("subscription_expired", language))
         return
     
@@ -832,14 +942,17 @@ async def handle_photo_translate(update: Update, context: ContextTypes.DEFAULT_T
     # Wyślij informację o aktywności bota
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
-    file = await context.bot.get_file(photo.file_id)
-    file_bytes = await file.download_as_bytearray()
+    file_bytes = await fetch_file(context.bot, photo.file_id, photo.file_unique_id)
     
     # Analizuj zdjęcie w trybie tłumaczenia
-    translation = await analyze_image(file_bytes, f"photo_{photo.file_unique_id}.jpg", mode="translate")
+    call_info = {}
+    translation = await analyze_image(file_bytes, f"photo_{photo.file_unique_id}.jpg", mode="translate", file_id=photo.file_unique_id, call_info=call_info)
     
-    # Odejmij kredyty
-    deduct_user_credits(user_id, credit_cost, "Tłumaczenie tekstu ze zdjęcia")
+    # Odejmij kredyty - atomowo, odmowa oznacza, że saldo zostało w międzyczasie wydane
+    credits = await ledger_deduct(user_id, credit_cost, "Tłumaczenie tekstu ze zdjęcia", "translation", **charged_tokens(call_info))
+    if credits is None:
+        await message.edit_text(get_text("subscription_expired", language))
+        return
     
     # Wyślij tłumaczenie do użytkownika
     await message.edit_text(
@@ -847,8 +960,7 @@ async def handle_photo_translate(update: Update, context: ContextTypes.DEFAULT_T
         parse_mode=ParseMode.MARKDOWN
     )
     
-    # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    credits = await balance_after(user_id, credits)
     if credits < 5:
         await update.message.reply_text(
             f"*Uwaga:* Pozostało Ci tylko *{credits}* kredytów. "
@@ -871,6 +983,81 @@ async def show_translation_instructions(update: Update, context: ContextTypes.DE
         parse_mode=ParseMode.MARKDOWN
     )
 
+@user_lane()
+async def translate_photo_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Tłumaczenie tekstu ze zdjęcia z przycisku pod analizą zdjęcia
+    Wykonywane w ścieżce użytkownika - ponowne kliknięcie czeka na zakończenie poprzedniego
+    tłumaczenia, więc oba nie przejdą kontroli salda przed pobraniem kredytów
+    """
+    query = update.callback_query
+    user_id = query.from_user.id
+    language = get_user_language(context, user_id)
+    photo_file_id = query.data.replace("translate_photo_", "")
+    back_markup = InlineKeyboardMarkup([[InlineKeyboardButton(get_text("back", language), callback_data="menu_back_main")]])
+    
+    # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
+    credit_cost = CREDIT_COSTS["photo"]
+    if not await check_user_credits(user_id, credit_cost):
+        await update_menu(query, get_text("subscription_expired", language), back_markup)
+        return
+    
+    # Informuj o rozpoczęciu tłumaczenia
+    await update_menu(
+        query,
+        get_text("translating_image", language),
+        None
+    )
+    
+    # Pobierz zdjęcie
+    file_bytes = await fetch_file(context.bot, photo_file_id)
+    
+    # Tłumacz tekst ze zdjęcia
+    # Przycisk przekazuje tylko file_id - obraz identyfikuje skrót zawartości
+    call_info = {}
+    translation = await analyze_image(file_bytes, f"photo_{photo_file_id}.jpg", mode="translate", call_info=call_info)
+    
+    # Odejmij kredyty - atomowo, odmowa oznacza, że saldo zostało w międzyczasie wydane
+    credits = await ledger_deduct(
+        user_id, credit_cost, "Tłumaczenie tekstu ze zdjęcia", "translation", **charged_tokens(call_info)
+    )
+    if credits is None:
+        await update_menu(query, get_text("subscription_expired", language), back_markup)
+        return
+    
+    # Wyślij tłumaczenie
+    await update_menu(
+        query,
+        f"*{get_text('translation_result', language)}*\n\n{translation}",
+        back_markup,
+        parse_mode="Markdown"
+    )
+
+@user_lane()
+async def translate_pdf_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Tłumaczenie PDF z przycisku pod analizą PDF lub "Wznów" po przerwanym tłumaczeniu
+    Przetłumaczone strony są zapisane, więc tłumaczone (i opłacane) są tylko brakujące. Ścieżka
+    użytkownika sprawia, że podwójne kliknięcie tłumaczy brakujące strony tylko raz.
+    """
+    query = update.callback_query
+    user_id = query.from_user.id
+    language = get_user_language(context, user_id)
+    
+    pdf = remembered_pdf(query.data.replace("translate_pdf_", ""))
+    if pdf is None:
+        await query.message.reply_text(get_text("pdf_resend", language))
+        return
+    
+    # Usuń przycisk, aby tłumaczenie nie zostało uruchomione drugi raz
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except Exception as e:
+        print(f"Błąd usuwania klawiatury: {e}")
+    
+    file_id, file_unique_id, file_name = pdf
+    await translate_pdf(context, query.message, user_id, language, file_id, file_unique_id, file_name)
+
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obsługa zapytań zwrotnych (z przycisków)"""
     query = update.callback_query
@@ -880,6 +1067,15 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     # Dodaj logger
     print(f"Otrzymano callback: {query.data} od użytkownika {user_id}")
     
+    # Przycisk "Stop" - obsłużony od razu, bo odpowiedź jest właśnie generowana
+    if query.data.startswith("stop_gen_"):
+        try:
+            stopped = stop_generation(user_id, int(query.data[len("stop_gen_"):]))
+        except ValueError:
+            stopped = False
+        await query.answer(None if stopped else get_text("generation_already_finished", language))
+        return
+    
     # Najpierw odpowiedz, aby usunąć oczekiwanie
     await query.answer()
     
@@ -981,42 +1177,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     # 9. Tłumaczenie zdjęć
     elif query.data.startswith("translate_photo_"):
         try:
-            photo_file_id = query.data.replace("translate_photo_", "")
-            
-            # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
-            credit_cost = CREDIT_COSTS["photo"]
-            if not check_user_credits(user_id, credit_cost):
-                await update_menu(
-                    query,
-                    get_text("subscription_expired", language),
-                    InlineKeyboardMarkup([[InlineKeyboardButton(get_text("back", language), callback_data="menu_back_main")]])
-                )
-                return
-            
-            # Informuj o rozpoczęciu tłumaczenia
-            await update_menu(
-                query,
-                get_text("translating_image", language),
-                None
-            )
-            
-            # Pobierz zdjęcie
-            file = await context.bot.get_file(photo_file_id)
-            file_bytes = await file.download_as_bytearray()
-            
-            # Tłumacz tekst ze zdjęcia
-            translation = await analyze_image(file_bytes, f"photo_{photo_file_id}.jpg", mode="translate")
-            
-            # Odejmij kredyty
-            deduct_user_credits(user_id, credit_cost, "Tłumaczenie tekstu ze zdjęcia")
-            
-            # Wyślij tłumaczenie
-            await update_menu(
-                query,
-                f"*{get_text('translation_result', language)}*\n\n{translation}",
-                InlineKeyboardMarkup([[InlineKeyboardButton(get_text("back", language), callback_data="menu_back_main")]]),
-                parse_mode="Markdown"
-            )
+            await translate_photo_callback(update, context)
             return
         except Exception as e:
             print(f"Błąd przy tłumaczeniu zdjęcia: {e}")
@@ -1025,51 +1186,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
 
     elif query.data.startswith("translate_pdf_"):
         try:
-            document_file_id = query.data.replace("translate_pdf_", "")
-            
-            # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
-            credit_cost = 8  # Koszt tłumaczenia PDF
-            if not check_user_credits(user_id, credit_cost):
-                await update_menu(
-                    query,
-                    get_text("subscription_expired", language),
-                    InlineKeyboardMarkup([[InlineKeyboardButton(get_text("back", language), callback_data="menu_back_main")]])
-                )
-                return
-            
-            # Informuj o rozpoczęciu tłumaczenia
-            await update_menu(
-                query,
-                get_text("translating_pdf", language),
-                None
-            )
-            
-            # Pobierz plik
-            file = await context.bot.get_file(document_file_id)
-            file_bytes = await file.download_as_bytearray()
-            
-            # Tłumacz pierwszy akapit z PDF
-            from utils.pdf_translator import translate_pdf_first_paragraph
-            result = await translate_pdf_first_paragraph(file_bytes)
-            
-            # Odejmij kredyty
-            deduct_user_credits(user_id, credit_cost, "Tłumaczenie pierwszego akapitu z PDF")
-            
-            # Przygotuj odpowiedź
-            if result["success"]:
-                response = f"*{get_text('pdf_translation_result', language)}*\n\n"
-                response += f"*{get_text('original_text', language)}:*\n{result['original_text'][:500]}...\n\n"
-                response += f"*{get_text('translated_text', language)}:*\n{result['translated_text'][:500]}..."
-            else:
-                response = f"*{get_text('pdf_translation_error', language)}*\n\n{result['error']}"
-            
-            # Wyślij wynik tłumaczenia
-            await update_menu(
-                query,
-                response,
-                InlineKeyboardMarkup([[InlineKeyboardButton(get_text("back", language), callback_data="menu_back_main")]]),
-                parse_mode="Markdown"
-            )
+            await translate_pdf_callback(update, context)
             return
         except Exception as e:
             print(f"Błąd przy tłumaczeniu PDF: {e}")
@@ -1080,8 +1197,8 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     elif query.data == "quick_new_chat":
         try:
             # Utwórz nową konwersację
-            from database.supabase_client import create_new_conversation
-            conversation = create_new_conversation(user_id)
+            from database.async_supabase_client import create_new_conversation
+            conversation = await create_new_conversation(user_id)
             
             await query.answer(get_text("new_chat_created", language))
             
@@ -1102,8 +1219,8 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     elif query.data == "quick_last_chat":
         try:
             # Pobierz aktywną konwersację
-            from database.supabase_client import get_active_conversation
-            conversation = get_active_conversation(user_id)
+            from database.async_supabase_client import get_active_conversation
+            conversation = await get_active_conversation(user_id)
             
             if conversation:
                 await query.answer(get_text("returning_to_last_chat", language))
@@ -1114,8 +1231,8 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
                 await query.answer(get_text("no_active_chat", language))
                 
                 # Utwórz nową konwersację
-                from database.supabase_client import create_new_conversation
-                create_new_conversation(user_id)
+                from database.async_supabase_client import create_new_conversation
+                await create_new_conversation(user_id)
                 
                 # Zamknij menu
                 await query.message.delete()
@@ -1157,47 +1274,70 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     except Exception as e:
         print(f"Błąd przy wyświetlaniu komunikatu o nieobsłużonym callbacku: {e}")
 
-# Rejestracja handlerów komend
-application.add_handler(CommandHandler("start", start_command))
-application.add_handler(CommandHandler("help", help_command))
-application.add_handler(CommandHandler("status", check_status))
-application.add_handler(CommandHandler("newchat", new_chat))
-application.add_handler(CommandHandler("restart", restart_command))
-application.add_handler(CommandHandler("mode", show_modes))
-application.add_handler(CommandHandler("image", generate_image))
-application.add_handler(CommandHandler("export", export_conversation))
-application.add_handler(CommandHandler("language", language_command))
-application.add_handler(CommandHandler("onboarding", onboarding_command))
-application.add_handler(CommandHandler("translate", translate_command))
+def build_application():
+    """
+    Tworzy aplikację bota i rejestruje handlery
+
+    Wywoływane tylko przy uruchomieniu bota - procesy robocze pul (utils.executor) importują
+    ten moduł jako '__mp_main__' i nie mogą budować aplikacji ani podmieniać HTTPXRequest.
+    """
+    patch_httpx_request()
+
+    # Wszystkie wywołania Bot API wysyłające wiadomości przechodzą przez wspólny harmonogram
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .rate_limiter(outbound_scheduler)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+
+    # Rejestracja handlerów komend
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("status", check_status))
+    application.add_handler(CommandHandler("newchat", new_chat))
+    application.add_handler(CommandHandler("restart", restart_command))
+    application.add_handler(CommandHandler("mode", show_modes))
+    application.add_handler(CommandHandler("image", generate_image))
+    application.add_handler(CommandHandler("export", export_conversation))
+    application.add_handler(CommandHandler("language", language_command))
+    application.add_handler(CommandHandler("onboarding", onboarding_command))
+    application.add_handler(CommandHandler("translate", translate_command))
 
-# Handlery kredytów i płatności
-application.add_handler(CommandHandler("credits", credits_command))
-application.add_handler(CommandHandler("buy", buy_command))
-application.add_handler(CommandHandler("creditstats", credit_stats_command))
-application.add_handler(CommandHandler("payment", payment_command))
-application.add_handler(CommandHandler("subscription", subscription_command))
-application.add_handler(CommandHandler("code", code_command))
+    # Handlery kredytów i płatności
+    application.add_handler(CommandHandler("credits", credits_command))
+    application.add_handler(CommandHandler("buy", buy_command))
+    application.add_handler(CommandHandler("creditstats", credit_stats_command))
+    application.add_handler(CommandHandler("payment", payment_command))
+    application.add_handler(CommandHandler("subscription", subscription_command))
+    application.add_handler(CommandHandler("code", code_command))
 
-# Handlery dla administratorów
-application.add_handler(CommandHandler("addpackage", add_package))
-application.add_handler(CommandHandler("listpackages", list_packages))
-application.add_handler(CommandHandler("togglepackage", toggle_package))
-application.add_handler(CommandHandler("adddefaultpackages", add_default_packages))
-application.add_handler(CommandHandler("gencode", admin_generate_code))
+    # Handlery dla administratorów
+    application.add_handler(CommandHandler("addpackage", add_package))
+    application.add_handler(CommandHandler("listpackages", list_packages))
+    application.add_handler(CommandHandler("togglepackage", toggle_package))
+    application.add_handler(CommandHandler("adddefaultpackages", add_default_packages))
+    application.add_handler(CommandHandler("gencode", admin_generate_code))
+    application.add_handler(CommandHandler("stats", bot_stats))
 
-# Handler wiadomości tekstowych
-application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+    # Handler wiadomości tekstowych
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
 
-# Handler dokumentów
-application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
+    # Handler dokumentów
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
 
-# Handler zdjęć
-application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    # Handler zdjęć
+    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
 
-# Handler dla callbacków (przycisków)
-application.add_handler(CallbackQueryHandler(handle_callback_query))
+    # Handler dla callbacków (przycisków)
+    application.add_handler(CallbackQueryHandler(handle_callback_query))
+    return application
 
 # Uruchomienie bota
 if __name__ == "__main__":
+    application = build_application()
     print("Bot uruchomiony. Naciśnij Ctrl+C, aby zatrzymać.")
     application.run_polling()
\ No newline at end of file
@@ -48,40 +48,8 @@ serve(async (req) => {
           const packageId = parseInt(session.metadata.package_id)
           const credits = parseInt(session.metadata.credits)
           
-          // Pobierz aktualną liczbę kredytów
-          const creditResponse = await fetch(`${supabaseUrl}/rest/v1/user_credits?user_id=eq.${userId}`, {
-            headers: {
-              'Content-Type': 'application/json',
-              'apikey': supabaseKey,
-              'Authorization': `Bearer ${supabaseKey}`
-            }
-          })
-          
-          const userCredits = await creditResponse.json()
-          const currentCredits = userCredits.length > 0 ? userCredits[0].credits_amount : 0
-          
-          // Aktualizuj kredyty użytkownika
-          await fetch(`${supabaseUrl}/rest/v1/user_credits?user_id=eq.${userId}`, {
-            method: userCredits.length > 0 ? 'PATCH' : 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-              'apikey': supabaseKey,
-              'Authorization': `Bearer ${supabaseKey}`
-            },
-            body: JSON.stringify({
-              user_id: userId,
-              credits_amount: currentCredits + credits,
-              total_credits_purchased: userCredits.length > 0 ? 
-                userCredits[0].total_credits_purchased + credits : credits,
-              last_purchase_date: new Date().toISOString(),
-              total_spent: userCredits.length > 0 ? 
-                parseFloat(userCredits[0].total_spent) + parseFloat(session.amount_total / 100) : 
-                parseFloat(session.amount_total / 100)
-            })
-          })
-          
-          // Dodaj transakcję kredytową
-          await fetch(`${supabaseUrl}/rest/v1/credit_transactions`, {
+          // Dodaj kredyty i zapisz transakcję w jednej operacji bazy (funkcja add_credits)
+          await fetch(`${supabaseUrl}/rest/v1/rpc/add_credits`, {
             method: 'POST',
             headers: {
               'Content-Type': 'application/json',
@@ -89,12 +57,11 @@ serve(async (req) => {
               'Authorization': `Bearer ${supabaseKey}`
             },
             body: JSON.stringify({
-              user_id: userId,
-              transaction_type: 'subscription',
-              amount: credits,
-              credits_before: currentCredits,
-              credits_after: currentCredits + credits,
-              description: `Miesięczna subskrypcja kredytów przez Stripe`
+              p_user_id: userId,
+              p_amount: credits,
+              p_description: `Miesięczna subskrypcja kredytów przez Stripe`,
+              p_transaction_type: 'subscription',
+              p_price: parseFloat(session.amount_total / 100)
             })
           })
           
@@ -181,36 +148,8 @@ serve(async (req) => {
           const packageData = packages[0]
           const credits = packageData.credits
           
-          // Pobierz aktualną liczbę kredytów
-          const creditResponse = await fetch(`${supabaseUrl}/rest/v1/user_credits?user_id=eq.${userId}`, {
-            headers: {
-              'Content-Type': 'application/json',
-              'apikey': supabaseKey,
-              'Authorization': `Bearer ${supabaseKey}`
-            }
-          })
-          
-          const userCredits = await creditResponse.json()
-          const currentCredits = userCredits.length > 0 ? userCredits[0].credits_amount : 0
-          
-          // Aktualizuj kredyty użytkownika
-          await fetch(`${supabaseUrl}/rest/v1/user_credits?user_id=eq.${userId}`, {
-            method: 'PATCH',
-            headers: {
-              'Content-Type': 'application/json',
-              'apikey': supabaseKey,
-              'Authorization': `Bearer ${supabaseKey}`
-            },
-            body: JSON.stringify({
-              credits_amount: currentCredits + credits,
-              total_credits_purchased: userCredits[0].total_credits_purchased + credits,
-              last_purchase_date: new Date().toISOString(),
-              total_spent: parseFloat(userCredits[0].total_spent) + parseFloat(invoice.amount_paid / 100)
-            })
-          })
-          
-          // Dodaj transakcję kredytową
-          await fetch(`${supabaseUrl}/rest/v1/credit_transactions`, {
+          // Dodaj kredyty i zapisz transakcję w jednej operacji bazy (funkcja add_credits)
+          await fetch(`${supabaseUrl}/rest/v1/rpc/add_credits`, {
             method: 'POST',
             headers: {
               'Content-Type': 'application/json',
@@ -218,12 +157,11 @@ serve(async (req) => {
               'Authorization': `Bearer ${supabaseKey}`
             },
             body: JSON.stringify({
-              user_id: userId,
-              transaction_type: 'subscription_renewal',
-              amount: credits,
-              credits_before: currentCredits,
-              credits_after: currentCredits + credits,
-              description: `Odnowienie miesięcznej subskrypcji kredytów`
+              p_user_id: userId,
+              p_amount: credits,
+              p_description: `Odnowienie miesięcznej subskrypcji kredytów`,
+              p_transaction_type: 'subscription_renewal',
+              p_price: parseFloat(invoice.amount_paid / 100)
             })
           })
           
@@ -45,40 +45,8 @@ serve(async (req) => {
       const packageId = parseInt(session.metadata.package_id)
       const credits = parseInt(session.metadata.credits)
       
-      // Pobierz aktualną liczbę kredytów
-      const creditResponse = await fetch(`${supabaseUrl}/rest/v1/user_credits?user_id=eq.${userId}`, {
-        headers: {
-          'Content-Type': 'application/json',
-          'apikey': supabaseKey,
-          'Authorization': `Bearer ${supabaseKey}`
-        }
-      })
-      
-      const userCredits = await creditResponse.json()
-      const currentCredits = userCredits.length > 0 ? userCredits[0].credits_amount : 0
-      
-      // Aktualizuj kredyty użytkownika
-      await fetch(`${supabaseUrl}/rest/v1/user_credits?user_id=eq.${userId}`, {
-        method: userCredits.length > 0 ? 'PATCH' : 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'apikey': supabaseKey,
-          'Authorization': `Bearer ${supabaseKey}`
-        },
-        body: JSON.stringify({
-          user_id: userId,
-          credits_amount: currentCredits + credits,
-          total_credits_purchased: userCredits.length > 0 ? 
-            userCredits[0].total_credits_purchased + credits : credits,
-          last_purchase_date: new Date().toISOString(),
-          total_spent: userCredits.length > 0 ? 
-            parseFloat(userCredits[0].total_spent) + parseFloat(session.amount_total / 100) : 
-            parseFloat(session.amount_total / 100)
-        })
-      })
-      
-      // Dodaj transakcję kredytową
-      await fetch(`${supabaseUrl}/rest/v1/credit_transactions`, {
+      // Dodaj kredyty i zapisz transakcję w jednej operacji bazy (funkcja add_credits)
+      await fetch(`${supabaseUrl}/rest/v1/rpc/add_credits`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -86,12 +54,11 @@ serve(async (req) => {
           'Authorization': `Bearer ${supabaseKey}`
         },
         body: JSON.stringify({
-          user_id: userId,
-          transaction_type: 'purchase',
-          amount: credits,
-          credits_before: currentCredits,
-          credits_after: currentCredits + credits,
-          description: `Zakup pakietu kredytów przez Stripe`
+          p_user_id: userId,
+          p_amount: credits,
+          p_description: `Zakup pakietu kredytów przez Stripe`,
+          p_transaction_type: 'purchase',
+          p_price: parseFloat(session.amount_total / 100)
         })
       })
     }
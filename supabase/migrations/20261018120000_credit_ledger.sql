@@ -0,0 +1,75 @@
+-- Atomowe operacje na kredytach użytkowników
+-- Każda funkcja w jednej transakcji zmienia saldo w user_credits i dopisuje wpis
+-- do credit_transactions, zwracając nowe saldo. Zastępuje sekwencję
+-- SELECT + UPDATE + INSERT wykonywaną wcześniej po stronie klienta.
+
+create unique index if not exists user_credits_user_id_key on public.user_credits (user_id);
+
+-- Odejmuje kredyty tylko wtedy, gdy saldo jest wystarczające.
+-- Zwraca nowe saldo lub NULL, jeśli kredytów jest za mało (brak zmian w bazie).
+create or replace function public.deduct_credits(
+    p_user_id bigint,
+    p_amount integer,
+    p_description text default null
+)
+returns integer
+language plpgsql
+as $$
+declare
+    v_after integer;
+begin
+    update public.user_credits
+       set credits_amount = credits_amount - p_amount
+     where user_id = p_user_id
+       and credits_amount >= p_amount
+    returning credits_amount into v_after;
+
+    if not found then
+        return null;
+    end if;
+
+    insert into public.credit_transactions
+        (user_id, transaction_type, amount, credits_before, credits_after, description, created_at)
+    values
+        (p_user_id, 'deduct', p_amount, v_after + p_amount, v_after, p_description, now());
+
+    return v_after;
+end;
+$$;
+
+-- Dodaje kredyty (zakup, subskrypcja, kod aktywacyjny, bonus).
+-- Tworzy rekord user_credits, jeśli jeszcze nie istnieje. Zwraca nowe saldo.
+create or replace function public.add_credits(
+    p_user_id bigint,
+    p_amount integer,
+    p_description text default null,
+    p_transaction_type text default 'add',
+    p_price numeric default 0
+)
+returns integer
+language plpgsql
+as $$
+declare
+    v_after integer;
+begin
+    insert into public.user_credits
+        (user_id, credits_amount, total_credits_purchased, total_spent, last_purchase_date)
+    values
+        (p_user_id, p_amount, p_amount, coalesce(p_price, 0), now())
+    on conflict (user_id) do update
+       set credits_amount = public.user_credits.credits_amount + excluded.credits_amount,
+           total_credits_purchased = coalesce(public.user_credits.total_credits_purchased, 0) + excluded.total_credits_purchased,
+           total_spent = coalesce(public.user_credits.total_spent, 0) + excluded.total_spent,
+           last_purchase_date = excluded.last_purchase_date
+    returning credits_amount into v_after;
+
+    if p_amount <> 0 then
+        insert into public.credit_transactions
+            (user_id, transaction_type, amount, credits_before, credits_after, description, created_at)
+        values
+            (p_user_id, p_transaction_type, p_amount, v_after - p_amount, v_after, p_description, now());
+    end if;
+
+    return v_after;
+end;
+$$;
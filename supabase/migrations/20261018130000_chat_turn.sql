@@ -0,0 +1,120 @@
+-- Operacje obsługi jednej tury czatu
+-- begin_chat_turn zwraca w jednym zapytaniu wszystko, czego handler potrzebuje przed
+-- wywołaniem modelu; commit_chat_turn zapisuje w jednej transakcji wynik tury.
+-- Zastępuje ok. 12 osobnych zapytań wykonywanych wcześniej na każdą wiadomość.
+
+-- Zwraca saldo, język, limit wiadomości, aktywną konwersację (tworzy ją, jeśli nie istnieje)
+-- oraz ostatnie p_history_limit wiadomości tej konwersacji w kolejności chronologicznej.
+create or replace function public.begin_chat_turn(
+    p_user_id bigint,
+    p_history_limit integer default 20
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_user record;
+    v_credits integer;
+    v_conversation_id bigint;
+    v_history jsonb;
+begin
+    select language, language_code, messages_limit, messages_used
+      into v_user
+      from public.users
+     where id = p_user_id;
+
+    select credits_amount
+      into v_credits
+      from public.user_credits
+     where user_id = p_user_id;
+
+    select id
+      into v_conversation_id
+      from public.conversations
+     where user_id = p_user_id
+     order by last_message_at desc nulls last
+     limit 1;
+
+    if v_conversation_id is null then
+        insert into public.conversations (user_id, created_at, last_message_at)
+        values (p_user_id, now(), now())
+        returning id into v_conversation_id;
+    end if;
+
+    select coalesce(jsonb_agg(to_jsonb(m) order by m.created_at, m.id), '[]'::jsonb)
+      into v_history
+      from (
+          select id, conversation_id, user_id, content, is_from_user, model_used, created_at
+            from public.messages
+           where conversation_id = v_conversation_id
+           order by created_at desc, id desc
+           limit p_history_limit
+      ) m;
+
+    return jsonb_build_object(
+        'credits', coalesce(v_credits, 0),
+        'language', coalesce(v_user.language, v_user.language_code, 'pl'),
+        'messages_limit', coalesce(v_user.messages_limit, 0),
+        'messages_used', coalesce(v_user.messages_used, 0),
+        'conversation_id', v_conversation_id,
+        'history', v_history
+    );
+end;
+$$;
+
+-- Zapisuje wiadomość użytkownika i odpowiedź asystenta, pobiera opłatę (deduct_credits),
+-- zwiększa licznik wiadomości i aktualizuje last_message_at konwersacji.
+-- Gdy p_assistant_message jest NULL (np. błąd generowania), zapisywana jest tylko
+-- wiadomość użytkownika - bez opłaty i bez zwiększania licznika.
+create or replace function public.commit_chat_turn(
+    p_user_id bigint,
+    p_conversation_id bigint,
+    p_user_message text,
+    p_assistant_message text default null,
+    p_model text default null,
+    p_credit_cost integer default 0,
+    p_description text default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_now timestamptz := now();
+    v_credits integer;
+    v_charged boolean := false;
+    v_messages_used integer;
+begin
+    insert into public.messages (conversation_id, user_id, content, is_from_user, model_used, created_at)
+    values (p_conversation_id, p_user_id, p_user_message, true, null, v_now);
+
+    if p_assistant_message is not null then
+        -- Odpowiedź dostaje późniejszy znacznik czasu, aby zachować kolejność w historii
+        insert into public.messages (conversation_id, user_id, content, is_from_user, model_used, created_at)
+        values (p_conversation_id, p_user_id, p_assistant_message, false, p_model, v_now + interval '1 millisecond');
+
+        if p_credit_cost > 0 then
+            v_credits := public.deduct_credits(p_user_id, p_credit_cost, p_description);
+            v_charged := v_credits is not null;
+        end if;
+
+        update public.users
+           set messages_used = coalesce(messages_used, 0) + 1
+         where id = p_user_id
+        returning messages_used into v_messages_used;
+    end if;
+
+    if v_credits is null then
+        select credits_amount into v_credits from public.user_credits where user_id = p_user_id;
+    end if;
+
+    update public.conversations
+       set last_message_at = v_now
+     where id = p_conversation_id;
+
+    return jsonb_build_object(
+        'credits', coalesce(v_credits, 0),
+        'charged', v_charged,
+        'messages_used', v_messages_used
+    );
+end;
+$$;
@@ -0,0 +1,12 @@
+-- Indeksy dla stronicowania kursorem (keyset) po parze (created_at, id)
+-- Strona historii lub transakcji to zakres indeksu zaczynający się od kursora,
+-- więc czas jej pobrania nie zależy od liczby wcześniejszych wierszy użytkownika.
+
+create index if not exists messages_conversation_created_id_idx
+    on public.messages (conversation_id, created_at desc, id desc);
+
+create index if not exists credit_transactions_user_created_id_idx
+    on public.credit_transactions (user_id, created_at desc, id desc);
+
+create index if not exists payment_transactions_user_created_id_idx
+    on public.payment_transactions (user_id, created_at desc, id desc);
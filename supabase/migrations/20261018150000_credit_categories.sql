@@ -0,0 +1,141 @@
+-- Kategoria operacji zapisywana przy pobieraniu kredytów
+-- Rozkład zużycia kredytów liczony jest zapytaniem GROUP BY po tej kolumnie,
+-- zamiast pobierania wszystkich transakcji i dopasowywania opisów po stronie bota.
+
+alter table public.credit_transactions
+    add column if not exists category text;
+
+alter table public.credit_transactions
+    drop constraint if exists credit_transactions_category_check;
+
+alter table public.credit_transactions
+    add constraint credit_transactions_category_check
+    check (category is null or category in (
+        'message', 'image', 'document', 'photo', 'translation', 'pdf_translation', 'other'
+    ));
+
+-- Jednorazowe uzupełnienie kategorii dla istniejących transakcji na podstawie opisów
+update public.credit_transactions
+   set category = case
+       when description ilike '%PDF%' and description ilike '%tłumacz%' then 'pdf_translation'
+       when description ilike '%tłumacz%' or description ilike 'translation%' then 'translation'
+       when description ilike '%wiadomoś%' then 'message'
+       when description ilike '%obraz%' or description ilike '%DALL-E%' or description ilike '%image%' then 'image'
+       when description ilike '%dokument%' then 'document'
+       when description ilike '%zdjęc%' or description ilike '%zdjęci%' then 'photo'
+       else 'other'
+   end
+ where transaction_type = 'deduct'
+   and category is null;
+
+create index if not exists credit_transactions_user_type_created_idx
+    on public.credit_transactions (user_id, transaction_type, created_at);
+
+-- deduct_credits przyjmuje kategorię operacji; stara wersja jest usuwana,
+-- aby wywołania z trzema argumentami nie były niejednoznaczne
+drop function if exists public.deduct_credits(bigint, integer, text);
+
+create or replace function public.deduct_credits(
+    p_user_id bigint,
+    p_amount integer,
+    p_description text default null,
+    p_category text default 'other'
+)
+returns integer
+language plpgsql
+as $$
+declare
+    v_after integer;
+begin
+    update public.user_credits
+       set credits_amount = credits_amount - p_amount
+     where user_id = p_user_id
+       and credits_amount >= p_amount
+    returning credits_amount into v_after;
+
+    if not found then
+        return null;
+    end if;
+
+    insert into public.credit_transactions
+        (user_id, transaction_type, amount, credits_before, credits_after, description, category, created_at)
+    values
+        (p_user_id, 'deduct', p_amount, v_after + p_amount, v_after, p_description, coalesce(p_category, 'other'), now());
+
+    return v_after;
+end;
+$$;
+
+-- commit_chat_turn bez zmian poza kategorią 'message' dla opłaty za wiadomość
+create or replace function public.commit_chat_turn(
+    p_user_id bigint,
+    p_conversation_id bigint,
+    p_user_message text,
+    p_assistant_message text default null,
+    p_model text default null,
+    p_credit_cost integer default 0,
+    p_description text default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_now timestamptz := now();
+    v_credits integer;
+    v_charged boolean := false;
+    v_messages_used integer;
+begin
+    insert into public.messages (conversation_id, user_id, content, is_from_user, model_used, created_at)
+    values (p_conversation_id, p_user_id, p_user_message, true, null, v_now);
+
+    if p_assistant_message is not null then
+        -- Odpowiedź dostaje późniejszy znacznik czasu, aby zachować kolejność w historii
+        insert into public.messages (conversation_id, user_id, content, is_from_user, model_used, created_at)
+        values (p_conversation_id, p_user_id, p_assistant_message, false, p_model, v_now + interval '1 millisecond');
+
+        if p_credit_cost > 0 then
+            v_credits := public.deduct_credits(p_user_id, p_credit_cost, p_description, 'message');
+            v_charged := v_credits is not null;
+        end if;
+
+        update public.users
+           set messages_used = coalesce(messages_used, 0) + 1
+         where id = p_user_id
+        returning messages_used into v_messages_used;
+    end if;
+
+    if v_credits is null then
+        select credits_amount into v_credits from public.user_credits where user_id = p_user_id;
+    end if;
+
+    update public.conversations
+       set last_message_at = v_now
+     where id = p_conversation_id;
+
+    return jsonb_build_object(
+        'credits', coalesce(v_credits, 0),
+        'charged', v_charged,
+        'messages_used', v_messages_used
+    );
+end;
+$$;
+
+-- Suma wykorzystanych kredytów według kategorii z ostatnich p_days dni
+-- (zwraca co najwyżej tyle wierszy, ile jest kategorii)
+create or replace function public.credit_usage_by_category(
+    p_user_id bigint,
+    p_days integer default 30
+)
+returns table (category text, amount bigint)
+language sql
+stable
+as $$
+    select coalesce(t.category, 'other') as category,
+           sum(t.amount)::bigint as amount
+      from public.credit_transactions t
+     where t.user_id = p_user_id
+       and t.transaction_type = 'deduct'
+       and t.created_at >= now() - make_interval(days => p_days)
+     group by 1
+     order by 2 desc;
+$$;
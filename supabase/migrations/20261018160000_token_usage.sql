@@ -0,0 +1,113 @@
+-- Zużycie tokenów OpenAI zapisywane przy odpowiedzi modelu i przy opłacie za nią
+-- Liczby tokenów promptu i odpowiedzi pozwalają ocenić faktyczny koszt wiadomości,
+-- dobrać długość kontekstu (MAX_CONTEXT_MESSAGES) i rozliczać wiadomości według tokenów.
+
+alter table public.messages
+    add column if not exists prompt_tokens integer,
+    add column if not exists completion_tokens integer;
+
+alter table public.credit_transactions
+    add column if not exists prompt_tokens integer,
+    add column if not exists completion_tokens integer;
+
+-- deduct_credits przyjmuje zużycie tokenów; stara wersja jest usuwana,
+-- aby wywołania z czterema argumentami nie były niejednoznaczne
+drop function if exists public.deduct_credits(bigint, integer, text, text);
+
+create or replace function public.deduct_credits(
+    p_user_id bigint,
+    p_amount integer,
+    p_description text default null,
+    p_category text default 'other',
+    p_prompt_tokens integer default null,
+    p_completion_tokens integer default null
+)
+returns integer
+language plpgsql
+as $$
+declare
+    v_after integer;
+begin
+    update public.user_credits
+       set credits_amount = credits_amount - p_amount
+     where user_id = p_user_id
+       and credits_amount >= p_amount
+    returning credits_amount into v_after;
+
+    if not found then
+        return null;
+    end if;
+
+    insert into public.credit_transactions
+        (user_id, transaction_type, amount, credits_before, credits_after, description, category,
+         prompt_tokens, completion_tokens, created_at)
+    values
+        (p_user_id, 'deduct', p_amount, v_after + p_amount, v_after, p_description, coalesce(p_category, 'other'),
+         p_prompt_tokens, p_completion_tokens, now());
+
+    return v_after;
+end;
+$$;
+
+-- commit_chat_turn zapisuje zużycie tokenów przy odpowiedzi modelu i przy opłacie
+drop function if exists public.commit_chat_turn(bigint, bigint, text, text, text, integer, text);
+
+create or replace function public.commit_chat_turn(
+    p_user_id bigint,
+    p_conversation_id bigint,
+    p_user_message text,
+    p_assistant_message text default null,
+    p_model text default null,
+    p_credit_cost integer default 0,
+    p_description text default null,
+    p_prompt_tokens integer default null,
+    p_completion_tokens integer default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_now timestamptz := now();
+    v_credits integer;
+    v_charged boolean := false;
+    v_messages_used integer;
+begin
+    insert into public.messages (conversation_id, user_id, content, is_from_user, model_used, created_at)
+    values (p_conversation_id, p_user_id, p_user_message, true, null, v_now);
+
+    if p_assistant_message is not null then
+        -- Odpowiedź dostaje późniejszy znacznik czasu, aby zachować kolejność w historii
+        insert into public.messages
+            (conversation_id, user_id, content, is_from_user, model_used, prompt_tokens, completion_tokens, created_at)
+        values
+            (p_conversation_id, p_user_id, p_assistant_message, false, p_model, p_prompt_tokens, p_completion_tokens,
+             v_now + interval '1 millisecond');
+
+        if p_credit_cost > 0 then
+            v_credits := public.deduct_credits(
+                p_user_id, p_credit_cost, p_description, 'message', p_prompt_tokens, p_completion_tokens
+            );
+            v_charged := v_credits is not null;
+        end if;
+
+        update public.users
+           set messages_used = coalesce(messages_used, 0) + 1
+         where id = p_user_id
+        returning messages_used into v_messages_used;
+    end if;
+
+    if v_credits is null then
+        select credits_amount into v_credits from public.user_credits where user_id = p_user_id;
+    end if;
+
+    update public.conversations
+       set last_message_at = v_now
+     where id = p_conversation_id;
+
+    return jsonb_build_object(
+        'credits', coalesce(v_credits, 0),
+        'charged', v_charged,
+        'messages_used', v_messages_used
+    );
+end;
+$$;
@@ -0,0 +1,116 @@
+"""
+Testy asynchronicznej warstwy dostępu do danych na lokalnym zamienniku PostgREST
+"""
+import asyncio
+import pytest
+from database import async_supabase_client as db
+from database.postgrest_stub import PostgRESTStub, rpc_begin_chat_turn
+from database.profile_cache import clear_profile_cache
+from database.history_buffer import clear_history_buffer
+
+pytestmark = pytest.mark.skipif(db.STORAGE_BACKEND != 'supabase', reason="testy backendu PostgREST")
+
+@pytest.fixture
+def stub():
+    stub = PostgRESTStub()
+    db.set_transport(stub)
+    clear_profile_cache()
+    clear_history_buffer()
+    yield stub
+    db.set_transport(None)
+    clear_profile_cache()
+    clear_history_buffer()
+
+def run(coroutine):
+    """Wykonuje korutynę i zamyka klienta HTTP w tej samej pętli zdarzeń"""
+    async def wrapper():
+        try:
+            return await coroutine
+        finally:
+            await db.close_client()
+    return asyncio.run(wrapper())
+
+def test_get_or_create_user_creates_user_and_credits(stub):
+    user = run(db.get_or_create_user(1, username="jan", language_code="en"))
+
+    assert user['id'] == 1
+    assert user['language'] == "en"
+    assert stub.table('user_credits') == [
+        {'id': 1, 'user_id': 1, 'credits_amount': 0, 'total_credits_purchased': 0, 'total_spent': 0}
+    ]
+
+    # Drugie wywołanie zwraca istniejącego użytkownika
+    again = run(db.get_or_create_user(1, username="inny"))
+    assert again['username'] == "jan"
+    assert len(stub.table('users')) == 1
+
+def test_save_message_updates_conversation(stub):
+    conversation = run(db.create_new_conversation(1))
+    saved = run(db.save_message(conversation['id'], 1, "Cześć", True))
+
+    assert saved['content'] == "Cześć"
+    assert stub.table('messages')[0]['conversation_id'] == conversation['id']
+    assert stub.table('conversations')[0]['last_message_at'] == saved['created_at']
+    assert [m['content'] for m in run(db.get_conversation_history(conversation['id']))] == ["Cześć"]
+
+def test_ledger_deduct_refuses_when_balance_too_low(stub):
+    stub.insert_row('user_credits', {'user_id': 1, 'credits_amount': 3})
+
+    assert run(db.ledger_deduct(1, 5, "Za drogo", 'document')) is None
+    assert stub.table('user_credits')[0]['credits_amount'] == 3
+    assert stub.table('credit_transactions') == []
+
+    assert run(db.ledger_deduct(1, 2, "Dokument", 'document', prompt_tokens=120, completion_tokens=45)) == 1
+    transaction = stub.table('credit_transactions')[0]
+    assert (transaction['amount'], transaction['credits_before'], transaction['credits_after']) == (2, 3, 1)
+    assert transaction['category'] == 'document'
+    assert (transaction['prompt_tokens'], transaction['completion_tokens']) == (120, 45)
+
+def test_chat_turn_round_trip(stub):
+    stub.insert_row('users', {'id': 1, 'language': 'ru', 'messages_limit': 10, 'messages_used': 0})
+    stub.insert_row('user_credits', {'user_id': 1, 'credits_amount': 10})
+
+    turn = run(db.begin_chat_turn(1))
+    assert (turn['credits'], turn['language'], turn['history']) == (10, 'ru', [])
+
+    result = run(db.commit_chat_turn(
+        1, turn['conversation_id'], "Pytanie", "Odpowiedź", "gpt-4o", credit_cost=4,
+        prompt_tokens=12, completion_tokens=34
+    ))
+    assert result == {'credits': 6, 'charged': True, 'messages_used': 1}
+
+    messages = stub.table('messages')
+    assert [(m['content'], m['is_from_user']) for m in messages] == [("Pytanie", True), ("Odpowiedź", False)]
+    assert (messages[1]['prompt_tokens'], messages[1]['completion_tokens']) == (12, 34)
+    assert stub.table('credit_transactions')[0]['category'] == 'message'
+
+    # Kolejna tura widzi zapisaną historię
+    clear_history_buffer()
+    turn = run(db.begin_chat_turn(1))
+    assert [m['content'] for m in turn['history']] == ["Pytanie", "Odpowiedź"]
+
+def test_next_chat_turn_reads_history_from_buffer(stub):
+    stub.insert_row('user_credits', {'user_id': 1, 'credits_amount': 10})
+    history_limits = []
+
+    def begin_chat_turn(stub, **params):
+        history_limits.append(params['p_history_limit'])
+        return rpc_begin_chat_turn(stub, **params)
+
+    stub.register_rpc('begin_chat_turn', begin_chat_turn)
+
+    turn = run(db.begin_chat_turn(1))
+    run(db.commit_chat_turn(1, turn['conversation_id'], "Pytanie", "Odpowiedź", credit_cost=1))
+    turn = run(db.begin_chat_turn(1))
+
+    # Druga tura nie pobiera historii z bazy - aktywna konwersacja i jej historia są w pamięci
+    assert history_limits == [20, 0]
+    assert [m['content'] for m in turn['history']] == ["Pytanie", "Odpowiedź"]
+
+def test_commit_chat_turn_without_credits_does_not_charge(stub):
+    stub.insert_row('user_credits', {'user_id': 1, 'credits_amount': 1})
+    turn = run(db.begin_chat_turn(1))
+
+    result = run(db.commit_chat_turn(1, turn['conversation_id'], "Pytanie", "Odpowiedź", credit_cost=4))
+    assert result['charged'] is False
+    assert result['credits'] == 1
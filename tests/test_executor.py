@@ -0,0 +1,32 @@
+"""
+Testy nazwanych pul wykonawczych na puli wątków
+"""
+import asyncio
+import threading
+import pytest
+from utils.executor import ExecutorPool, ExecutorBusy
+
+def test_stats_without_completed_tasks():
+    stats = ExecutorPool("test", "thread", 1, 0, 1).stats()
+    assert "wait_seconds" not in stats and "run_seconds" not in stats
+    assert (stats["avg_wait_ms"], stats["avg_run_ms"], stats["max_run_ms"]) == (0.0, 0.0, 0.0)
+
+def test_rejects_over_capacity_and_times_out():
+    pool = ExecutorPool("test", "thread", 1, 0, 1)
+    release = threading.Event()
+
+    async def scenario():
+        blocked = asyncio.ensure_future(pool.run(release.wait, (), {}, 0.05))
+        await asyncio.sleep(0.01)
+        with pytest.raises(ExecutorBusy):
+            await pool.run(sum, ([1, 2],), {})
+        with pytest.raises(asyncio.TimeoutError):
+            await blocked
+        # Wątku nie da się przerwać - zadanie zajmuje miejsce w puli, dopóki się nie zakończy
+        stats = pool.stats()
+        release.set()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert (stats["rejected"], stats["timeouts"], stats["in_flight"]) == (1, 1, 1)
+    pool.shutdown()
@@ -0,0 +1,61 @@
+"""
+Testy pamięci podręcznej plików z Telegrama na zamienniku bota z lokalnym serwerem Bot API
+"""
+import asyncio
+from utils.media_cache import MediaCache
+
+class FakeFile:
+    def __init__(self, path, file_unique_id):
+        self.file_path = str(path)
+        self.file_unique_id = file_unique_id
+
+    async def download_as_bytearray(self):
+        with open(self.file_path, "rb") as f:
+            return bytearray(f.read())
+
+class FakeBot:
+    """Zwraca plik na dysku (jak lokalny serwer Bot API) i liczy zapytania getFile"""
+
+    def __init__(self, path):
+        self.path = path
+        self.get_file_calls = 0
+
+    async def get_file(self, file_id):
+        self.get_file_calls += 1
+        await asyncio.sleep(0.01)
+        return FakeFile(self.path, "unique-1")
+
+def _read_opened(cache, bot):
+    async def read():
+        async with cache.open(bot, "file-1", "unique-1") as f:
+            return f.read()
+    return read()
+
+def test_concurrent_open_and_fetch_share_one_download(tmp_path):
+    path = tmp_path / "document.txt"
+    path.write_bytes(b"tekst dokumentu")
+    bot = FakeBot(path)
+    cache = MediaCache(max_bytes=1024 * 1024, max_file_bytes=1024 * 1024, ttl=60)
+
+    async def scenario():
+        return await asyncio.gather(
+            _read_opened(cache, bot), _read_opened(cache, bot), cache.fetch(bot, "file-1", "unique-1")
+        )
+
+    assert asyncio.run(scenario()) == [b"tekst dokumentu"] * 3
+    assert bot.get_file_calls == 1
+    stats = cache.stats()
+    assert (stats["misses"], stats["joined_downloads"]) == (1, 2)
+
+def test_disk_tier_keeps_files_within_size_limit(tmp_path):
+    cache = MediaCache(max_bytes=10, max_file_bytes=100, ttl=60, directory=str(tmp_path / "media"), disk_max_bytes=25)
+
+    async def scenario():
+        for index in range(4):
+            await cache._store(f"unique-{index}", bytes([index]) * 10)
+
+    asyncio.run(scenario())
+    # Pliki usunięte z pamięci trafiają na dysk, a najstarsze są z niego usuwane po przekroczeniu limitu
+    assert cache.disk.total_bytes <= 25
+    assert cache.disk.get("unique-0") is None
+    assert cache.disk.get("unique-2") == bytes([2]) * 10
@@ -0,0 +1,83 @@
+"""
+Testy kolejki zapisu wiadomości w tle - ponowienia i pomijanie odrzuconych rekordów
+"""
+import asyncio
+import time
+import httpx
+import pytest
+from database import message_queue
+from database.message_queue import MessageQueue
+
+def _record(content, conversation_id=1):
+    return {'conversation_id': conversation_id, 'user_id': 1, 'content': content, 'created_at': f"2024-01-01T00:00:0{content[-1]}"}
+
+def _http_error(status):
+    request = httpx.Request('POST', 'http://localhost/rest/v1/messages')
+    return httpx.HTTPStatusError("błąd", request=request, response=httpx.Response(status, request=request))
+
+@pytest.fixture
+def database(monkeypatch):
+    """Zamiennik zapisu: zapisuje rekordy, a rekordy z treścią 'zły*' odrzuca jak naruszenie ograniczeń"""
+    state = {'rows': [], 'calls': 0, 'outage': 0, 'touched': {}}
+
+    async def insert_messages(records):
+        state['calls'] += 1
+        if state['outage']:
+            state['outage'] -= 1
+            raise httpx.ConnectError("brak połączenia")
+        if any(record['content'].startswith('zły') for record in records):
+            raise _http_error(409)
+        state['rows'].extend(records)
+
+    async def touch_conversation(conversation_id, timestamp):
+        state['touched'][conversation_id] = timestamp
+
+    monkeypatch.setattr(message_queue, 'insert_messages', insert_messages)
+    monkeypatch.setattr(message_queue, 'touch_conversation', touch_conversation)
+    return state
+
+def _queue(**kwargs):
+    options = {'batch_size': 10, 'flush_interval': 60, 'max_pending': 100, 'retry_base_delay': 1, 'retry_max_delay': 4}
+    options.update(kwargs)
+    return MessageQueue(**options)
+
+def test_rejected_record_is_dropped_and_rest_is_written(database):
+    async def scenario():
+        queue = _queue()
+        for content in ('ok1', 'zły2', 'ok3'):
+            queue.enqueue(_record(content))
+        assert await queue.flush() is True
+        await queue.drain()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert [row['content'] for row in database['rows']] == ['ok1', 'ok3']
+    assert queue.stats()['rejected'] == 1
+    assert queue.stats()['pending'] == 0
+    assert database['touched'] == {1: "2024-01-01T00:00:03"}
+
+def test_transient_error_backs_off_with_cap(database):
+    async def scenario():
+        queue = _queue()
+        database['outage'] = 10
+        queue.enqueue(_record('ok1'))
+
+        delays = []
+        for _ in range(4):
+            assert await queue.flush(force=True) is False
+            delays.append(queue._retry_at - time.monotonic())
+        # W czasie opóźnienia zwykłe opróżnienie nie próbuje zapisu
+        calls = database['calls']
+        assert await queue.flush() is False
+        assert database['calls'] == calls
+
+        database['outage'] = 0
+        assert await queue.flush(force=True) is True
+        await queue.drain()
+        return queue, delays
+
+    queue, delays = asyncio.run(scenario())
+    assert [round(delay) for delay in delays] == [1, 2, 4, 4]
+    assert [row['content'] for row in database['rows']] == ['ok1']
+    assert queue.stats()['failures'] == 4
+    assert queue._failures_in_row == 0
@@ -0,0 +1,26 @@
+"""
+Testy zbierania i formatowania statystyk
+"""
+from utils import metrics
+
+def test_collect_stats_reports_failing_provider(monkeypatch):
+    monkeypatch.setattr(metrics, '_providers', {})
+    metrics.register_stats("queue", lambda: {"pending": 2})
+    metrics.register_stats("broken", lambda: 1 / 0)
+
+    stats = metrics.collect_stats()
+    assert stats["queue"] == {"pending": 2}
+    assert "division by zero" in stats["broken"]["error"]
+
+def test_format_stats_flattens_nested_groups():
+    text = metrics.format_stats({
+        "executor": {"pdf": {"submitted": 5, "timeouts": 1}},
+        "outbound": {"queue_depth": 3, "queue_by_priority": {0: 1, 2: 2}},
+        "rate_limits": [{"model": "gpt-4o", "waiting": 0}]
+    })
+    assert text.splitlines() == [
+        "executor.pdf: submitted=5 timeouts=1",
+        "outbound: queue_depth=3",
+        "outbound.queue_by_priority: 0=1 2=2",
+        "rate_limits[0]: model=gpt-4o waiting=0"
+    ]
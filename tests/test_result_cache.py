@@ -0,0 +1,21 @@
+"""
+Testy pamięci podręcznej wyników z poziomem dyskowym
+"""
+from utils.result_cache import ResultCache, DiskCache
+
+def test_disk_tier_survives_restart(tmp_path):
+    cache = ResultCache(max_size=1, directory=str(tmp_path), max_bytes=1024 * 1024)
+    cache.set("strona-1", "Przetłumaczona strona 1")
+    cache.set("strona-2", "Przetłumaczona strona 2")
+
+    # Nowa instancja (np. po restarcie bota) ma pustą pamięć, ale czyta wpisy z dysku
+    restarted = ResultCache(max_size=1, directory=str(tmp_path), max_bytes=1024 * 1024)
+    assert restarted.get("strona-1") == "Przetłumaczona strona 1"
+    assert restarted.stats()["disk_hits"] == 1
+
+def test_disk_cache_ignores_corrupted_entry(tmp_path):
+    disk = DiskCache(str(tmp_path), 1024)
+    (tmp_path / "zepsuty.json").write_text("{niepoprawny json", encoding="utf-8")
+
+    assert disk.get("zepsuty") is None
+    assert disk.get("brak") is None
@@ -0,0 +1,113 @@
+"""
+Testy wbudowanego backendu SQLite na tymczasowym pliku bazy
+"""
+import sqlite3
+import time
+import pytest
+from database import sqlite_client as db
+from database.profile_cache import clear_profile_cache
+from database.history_buffer import clear_history_buffer
+
+@pytest.fixture(autouse=True)
+def database(tmp_path, monkeypatch):
+    db.close_connection()
+    monkeypatch.setattr(db, 'SQLITE_PATH', str(tmp_path / 'bot.sqlite'))
+    clear_profile_cache()
+    clear_history_buffer()
+    yield
+    db.close_connection()
+    clear_profile_cache()
+    clear_history_buffer()
+
+def _message(conversation_id, content, created_at):
+    return {
+        'conversation_id': conversation_id,
+        'user_id': 1,
+        'content': content,
+        'is_from_user': True,
+        'model_used': None,
+        'prompt_tokens': None,
+        'completion_tokens': None,
+        'created_at': created_at
+    }
+
+def test_ledger_add_and_deduct():
+    db.get_or_create_user(1, username="jan", language_code="en")
+
+    assert db.ledger_add(1, 10, "Zakup", 'purchase', 9.99) == 10
+    assert db.ledger_deduct(1, 25, "Za drogo", 'document') is None
+    assert db.ledger_deduct(1, 4, "Dokument", 'document', prompt_tokens=120, completion_tokens=45) == 6
+    assert db.get_user_credits(1) == 6
+
+    transactions = db.get_credit_transactions(1)
+    assert [(t['transaction_type'], t['amount'], t['credits_after']) for t in transactions] == [
+        ('purchase', 10, 10), ('deduct', 4, 6)
+    ]
+    assert (transactions[1]['prompt_tokens'], transactions[1]['completion_tokens']) == (120, 45)
+    assert db.get_credit_usage_by_type(1) == {'document': 4}
+
+def test_chat_turn_round_trip():
+    db.get_or_create_user(1, language_code="ru")
+    db.ledger_add(1, 5)
+
+    turn = db.begin_chat_turn(1)
+    assert (turn['credits'], turn['language'], turn['history']) == (5, 'ru', [])
+
+    result = db.commit_chat_turn(1, turn['conversation_id'], "Pytanie", "Odpowiedź", "gpt-4o", credit_cost=3,
+                                 prompt_tokens=12, completion_tokens=34)
+    assert result == {'credits': 2, 'charged': True, 'messages_used': 1}
+
+    # Za mało kredytów - wiadomości są zapisane, opłata nie. Kolejna tura zaczyna się po odpowiedzi
+    # modelu, czyli później niż znacznik czasu poprzedniej odpowiedzi (+1 ms)
+    time.sleep(0.002)
+    result = db.commit_chat_turn(1, turn['conversation_id'], "Drugie", "Odpowiedź 2", credit_cost=3)
+    assert (result['credits'], result['charged']) == (2, False)
+
+    clear_history_buffer()
+    history = db.begin_chat_turn(1)['history']
+    assert [m['content'] for m in history] == ["Pytanie", "Odpowiedź", "Drugie", "Odpowiedź 2"]
+    assert (history[1]['prompt_tokens'], history[1]['completion_tokens']) == (12, 34)
+
+def test_messages_keyset_pagination():
+    conversation = db.create_new_conversation(1)
+    db.insert_messages([
+        _message(conversation['id'], f"m{i}", f"2024-01-01T00:00:{i:02d}+00:00") for i in range(7)
+    ])
+
+    first = db.get_messages_page(conversation['id'], page_size=3)
+    assert [m['content'] for m in first['items']] == ["m6", "m5", "m4"]
+    assert (first['has_older'], first['has_newer']) == (True, False)
+
+    second = db.get_messages_page(conversation['id'], first['older_cursor'], 'older', 3)
+    assert [m['content'] for m in second['items']] == ["m3", "m2", "m1"]
+
+    last = db.get_messages_page(conversation['id'], second['older_cursor'], 'older', 3)
+    assert [m['content'] for m in last['items']] == ["m0"]
+    assert (last['has_older'], last['has_newer']) == (False, True)
+
+    back = db.get_messages_page(conversation['id'], second['newer_cursor'], 'newer', 3)
+    assert [m['content'] for m in back['items']] == ["m6", "m5", "m4"]
+
+def test_insert_messages_is_atomic():
+    conversation = db.create_new_conversation(1)
+    db.insert_messages([_message(conversation['id'], "ok", "2024-01-01T00:00:00+00:00")])
+
+    # Wiadomość bez konwersacji narusza ograniczenie NOT NULL - cała partia jest wycofana
+    with pytest.raises(sqlite3.IntegrityError):
+        db.insert_messages([
+            _message(conversation['id'], "druga", "2024-01-01T00:00:01+00:00"),
+            _message(None, "zła", "2024-01-01T00:00:02+00:00")
+        ])
+
+    assert [m['content'] for m in db.get_messages_page(conversation['id'])['items']] == ["ok"]
+
+def test_user_language_and_payment_methods():
+    db.get_or_create_user(1, language_code="en")
+    assert db.get_user_language(1) == "en"
+    assert db.update_user_language(1, "ru") is True
+    assert db.get_user_language(1) == "ru"
+
+    codes = [method['code'] for method in db.get_payment_methods("ru")]
+    assert "stripe" in codes
+    assert db.get_payment_method_by_code("allegro")['is_active'] is True
+    assert db.get_active_subscriptions(1) == []
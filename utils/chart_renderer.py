@@ -0,0 +1,203 @@
+"""
+Rysowanie wykresów zużycia kredytów
+Funkcje są wykonywane w procesach puli 'charts' (utils.executor), dlatego moduł importuje tylko
+matplotlib - proces roboczy nie ładuje klientów bazy danych ani reszty bota.
+"""
+import io
+import datetime
+import logging
+import matplotlib
+matplotlib.use('Agg')  # Wykresy są rysowane w procesach puli 'charts', bez interfejsu graficznego
+import matplotlib.pyplot as plt
+from matplotlib.dates import DateFormatter
+
+logger = logging.getLogger(__name__)
+
+def render_credit_usage_chart(transactions, user_id=None, days=30):
+    """Rysuje wykres użycia kredytów w czasie z listy transakcji (rosnąco po dacie)"""
+    try:
+        if not transactions:
+            logger.warning(f"Brak transakcji dla użytkownika {user_id} w okresie {days} dni")
+            # Generujemy prosty wykres informacyjny zamiast zwracać None
+            plt.figure(figsize=(10, 6))
+            plt.text(0.5, 0.5, 'Brak danych transakcji', 
+                    horizontalalignment='center', verticalalignment='center', 
+                    fontsize=20, color='gray', transform=plt.gca().transAxes)
+            plt.gca().set_axis_off()
+            
+            # Zapisz wykres do bufora
+            buf = io.BytesIO()
+            plt.savefig(buf, format='png', dpi=100)
+            buf.seek(0)
+            plt.close()
+            return buf
+        
+        # Przygotuj dane do wykresu
+        dates = []
+        balances = []
+        usage_amounts = []
+        purchase_amounts = []
+        
+        logger.info(f"Znaleziono {len(transactions)} transakcji do analizy")
+        
+        for trans in transactions:
+            try:
+                # Konwersja formatu daty
+                created_at = trans['created_at']
+                if isinstance(created_at, str):
+                    dt = datetime.datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+                else:
+                    dt = created_at
+                    
+                dates.append(dt)
+                balances.append(trans['credits_after'])
+                
+                if trans['transaction_type'] == 'deduct':
+                    usage_amounts.append(trans['amount'])
+                    purchase_amounts.append(0)
+                elif trans['transaction_type'] in ['add', 'purchase', 'subscription', 'subscription_renewal']:
+                    usage_amounts.append(0)
+                    purchase_amounts.append(trans['amount'])
+            except Exception as e:
+                logger.error(f"Błąd przy przetwarzaniu transakcji: {e}", exc_info=True)
+        
+        if not dates:
+            logger.warning(f"Nie udało się przetworzyć żadnej transakcji")
+            # Generujemy prosty wykres informacyjny
+            plt.figure(figsize=(10, 6))
+            plt.text(0.5, 0.5, 'Błąd przetwarzania transakcji', 
+                    horizontalalignment='center', verticalalignment='center', 
+                    fontsize=20, color='gray', transform=plt.gca().transAxes)
+            plt.gca().set_axis_off()
+            
+            # Zapisz wykres do bufora
+            buf = io.BytesIO()
+            plt.savefig(buf, format='png', dpi=100)
+            buf.seek(0)
+            plt.close()
+            return buf
+        
+        plt.figure(figsize=(10, 6))
+        
+        # Wykres salda
+        plt.subplot(2, 1, 1)
+        plt.plot(dates, balances, 'b-', label='Saldo kredytów')
+        plt.xlabel('Data')
+        plt.ylabel('Kredyty')
+        plt.title('Historia salda kredytów')
+        plt.grid(True, linestyle='--', alpha=0.7)
+        plt.gca().xaxis.set_major_formatter(DateFormatter('%d-%m-%Y'))
+        plt.gcf().autofmt_xdate()
+        plt.legend()
+        
+        # Wykres użycia/zakupów
+        plt.subplot(2, 1, 2)
+        
+        # Konwertujemy daty na liczby dla łatwiejszego wykreślania słupków
+        dates_num = [x.timestamp() for x in dates]
+        width = min(7200, (max(dates_num) - min(dates_num)) / len(dates_num) * 0.8) if len(dates_num) > 1 else 7200
+        
+        # Wykres słupkowy użycia
+        usage_bars = plt.bar([d - width/2 for d in dates_num], usage_amounts, width=width, color='r', alpha=0.6, label='Wydane kredyty')
+        
+        # Wykres słupkowy zakupów
+        purchase_bars = plt.bar([d + width/2 for d in dates_num], purchase_amounts, width=width, color='g', alpha=0.6, label='Dodane kredyty')
+        
+        # Formatowanie osi X
+        plt.gca().xaxis.set_major_formatter(DateFormatter('%d-%m-%Y'))
+        plt.gcf().autofmt_xdate()
+        
+        # Etykiety i legenda
+        plt.xlabel('Data')
+        plt.ylabel('Kredyty')
+        plt.title('Szczegóły transakcji')
+        plt.grid(True, linestyle='--', alpha=0.7)
+        plt.legend()
+        
+        # Dopasowanie układu
+        plt.tight_layout()
+        
+        # Zapisz wykres do bufora
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png', dpi=100)
+        buf.seek(0)
+        plt.close()
+        
+        return buf
+    
+    except Exception as e:
+        logger.error(f"Błąd przy generowaniu wykresu: {e}", exc_info=True)
+        # Generujemy wykres błędu
+        plt.figure(figsize=(10, 6))
+        plt.text(0.5, 0.5, f'Błąd generowania wykresu: {str(e)}', 
+                horizontalalignment='center', verticalalignment='center', 
+                fontsize=12, color='red', transform=plt.gca().transAxes)
+        plt.gca().set_axis_off()
+        
+        # Zapisz wykres do bufora
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png', dpi=100)
+        buf.seek(0)
+        plt.close()
+        return buf
+
+def render_usage_breakdown_chart(usage_breakdown, user_id=None, days=30):
+    """Rysuje wykres kołowy rozkładu zużycia kredytów (etykieta kategorii -> suma kredytów)"""
+    try:
+        if not usage_breakdown:
+            logger.warning(f"Brak danych rozkładu dla użytkownika {user_id}")
+            # Generujemy prosty wykres informacyjny zamiast zwracać None
+            plt.figure(figsize=(8, 6))
+            plt.text(0.5, 0.5, 'Brak danych do analizy', 
+                    horizontalalignment='center', verticalalignment='center', 
+                    fontsize=20, color='gray', transform=plt.gca().transAxes)
+            plt.gca().set_axis_off()
+            
+            # Zapisz wykres do bufora
+            buf = io.BytesIO()
+            plt.savefig(buf, format='png', dpi=100)
+            buf.seek(0)
+            plt.close()
+            return buf
+        
+        plt.figure(figsize=(8, 6))
+        
+        labels = list(usage_breakdown.keys())
+        sizes = list(usage_breakdown.values())
+        
+        # Ustaw kolory dla wykresów
+        colors = ['#ff9999', '#66b3ff', '#99ff99', '#ffcc99', '#c2c2f0', '#ffb366', '#ff6666']
+        
+        if sum(sizes) > 0:  # Sprawdź, czy są dane do wykreślenia
+            plt.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90, shadow=True)
+            plt.axis('equal')
+            plt.title(f'Rozkład zużycia kredytów w ostatnich {days} dniach')
+        else:
+            plt.text(0.5, 0.5, 'Brak transakcji zużycia kredytów', 
+                    horizontalalignment='center', verticalalignment='center', 
+                    fontsize=16, color='gray', transform=plt.gca().transAxes)
+            plt.gca().set_axis_off()
+        
+        # Zapisz wykres do bufora
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png', dpi=100)
+        buf.seek(0)
+        plt.close()
+        
+        return buf
+    
+    except Exception as e:
+        logger.error(f"Błąd przy generowaniu wykresu rozkładu: {e}", exc_info=True)
+        # Generujemy wykres błędu
+        plt.figure(figsize=(8, 6))
+        plt.text(0.5, 0.5, f'Błąd generowania wykresu: {str(e)}', 
+                horizontalalignment='center', verticalalignment='center', 
+                fontsize=12, color='red', transform=plt.gca().transAxes)
+        plt.gca().set_axis_off()
+        
+        # Zapisz wykres do bufora
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png', dpi=100)
+        buf.seek(0)
+        plt.close()
+        return buf
@@ -0,0 +1,169 @@
+"""
+Budowanie kontekstu rozmowy dla OpenAI z limitem tokenów
+Liczy tokeny lokalnie (tiktoken, jeśli jest zainstalowany; w przeciwnym razie
+szacunek na podstawie liczby znaków) i wypełnia prompt historią od najnowszych
+wiadomości, dopóki nie zostanie osiągnięty budżet tokenów dla danego modelu.
+"""
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict
+from config import MODEL_CONTEXT_BUDGETS, DEFAULT_SYSTEM_PROMPT
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Narzut formatu czatu OpenAI: tokeny na każdą wiadomość i na rozpoczęcie odpowiedzi
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Przybliżenie bez tiktoken - zaniżone dzielenie, aby nie przekroczyć budżetu dla tekstów innych niż angielskie
+CHARS_PER_TOKEN = 3
+
+# Maksymalna liczba zapamiętanych wyników liczenia tokenów
+TOKEN_CACHE_SIZE = 50000
+
+_encodings = {}
+_token_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _get_encoding(model):
+    """Zwraca koder tiktoken dla modelu lub None, jeśli tiktoken nie jest dostępny"""
+    if tiktoken is None:
+        return None
+
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.error(f"Nie udało się wczytać kodera tiktoken dla {model}: {e}")
+            _encodings[model] = None
+    return _encodings[model]
+
+def get_context_budget(model):
+    """Zwraca budżet tokenów promptu dla modelu"""
+    return MODEL_CONTEXT_BUDGETS.get(model, MODEL_CONTEXT_BUDGETS["default"])
+
+def count_tokens(text, model):
+    """
+    Liczy tokeny tekstu dla danego modelu
+
+    Args:
+        text (str): Tekst
+        model (str): Nazwa modelu OpenAI
+
+    Returns:
+        int: Liczba tokenów
+    """
+    if not text:
+        return 0
+
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def count_message_tokens(message, model):
+    """
+    Liczy tokeny wiadomości z historii (z narzutem formatu czatu), zapamiętując wynik
+
+    Args:
+        message (dict): Wiadomość z bazy ('content', opcjonalnie 'id')
+        model (str): Nazwa modelu OpenAI
+
+    Returns:
+        int: Liczba tokenów
+    """
+    content = message.get("content") or ""
+    encoding = _get_encoding(model)
+    encoding_name = encoding.name if encoding is not None else "chars"
+
+    # Zapisane wiadomości identyfikujemy po ID, pozostałe po skrócie treści
+    if message.get("id") is not None:
+        key = (encoding_name, "id", message["id"])
+    else:
+        key = (encoding_name, "sha1", hashlib.sha1(content.encode("utf-8")).hexdigest())
+
+    with _cache_lock:
+        if key in _token_cache:
+            _token_cache.move_to_end(key)
+            return _token_cache[key]
+
+    tokens = count_tokens(content, model) + TOKENS_PER_MESSAGE
+
+    with _cache_lock:
+        _token_cache[key] = tokens
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return tokens
+
+def truncate_to_tokens(text, max_tokens, model):
+    """Skraca tekst do podanej liczby tokenów (zachowując początek)"""
+    if max_tokens <= 0:
+        return ""
+
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+def build_chat_context(history, user_message, system_prompt, model):
+    """
+    Przygotuj listę wiadomości dla API OpenAI w ramach budżetu tokenów modelu
+
+    Prompt systemowy i bieżąca wiadomość użytkownika są zawsze dołączane (wiadomość
+    użytkownika jest skracana, jeśli sama przekracza budżet). Historia jest dodawana
+    od najnowszej wiadomości do momentu wyczerpania budżetu.
+
+    Args:
+        history (list): Wiadomości z historii konwersacji w kolejności chronologicznej
+        user_message (str): Aktualna wiadomość użytkownika
+        system_prompt (str): Prompt systemowy (z CHAT_MODES); None oznacza DEFAULT_SYSTEM_PROMPT
+        model (str): Nazwa modelu OpenAI
+
+    Returns:
+        tuple: (lista wiadomości w formacie OpenAI, liczba tokenów promptu)
+    """
+    if system_prompt is None:
+        system_prompt = DEFAULT_SYSTEM_PROMPT
+    user_message = user_message if user_message is not None else ""
+
+    budget = get_context_budget(model)
+    used = TOKENS_PER_REPLY + count_tokens(system_prompt, model) + TOKENS_PER_MESSAGE
+
+    user_tokens = count_tokens(user_message, model) + TOKENS_PER_MESSAGE
+    if used + user_tokens > budget:
+        user_message = truncate_to_tokens(user_message, budget - used - TOKENS_PER_MESSAGE, model)
+        user_tokens = count_tokens(user_message, model) + TOKENS_PER_MESSAGE
+        logger.warning(f"Wiadomość użytkownika skrócona do budżetu modelu {model} ({budget} tokenów)")
+    used += user_tokens
+
+    # Historia od najnowszej - zatrzymujemy się na pierwszej wiadomości, która się nie mieści
+    selected = []
+    for message in reversed(history or []):
+        tokens = count_message_tokens(message, model)
+        if used + tokens > budget:
+            break
+        used += tokens
+        selected.append({
+            "role": "user" if message.get("is_from_user") else "assistant",
+            "content": message.get("content") or ""
+        })
+    selected.reverse()
+
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(selected)
+    messages.append({"role": "user", "content": user_message})
+
+    return messages, used
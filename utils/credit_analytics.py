@@ -1,188 +1,58 @@
 """
 Ulepszony moduł do analizy wykorzystania kredytów
 """
-import io
-import matplotlib.pyplot as plt
-import numpy as np
 import datetime
-import pytz
 import logging
-from matplotlib.dates import DateFormatter
 from database.supabase_client import get_credit_transactions, get_user_credits
+from database import async_supabase_client
+from utils.executor import run_blocking
+from utils.chart_renderer import render_credit_usage_chart, render_usage_breakdown_chart
 
 # Dodaję loggera dla lepszej diagnostyki
 logger = logging.getLogger(__name__)
 
+# Etykiety kategorii operacji (kolumna credit_transactions.category)
+CATEGORY_LABELS = {
+    "message": "Wiadomości",
+    "image": "Obrazy",
+    "document": "Analiza dokumentów",
+    "photo": "Analiza zdjęć",
+    "translation": "Tłumaczenia",
+    "pdf_translation": "Tłumaczenia PDF",
+    "other": "Inne"
+}
+
 def generate_credit_usage_chart(user_id, days=30):
     """Generuje wykres użycia kredytów w czasie"""
-    try:
-        transactions = get_credit_transactions(user_id, days)
-        
-        if not transactions:
-            logger.warning(f"Brak transakcji dla użytkownika {user_id} w okresie {days} dni")
-            # Generujemy prosty wykres informacyjny zamiast zwracać None
-            plt.figure(figsize=(10, 6))
-            plt.text(0.5, 0.5, 'Brak danych transakcji', 
-                    horizontalalignment='center', verticalalignment='center', 
-                    fontsize=20, color='gray', transform=plt.gca().transAxes)
-            plt.gca().set_axis_off()
-            
-            # Zapisz wykres do bufora
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=100)
-            buf.seek(0)
-            plt.close()
-            return buf
-        
-        # Przygotuj dane do wykresu
-        dates = []
-        balances = []
-        usage_amounts = []
-        purchase_amounts = []
-        
-        logger.info(f"Znaleziono {len(transactions)} transakcji do analizy")
-        
-        for trans in transactions:
-            try:
-                # Konwersja formatu daty
-                created_at = trans['created_at']
-                if isinstance(created_at, str):
-                    dt = datetime.datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                else:
-                    dt = created_at
-                    
-                dates.append(dt)
-                balances.append(trans['credits_after'])
-                
-                if trans['transaction_type'] == 'deduct':
-                    usage_amounts.append(trans['amount'])
-                    purchase_amounts.append(0)
-                elif trans['transaction_type'] in ['add', 'purchase', 'subscription', 'subscription_renewal']:
-                    usage_amounts.append(0)
-                    purchase_amounts.append(trans['amount'])
-            except Exception as e:
-                logger.error(f"Błąd przy przetwarzaniu transakcji: {e}", exc_info=True)
-        
-        if not dates:
-            logger.warning(f"Nie udało się przetworzyć żadnej transakcji")
-            # Generujemy prosty wykres informacyjny
-            plt.figure(figsize=(10, 6))
-            plt.text(0.5, 0.5, 'Błąd przetwarzania transakcji', 
-                    horizontalalignment='center', verticalalignment='center', 
-                    fontsize=20, color='gray', transform=plt.gca().transAxes)
-            plt.gca().set_axis_off()
-            
-            # Zapisz wykres do bufora
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=100)
-            buf.seek(0)
-            plt.close()
-            return buf
-        
-        plt.figure(figsize=(10, 6))
-        
-        # Wykres salda
-        plt.subplot(2, 1, 1)
-        plt.plot(dates, balances, 'b-', label='Saldo kredytów')
-        plt.xlabel('Data')
-        plt.ylabel('Kredyty')
-        plt.title('Historia salda kredytów')
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.gca().xaxis.set_major_formatter(DateFormatter('%d-%m-%Y'))
-        plt.gcf().autofmt_xdate()
-        plt.legend()
-        
-        # Wykres użycia/zakupów
-        plt.subplot(2, 1, 2)
-        
-        # Konwertujemy daty na liczby dla łatwiejszego wykreślania słupków
-        dates_num = [x.timestamp() for x in dates]
-        width = min(7200, (max(dates_num) - min(dates_num)) / len(dates_num) * 0.8) if len(dates_num) > 1 else 7200
-        
-        # Wykres słupkowy użycia
-        usage_bars = plt.bar([d - width/2 for d in dates_num], usage_amounts, width=width, color='r', alpha=0.6, label='Wydane kredyty')
-        
-        # Wykres słupkowy zakupów
-        purchase_bars = plt.bar([d + width/2 for d in dates_num], purchase_amounts, width=width, color='g', alpha=0.6, label='Dodane kredyty')
-        
-        # Formatowanie osi X
-        plt.gca().xaxis.set_major_formatter(DateFormatter('%d-%m-%Y'))
-        plt.gcf().autofmt_xdate()
-        
-        # Etykiety i legenda
-        plt.xlabel('Data')
-        plt.ylabel('Kredyty')
-        plt.title('Szczegóły transakcji')
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.legend()
-        
-        # Dopasowanie układu
-        plt.tight_layout()
-        
-        # Zapisz wykres do bufora
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=100)
-        buf.seek(0)
-        plt.close()
-        
-        return buf
+    return render_credit_usage_chart(get_credit_transactions(user_id, days), user_id, days)
+
+async def credit_usage_chart(user_id, days=30):
+    """
+    Pobiera transakcje i rysuje wykres użycia kredytów w puli procesów, bez blokowania pętli zdarzeń
     
+    Returns:
+        BytesIO: Wykres PNG lub None, gdy pula jest zajęta albo rysowanie przekroczyło limit czasu
+    """
+    try:
+        transactions = await async_supabase_client.get_credit_transactions(user_id, days)
+        return await run_blocking("charts", render_credit_usage_chart, transactions, user_id, days)
     except Exception as e:
-        logger.error(f"Błąd przy generowaniu wykresu: {e}", exc_info=True)
-        # Generujemy wykres błędu
-        plt.figure(figsize=(10, 6))
-        plt.text(0.5, 0.5, f'Błąd generowania wykresu: {str(e)}', 
-                horizontalalignment='center', verticalalignment='center', 
-                fontsize=12, color='red', transform=plt.gca().transAxes)
-        plt.gca().set_axis_off()
-        
-        # Zapisz wykres do bufora
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=100)
-        buf.seek(0)
-        plt.close()
-        return buf
+        logger.error(f"Nie udało się narysować wykresu użycia kredytów: {e!r}")
+        return None
+
+def _label_breakdown(breakdown):
+    """Kategorie zapisane przy pobieraniu kredytów -> etykiety wykresów i statystyk"""
+    result = {}
+    for category, amount in breakdown.items():
+        label = CATEGORY_LABELS.get(category, CATEGORY_LABELS["other"])
+        result[label] = result.get(label, 0) + amount
+    return result
 
 def get_credit_usage_breakdown(user_id, days=30):
     """Pobiera rozkład zużycia kredytów według rodzaju operacji z dodatkową obsługą błędów"""
     try:
         from database.supabase_client import get_credit_usage_by_type
-        breakdown = get_credit_usage_by_type(user_id, days)
-        
-        # Jeśli brak kategorii, stwórz podstawowy rozkład
-        if not breakdown:
-            logger.warning(f"Brak danych rozkładu dla użytkownika {user_id} - wykorzystujemy dane transakcji")
-            transactions = get_credit_transactions(user_id, days)
-            
-            # Ręczna kategoryzacja
-            breakdown = {"Inne": 0}
-            for trans in transactions:
-                if trans['transaction_type'] != 'deduct':
-                    continue
-                    
-                description = trans.get('description', '').lower()
-                amount = trans.get('amount', 0)
-                
-                if any(term in description for term in ['wiadomość', 'message', 'chat', 'gpt']):
-                    if "Wiadomości" not in breakdown:
-                        breakdown["Wiadomości"] = 0
-                    breakdown["Wiadomości"] += amount
-                elif any(term in description for term in ['obraz', 'dall-e', 'image', 'dall']):
-                    if "Obrazy" not in breakdown:
-                        breakdown["Obrazy"] = 0
-                    breakdown["Obrazy"] += amount
-                elif any(term in description for term in ['dokument', 'document', 'pdf', 'plik']):
-                    if "Dokumenty" not in breakdown:
-                        breakdown["Dokumenty"] = 0
-                    breakdown["Dokumenty"] += amount
-                elif any(term in description for term in ['zdjęci', 'zdjęc', 'photo', 'foto']):
-                    if "Zdjęcia" not in breakdown:
-                        breakdown["Zdjęcia"] = 0
-                    breakdown["Zdjęcia"] += amount
-                else:
-                    breakdown["Inne"] += amount
-        
-        return breakdown
+        return _label_breakdown(get_credit_usage_by_type(user_id, days))
     except Exception as e:
         logger.error(f"Błąd przy pobieraniu rozkładu zużycia: {e}", exc_info=True)
         # Zwracamy prosty słownik w przypadku błędu
@@ -190,66 +60,21 @@ def get_credit_usage_breakdown(user_id, days=30):
 
 def generate_usage_breakdown_chart(user_id, days=30):
     """Generuje wykres kołowy rozkładu zużycia kredytów z lepszą obsługą błędów"""
-    try:
-        usage_breakdown = get_credit_usage_breakdown(user_id, days)
-        
-        if not usage_breakdown:
-            logger.warning(f"Brak danych rozkładu dla użytkownika {user_id}")
-            # Generujemy prosty wykres informacyjny zamiast zwracać None
-            plt.figure(figsize=(8, 6))
-            plt.text(0.5, 0.5, 'Brak danych do analizy', 
-                    horizontalalignment='center', verticalalignment='center', 
-                    fontsize=20, color='gray', transform=plt.gca().transAxes)
-            plt.gca().set_axis_off()
-            
-            # Zapisz wykres do bufora
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=100)
-            buf.seek(0)
-            plt.close()
-            return buf
-        
-        plt.figure(figsize=(8, 6))
-        
-        labels = list(usage_breakdown.keys())
-        sizes = list(usage_breakdown.values())
-        
-        # Ustaw kolory dla wykresów
-        colors = ['#ff9999', '#66b3ff', '#99ff99', '#ffcc99', '#c2c2f0', '#ffb366', '#ff6666']
-        
-        if sum(sizes) > 0:  # Sprawdź, czy są dane do wykreślenia
-            plt.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90, shadow=True)
-            plt.axis('equal')
-            plt.title(f'Rozkład zużycia kredytów w ostatnich {days} dniach')
-        else:
-            plt.text(0.5, 0.5, 'Brak transakcji zużycia kredytów', 
-                    horizontalalignment='center', verticalalignment='center', 
-                    fontsize=16, color='gray', transform=plt.gca().transAxes)
-            plt.gca().set_axis_off()
-        
-        # Zapisz wykres do bufora
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=100)
-        buf.seek(0)
-        plt.close()
-        
-        return buf
+    return render_usage_breakdown_chart(get_credit_usage_breakdown(user_id, days), user_id, days)
+
+async def usage_breakdown_chart(user_id, days=30):
+    """
+    Pobiera rozkład zużycia i rysuje wykres kołowy w puli procesów, bez blokowania pętli zdarzeń
     
+    Returns:
+        BytesIO: Wykres PNG lub None, gdy pula jest zajęta albo rysowanie przekroczyło limit czasu
+    """
+    try:
+        breakdown = _label_breakdown(await async_supabase_client.get_credit_usage_by_type(user_id, days))
+        return await run_blocking("charts", render_usage_breakdown_chart, breakdown, user_id, days)
     except Exception as e:
-        logger.error(f"Błąd przy generowaniu wykresu rozkładu: {e}", exc_info=True)
-        # Generujemy wykres błędu
-        plt.figure(figsize=(8, 6))
-        plt.text(0.5, 0.5, f'Błąd generowania wykresu: {str(e)}', 
-                horizontalalignment='center', verticalalignment='center', 
-                fontsize=12, color='red', transform=plt.gca().transAxes)
-        plt.gca().set_axis_off()
-        
-        # Zapisz wykres do bufora
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=100)
-        buf.seek(0)
-        plt.close()
-        return buf
+        logger.error(f"Nie udało się narysować wykresu rozkładu zużycia: {e!r}")
+        return None
 
 def predict_credit_depletion(user_id, days=30):
     """Przewiduje, kiedy skończą się kredyty użytkownika z ulepszoną logiką"""
@@ -0,0 +1,91 @@
+"""
+Katalog plików ograniczony łącznym rozmiarem, z usuwaniem najdawniej używanych
+Wspólny poziom dyskowy pamięci podręcznej wyników (utils.result_cache) i plików
+z Telegrama (utils.media_cache). Czas modyfikacji pliku służy jako czas ostatniego użycia.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rozmiar fragmentu przy kopiowaniu pliku źródłowego do katalogu
+COPY_CHUNK_SIZE = 256 * 1024
+
+class DiskLRU:
+    """
+    Katalog z wpisami w plikach, ograniczony łącznym rozmiarem (LRU)
+
+    Args:
+        directory (str): Katalog na pliki
+        max_bytes (int): Maksymalny łączny rozmiar plików
+        suffix (str): Rozszerzenie plików wpisów (np. '.json')
+        ttl (float, optional): Czas przechowywania pliku od ostatniego użycia (s); None - bez limitu
+    """
+
+    def __init__(self, directory, max_bytes, suffix, ttl=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._files())
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _files(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.suffix):
+                stat = entry.stat()
+                files.append((entry.path, stat.st_mtime, stat.st_size))
+        return files
+
+    def open(self, key):
+        """Otwiera plik wpisu do odczytu i oznacza go jako użyty; None, jeśli go nie ma lub wygasł"""
+        path = self._path(key)
+        with self._lock:
+            try:
+                stat = os.stat(path)
+                if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                    os.remove(path)
+                    self.total_bytes -= stat.st_size
+                    return None
+                os.utime(path)
+                return open(path, "rb")
+            except FileNotFoundError:
+                return None
+
+    def write(self, key, source):
+        """Zapisuje wpis, kopiując go fragmentami z otwartego pliku źródłowego"""
+        path = self._path(key)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(source, f, COPY_CHUNK_SIZE)
+                size = f.tell()
+            os.replace(tmp_path, path)
+
+            self.total_bytes += size - previous
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Usuwa najdawniej używane pliki, aż łączny rozmiar spadnie do 90% limitu"""
+        files = sorted(self._files(), key=lambda item: item[1])
+        self.total_bytes = sum(size for _, _, size in files)
+        target = self.max_bytes * 0.9
+
+        for path, _, size in files:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self.total_bytes -= size
+            except OSError as e:
+                logger.warning(f"Nie udało się usunąć pliku pamięci podręcznej {path}: {e}")
@@ -0,0 +1,369 @@
+"""
+Analiza i tłumaczenie długich dokumentów metodą map-reduce
+Tekst dokumentu jest dzielony na części o ograniczonej liczbie tokenów, z podziałem na
+granicach struktury (nagłówki i akapity, a dla zbyt długich akapitów - linie, zdania
+i słowa). Części są przetwarzane równolegle z limitem jednoczesnych wywołań modelu na
+użytkownika i dla całego bota. W trybie analizy częściowe wyniki są łączone hierarchicznie
+(grupami mieszczącymi się w jednym zapytaniu), aż zostanie jedna analiza; w trybie
+tłumaczenia przetłumaczone części są składane w oryginalnej kolejności.
+"""
+import asyncio
+import io
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from utils.context_builder import count_tokens, CHARS_PER_TOKEN
+from utils.telegram_scheduler import outbound_priority, PRIORITY_LOW
+from utils.translations import get_text
+from config import (
+    DOCUMENT_CHUNK_TOKENS, DOCUMENT_PARTIAL_MAX_TOKENS, DOCUMENT_GLOBAL_CONCURRENCY,
+    DOCUMENT_USER_CONCURRENCY, DOCUMENT_PROGRESS_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# Separator części przy składaniu tekstu
+BLOCK_SEPARATOR = "\n\n"
+
+# Akapity rozdziela pusta linia; nagłówek Markdown zaczyna nową część, jeśli bieżąca jest już w połowie pełna
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n+")
+HEADING = re.compile(r"^(#{1,6}\s|[A-Z0-9][^\n]{0,80}\n[=-]{3,}[ \t]*$)")
+
+# Kolejne poziomy podziału akapitu, który sam przekracza limit: linie, zdania, słowa
+SPLIT_LEVELS = [re.compile(r"(?<=\n)"), re.compile(r"(?<=[.!?…])\s+"), re.compile(r"(?<= )")]
+
+# Limit długości wiadomości Telegrama - dłuższy wynik jest wysyłany jako plik tekstowy
+MESSAGE_LIMIT = 4096
+
+_global_slots = asyncio.Semaphore(DOCUMENT_GLOBAL_CONCURRENCY)
+_user_slots = {}  # user_id -> [semafor, liczba korzystających zadań]
+
+def _hard_split(text, model, max_tokens):
+    """Dzieli tekst bez żadnych separatorów (np. zminifikowany JSON) na kawałki o ograniczonej długości"""
+    pieces = []
+    step = max(1, max_tokens * CHARS_PER_TOKEN)
+    while text:
+        cut = min(len(text), step)
+        while cut > 1 and count_tokens(text[:cut], model) > max_tokens:
+            cut //= 2
+        pieces.append(text[:cut])
+        text = text[cut:]
+    return pieces
+
+def _split_oversized(text, model, max_tokens, level=0):
+    """Dzieli zbyt długi akapit na kawałki mieszczące się w limicie, zaczynając od najgrubszego poziomu"""
+    if count_tokens(text, model) <= max_tokens:
+        return [text]
+    if level == len(SPLIT_LEVELS):
+        return _hard_split(text, model, max_tokens)
+
+    pieces = []
+    current = ""
+    for part in SPLIT_LEVELS[level].split(text):
+        if not part:
+            continue
+        candidate = current + part if current else part
+        if count_tokens(candidate, model) <= max_tokens:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        if count_tokens(part, model) <= max_tokens:
+            current = part
+        else:
+            pieces.extend(_split_oversized(part, model, max_tokens, level + 1))
+            current = ""
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_into_chunks(text, model, max_tokens=DOCUMENT_CHUNK_TOKENS):
+    """
+    Dzieli tekst na części o najwyżej max_tokens tokenach, z podziałem na granicach struktury
+
+    Args:
+        text (str): Tekst dokumentu
+        model (str): Model, dla którego liczone są tokeny
+        max_tokens (int): Największa liczba tokenów w części
+
+    Returns:
+        list: Części tekstu w oryginalnej kolejności
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    separator_tokens = count_tokens(BLOCK_SEPARATOR, model)
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append(BLOCK_SEPARATOR.join(current))
+        current, current_tokens = [], 0
+
+    for block in PARAGRAPH_BREAK.split(text):
+        block = block.strip("\n")
+        if not block.strip():
+            continue
+
+        # Nowy rozdział zaczyna nową część, o ile nie zostawia prawie pustej poprzedniej
+        if HEADING.match(block) and current_tokens > max_tokens // 2:
+            flush()
+
+        block_tokens = count_tokens(block, model)
+        if block_tokens > max_tokens:
+            flush()
+            chunks.extend(_split_oversized(block, model, max_tokens))
+            continue
+
+        if current and current_tokens + separator_tokens + block_tokens > max_tokens:
+            flush()
+        current.append(block)
+        current_tokens += block_tokens + (separator_tokens if len(current) > 1 else 0)
+
+    flush()
+    return chunks
+
+@asynccontextmanager
+async def model_slot(user_id):
+    """Miejsce na jedno wywołanie modelu: w limicie użytkownika i w limicie całego bota (wspólne dla analizy i tłumaczenia plików)"""
+    entry = _user_slots.get(user_id)
+    if entry is None:
+        entry = _user_slots[user_id] = [asyncio.Semaphore(DOCUMENT_USER_CONCURRENCY), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            async with _global_slots:
+                yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _user_slots.pop(user_id, None)
+
+class ProgressReporter:
+    """
+    Zgłasza postęp nie częściej niż co DOCUMENT_PROGRESS_INTERVAL sekund
+
+    Zgłoszenie działa jako osobne zadanie (najwyżej jedno w toku), więc wolna edycja
+    wiadomości nie wstrzymuje przetwarzania kolejnych części.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._last = 0.0
+        self._task = None
+
+    def report(self, stage, done, total):
+        if self._callback is None:
+            return
+        now = time.monotonic()
+        if self._task is not None and not self._task.done():
+            return
+        if now - self._last < DOCUMENT_PROGRESS_INTERVAL and done < total:
+            return
+        self._last = now
+        self._task = asyncio.create_task(self._send(stage, done, total))
+
+    async def _send(self, stage, done, total):
+        try:
+            await self._callback(stage, done, total)
+        except Exception as e:
+            logger.warning(f"Nie udało się zgłosić postępu analizy dokumentu: {e}")
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+async def _run_all(calls, progress, stage):
+    """Wykonuje wywołania równolegle (w limitach) i zwraca wyniki w kolejności wywołań"""
+    done = 0
+    total = len(calls)
+    progress.report(stage, done, total)
+
+    async def run(call):
+        nonlocal done
+        result = await call()
+        done += 1
+        progress.report(stage, done, total)
+        return result
+
+    tasks = [asyncio.create_task(run(call)) for call in calls]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # Błąd jednej części przerywa całą analizę - nie płać za pozostałe wywołania
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def _group_for_merge(partials, model, max_tokens):
+    """Dzieli częściowe wyniki na grupy mieszczące się w jednym zapytaniu (co najmniej dwa wyniki w grupie)"""
+    groups = []
+    current, current_tokens = [], 0
+    for index, partial in enumerate(partials):
+        tokens = count_tokens(partial, model)
+        if len(current) >= 2 and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append((index, partial))
+        current_tokens += tokens
+    if current:
+        # Pojedynczy wynik na końcu dołącza do poprzedniej grupy, aby każdy poziom faktycznie zmniejszał liczbę wyników
+        if len(current) == 1 and groups:
+            groups[-1].extend(current)
+        else:
+            groups.append(current)
+    return groups
+
+async def analyze_long_document(text, file_name, model, complete, mode="analyze", target_language_name=None,
+                                user_id=None, chunk_tokens=DOCUMENT_CHUNK_TOKENS, on_progress=None, chunks=None):
+    """
+    Analizuje lub tłumaczy długi dokument częściami
+
+    Args:
+        text (str): Tekst dokumentu
+        file_name (str): Nazwa pliku
+        model (str): Model do użycia
+        complete (callable): Funkcja async (messages, max_tokens) -> tekst odpowiedzi modelu
+        mode (str): "analyze" lub "translate"
+        target_language_name (str, optional): Nazwa języka docelowego (tryb "translate")
+        user_id (int, optional): ID użytkownika - do limitu jednoczesnych wywołań na użytkownika
+        chunk_tokens (int): Największa liczba tokenów tekstu w jednej części
+        on_progress (callable, optional): Funkcja async (etap, gotowe, wszystkie) wywoływana przy postępie;
+            etap to "map" (części dokumentu) lub "reduce" (łączenie wyników)
+        chunks (list, optional): Tekst już podzielony przez split_into_chunks - nie jest dzielony ponownie
+
+    Returns:
+        str: Analiza dokumentu lub pełne tłumaczenie
+    """
+    if chunks is None:
+        chunks = split_into_chunks(text, model, chunk_tokens)
+    total = len(chunks)
+    progress = ProgressReporter(on_progress)
+    started = time.monotonic()
+
+    async def call(messages, max_tokens):
+        async with model_slot(user_id):
+            return await complete(messages, max_tokens) or ""
+
+    try:
+        if mode == "translate":
+            system_instruction = (
+                f"You are a professional translator. Translate the text to {target_language_name}. "
+                "Preserve the original formatting. Reply with the translation only."
+            )
+            calls = [
+                lambda index=index, chunk=chunk: call([
+                    {"role": "system", "content": system_instruction},
+                    {"role": "user", "content": f"Part {index + 1} of {total} of file {file_name}:\n\n{chunk}"}
+                ], max_tokens=2 * chunk_tokens)
+                for index, chunk in enumerate(chunks)
+            ]
+            translated = await _run_all(calls, progress, "map")
+            logger.info(f"Przetłumaczono {file_name} w {total} częściach w {time.monotonic() - started:.1f} s")
+            return BLOCK_SEPARATOR.join(part.strip() for part in translated)
+
+        system_instruction = "You are a helpful assistant who analyzes documents and files."
+        calls = [
+            lambda index=index, chunk=chunk: call([
+                {"role": "system", "content": system_instruction},
+                {"role": "user", "content": (
+                    f"This is part {index + 1} of {total} of file {file_name}. Summarize the key information, "
+                    f"facts and conclusions from this part concisely.\n\nPart content:\n\n{chunk}"
+                )}
+            ], max_tokens=DOCUMENT_PARTIAL_MAX_TOKENS)
+            for index, chunk in enumerate(chunks)
+        ]
+        partials = await _run_all(calls, progress, "map")
+        spans = [(index + 1, index + 1) for index in range(total)]
+
+        # Łączenie hierarchiczne: każdy poziom scala grupy wyników, dopóki nie zmieszczą się w jednym zapytaniu
+        levels = 0
+        while True:
+            groups = _group_for_merge(partials, model, chunk_tokens)
+            if len(groups) == 1:
+                break
+            levels += 1
+            calls = []
+            for group in groups:
+                first, last = spans[group[0][0]][0], spans[group[-1][0]][1]
+                summaries = BLOCK_SEPARATOR.join(
+                    f"Parts {spans[i][0]}-{spans[i][1]}:\n{partial}" for i, partial in group
+                )
+                calls.append(lambda first=first, last=last, summaries=summaries: call([
+                    {"role": "system", "content": system_instruction},
+                    {"role": "user", "content": (
+                        f"Combine these partial analyses of parts {first}-{last} of {total} of file {file_name} "
+                        f"into one concise analysis. Keep all key information.\n\n{summaries}"
+                    )}
+                ], max_tokens=DOCUMENT_PARTIAL_MAX_TOKENS))
+            spans = [(spans[group[0][0]][0], spans[group[-1][0]][1]) for group in groups]
+            partials = await _run_all(calls, progress, "reduce")
+
+        summaries = BLOCK_SEPARATOR.join(
+            f"Parts {first}-{last}:\n{partial}" for (first, last), partial in zip(spans, partials)
+        )
+        result = await call([
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": (
+                f"Analyze file {file_name} and describe its contents. Provide key information and conclusions. "
+                f"The file was too long to read at once - below are analyses of its {total} parts in order."
+                f"\n\n{summaries}"
+            )}
+        ], max_tokens=1500)
+        logger.info(
+            f"Przeanalizowano {file_name} w {total} częściach ({levels} poziomów łączenia) "
+            f"w {time.monotonic() - started:.1f} s"
+        )
+        return result
+    finally:
+        await progress.close()
+
+def message_progress(message, language, translate=False):
+    """
+    Tworzy funkcję zgłaszania postępu, która edytuje wiadomość o statusie
+
+    Edycje mają niski priorytet - przy limicie Telegrama są pomijane, a nie kolejkowane.
+    """
+    async def report(stage, done, total):
+        if stage == "reduce":
+            text = get_text("document_progress_merging", language)
+        else:
+            key = "document_progress_translating" if translate else "document_progress_analyzing"
+            text = get_text(key, language, done=done, total=total)
+        with outbound_priority(PRIORITY_LOW):
+            await message.edit_text(text)
+    return report
+
+async def _edit_markdown(message, text):
+    """Edytuje wiadomość z Markdown, a przy niepoprawnym formatowaniu - bez niego"""
+    try:
+        await message.edit_text(text, parse_mode=ParseMode.MARKDOWN)
+    except BadRequest as e:
+        if "not modified" in str(e):
+            return
+        await message.edit_text(text)
+
+async def send_document_result(message, header, result, file_name):
+    """
+    Wysyła wynik analizy w miejsce wiadomości o statusie; wynik dłuższy niż limit wiadomości
+    Telegrama trafia do pliku tekstowego, a wiadomość zawiera jego początek
+    """
+    text = f"{header}{result}"
+    if len(text) <= MESSAGE_LIMIT:
+        await _edit_markdown(message, text)
+        return
+
+    preview = result[:MESSAGE_LIMIT - len(header) - 10].rsplit("\n", 1)[0]
+    await _edit_markdown(message, f"{header}{preview}\n\n[...]")
+
+    document = io.BytesIO(result.encode("utf-8"))
+    base_name = file_name.rsplit(".", 1)[0] if "." in file_name else file_name
+    await message.chat.send_document(document, filename=f"{base_name}_result.txt")
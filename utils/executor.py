@@ -0,0 +1,272 @@
+"""
+Wspólne pule do wykonywania pracy blokującej poza pętlą zdarzeń
+Parsowanie i generowanie PDF, rysowanie wykresów, przygotowanie obrazów i kodowanie Base64
+działają w nazwanych pulach wątków lub procesów (EXECUTOR_POOLS), aby długa operacja jednego
+użytkownika nie wstrzymywała odpowiedzi dla pozostałych. Czysto pythonowa praca (PyPDF2,
+reportlab, matplotlib) trafia do procesów - w wątku i tak trzymałaby GIL - a kod w C, który
+zwalnia GIL (Pillow, base64), do wątków.
+
+Każda pula ma limit zadań w toku i w kolejce - po jego przekroczeniu zadanie jest od razu
+odrzucane (ExecutorBusy) zamiast czekać bez końca - oraz domyślny limit czasu zadania.
+Pula procesów składa się z osobnych procesów roboczych, z których każdy wykonuje naraz jedno
+zadanie. Zadanie, które przekroczy limit czasu, jest przerywane razem ze swoim procesem (np.
+złośliwy PDF nie zajmuje go bez końca), a zadania w pozostałych procesach działają dalej.
+Wątku nie da się przerwać: po przekroczeniu limitu wywołujący dostaje błąd, a zadanie
+zajmuje miejsce w puli, dopóki się nie zakończy.
+
+Funkcje wykonywane w procesach leżą w lekkich modułach (WORKER_MODULES), które nie importują
+reszty bota. Przy metodzie 'forkserver' są one - razem z głównym modułem - importowane raz
+w procesie serwera, a procesy robocze dziedziczą je zamiast importować main.py od nowa.
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import EXECUTOR_POOLS, EXECUTOR_START_METHOD
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Moduły z funkcjami wykonywanymi w pulach procesów - importowane z góry w procesie forkserver
+WORKER_MODULES = ["utils.pdf_reader", "utils.pdf_generator", "utils.chart_renderer"]
+
+class ExecutorBusy(Exception):
+    """Pula ma komplet zadań w toku i w kolejce"""
+
+def _timed(func, args, kwargs):
+    """Wykonuje zadanie w wątku lub procesie puli i mierzy czas samego wykonania"""
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+_context = None
+
+def _get_context():
+    """Zwraca kontekst multiprocessing dla pul procesów (przy pierwszym użyciu ustawia preload serwera)"""
+    global _context
+    if _context is None:
+        _context = multiprocessing.get_context(EXECUTOR_START_METHOD)
+        if EXECUTOR_START_METHOD == "forkserver":
+            # '__main__' importuje main.py raz w serwerze - procesy robocze nie robią tego każdy osobno
+            _context.set_forkserver_preload(["__main__"] + WORKER_MODULES)
+    return _context
+
+class _ProcessSlot:
+    """Jeden proces roboczy puli procesów - wykonuje naraz jedno zadanie, można go przerwać osobno"""
+
+    def __init__(self):
+        self._executor = None
+
+    def submit(self, func, *args):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=_get_context())
+        return self._executor.submit(func, *args)
+
+    def kill(self):
+        """Przerywa proces (z zadaniem w toku) - kolejne zadanie uruchomi nowy; zwraca True, jeśli działał"""
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return False
+        # ProcessPoolExecutor nie ma publicznego sposobu na przerwanie procesu z zadaniem w toku
+        for process in list(getattr(executor, "_processes", {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        return True
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+class ExecutorPool:
+    """
+    Nazwana pula wątków lub procesów z limitem zadań, limitem czasu i statystykami
+
+    Args:
+        name (str): Nazwa puli (w logach i statystykach)
+        kind (str): 'thread' lub 'process'
+        workers (int): Liczba wątków lub procesów
+        queue (int): Liczba zadań, które mogą czekać na wolny wątek lub proces
+        timeout (float): Domyślny limit czasu zadania w sekundach
+    """
+
+    def __init__(self, name, kind, workers, queue, timeout):
+        self.name = name
+        self.kind = kind
+        self.workers = workers
+        self.capacity = workers + queue
+        self.timeout = timeout
+        self._executor = None
+        self._slots = [_ProcessSlot() for _ in range(workers)] if kind == "process" else []
+        # Wolne procesy robocze (tworzona w pętli zdarzeń przy pierwszym zadaniu)
+        self._idle = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "restarts": 0,
+            "max_in_flight": 0,
+            "wait_seconds": 0.0,
+            "run_seconds": 0.0,
+            "max_run_seconds": 0.0
+        }
+
+    def _release(self, _future=None):
+        # W puli wątków wywoływane z wątku puli - po faktycznym zakończeniu zadania
+        with self._lock:
+            self._in_flight -= 1
+
+    async def _run_in_thread(self, func, args, kwargs):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"executor-{self.name}")
+        try:
+            future = self._executor.submit(_timed, func, args, kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _restart_slot(self, slot):
+        if slot.kill():
+            with self._lock:
+                self._stats["restarts"] += 1
+
+    async def _run_in_process(self, func, args, kwargs):
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for slot in self._slots:
+                self._idle.put_nowait(slot)
+
+        slot = await self._idle.get()
+        future = None
+        try:
+            future = slot.submit(_timed, func, args, kwargs)
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Przekroczony limit czasu (wait_for anuluje zadanie) - przerywany jest tylko proces tego zadania
+            if future is not None and not future.done():
+                self._restart_slot(slot)
+            raise
+        except BrokenProcessPool:
+            # Proces zabity przez system - kolejne zadanie w tym miejscu uruchomi nowy
+            self._restart_slot(slot)
+            raise
+        except Exception:
+            if future is None:
+                # Nie udało się przekazać zadania do procesu - następne dostanie nowy
+                self._restart_slot(slot)
+            raise
+        finally:
+            self._idle.put_nowait(slot)
+
+    async def run(self, func, args, kwargs, timeout=None):
+        """Wykonuje func(*args, **kwargs) w puli; zob. run_blocking"""
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self._stats["rejected"] += 1
+                raise ExecutorBusy(self.name)
+            self._in_flight += 1
+            self._stats["submitted"] += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._in_flight)
+
+        submitted = time.monotonic()
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            if self.kind == "process":
+                work = self._run_in_process(func, args, kwargs)
+            else:
+                work = self._run_in_thread(func, args, kwargs)
+            result, run_seconds = await asyncio.wait_for(work, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            logger.error(f"Zadanie {getattr(func, '__name__', func)} w puli {self.name} przekroczyło limit {timeout} s")
+            raise
+        except BrokenProcessPool:
+            with self._lock:
+                self._stats["failed"] += 1
+            logger.error(f"Proces roboczy puli {self.name} przestał działać - zostanie uruchomiony od nowa")
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        finally:
+            # Proces z zadaniem jest zwolniony albo przerwany - w puli wątków zwalnia _release
+            if self.kind == "process":
+                self._release()
+
+        with self._lock:
+            self._stats["completed"] += 1
+            self._stats["run_seconds"] += run_seconds
+            self._stats["wait_seconds"] += max(0.0, time.monotonic() - submitted - run_seconds)
+            self._stats["max_run_seconds"] = max(self._stats["max_run_seconds"], run_seconds)
+        return result
+
+    def shutdown(self):
+        """Zamyka pulę bez czekania na zadania w toku"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        for slot in self._slots:
+            slot.shutdown()
+
+    def stats(self):
+        """Zwraca statystyki puli wraz ze średnim czasem oczekiwania i wykonania"""
+        with self._lock:
+            stats = dict(self._stats, kind=self.kind, workers=self.workers, capacity=self.capacity,
+                         in_flight=self._in_flight)
+        completed = stats["completed"]
+        wait_seconds = stats.pop("wait_seconds")
+        run_seconds = stats.pop("run_seconds")
+        stats["avg_wait_ms"] = round(wait_seconds * 1000 / completed, 1) if completed else 0.0
+        stats["avg_run_ms"] = round(run_seconds * 1000 / completed, 1) if completed else 0.0
+        stats["max_run_ms"] = round(stats.pop("max_run_seconds") * 1000, 1)
+        return stats
+
+# Wspólne pule dla całego procesu (tworzone przy pierwszym zadaniu)
+_pools = {name: ExecutorPool(name, **settings) for name, settings in EXECUTOR_POOLS.items()}
+
+async def run_blocking(pool, func, *args, timeout=None, **kwargs):
+    """
+    Wykonuje funkcję blokującą w nazwanej puli i czeka na wynik bez blokowania pętli zdarzeń
+
+    W puli procesów funkcja, argumenty i wynik są przekazywane przez pickle - funkcja musi być
+    zdefiniowana na poziomie modułu, a argumenty nie mogą być otwartymi plikami.
+
+    Args:
+        pool (str): Nazwa puli z EXECUTOR_POOLS (np. 'threads', 'pdf', 'charts')
+        func (callable): Funkcja do wykonania
+        *args: Argumenty funkcji
+        timeout (float, optional): Limit czasu zadania w sekundach; domyślnie limit puli
+        **kwargs: Argumenty nazwane funkcji
+
+    Returns:
+        Wynik funkcji
+
+    Raises:
+        ExecutorBusy: Gdy pula ma komplet zadań w toku i w kolejce
+        asyncio.TimeoutError: Gdy zadanie przekroczyło limit czasu
+    """
+    return await _pools[pool].run(func, args, kwargs, timeout)
+
+def shutdown_executors():
+    """Zamyka wszystkie pule (przy zamykaniu bota)"""
+    for pool in _pools.values():
+        pool.shutdown()
+
+def _pool_stats():
+    """Zwraca statystyki wszystkich pul"""
+    return {name: pool.stats() for name, pool in _pools.items()}
+
+register_stats("executor", _pool_stats)
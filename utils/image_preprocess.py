@@ -0,0 +1,141 @@
+"""
+Przygotowanie obrazów przed wywołaniem modelu z obsługą obrazów
+Obraz jest zmniejszany do rozdzielczości, którą model faktycznie wykorzystuje (większe
+obrazy API i tak skaluje po stronie serwera), ponownie kompresowany do JPEG i wysyłany
+z dobraną szczegółowością: 'high' dla odczytu tekstu (tłumaczenie) i obrazów wydłużonych,
+'low' dla zwykłego opisu - 85 tokenów zamiast kilkuset. Dekodowanie i kompresja działają
+w puli wątków 'threads' (utils.executor), aby nie blokować pętli zdarzeń.
+"""
+import io
+import logging
+import threading
+import time
+from PIL import Image, ImageOps
+from utils.executor import run_blocking
+from config import IMAGE_DETAIL, IMAGE_JPEG_QUALITY
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Rozdzielczość wykorzystywana przez model: w wysokiej szczegółowości obraz mieści się
+# w 2048x2048, a krótszy bok ma najwyżej 768 px; w niskiej - mieści się w 512x512
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_MAX_SHORT_SIDE = 768
+LOW_DETAIL_MAX_SIDE = 512
+
+# Obrazy wyraźnie wydłużone (zrzuty ekranu, paragony, skany) są nieczytelne w niskiej szczegółowości
+TALL_ASPECT_RATIO = 2.5
+
+# Znacznik EXIF z orientacją zdjęcia; wartości 5-8 oznaczają obrót o 90 stopni
+EXIF_ORIENTATION = 0x0112
+
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "failures": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+
+def choose_detail(width, height, mode="analyze"):
+    """
+    Dobiera szczegółowość obrazu do jego rozmiaru i zadania
+
+    Args:
+        width (int): Szerokość obrazu
+        height (int): Wysokość obrazu
+        mode (str): Tryb: 'analyze' (opis) lub 'translate' (odczyt i tłumaczenie tekstu)
+
+    Returns:
+        str: 'low' lub 'high'
+    """
+    if IMAGE_DETAIL in ("low", "high"):
+        return IMAGE_DETAIL
+    # Mały obraz wygląda tak samo w obu trybach - niska szczegółowość jest tańsza
+    if max(width, height) <= LOW_DETAIL_MAX_SIDE:
+        return "low"
+    if mode == "translate":
+        return "high"
+    return "high" if max(width, height) / max(1, min(width, height)) >= TALL_ASPECT_RATIO else "low"
+
+def target_size(width, height, detail):
+    """Rozmiar, do którego warto zmniejszyć obraz przy danej szczegółowości (nigdy nie powiększa)"""
+    if detail == "low":
+        scale = LOW_DETAIL_MAX_SIDE / max(width, height)
+    else:
+        scale = min(HIGH_DETAIL_MAX_SIDE / max(width, height), HIGH_DETAIL_MAX_SHORT_SIDE / min(width, height))
+    scale = min(1.0, scale)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def _prepare(image_content, mode):
+    image = Image.open(io.BytesIO(image_content))
+    source_format = image.format
+
+    # Rozmiar po uwzględnieniu orientacji z EXIF (zdjęcia z telefonów)
+    orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+    width, height = image.size
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+
+    detail = choose_detail(width, height, mode)
+    size = target_size(width, height, detail)
+
+    if source_format == "JPEG" and size == (width, height) and orientation == 1:
+        # Obraz mieści się już w limitach - ponowna kompresja tylko obniżyłaby jakość
+        return bytes(image_content), "image/jpeg", detail
+
+    # JPEG można zdekodować od razu w zmniejszonej skali, co znacznie skraca dekodowanie dużych zdjęć
+    image.draft("RGB", size if orientation < 5 else (size[1], size[0]))
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode not in ("RGB", "L"):
+        # JPEG nie obsługuje przezroczystości - obraz trafia na białe tło
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+
+    if image.size != size:
+        image = image.resize(size, Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return output.getvalue(), "image/jpeg", detail
+
+async def prepare_image(image_content, mode="analyze"):
+    """
+    Przygotowuje obraz do wysłania do modelu (w puli wątków)
+
+    Args:
+        image_content (bytes): Zawartość obrazu w dowolnym formacie obsługiwanym przez Pillow
+        mode (str): Tryb: 'analyze' lub 'translate'
+
+    Returns:
+        tuple: (zawartość, typ MIME, szczegółowość); gdy obrazu nie udało się odczytać -
+               oryginalna zawartość, 'image/jpeg' i None (domyślna szczegółowość API)
+    """
+    started = time.monotonic()
+    try:
+        content, mime_type, detail = await run_blocking("threads", _prepare, bytes(image_content), mode)
+    except Exception as e:
+        logger.warning(f"Nie udało się przygotować obrazu - wysyłam oryginał: {e}")
+        with _stats_lock:
+            _stats["failures"] += 1
+        return bytes(image_content), "image/jpeg", None
+
+    elapsed = time.monotonic() - started
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["bytes_in"] += len(image_content)
+        _stats["bytes_out"] += len(content)
+        _stats["seconds"] += elapsed
+    logger.info(
+        f"Obraz przygotowany w {elapsed * 1000:.0f} ms: {len(image_content)} -> {len(content)} B, "
+        f"szczegółowość {detail}"
+    )
+    return content, mime_type, detail
+
+def _preprocess_stats():
+    """Zwraca statystyki przygotowania obrazów: łączne rozmiary, średni czas i stopień zmniejszenia"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["avg_ms"] = round(stats["seconds"] * 1000 / stats["images"], 1) if stats["images"] else 0.0
+    stats["ratio"] = round(stats["bytes_out"] / stats["bytes_in"], 3) if stats["bytes_in"] else 0.0
+    return stats
+
+register_stats("image_preprocess", _preprocess_stats)
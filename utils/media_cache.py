@@ -0,0 +1,436 @@
+"""
+Pobieranie plików z Telegrama ze wspólną pamięcią podręczną
+Pliki są identyfikowane przez file_unique_id (ten sam dla tego samego pliku, niezależnie
+od wiadomości i bota), więc scenariusz "analizuj, potem przetłumacz" pobiera plik raz.
+Przyciski przekazują tylko file_id - powiązanie file_id -> file_unique_id jest zapamiętywane
+przy pierwszym pobraniu.
+
+Równoczesne pobrania tego samego pliku są łączone w jedno. Ostatnio używane pliki
+są trzymane w pamięci (LRU ograniczone łącznym rozmiarem), a usuwane z pamięci trafiają
+do opcjonalnego katalogu na dysku (MEDIA_CACHE_DIR). Ścieżki plików z getFile są ważne
+co najmniej godzinę i w tym czasie są używane ponownie bez zapytania do Bot API.
+
+Duże dokumenty otwiera się przez open_file: plik jest pobierany strumieniowo do pliku
+tymczasowego (w pamięci tylko do MEDIA_SPOOL_MEMORY_BYTES), a wywołujący czyta go jak
+zwykły plik - zużycie pamięci nie zależy od rozmiaru dokumentu.
+"""
+import asyncio
+import io
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import httpx
+from config import (
+    MEDIA_CACHE_MEMORY_BYTES, MEDIA_CACHE_MAX_FILE_BYTES, MEDIA_CACHE_TTL,
+    MEDIA_CACHE_DIR, MEDIA_CACHE_DISK_MAX_BYTES, MEDIA_SPOOL_MEMORY_BYTES
+)
+from utils.disk_lru import DiskLRU
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Ścieżka pliku z getFile jest ważna co najmniej godzinę - używamy jej nieco krócej
+FILE_PATH_TTL = 50 * 60
+
+# Maksymalna liczba zapamiętanych ścieżek plików i powiązań file_id -> file_unique_id
+MAX_FILE_IDS = 10000
+
+# Pobieranie strumieniowe: rozmiar fragmentu i limity czasu
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+class MediaDiskTier(DiskLRU):
+    """
+    Katalog z plikami usuniętymi z pamięci, ograniczony łącznym rozmiarem
+
+    Args:
+        directory (str): Katalog na pliki
+        max_bytes (int): Maksymalny łączny rozmiar plików
+        ttl (float): Czas przechowywania pliku od ostatniego użycia (s)
+    """
+
+    def __init__(self, directory, max_bytes, ttl):
+        super().__init__(directory, max_bytes, ".bin", ttl)
+
+    def get(self, key):
+        stream = self.open(key)
+        if stream is None:
+            return None
+        with stream:
+            return stream.read()
+
+    def set(self, key, data):
+        self.write(key, io.BytesIO(data))
+
+class MediaCache:
+    """
+    Pamięć podręczna plików z Telegrama: LRU w pamięci, opcjonalny dysk i łączenie pobrań
+
+    Args:
+        max_bytes (int): Limit łącznego rozmiaru plików w pamięci
+        max_file_bytes (int): Największy zapamiętywany plik
+        ttl (float): Czas przechowywania pliku od ostatniego użycia (s)
+        directory (str, optional): Katalog poziomu dyskowego; None wyłącza dysk
+        disk_max_bytes (int): Limit rozmiaru poziomu dyskowego
+    """
+
+    def __init__(self, max_bytes, max_file_bytes, ttl, directory=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()   # file_unique_id -> (zawartość, czas ostatniego użycia)
+        self._paths = OrderedDict()     # file_id -> (obiekt File z getFile, czas ważności)
+        self._aliases = OrderedDict()   # file_id -> file_unique_id
+        self._inflight = {}
+        self.total_bytes = 0
+        self.disk = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.joined = 0
+        self.path_hits = 0
+        self.bytes_downloaded = 0
+
+        if directory:
+            try:
+                self.disk = MediaDiskTier(directory, disk_max_bytes, ttl)
+            except Exception as e:
+                logger.error(f"Nie udało się przygotować katalogu pamięci podręcznej plików {directory}: {e}")
+
+    async def fetch(self, bot, file_id, file_unique_id=None):
+        """
+        Zwraca zawartość pliku - z pamięci, z dysku lub pobraną z Telegrama
+
+        Args:
+            bot: Bot z python-telegram-bot
+            file_id (str): file_id pliku
+            file_unique_id (str, optional): file_unique_id, jeśli jest znany
+
+        Returns:
+            bytes: Zawartość pliku
+        """
+        if file_unique_id:
+            self._remember(self._aliases, file_id, file_unique_id)
+        else:
+            file_unique_id = self._aliases.get(file_id)
+
+        if file_unique_id:
+            data = await self._lookup(file_unique_id)
+            if data is not None:
+                return data
+
+        # Równoczesne prośby o ten sam plik (również przez open) czekają na jedno pobranie
+        key = file_unique_id or file_id
+        task = self._inflight.get(key)
+        if task is not None:
+            self.joined += 1
+            result = await asyncio.shield(task)
+            if isinstance(result, bytes):
+                return result
+            # Pobranie przez open zwraca plik tymczasowy wywołującego - zawartość jest
+            # w pamięci lub na dysku, o ile mieści się w limitach
+            file_unique_id = self._aliases.get(file_id)
+            data = await self._lookup(file_unique_id) if file_unique_id else None
+            if data is not None:
+                return data
+
+        return await self._start_download(key, self._download(bot, file_id))
+
+    @asynccontextmanager
+    async def open(self, bot, file_id, file_unique_id=None):
+        """
+        Otwiera plik do odczytu bez wczytywania całej zawartości do pamięci
+
+        Args:
+            bot: Bot z python-telegram-bot
+            file_id (str): file_id pliku
+            file_unique_id (str, optional): file_unique_id, jeśli jest znany
+
+        Yields:
+            Plik binarny ustawiony na początku (zamykany po wyjściu z bloku)
+        """
+        stream = await self._open(bot, file_id, file_unique_id)
+        try:
+            yield stream
+        finally:
+            stream.close()
+
+    async def _open(self, bot, file_id, file_unique_id):
+        if file_unique_id:
+            self._remember(self._aliases, file_id, file_unique_id)
+        else:
+            file_unique_id = self._aliases.get(file_id)
+
+        if file_unique_id:
+            stream = await self._open_cached(file_unique_id)
+            if stream is not None:
+                return stream
+
+        # Równoczesne prośby o ten sam plik (również przez fetch) czekają na jedno pobranie
+        key = file_unique_id or file_id
+        task = self._inflight.get(key)
+        if task is not None:
+            self.joined += 1
+            stream = await self._open_joined(task, file_id)
+            if stream is not None:
+                return stream
+
+        return await self._start_download(key, self._download_to_spool(bot, file_id))
+
+    async def _open_joined(self, task, file_id):
+        """
+        Czeka na trwające pobranie i otwiera jego wynik; None, gdy plik trzeba pobrać samodzielnie
+        (błąd pobrania albo plik zbyt duży, aby trafił do pamięci podręcznej)
+        """
+        try:
+            result = await asyncio.shield(task)
+        except Exception:
+            return None
+        if isinstance(result, bytes):
+            return io.BytesIO(result)
+        # Plik tymczasowy z pobrania przez open należy do wywołującego - czytamy zapamiętaną kopię
+        file_unique_id = self._aliases.get(file_id)
+        return await self._open_cached(file_unique_id) if file_unique_id else None
+
+    async def _start_download(self, key, download):
+        """
+        Uruchamia pobranie, do którego mogą dołączyć równoczesne prośby o ten sam plik
+
+        Args:
+            key (str): file_unique_id lub file_id pliku
+            download: Korutyna pobierająca plik (_download lub _download_to_spool)
+        """
+        task = asyncio.ensure_future(download)
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._download_finished(key, done))
+
+        # Przerwanie jednego z oczekujących nie przerywa pobrania dla pozostałych
+        return await asyncio.shield(task)
+
+    async def _download_to_spool(self, bot, file_id):
+        """Pobiera plik strumieniowo do pliku tymczasowego i zapamiętuje go, o ile mieści się w limitach"""
+        file, from_cache = await self._get_file(bot, file_id)
+        file_unique_id = file.file_unique_id
+        self._remember(self._aliases, file_id, file_unique_id)
+
+        stream = await self._open_cached(file_unique_id)
+        if stream is not None:
+            return stream
+        self.misses += 1
+
+        try:
+            spool = await self._stream_download(file)
+        except Exception:
+            if not from_cache:
+                raise
+            # Zapamiętana ścieżka mogła wygasnąć - pobierz nową
+            self._paths.pop(file_id, None)
+            file, _ = await self._get_file(bot, file_id)
+            spool = await self._stream_download(file)
+
+        size = spool.seek(0, os.SEEK_END)
+        self.bytes_downloaded += size
+        spool.seek(0)
+
+        # Małe pliki zapamiętujemy w pamięci, większe tylko na dysku
+        if size <= MEDIA_SPOOL_MEMORY_BYTES:
+            await self._store(file_unique_id, spool.read())
+        elif self.disk is not None and size <= self.max_file_bytes:
+            try:
+                await asyncio.to_thread(self.disk.write, file_unique_id, spool)
+            except Exception as e:
+                logger.error(f"Błąd zapisu pliku do pamięci podręcznej na dysku: {e}")
+        spool.seek(0)
+        return spool
+
+    async def _open_cached(self, file_unique_id):
+        """Otwiera plik z pamięci lub z dysku; None, jeśli nie jest zapamiętany"""
+        entry = self._entries.get(file_unique_id)
+        if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+            self.hits += 1
+            self._entries[file_unique_id] = (entry[0], time.monotonic())
+            self._entries.move_to_end(file_unique_id)
+            # BytesIO z obiektu bytes współdzieli bufor do pierwszego zapisu - bez kopiowania
+            return io.BytesIO(entry[0])
+
+        if self.disk is None:
+            return None
+        try:
+            stream = await asyncio.to_thread(self.disk.open, file_unique_id)
+        except Exception as e:
+            logger.warning(f"Błąd odczytu pliku z pamięci podręcznej na dysku: {e}")
+            return None
+        if stream is not None:
+            self.disk_hits += 1
+        return stream
+
+    async def _stream_download(self, file):
+        """Pobiera plik fragmentami do pliku tymczasowego"""
+        if not file.file_path.startswith(("http://", "https://")):
+            # Lokalny serwer Bot API udostępnia plik na dysku - czytamy go bezpośrednio
+            return await asyncio.to_thread(open, file.file_path, "rb")
+
+        spool = tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_MEMORY_BYTES)
+        try:
+            async with httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT) as client:
+                async with client.stream("GET", file.file_path) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        return spool
+
+    def _download_finished(self, key, task):
+        # Po nieudanym dołączeniu pod tym kluczem mogło już ruszyć kolejne pobranie
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Błąd pobierania pliku {key}: {task.exception()}")
+
+    async def _download(self, bot, file_id):
+        file, from_cache = await self._get_file(bot, file_id)
+        file_unique_id = file.file_unique_id
+        self._remember(self._aliases, file_id, file_unique_id)
+
+        # Plik mógł trafić do pamięci pod file_unique_id przez inny file_id
+        data = await self._lookup(file_unique_id)
+        if data is not None:
+            return data
+        self.misses += 1
+
+        try:
+            data = bytes(await file.download_as_bytearray())
+        except Exception:
+            if not from_cache:
+                raise
+            # Zapamiętana ścieżka mogła wygasnąć - pobierz nową
+            self._paths.pop(file_id, None)
+            file, _ = await self._get_file(bot, file_id)
+            data = bytes(await file.download_as_bytearray())
+
+        self.bytes_downloaded += len(data)
+        await self._store(file_unique_id, data)
+        return data
+
+    async def _get_file(self, bot, file_id):
+        """Zwraca obiekt File (ze ścieżką do pobrania) i informację, czy pochodzi z pamięci"""
+        cached = self._paths.get(file_id)
+        if cached is not None and cached[1] > time.monotonic():
+            self.path_hits += 1
+            self._paths.move_to_end(file_id)
+            return cached[0], True
+
+        file = await bot.get_file(file_id)
+        self._remember(self._paths, file_id, (file, time.monotonic() + FILE_PATH_TTL))
+        return file, False
+
+    async def _lookup(self, file_unique_id):
+        entry = self._entries.get(file_unique_id)
+        now = time.monotonic()
+        if entry is not None:
+            if now - entry[1] <= self.ttl:
+                self.hits += 1
+                self._entries[file_unique_id] = (entry[0], now)
+                self._entries.move_to_end(file_unique_id)
+                return entry[0]
+            self._drop(file_unique_id)
+
+        if self.disk is None:
+            return None
+        try:
+            data = await asyncio.to_thread(self.disk.get, file_unique_id)
+        except Exception as e:
+            logger.warning(f"Błąd odczytu pliku z pamięci podręcznej na dysku: {e}")
+            return None
+        if data is None:
+            return None
+
+        self.disk_hits += 1
+        await self._store(file_unique_id, data)
+        return data
+
+    async def _store(self, file_unique_id, data):
+        if len(data) > self.max_file_bytes:
+            return
+        if file_unique_id in self._entries:
+            self._drop(file_unique_id)
+        self._entries[file_unique_id] = (data, time.monotonic())
+        self.total_bytes += len(data)
+
+        evicted = []
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, (old_data, used) = self._entries.popitem(last=False)
+            self.total_bytes -= len(old_data)
+            if time.monotonic() - used <= self.ttl:
+                evicted.append((key, old_data))
+
+        # Pliki usunięte z pamięci trafiają na dysk
+        if self.disk is not None:
+            for key, old_data in evicted:
+                try:
+                    await asyncio.to_thread(self.disk.set, key, old_data)
+                except Exception as e:
+                    logger.error(f"Błąd zapisu pliku do pamięci podręcznej na dysku: {e}")
+
+    def _drop(self, file_unique_id):
+        data, _ = self._entries.pop(file_unique_id)
+        self.total_bytes -= len(data)
+
+    @staticmethod
+    def _remember(mapping, key, value):
+        mapping[key] = value
+        mapping.move_to_end(key)
+        while len(mapping) > MAX_FILE_IDS:
+            mapping.popitem(last=False)
+
+    def stats(self):
+        """Zwraca statystyki trafień i zajętości"""
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "files": len(self._entries),
+            "memory_bytes": self.total_bytes,
+            "disk_bytes": self.disk.total_bytes if self.disk else 0,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "joined_downloads": self.joined,
+            "file_path_hits": self.path_hits,
+            "bytes_downloaded": self.bytes_downloaded,
+            "hit_ratio": round((self.hits + self.disk_hits) / total, 3) if total else 0.0
+        }
+
+# Wspólna instancja dla całego procesu
+_cache = MediaCache(
+    MEDIA_CACHE_MEMORY_BYTES, MEDIA_CACHE_MAX_FILE_BYTES, MEDIA_CACHE_TTL,
+    MEDIA_CACHE_DIR, MEDIA_CACHE_DISK_MAX_BYTES
+)
+register_stats("media_cache", _cache.stats)
+
+async def fetch_file(bot, file_id, file_unique_id=None):
+    """
+    Pobiera plik z Telegrama przez wspólną pamięć podręczną
+
+    Args:
+        bot: Bot z python-telegram-bot (np. context.bot)
+        file_id (str): file_id pliku
+        file_unique_id (str, optional): file_unique_id - pozwala zwrócić plik bez zapytania do Bot API
+
+    Returns:
+        bytes: Zawartość pliku
+    """
+    return await _cache.fetch(bot, file_id, file_unique_id)
+
+def open_file(bot, file_id, file_unique_id=None):
+    """
+    Otwiera plik z Telegrama do odczytu strumieniowego (async context manager)
+
+    Przykład:
+        async with open_file(context.bot, document.file_id, document.file_unique_id) as f:
+            result = await analyze_document(f, document.file_name)
+    """
+    return _cache.open(bot, file_id, file_unique_id)
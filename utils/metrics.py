@@ -0,0 +1,86 @@
+"""
+Statystyki działania bota zebrane w jednym miejscu
+Moduły ze wspólnymi kolejkami, pulami i pamięciami podręcznymi rejestrują funkcję zwracającą
+swoje statystyki (register_stats). collect_stats() zbiera je dla komendy administratora /stats
+i dla okresowego wpisu w logu (co METRICS_LOG_INTERVAL sekund; 0 wyłącza wpisy).
+"""
+import asyncio
+import json
+import logging
+from config import METRICS_LOG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Nazwa -> funkcja bez argumentów zwracająca statystyki (słownik lub lista)
+_providers = {}
+_log_task = None
+
+def register_stats(name, provider):
+    """
+    Rejestruje źródło statystyk
+
+    Args:
+        name (str): Nazwa w zestawieniu (np. 'message_queue')
+        provider (callable): Funkcja bez argumentów zwracająca statystyki
+    """
+    _providers[name] = provider
+
+def collect_stats():
+    """Zwraca statystyki wszystkich zarejestrowanych źródeł (nazwa -> statystyki)"""
+    stats = {}
+    for name, provider in _providers.items():
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            logger.error(f"Błąd przy zbieraniu statystyk {name}: {e}")
+            stats[name] = {"error": str(e)}
+    return stats
+
+def format_stats(stats):
+    """
+    Formatuje statystyki jako tekst - jeden wiersz na grupę wartości, np.
+    'executor.pdf: submitted=5 completed=4 timeouts=1'
+    """
+    lines = []
+
+    def add(prefix, value):
+        if isinstance(value, list):
+            for index, item in enumerate(value):
+                add(f"{prefix}[{index}]", item)
+        elif isinstance(value, dict):
+            scalars = {key: item for key, item in value.items() if not isinstance(item, (dict, list))}
+            if scalars:
+                lines.append(f"{prefix}: " + " ".join(f"{key}={item}" for key, item in scalars.items()))
+            for key, item in value.items():
+                if isinstance(item, (dict, list)):
+                    add(f"{prefix}.{key}", item)
+        else:
+            lines.append(f"{prefix}: {value}")
+
+    for name, value in stats.items():
+        add(name, value)
+    return "\n".join(lines)
+
+async def _log_periodically(interval):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Statystyki: {json.dumps(collect_stats(), ensure_ascii=False, default=str)}")
+
+def start_stats_logging():
+    """Uruchamia okresowy zapis statystyk w logu (wywoływane przy starcie bota)"""
+    global _log_task
+    if METRICS_LOG_INTERVAL > 0 and (_log_task is None or _log_task.done()):
+        _log_task = asyncio.get_running_loop().create_task(_log_periodically(METRICS_LOG_INTERVAL))
+
+async def stop_stats_logging():
+    """Zatrzymuje okresowy zapis statystyk i zapisuje je ostatni raz (przy zamykaniu bota)"""
+    global _log_task
+    if _log_task is None:
+        return
+    _log_task.cancel()
+    try:
+        await _log_task
+    except asyncio.CancelledError:
+        pass
+    _log_task = None
+    logger.info(f"Statystyki: {json.dumps(collect_stats(), ensure_ascii=False, default=str)}")
@@ -1,73 +1,168 @@
 import openai
 from openai import AsyncOpenAI
 import base64
+import codecs
 import os
 import asyncio
 from utils.translations import get_text
-from config import OPENAI_API_KEY, DEFAULT_MODEL, DEFAULT_SYSTEM_PROMPT, DALL_E_MODEL
+from config import (
+    OPENAI_API_KEY, DEFAULT_MODEL, DEFAULT_SYSTEM_PROMPT, DALL_E_MODEL, OPENAI_STREAM_USAGE,
+    DOCUMENT_TEXT_MAX_BYTES, DOCUMENT_CHUNK_TOKENS, DOCUMENT_TRANSLATE_CHUNK_TOKENS
+)
 print(f"API Key is {'set' if OPENAI_API_KEY else 'NOT SET'}")
 print(f"API Key length: {len(OPENAI_API_KEY) if OPENAI_API_KEY else 0}")
 
-from httpx import AsyncClient
-http_client = AsyncClient()
-client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
+from utils.openai_http import http_client, REQUEST_TIMEOUT, STREAM_TIMEOUT
+from utils.rate_limiter import acquire_rate_limit, estimate_prompt_tokens, estimate_request_tokens
+from utils.context_builder import count_tokens
+from utils.openai_retry import call_with_retry, stream_with_retry
+from utils.result_cache import make_result_key, get_cached_result, cache_result
+from utils.usage_meter import usage_from_response, record_usage, add_call_usage
+from utils.image_preprocess import prepare_image
+from utils.document_analysis import analyze_long_document, split_into_chunks
+from utils.executor import run_blocking
+# Ponawianiem zajmuje się utils.openai_retry - wbudowane ponowienia SDK są wyłączone
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, timeout=REQUEST_TIMEOUT, max_retries=0)
 
 import os
 os.environ["HTTPX_SKIP_PROXY"] = "true"  # Wyłącza proxy dla httpx
 
-async def chat_completion_stream(messages, model=DEFAULT_MODEL):
+# Model analizy i tłumaczenia dokumentów
+DOCUMENT_MODEL = "gpt-4o"
+
+# Rozszerzenia plików, których treść jest dołączana do zapytania jako tekst
+TEXT_EXTENSIONS = ['.txt', '.csv', '.md', '.json', '.xml', '.html', '.js', '.py', '.cpp', '.c', '.java']
+
+# Nazwy języków docelowych tłumaczenia używane w instrukcjach dla modelu
+LANGUAGE_NAMES = {
+    "en": "English",
+    "pl": "Polish",
+    "ru": "Russian",
+    "fr": "French",
+    "de": "German",
+    "es": "Spanish",
+    "it": "Italian",
+    "zh": "Chinese"
+}
+
+async def _stream_chat(messages, model, call_info=None):
+    """Jedna próba odpowiedzi strumieniowej dla podanego modelu"""
+    # Czekamy tylko wtedy, gdy limit zapytań lub tokenów modelu jest wyczerpany
+    prompt_tokens = estimate_prompt_tokens(messages, model)
+    slot = await acquire_rate_limit(model, estimate_request_tokens(messages, model))
+    
+    # Zużycie tokenów przychodzi w ostatnim fragmencie (bez treści), o ile o nie poprosimy
+    extra_body = {"stream_options": {"include_usage": True}} if OPENAI_STREAM_USAGE else None
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        timeout=STREAM_TIMEOUT,
+        extra_body=extra_body
+    )
+    
+    generated = []
+    usage = None
+    try:
+        async for chunk in stream:
+            usage = usage_from_response(chunk) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                generated.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    finally:
+        # Przy przerwaniu (np. przycisk "Stop") zamknij połączenie od razu, aby model przestał generować
+        await stream.response.aclose()
+        # Bez zużycia z API (przerwany strumień) liczymy tokeny promptu i wygenerowanego tekstu
+        if usage is None:
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": count_tokens("".join(generated), model),
+                "estimated": True
+            }
+        slot.settle(usage["prompt_tokens"] + usage["completion_tokens"])
+        record_usage(model, usage)
+        if call_info is not None:
+            call_info["usage"] = usage
+
+async def chat_completion_stream(messages, model=DEFAULT_MODEL, fallback=True, call_info=None):
     """
     Wygeneruj odpowiedź strumieniową z OpenAI API
     
+    Błędy przejściowe przed pierwszym fragmentem są ponawiane (również na modelu
+    zapasowym), więc wywołujący widzi je tylko jako wyjątek po wyczerpaniu prób.
+    
     Args:
         messages (list): Lista wiadomości w formacie OpenAI
         model (str, optional): Model do użycia. Domyślnie DEFAULT_MODEL.
+        fallback (bool, optional): Czy wolno przejść na model zapasowy z MODEL_FALLBACK_CHAIN
+        call_info (dict, optional): Uzupełniany o faktycznie użyty model ('model'), liczbę prób ('attempts')
+            i zużycie tokenów ostatniej próby ('usage': prompt_tokens, completion_tokens, estimated)
     
     Returns:
         async generator: Generator zwracający fragmenty odpowiedzi
+    
+    Raises:
+        Exception: Błąd API, jeśli odpowiedzi nie udało się wygenerować
     """
+    print(f"Wywołuję OpenAI API z modelem {model}")
     try:
-        print(f"Wywołuję OpenAI API z modelem {model}")
-        # Dodaj opóźnienie w przypadku gdy używamy GPT-4 (aby uniknąć rate limitów)
-        if "gpt-4" in model:
-            import asyncio
-            await asyncio.sleep(0.5)
-            
-        stream = await client.chat.completions.create(
-            model=model,
-            messages=messages,
-            stream=True
-        )
-        
-        async for chunk in stream:
-            if chunk.choices and chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+        async for piece in stream_with_retry(
+            lambda attempt_model: _stream_chat(messages, attempt_model, call_info), model, fallback, call_info
+        ):
+            yield piece
     except Exception as e:
-        error_msg = f"Błąd API OpenAI (stream): {str(e)}"
-        print(error_msg)
-        yield error_msg
+        print(f"Błąd API OpenAI (stream): {e}")
+        raise
 
+async def create_chat_completion(messages, model, fallback=False, **kwargs):
+    """
+    Wywołanie niestrumieniowe z limitem zapytań modelu i ponawianiem
+    
+    Args:
+        messages (list): Lista wiadomości w formacie OpenAI
+        model (str): Model do użycia
+        fallback (bool, optional): Czy wolno przejść na model zapasowy
+        **kwargs: Dodatkowe parametry API (np. max_tokens)
+    
+    Returns:
+        tuple: (odpowiedź API, faktycznie użyty model)
+    """
+    async def request(attempt_model):
+        slot = await acquire_rate_limit(
+            attempt_model, estimate_request_tokens(messages, attempt_model, kwargs.get("max_tokens"))
+        )
+        response = await client.chat.completions.create(model=attempt_model, messages=messages, **kwargs)
+        slot.settle(get_usage_tokens(response))
+        record_usage(attempt_model, usage_from_response(response))
+        return response
+
+    return await call_with_retry(request, model, fallback)
 
-async def chat_completion(messages, model=DEFAULT_MODEL):
+
+async def chat_completion(messages, model=DEFAULT_MODEL, call_info=None):
     """
     Wygeneruj całą odpowiedź z OpenAI API (niestrumieniowa)
     
     Args:
         messages (list): Lista wiadomości w formacie OpenAI
         model (str, optional): Model do użycia. Domyślnie DEFAULT_MODEL.
+        call_info (dict, optional): Uzupełniany o zużycie tokenów ('usage': prompt_tokens, completion_tokens)
     
     Returns:
-        str: Wygenerowana odpowiedź
+        str: Wygenerowana odpowiedź lub None, jeśli nie udało się jej uzyskać
     """
     try:
-        response = await client.chat.completions.create(
-            model=model,
-            messages=messages
-        )
+        response, _ = await create_chat_completion(messages, model, fallback=True)
+        add_call_usage(call_info, usage_from_response(response))
         return response.choices[0].message.content
     except Exception as e:
         print(f"Błąd API OpenAI: {e}")
-        return get_text("openai_response_error", language, error=str(e))
+        return None
+
+def get_usage_tokens(response):
+    """Zwraca łączne zużycie tokenów z odpowiedzi API lub None, jeśli go brak"""
+    usage = getattr(response, "usage", None)
+    return usage.total_tokens if usage else None
 
 def prepare_messages_from_history(history, user_message, system_prompt=None):
     """
@@ -114,50 +209,119 @@ async def generate_image_dall_e(prompt):
     Returns:
         str: URL wygenerowanego obrazu lub błąd
     """
-    try:
-        response = await client.images.generate(
-            model=DALL_E_MODEL,
+    async def request(model):
+        await acquire_rate_limit(model)
+        return await client.images.generate(
+            model=model,
             prompt=prompt,
             n=1,
             size="1024x1024"
         )
-        
+    
+    try:
+        response, _ = await call_with_retry(request, DALL_E_MODEL, fallback=False)
         return response.data[0].url
     except Exception as e:
         print(f"Błąd generowania obrazu: {e}")
         return None
 
 
-async def analyze_document(file_content, file_name, mode="analyze", target_language="en"):
+def read_document_text(file_content, max_bytes=DOCUMENT_TEXT_MAX_BYTES):
+    """
+    Odczytuje tekst UTF-8 z początku dokumentu
+
+    Args:
+        file_content (bytes or file): Zawartość pliku lub otwarty plik binarny
+        max_bytes (int): Największa liczba odczytywanych bajtów
+
+    Returns:
+        tuple: (tekst, czy dokument został obcięty)
+
+    Raises:
+        UnicodeDecodeError: Gdy zawartość nie jest tekstem UTF-8
+    """
+    if hasattr(file_content, "read"):
+        file_content.seek(0)
+        data = file_content.read(max_bytes + 1)
+    else:
+        data = memoryview(file_content)[:max_bytes + 1]
+
+    truncated = len(data) > max_bytes
+    # Przy obcięciu ostatni znak wielobajtowy mógł zostać przecięty - dekoder go pomija
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    return decoder.decode(data[:max_bytes], final=not truncated), truncated
+
+def prepare_document(file_content, file_name, mode="analyze"):
+    """
+    Odczytuje tekst dokumentu i dzieli go na części tak, jak przetworzy go analyze_document.
+    Wywoływane w puli wątków przed wywołaniem modelu - liczba części pozwala wycenić analizę
+    długiego dokumentu (document_credits), a analyze_document nie odczytuje tekstu ponownie
+
+    Args:
+        file_content (bytes or file): Zawartość pliku lub otwarty plik binarny
+        file_name (str): Nazwa pliku
+        mode (str): Tryb analizy: "analyze" lub "translate"
+
+    Returns:
+        dict: Słownik z kluczami text (None dla pliku binarnego), truncated, chunks (części tekstu;
+              None, gdy tekst mieści się w jednym zapytaniu) i parts (liczba części)
+    """
+    prepared = {"text": None, "truncated": False, "chunks": None, "parts": 1}
+    if os.path.splitext(file_name)[1].lower() not in TEXT_EXTENSIONS:
+        return prepared
+    try:
+        prepared["text"], prepared["truncated"] = read_document_text(file_content)
+    except UnicodeDecodeError:
+        return prepared
+
+    chunk_tokens = DOCUMENT_TRANSLATE_CHUNK_TOKENS if mode == "translate" else DOCUMENT_CHUNK_TOKENS
+    if count_tokens(prepared["text"], DOCUMENT_MODEL) > chunk_tokens:
+        prepared["chunks"] = split_into_chunks(prepared["text"], DOCUMENT_MODEL, chunk_tokens)
+        prepared["parts"] = len(prepared["chunks"])
+    return prepared
+
+async def analyze_document(file_content, file_name, mode="analyze", target_language="en", file_id=None,
+                           user_id=None, on_progress=None, call_info=None, prepared=None):
     """
     Analizuj lub tłumacz dokument za pomocą OpenAI API
     
+    Wynik dla tego samego pliku i parametrów jest zwracany z pamięci podręcznej. Tekst, który
+    nie mieści się w jednym zapytaniu, jest analizowany częściami (utils.document_analysis).
+    
     Args:
-        file_content (bytes): Zawartość pliku
+        file_content (bytes or file): Zawartość pliku lub otwarty plik binarny (np. z media_cache.open_file)
         file_name (str): Nazwa pliku
         mode (str): Tryb analizy: "analyze" (domyślnie) lub "translate"
         target_language (str): Docelowy język tłumaczenia (dwuliterowy kod)
+        file_id (str, optional): file_unique_id z Telegrama; bez niego plik identyfikuje skrót zawartości
+        user_id (int, optional): ID użytkownika - do limitu jednoczesnych wywołań przy analizie częściami
+        on_progress (callable, optional): Funkcja async (etap, gotowe, wszystkie) zgłaszająca postęp analizy częściami
+        call_info (dict, optional): Uzupełniany o zużycie tokenów wszystkich wywołań modelu ('usage');
+            przy wyniku z pamięci podręcznej zawiera tylko 'cached': True
+        prepared (dict, optional): Wynik prepare_document dla tego pliku i trybu; bez niego tekst
+            jest odczytywany w puli wątków
         
     Returns:
         str: Analiza dokumentu, tłumaczenie lub informacja o błędzie
     """
+    model = DOCUMENT_MODEL  # Używamy GPT-4o dla lepszej jakości
     try:
         # Określamy typ zawartości na podstawie rozszerzenia pliku
         file_extension = os.path.splitext(file_name)[1].lower()
         
+        cache_key = make_result_key(file_content, "document", mode, target_language, model, file_id, file_extension)
+        cached = get_cached_result(cache_key)
+        if cached is not None:
+            if call_info is not None:
+                call_info["cached"] = True
+            return cached
+        
+        if prepared is None:
+            prepared = await run_blocking("threads", prepare_document, file_content, file_name, mode)
+        
         # Przygotuj odpowiednie instrukcje w zależności od trybu
         if mode == "translate":
-            language_names = {
-                "en": "English",
-                "pl": "Polish",
-                "ru": "Russian",
-                "fr": "French",
-                "de": "German",
-                "es": "Spanish",
-                "it": "Italian",
-                "zh": "Chinese"
-            }
-            target_lang_name = language_names.get(target_language, target_language)
+            target_lang_name = LANGUAGE_NAMES.get(target_language, target_language)
             
             # Uniwersalne instrukcje niezależne od języka
             system_instruction = f"You are a professional translator. Your task is to translate text from the document to {target_lang_name}. Preserve the original text format."
@@ -177,57 +341,85 @@ async def analyze_document(file_content, file_name, mode="analyze", target_langu
             }
         ]
         
-        # Dla plików tekstowych możemy dodać zawartość bezpośrednio
-        if file_extension in ['.txt', '.csv', '.md', '.json', '.xml', '.html', '.js', '.py', '.cpp', '.c', '.java']:
-            try:
-                # Próbuj odkodować jako UTF-8
-                file_text = file_content.decode('utf-8')
-                messages[1]["content"] += f"\n\nFile content:\n\n{file_text}"
-            except UnicodeDecodeError:
-                # Jeśli nie możemy odkodować, traktuj jako plik binarny
-                messages[1]["content"] += "\n\nThe file contains binary data that cannot be displayed as text."
+        if prepared["chunks"] is not None:
+            # Tekst nie mieści się w jednym zapytaniu - analiza częściami z łączeniem wyników
+            async def complete(part_messages, max_tokens):
+                response, _ = await create_chat_completion(part_messages, model, max_tokens=max_tokens)
+                add_call_usage(call_info, usage_from_response(response))
+                return response.choices[0].message.content
+            
+            chunk_tokens = DOCUMENT_TRANSLATE_CHUNK_TOKENS if mode == "translate" else DOCUMENT_CHUNK_TOKENS
+            result = await analyze_long_document(
+                prepared["text"], file_name, model, complete, mode=mode,
+                target_language_name=LANGUAGE_NAMES.get(target_language, target_language),
+                user_id=user_id, chunk_tokens=chunk_tokens, on_progress=on_progress, chunks=prepared["chunks"]
+            )
+            if prepared["truncated"]:
+                result += "\n\n[The file is longer - only its beginning was processed.]"
+            cache_result(cache_key, result)
+            return result
+        
+        # Dla plików tekstowych możemy dodać zawartość bezpośrednio - tylko tyle tekstu, ile zmieści się w zapytaniu
+        if prepared["text"] is not None:
+            messages[1]["content"] += f"\n\nFile content:\n\n{prepared['text']}"
+            if prepared["truncated"]:
+                messages[1]["content"] += "\n\n[The file is longer - only its beginning is included.]"
+        elif file_extension in TEXT_EXTENSIONS:
+            # Jeśli nie możemy odkodować jako UTF-8, traktuj jako plik binarny
+            messages[1]["content"] += "\n\nThe file contains binary data that cannot be displayed as text."
         
-        response = await client.chat.completions.create(
-            model="gpt-4o",  # Używamy GPT-4o dla lepszej jakości
-            messages=messages,
+        response, _ = await create_chat_completion(
+            messages,
+            model,
             max_tokens=1500  # Zwiększamy limit tokenów dla dłuższych tekstów
         )
+        add_call_usage(call_info, usage_from_response(response))
         
-        return response.choices[0].message.content
+        result = response.choices[0].message.content
+        cache_result(cache_key, result)
+        return result
     except Exception as e:
         print(f"Błąd analizy dokumentu: {e}")
         return f"Sorry, an error occurred while analyzing the document: {str(e)}"
 
-async def analyze_image(image_content, image_name, mode="analyze", target_language="en"):
+async def analyze_image(image_content, image_name, mode="analyze", target_language="en", file_id=None, call_info=None):
     """
     Analizuj obraz za pomocą OpenAI API
     
+    Wynik dla tego samego obrazu i parametrów jest zwracany z pamięci podręcznej. Przed wysłaniem
+    obraz jest zmniejszany i kompresowany, a szczegółowość dobierana do rozmiaru i trybu.
+    
     Args:
         image_content (bytes): Zawartość obrazu
         image_name (str): Nazwa obrazu
         mode (str): Tryb analizy: "analyze" (domyślnie) lub "translate"
         target_language (str): Docelowy język tłumaczenia (dwuliterowy kod)
+        file_id (str, optional): file_unique_id z Telegrama; bez niego obraz identyfikuje skrót zawartości
+        call_info (dict, optional): Uzupełniany o zużycie tokenów ('usage'); przy wyniku z pamięci
+            podręcznej zawiera tylko 'cached': True
         
     Returns:
         str: Analiza obrazu lub tłumaczenie tekstu
     """
+    model = "gpt-4o"  # Używamy GPT-4o zamiast zdeprecjonowanego gpt-4-vision-preview
     try:
-        # Kodowanie obrazu do Base64
-        base64_image = base64.b64encode(image_content).decode('utf-8')
+        cache_key = make_result_key(image_content, "image", mode, target_language, model, file_id)
+        cached = get_cached_result(cache_key)
+        if cached is not None:
+            if call_info is not None:
+                call_info["cached"] = True
+            return cached
+        
+        # Zmniejszenie, kompresja i wybór szczegółowości (w osobnym wątku), potem kodowanie do Base64
+        image_data, mime_type, detail = await prepare_image(image_content, mode)
+        base64_image = (await run_blocking("threads", base64.b64encode, image_data)).decode('utf-8')
+        image_url = {"url": f"data:{mime_type};base64,{base64_image}"}
+        if detail:
+            image_url["detail"] = detail
         
         # Przygotuj odpowiednie instrukcje bazując na trybie
         if mode == "translate":
-            language_names = {
-                "en": "English",
-                "pl": "Polish",
-                "ru": "Russian",
-                "fr": "French",
-                "de": "German",
-                "es": "Spanish",
-                "it": "Italian",
-                "zh": "Chinese"
-            }
-            target_lang_name = language_names.get(target_language, target_language)
+            target_lang_name = LANGUAGE_NAMES.get(target_language, target_language)
             
             # Uniwersalne instrukcje niezależne od języka
             system_instruction = f"You are a helpful assistant who translates text from images to {target_lang_name}. Focus only on reading and translating the text visible in the image."
@@ -250,21 +442,22 @@ async def analyze_image(image_content, image_name, mode="analyze", target_langua
                     },
                     {
                         "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
-                        }
+                        "image_url": image_url
                     }
                 ]
             }
         ]
         
-        response = await client.chat.completions.create(
-            model="gpt-4o",  # Używamy GPT-4o zamiast zdeprecjonowanego gpt-4-vision-preview
-            messages=messages,
+        response, _ = await create_chat_completion(
+            messages,
+            model,
             max_tokens=800  # Zwiększona liczba tokenów dla dłuższych tekstów
         )
+        add_call_usage(call_info, usage_from_response(response))
         
-        return response.choices[0].message.content
+        result = response.choices[0].message.content
+        cache_result(cache_key, result)
+        return result
     except Exception as e:
         print(f"Błąd analizy obrazu: {e}")
         return f"Sorry, an error occurred while analyzing the image: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Współdzielona pula połączeń HTTP dla klienta OpenAI
+Jawne limity puli i keep-alive, HTTP/2 (jeśli dostępny jest pakiet h2), osobne limity
+czasu dla połączenia, odpowiedzi i odpowiedzi strumieniowych, rozgrzewanie połączeń
+przy starcie bota i zamykanie puli przy jego zamykaniu oraz statystyki wykorzystania puli.
+"""
+import asyncio
+import logging
+import httpx
+from config import (
+    OPENAI_API_KEY, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_KEEPALIVE_EXPIRY, OPENAI_HTTP2, OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT,
+    OPENAI_STREAM_IDLE_TIMEOUT, OPENAI_POOL_TIMEOUT, OPENAI_WARMUP_CONNECTIONS
+)
+
+try:
+    import h2  # noqa: F401 - wymagany przez httpx do obsługi HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+OPENAI_BASE_URL = "https://api.openai.com/v1/"
+
+# Limity czasu dla zwykłych wywołań - odpowiedź przychodzi w całości po zakończeniu generowania
+REQUEST_TIMEOUT = httpx.Timeout(
+    connect=OPENAI_CONNECT_TIMEOUT,
+    read=OPENAI_READ_TIMEOUT,
+    write=OPENAI_READ_TIMEOUT,
+    pool=OPENAI_POOL_TIMEOUT
+)
+
+# Limity czasu dla odpowiedzi strumieniowych - limit odczytu dotyczy przerwy między fragmentami
+STREAM_TIMEOUT = httpx.Timeout(
+    connect=OPENAI_CONNECT_TIMEOUT,
+    read=OPENAI_STREAM_IDLE_TIMEOUT,
+    write=OPENAI_READ_TIMEOUT,
+    pool=OPENAI_POOL_TIMEOUT
+)
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Strumień odpowiedzi, który zgłasza transportowi swoje zamknięcie"""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._on_close()
+        await self._stream.aclose()
+
+class MeteredTransport(httpx.AsyncHTTPTransport):
+    """
+    Transport httpx zliczający zapytania w toku
+
+    Zapytanie jest w toku od wysłania do zamknięcia odpowiedzi - w przypadku
+    odpowiedzi strumieniowej do odebrania ostatniego fragmentu.
+    """
+
+    def __init__(self, max_connections, http2=False, **kwargs):
+        super().__init__(http2=http2, **kwargs)
+        self.max_connections = max_connections
+        self.http2 = http2
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+
+    async def handle_async_request(self, request):
+        self.in_flight += 1
+        self.requests += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            self.in_flight -= 1
+            self.errors += 1
+            raise
+
+        response.stream = _TrackedStream(response.stream, self._release)
+        return response
+
+    def _release(self):
+        self.in_flight -= 1
+
+    def stats(self):
+        """Zwraca statystyki wykorzystania puli"""
+        connections = self._pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            "http2": self.http2,
+            "connections": len(connections),
+            "idle_connections": idle,
+            "max_connections": self.max_connections,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "utilisation": self.in_flight / self.max_connections if self.max_connections else 0.0,
+            "requests": self.requests,
+            "errors": self.errors
+        }
+
+def _create_transport():
+    http2 = OPENAI_HTTP2 and HTTP2_AVAILABLE
+    if OPENAI_HTTP2 and not HTTP2_AVAILABLE:
+        logger.warning("Pakiet h2 nie jest zainstalowany - klient OpenAI używa HTTP/1.1")
+
+    return MeteredTransport(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+        )
+    )
+
+# Wspólna pula dla całego procesu
+_transport = _create_transport()
+http_client = httpx.AsyncClient(transport=_transport, timeout=REQUEST_TIMEOUT)
+register_stats("openai_pool", _transport.stats)
+
+async def warm_up_openai_pool(connections=OPENAI_WARMUP_CONNECTIONS):
+    """
+    Otwiera połączenia z API OpenAI przed pierwszą wiadomością użytkownika,
+    aby czas do pierwszego tokena nie obejmował DNS, TCP i TLS
+
+    Przy HTTP/2 wystarcza jedno połączenie - zapytania są w nim multipleksowane.
+    """
+    if not OPENAI_API_KEY:
+        return
+
+    count = 1 if _transport.http2 else max(1, min(connections, OPENAI_MAX_KEEPALIVE_CONNECTIONS))
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+
+    # Lekkie zapytanie o listę modeli - nie zużywa tokenów
+    results = await asyncio.gather(
+        *(http_client.get(f"{OPENAI_BASE_URL}models", headers=headers) for _ in range(count)),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        logger.warning(f"Nie udało się rozgrzać połączeń z OpenAI: {errors[0]}")
+    else:
+        logger.info(f"Rozgrzano połączenia z OpenAI: {count} (HTTP/2: {_transport.http2})")
+
+async def close_openai_pool():
+    """Zamyka pulę połączeń OpenAI - wywoływane przy zamykaniu bota"""
+    await http_client.aclose()
@@ -0,0 +1,215 @@
+"""
+Ponawianie wywołań OpenAI i przełączanie na modele zapasowe
+Błędy są klasyfikowane (limit zapytań, przekroczenie czasu, błąd serwera, błędne
+zapytanie). Błędy przejściowe są ponawiane z losowym opóźnieniem wykładniczym
+(z poszanowaniem nagłówka Retry-After), a po wyczerpaniu prób wywołanie przechodzi
+na kolejny model z łańcucha MODEL_FALLBACK_CHAIN. Odpowiedź strumieniowa jest
+ponawiana tylko do pierwszego fragmentu - później użytkownik widzi już tekst.
+"""
+import asyncio
+import email.utils
+import logging
+import random
+import time
+import httpx
+import openai
+from config import (
+    OPENAI_MAX_RETRIES, OPENAI_RETRY_BASE_DELAY, OPENAI_RETRY_MAX_DELAY,
+    OPENAI_MODEL_FALLBACK, MODEL_FALLBACK_CHAIN
+)
+
+logger = logging.getLogger(__name__)
+
+# Klasy błędów
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+SERVER_ERROR = "server_error"
+MODEL_UNAVAILABLE = "model_unavailable"
+INVALID_REQUEST = "invalid_request"
+FATAL = "fatal"
+
+# Błędy, które warto ponowić na tym samym modelu
+TRANSIENT_ERRORS = (RATE_LIMIT, TIMEOUT, SERVER_ERROR)
+
+def classify_error(error):
+    """
+    Określa klasę błędu wywołania OpenAI
+
+    Args:
+        error (Exception): Wyjątek z klienta OpenAI lub httpx (podczas odczytu strumienia)
+
+    Returns:
+        str: Jedna z klas: RATE_LIMIT, TIMEOUT, SERVER_ERROR, MODEL_UNAVAILABLE, INVALID_REQUEST, FATAL
+    """
+    if isinstance(error, openai.RateLimitError):
+        # Wyczerpany budżet konta nie odnowi się po chwili
+        if getattr(error, "code", None) == "insufficient_quota":
+            return FATAL
+        return RATE_LIMIT
+    if isinstance(error, (openai.APITimeoutError, httpx.TimeoutException)):
+        return TIMEOUT
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        # Zerwane połączenie traktujemy jak przekroczenie czasu - ponowienie zwykle pomaga
+        return TIMEOUT
+    if isinstance(error, openai.InternalServerError):
+        return SERVER_ERROR
+    if isinstance(error, openai.NotFoundError):
+        return MODEL_UNAVAILABLE
+    if isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return FATAL
+    if isinstance(error, openai.APIStatusError):
+        # 409 zgłaszany przez API przy chwilowych konfliktach wewnętrznych
+        if error.status_code >= 500 or error.status_code == 409:
+            return SERVER_ERROR
+        return INVALID_REQUEST
+    return FATAL
+
+def get_retry_after(error):
+    """Zwraca czas oczekiwania (sekundy) z nagłówków Retry-After odpowiedzi lub None"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            # Format daty HTTP
+            retry_date = email.utils.parsedate_to_datetime(retry_after)
+            return max(0.0, retry_date.timestamp() - time.time())
+    except Exception as e:
+        logger.debug(f"Nieprawidłowy nagłówek Retry-After: {e}")
+        return None
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Opóźnienie przed kolejną próbą - wykładnicze z pełnym losowaniem
+
+    Args:
+        attempt (int): Numer nieudanej próby (od 0)
+        retry_after (float, optional): Czas wskazany przez serwer
+
+    Returns:
+        float: Opóźnienie w sekundach
+    """
+    delay = random.uniform(0, min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_BASE_DELAY * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def model_chain(model, fallback=True):
+    """Zwraca listę modeli do wypróbowania: wybrany model i (opcjonalnie) jego zapasowe"""
+    if not fallback or not OPENAI_MODEL_FALLBACK:
+        return [model]
+    return [model] + [m for m in MODEL_FALLBACK_CHAIN.get(model, []) if m != model]
+
+class RetryState:
+    """Stan ponawiania jednego wywołania: bieżący model i numer próby"""
+
+    def __init__(self, model, fallback=True):
+        self.models = model_chain(model, fallback)
+        self.index = 0
+        self.attempt = 0
+        self.attempts = 0
+
+    @property
+    def model(self):
+        return self.models[self.index]
+
+    async def should_retry(self, error):
+        """
+        Decyduje o kolejnej próbie po błędzie i odczekuje wymagany czas
+
+        Returns:
+            bool: True, jeśli należy spróbować ponownie (model mógł się zmienić)
+        """
+        self.attempts += 1
+        kind = classify_error(error)
+
+        if kind in TRANSIENT_ERRORS:
+            retry_after = get_retry_after(error)
+            # Zbyt długie oczekiwanie na ten sam model - lepiej od razu przejść na zapasowy
+            if self.attempt < OPENAI_MAX_RETRIES and (retry_after is None or retry_after <= OPENAI_RETRY_MAX_DELAY):
+                delay = backoff_delay(self.attempt, retry_after)
+                self.attempt += 1
+                logger.warning(
+                    f"Błąd OpenAI ({kind}) dla {self.model}, próba {self.attempt}/{OPENAI_MAX_RETRIES} "
+                    f"za {delay:.1f} s: {error}"
+                )
+                await asyncio.sleep(delay)
+                return True
+            return self._next_model(kind, error)
+
+        if kind == MODEL_UNAVAILABLE:
+            return self._next_model(kind, error)
+
+        return False
+
+    def _next_model(self, kind, error):
+        if self.index + 1 >= len(self.models):
+            return False
+        previous = self.model
+        self.index += 1
+        self.attempt = 0
+        logger.warning(f"Błąd OpenAI ({kind}) dla {previous} - przełączam na {self.model}: {error}")
+        return True
+
+async def call_with_retry(request, model, fallback=True):
+    """
+    Wykonuje wywołanie OpenAI z ponawianiem i przełączaniem modeli
+
+    Args:
+        request (callable): Funkcja async przyjmująca nazwę modelu i zwracająca wynik
+        model (str): Model preferowany
+        fallback (bool): Czy wolno przejść na model zapasowy
+
+    Returns:
+        tuple: (wynik, użyty model)
+
+    Raises:
+        Exception: Ostatni błąd, jeśli żadna próba się nie powiodła
+    """
+    state = RetryState(model, fallback)
+    while True:
+        try:
+            return await request(state.model), state.model
+        except Exception as e:
+            if not await state.should_retry(e):
+                raise
+
+async def stream_with_retry(open_stream, model, fallback=True, call_info=None):
+    """
+    Przekazuje fragmenty odpowiedzi strumieniowej, ponawiając ją do pierwszego fragmentu
+
+    Args:
+        open_stream (callable): Funkcja przyjmująca nazwę modelu i zwracająca generator async fragmentów
+        model (str): Model preferowany
+        fallback (bool): Czy wolno przejść na model zapasowy
+        call_info (dict, optional): Uzupełniany o 'model' (faktycznie użyty) i 'attempts'
+
+    Yields:
+        str: Fragmenty odpowiedzi
+
+    Raises:
+        Exception: Błąd po pierwszym fragmencie lub po wyczerpaniu prób
+    """
+    state = RetryState(model, fallback)
+    while True:
+        started = False
+        if call_info is not None:
+            call_info["model"] = state.model
+            call_info["attempts"] = state.attempts + 1
+        try:
+            async for piece in open_stream(state.model):
+                started = True
+                yield piece
+            return
+        except Exception as e:
+            if started or not await state.should_retry(e):
+                raise
@@ -0,0 +1,60 @@
+"""
+Stronicowanie list w menu (historia rozmowy, transakcje kredytowe i płatności)
+Kursory sąsiednich stron są przechowywane w danych użytkownika w kontekście czatu,
+ponieważ callback_data przycisku Telegrama mieści tylko 64 bajty.
+"""
+import logging
+from telegram import InlineKeyboardButton
+from utils.translations import get_text
+
+logger = logging.getLogger(__name__)
+
+def _user_pages(context, user_id):
+    if 'user_data' not in context.chat_data:
+        context.chat_data['user_data'] = {}
+    if user_id not in context.chat_data['user_data']:
+        context.chat_data['user_data'][user_id] = {}
+    return context.chat_data['user_data'][user_id].setdefault('pages', {})
+
+def get_page_request(context, user_id, view, action):
+    """
+    Zamienia akcję przycisku na parametry zapytania o stronę
+
+    Args:
+        context: Kontekst bota
+        user_id (int): ID użytkownika
+        view (str): Nazwa widoku, np. 'history'
+        action (str): 'older', 'newer' lub None (pierwsza, najnowsza strona)
+
+    Returns:
+        tuple: (kursor lub None, kierunek)
+    """
+    if action not in ('older', 'newer'):
+        return None, 'older'
+
+    page = _user_pages(context, user_id).get(view)
+    if not page:
+        # Brak zapisanego stanu (np. po restarcie bota) - zaczynamy od najnowszej strony
+        return None, 'older'
+    return page.get(f'{action}_cursor'), action
+
+def store_page(context, user_id, view, page):
+    """Zapamiętuje kursory wyświetlonej strony"""
+    _user_pages(context, user_id)[view] = {
+        'older_cursor': page.get('older_cursor'),
+        'newer_cursor': page.get('newer_cursor')
+    }
+
+def build_page_navigation(page, callback_prefix, language):
+    """
+    Tworzy wiersz przycisków nawigacji ("starsze" / "nowsze") dla strony
+
+    Returns:
+        list: Wiersz przycisków (pusty, jeśli lista mieści się na jednej stronie)
+    """
+    row = []
+    if page.get('has_older'):
+        row.append(InlineKeyboardButton(get_text("page_older", language), callback_data=f"{callback_prefix}_older"))
+    if page.get('has_newer'):
+        row.append(InlineKeyboardButton(get_text("page_newer", language), callback_data=f"{callback_prefix}_newer"))
+    return row
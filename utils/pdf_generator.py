@@ -2,7 +2,7 @@
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak
 from reportlab.lib.units import cm
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
@@ -10,21 +10,16 @@ import io
 import os
 import datetime
 import re
+from xml.sax.saxutils import escape
+from utils.translations import get_text
 
-def generate_conversation_pdf(conversation, user_info, bot_name="AI Bot"):
+def register_fonts():
     """
-    Generuje plik PDF z historią konwersacji
+    Rejestruje fonty z obsługą polskich znaków (DejaVu z katalogu fonts), jeśli są dostępne
     
-    Args:
-        conversation (list): Lista wiadomości z konwersacji
-        user_info (dict): Informacje o użytkowniku
-        bot_name (str): Nazwa bota
-        
     Returns:
-        BytesIO: Bufor zawierający wygenerowany plik PDF
+        tuple: (font podstawowy, font pogrubiony) - DejaVu lub Helvetica
     """
-    buffer = io.BytesIO()
-    
     # Próba rejestracji fontów z obsługą polskich znaków
     try:
         # Sprawdź, czy fonty DejaVu są dostępne
@@ -51,6 +46,25 @@ def generate_conversation_pdf(conversation, user_info, bot_name="AI Bot"):
         main_font = 'Helvetica'
         bold_font = 'Helvetica-Bold'
     
+    return main_font, bold_font
+
+def generate_conversation_pdf(conversation, user_info, bot_name="AI Bot", language="pl"):
+    """
+    Generuje plik PDF z historią konwersacji
+    
+    Args:
+        conversation (list): Lista wiadomości z konwersacji
+        user_info (dict): Informacje o użytkowniku
+        bot_name (str): Nazwa bota
+        language (str): Język etykiet w dokumencie
+        
+    Returns:
+        BytesIO: Bufor zawierający wygenerowany plik PDF
+    """
+    buffer = io.BytesIO()
+    
+    main_font, bold_font = register_fonts()
+    
     # Konfiguracja dokumentu
     doc = SimpleDocTemplate(
         buffer,
@@ -164,4 +178,62 @@ def generate_conversation_pdf(conversation, user_info, bot_name="AI Bot"):
     
     # Zresetuj pozycję w buforze i zwróć go
     buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return buffer
+
+def generate_translated_pdf(pages, title):
+    """
+    Generuje plik PDF z przetłumaczonym dokumentem - każda strona oryginału zaczyna nową stronę
+    
+    Args:
+        pages (list): Przetłumaczone teksty kolejnych stron (pusty tekst dla stron bez tekstu)
+        title (str): Tytuł dokumentu
+        
+    Returns:
+        BytesIO: Bufor zawierający wygenerowany plik PDF
+    """
+    buffer = io.BytesIO()
+    main_font, bold_font = register_fonts()
+    
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        rightMargin=2*cm,
+        leftMargin=2*cm,
+        topMargin=2*cm,
+        bottomMargin=2*cm,
+        title=title
+    )
+    
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(
+        name='TranslatedText',
+        parent=styles['Normal'],
+        fontName=main_font,
+        spaceAfter=6
+    ))
+    styles.add(ParagraphStyle(
+        name='PageNumber',
+        parent=styles['Normal'],
+        fontName=main_font,
+        fontSize=8,
+        textColor=colors.gray,
+        alignment=2,
+        spaceAfter=6
+    ))
+    
+    elements = []
+    for index, text in enumerate(pages):
+        if index:
+            elements.append(PageBreak())
+        # Numer strony oryginału - strony bez tekstu zostają zachowane
+        elements.append(Paragraph(str(index + 1), styles['PageNumber']))
+        
+        for paragraph in re.split(r'\n\s*\n', text or ""):
+            paragraph = paragraph.strip()
+            if paragraph:
+                elements.append(Paragraph(escape(paragraph).replace('\n', '<br/>'), styles['TranslatedText']))
+    
+    doc.build(elements)
+    
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,24 @@
+"""
+Wyciąganie tekstu stron pliku PDF
+Funkcja jest wykonywana w procesach puli 'pdf' (utils.executor), dlatego moduł importuje tylko
+PyPDF2 - proces roboczy nie ładuje klienta OpenAI ani reszty bota.
+"""
+import io
+import PyPDF2
+
+def read_pdf_pages(pdf_data, max_pages):
+    """
+    Wyciąga tekst ze wszystkich stron pliku PDF
+
+    Args:
+        pdf_data (bytes): Zawartość pliku PDF
+        max_pages (int): Największa liczba stron, dla której tekst jest wyciągany
+
+    Returns:
+        tuple: (liczba stron, lista tekstów stron lub None, gdy plik ma więcej stron niż max_pages)
+    """
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_data))
+    page_count = len(reader.pages)
+    if page_count > max_pages:
+        return page_count, None
+    return page_count, [(page.extract_text() or "").strip() for page in reader.pages]
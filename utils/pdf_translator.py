@@ -1,138 +1,216 @@
 """
-Moduł do tłumaczenia fragmentów dokumentów PDF
+Moduł do tłumaczenia całych dokumentów PDF
+Tekst jest wyciągany strona po stronie, dzielony na jednostki tłumaczenia (utils.document_analysis)
+i tłumaczony przez ograniczoną pulę zadań, a przetłumaczone jednostki są składane z powrotem
+w kolejności stron. Każda ukończona strona jest zapisywana w pamięci podręcznej wyników oraz
+w katalogu postępu na dysku (PDF_PROGRESS_DIR) - po błędzie ponowne tłumaczenie tego samego pliku
+obejmuje (i jest opłacane) tylko za brakujące strony, nawet gdy pamięć podręczna ich już nie ma.
 """
-import io
-import PyPDF2
-import re
+import asyncio
+import hashlib
 import logging
-from utils.openai_client import client
+from utils.openai_client import create_chat_completion, LANGUAGE_NAMES
+from utils.usage_meter import usage_from_response, add_call_usage
+from utils.document_analysis import split_into_chunks, model_slot, ProgressReporter, BLOCK_SEPARATOR
+from utils.result_cache import DiskCache, make_result_key, get_cached_result, cache_result
+from utils.executor import run_blocking
+from utils.pdf_reader import read_pdf_pages
+from config import (
+    PDF_MAX_PAGES, PDF_TRANSLATION_WORKERS, DOCUMENT_TRANSLATE_CHUNK_TOKENS,
+    PDF_PROGRESS_DIR, PDF_PROGRESS_MAX_BYTES
+)
 
 logger = logging.getLogger(__name__)
 
-async def extract_first_paragraph(pdf_content):
-    """
-    Ekstrahuje pierwszy akapit z pliku PDF
-    
-    Args:
-        pdf_content (bytes): Zawartość pliku PDF w formie bajtowej
-    
-    Returns:
-        str: Pierwszy akapit tekstu lub informacja o błędzie
-    """
+PDF_TRANSLATION_MODEL = "gpt-4o"  # Używamy GPT-4o dla lepszej jakości tłumaczenia
+
+# Przetłumaczone strony na dysku - pamięć podręczna wyników jest ograniczona liczbą wpisów
+_progress = None
+if PDF_PROGRESS_DIR:
     try:
-        # Utwórz obiekt PdfReader z zawartości bajtowej
-        pdf_file = io.BytesIO(pdf_content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        # Sprawdź, czy PDF ma co najmniej jedną stronę
-        if len(pdf_reader.pages) < 1:
-            return "PDF nie zawiera żadnych stron."
-        
-        # Pobierz tekst z pierwszej strony
-        first_page = pdf_reader.pages[0]
-        text = first_page.extract_text()
-        
-        if not text:
-            return "Nie można odczytać tekstu z pierwszej strony PDF."
-        
-        # Podziel tekst na akapity (zakładamy, że akapity są oddzielone podwójnymi znakami nowej linii)
-        paragraphs = re.split(r'\n\s*\n', text)
-        
-        # Znajdź pierwszy niepusty akapit
-        for paragraph in paragraphs:
-            paragraph = paragraph.strip()
-            if paragraph and len(paragraph) > 10:  # Minimalny rozmiar akapitu
-                return paragraph
-        
-        # Jeśli nie znaleziono wyraźnych akapitów, zwróć pierwsze 500 znaków
-        if text.strip():
-            return text.strip()[:500]
-        
-        return "Nie znaleziono wyraźnych akapitów w tekście."
-    
+        _progress = DiskCache(PDF_PROGRESS_DIR, PDF_PROGRESS_MAX_BYTES)
     except Exception as e:
-        logger.error(f"Błąd podczas ekstrahowania akapitu z PDF: {e}")
-        return f"Wystąpił błąd podczas odczytywania pliku PDF: {str(e)}"
+        logger.error(f"Nie udało się przygotować katalogu postępu tłumaczenia PDF {PDF_PROGRESS_DIR}: {e}")
+
+def _read_content(pdf_file):
+    pdf_file.seek(0)
+    return pdf_file.read()
 
-async def translate_paragraph(text, source_lang="pl", target_lang="en"):
+async def extract_pages(pdf_content, max_pages=PDF_MAX_PAGES):
     """
-    Tłumaczy tekst z jednego języka na drugi za pomocą OpenAI API
-    
+    Wyciąga tekst ze wszystkich stron pliku PDF w puli procesów 'pdf'
+
+    Parsowanie jest przerywane po limicie czasu puli, więc uszkodzony lub złośliwy plik nie zajmie
+    procesu bez końca. Zawartość pliku trafia do procesu w całości (pliki są ograniczone do 25 MB).
+
     Args:
-        text (str): Tekst do przetłumaczenia
-        source_lang (str): Język źródłowy (domyślnie "pl")
-        target_lang (str): Język docelowy (domyślnie "en")
-    
+        pdf_content (bytes or file): Zawartość pliku PDF lub otwarty plik binarny
+        max_pages (int): Największa liczba stron, dla której tekst jest wyciągany
+
     Returns:
-        str: Przetłumaczony tekst lub informacja o błędzie
+        tuple: (liczba stron, lista tekstów stron) - lista jest None, gdy plik ma więcej stron niż max_pages;
+               strony bez tekstu (np. skany) mają pusty tekst
+
+    Raises:
+        ExecutorBusy: Gdy pula 'pdf' jest zajęta
+        asyncio.TimeoutError: Gdy parsowanie przekroczyło limit czasu
     """
-    try:
-        # Przygotuj prompt dla OpenAI API
-        messages = [
-            {
-                "role": "system",
-                "content": f"Jesteś profesjonalnym tłumaczem. Przetłumacz podany tekst z języka {source_lang} na język {target_lang}. Zachowaj oryginalny format tekstu."
-            },
-            {
-                "role": "user",
-                "content": f"Przetłumacz ten tekst na język {target_lang}:\n\n{text}"
-            }
-        ]
-        
-        # Wyślij zapytanie do API
-        response = await client.chat.completions.create(
-            model="gpt-4o",  # Używamy GPT-4o dla lepszej jakości tłumaczenia
-            messages=messages,
-            max_tokens=1500  # Zwiększamy limit tokenów dla dłuższych tekstów
+    if hasattr(pdf_content, "read"):
+        pdf_content = await run_blocking("threads", _read_content, pdf_content)
+    return await run_blocking("pdf", read_pdf_pages, bytes(pdf_content), max_pages)
+
+def pdf_document_key(pdf_content, target_lang):
+    """Klucz tłumaczenia pliku (skrót zawartości, język docelowy i model), wspólny dla wszystkich jego stron"""
+    return make_result_key(pdf_content, "pdf", "translate", target_lang, PDF_TRANSLATION_MODEL)
+
+def _page_key(document_key, page_index):
+    return hashlib.sha256(f"{document_key}|page:{page_index}".encode("utf-8")).hexdigest()
+
+def _saved_page(document_key, page_index):
+    """Zwraca zapisane tłumaczenie strony - z pamięci podręcznej lub z katalogu postępu - albo None"""
+    key = _page_key(document_key, page_index)
+    text = get_cached_result(key)
+    if text is None and _progress is not None:
+        text = _progress.get(key)
+        if text is not None:
+            cache_result(key, text)
+    return text
+
+def _save_page(document_key, page_index, text):
+    """Zapisuje tłumaczenie strony w pamięci podręcznej i w katalogu postępu"""
+    key = _page_key(document_key, page_index)
+    cache_result(key, text)
+    if _progress is not None:
+        try:
+            _progress.set(key, text)
+        except Exception as e:
+            logger.error(f"Błąd zapisu postępu tłumaczenia PDF na dysk: {e}")
+
+def pending_pages(pages, document_key):
+    """Zwraca numery (od 0) stron z tekstem, których tłumaczenie nie zostało jeszcze zapisane"""
+    return [
+        index for index, text in enumerate(pages)
+        if text and _saved_page(document_key, index) is None
+    ]
+
+async def _translate_unit(text, target_lang_name, user_id, call_info):
+    """Tłumaczy jedną jednostkę tekstu; błąd (po ponowieniach) przerywa tłumaczenie dokumentu"""
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                f"You are a professional translator. Translate the text from a PDF page to {target_lang_name}. "
+                "Preserve the paragraphs and line breaks of the original. Reply with the translation only."
+            )
+        },
+        {
+            "role": "user",
+            "content": text
+        }
+    ]
+    async with model_slot(user_id):
+        response, _ = await create_chat_completion(
+            messages,
+            PDF_TRANSLATION_MODEL,
+            max_tokens=2 * DOCUMENT_TRANSLATE_CHUNK_TOKENS  # Tłumaczenie bywa dłuższe niż oryginał
         )
-        
-        # Zwróć tłumaczenie
-        return response.choices[0].message.content
-    
-    except Exception as e:
-        logger.error(f"Błąd podczas tłumaczenia tekstu: {e}")
-        return f"Wystąpił błąd podczas tłumaczenia: {str(e)}"
+    add_call_usage(call_info, usage_from_response(response))
+    return response.choices[0].message.content or ""
 
-async def translate_pdf_first_paragraph(pdf_content, source_lang="pl", target_lang="en"):
+async def translate_pdf_pages(pages, document_key, target_lang="en", user_id=None, on_progress=None, call_info=None):
     """
-    Ekstrahuje i tłumaczy pierwszy akapit z pliku PDF
-    
+    Tłumaczy tekst stron dokumentu PDF
+
+    Jednostki wszystkich stron trafiają do jednej kolejki w kolejności stron, a PDF_TRANSLATION_WORKERS
+    zadań tłumaczy je równolegle. Strona jest gotowa, gdy przetłumaczono wszystkie jej jednostki - wtedy
+    trafia do pamięci podręcznej i katalogu postępu. Strony zapisane wcześniej (np. przed błędem) nie są
+    tłumaczone ponownie.
+
     Args:
-        pdf_content (bytes): Zawartość pliku PDF w formie bajtowej
-        source_lang (str): Język źródłowy (domyślnie "pl")
-        target_lang (str): Język docelowy (domyślnie "en")
-    
+        pages (list): Teksty stron z extract_pages
+        document_key (str): Klucz z pdf_document_key
+        target_lang (str): Język docelowy (dwuliterowy kod)
+        user_id (int, optional): ID użytkownika - do limitu jednoczesnych wywołań modelu
+        on_progress (callable, optional): Funkcja async (etap, gotowe strony, wszystkie strony)
+        call_info (dict, optional): Uzupełniany o zużycie tokenów wywołań modelu w tym tłumaczeniu ('usage')
+
     Returns:
-        dict: Słownik zawierający oryginalny tekst i tłumaczenie
+        dict: success, pages (przetłumaczone teksty stron; None dla nieprzetłumaczonych), translated
+              (numery stron przetłumaczonych w tym wywołaniu), failed_page (numer strony, na której
+              wystąpił błąd, lub None) i error
     """
-    # Ekstrahuj pierwszy akapit
-    original_text = await extract_first_paragraph(pdf_content)
-    
-    # Sprawdź, czy ekstrakcja się powiodła
-    if original_text.startswith("Wystąpił błąd") or original_text.startswith("Nie można"):
-        return {
-            "success": False,
-            "original_text": original_text,
-            "translated_text": None,
-            "error": original_text
-        }
-    
-    # Tłumacz akapit
-    translated_text = await translate_paragraph(original_text, source_lang, target_lang)
-    
-    # Sprawdź, czy tłumaczenie się powiodło
-    if translated_text.startswith("Wystąpił błąd"):
+    target_lang_name = LANGUAGE_NAMES.get(target_lang, target_lang)
+    translated_pages = [None] * len(pages)
+    parts = {}
+    queue = asyncio.Queue()
+
+    for index, text in enumerate(pages):
+        if not text:
+            translated_pages[index] = ""
+            continue
+        cached = _saved_page(document_key, index)
+        if cached is not None:
+            translated_pages[index] = cached
+            continue
+        units = split_into_chunks(text, PDF_TRANSLATION_MODEL, DOCUMENT_TRANSLATE_CHUNK_TOKENS)
+        parts[index] = [None] * len(units)
+        for unit_index, unit in enumerate(units):
+            queue.put_nowait((index, unit_index, unit))
+
+    total = len(pages)
+    done = total - len(parts)
+    translated = []
+    failure = None
+    progress = ProgressReporter(on_progress)
+    progress.report("pages", done, total)
+
+    async def worker():
+        nonlocal done, failure
+        while failure is None:
+            try:
+                page_index, unit_index, text = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                parts[page_index][unit_index] = await _translate_unit(text, target_lang_name, user_id, call_info)
+            except Exception as e:
+                logger.error(f"Błąd tłumaczenia strony {page_index + 1} pliku PDF: {e}")
+                if failure is None or page_index < failure[0]:
+                    failure = (page_index, e)
+                return
+
+            if all(part is not None for part in parts[page_index]):
+                page_text = BLOCK_SEPARATOR.join(part.strip() for part in parts.pop(page_index))
+                translated_pages[page_index] = page_text
+                _save_page(document_key, page_index, page_text)
+                translated.append(page_index)
+                done += 1
+                progress.report("pages", done, total)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(PDF_TRANSLATION_WORKERS, queue.qsize()))]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+    finally:
+        await progress.close()
+
+    translated.sort()
+    if failure is not None:
         return {
             "success": False,
-            "original_text": original_text,
-            "translated_text": None,
-            "error": translated_text
+            "pages": translated_pages,
+            "translated": translated,
+            "failed_page": failure[0],
+            "error": str(failure[1])
         }
-    
-    # Zwróć wyniki
     return {
         "success": True,
-        "original_text": original_text,
-        "translated_text": translated_text,
+        "pages": translated_pages,
+        "translated": translated,
+        "failed_page": None,
         "error": None
-    }
\ No newline at end of file
+    }
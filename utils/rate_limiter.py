@@ -0,0 +1,187 @@
+"""
+Ograniczanie tempa wywołań OpenAI osobno dla każdego modelu
+Dwa kubełki tokenów na model - zapytania na minutę (RPM) i tokeny na minutę (TPM).
+Przed wywołaniem rezerwowany jest szacunek (prompt + przewidywana odpowiedź), a po
+wywołaniu rezerwacja jest korygowana o faktyczne zużycie. Oczekujące wywołania
+tworzą kolejkę FIFO, więc duże zapytanie nie jest wyprzedzane przez mniejsze.
+"""
+import asyncio
+import logging
+import time
+from config import MODEL_RATE_LIMITS, OPENAI_RATE_LIMIT_HEADROOM, OPENAI_COMPLETION_TOKENS_ESTIMATE
+from utils.context_builder import count_tokens, TOKENS_PER_MESSAGE, TOKENS_PER_REPLY
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Przybliżony koszt obrazu w wiadomości (górna granica dla obrazu w wysokiej szczegółowości)
+IMAGE_TOKENS_ESTIMATE = 765
+# Koszt obrazu w niskiej szczegółowości (stały)
+IMAGE_LOW_DETAIL_TOKENS = 85
+
+class TokenBucket:
+    """Kubełek uzupełniany w sposób ciągły do pojemności `per_minute` w ciągu minuty"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Zwraca liczbę sekund do momentu, w którym w kubełku będzie `amount`"""
+        self._refill()
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+    def give_back(self, amount):
+        """Zwraca (lub przy wartości ujemnej dobiera) część rezerwacji"""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+class RateLimitSlot:
+    """Rezerwacja jednego wywołania - pozwala skorygować liczbę tokenów po odpowiedzi"""
+
+    def __init__(self, limiter, reserved_tokens):
+        self._limiter = limiter
+        self.reserved_tokens = reserved_tokens
+        self._settled = False
+
+    def settle(self, actual_tokens):
+        """
+        Koryguje rezerwację o faktyczne zużycie tokenów
+
+        Args:
+            actual_tokens (int): Tokeny zużyte przez wywołanie; None pozostawia szacunek
+        """
+        if self._settled or actual_tokens is None:
+            return
+        self._settled = True
+        self._limiter._settle(self.reserved_tokens, actual_tokens)
+
+class ModelRateLimiter:
+    """Limiter RPM/TPM jednego modelu"""
+
+    def __init__(self, model, rpm, tpm):
+        self.model = model
+        self._requests = TokenBucket(rpm * OPENAI_RATE_LIMIT_HEADROOM)
+        self._tokens = TokenBucket(tpm * OPENAI_RATE_LIMIT_HEADROOM) if tpm else None
+        # Lock w asyncio budzi oczekujących w kolejności przybycia
+        self._queue = asyncio.Lock()
+        self.waiting = 0
+        self.total_wait = 0.0
+
+    async def acquire(self, tokens=0):
+        """
+        Czeka, aż model będzie mógł przyjąć kolejne zapytanie z podaną liczbą tokenów
+
+        Args:
+            tokens (int): Szacowana liczba tokenów (prompt + odpowiedź)
+
+        Returns:
+            RateLimitSlot: Rezerwacja do skorygowania po odpowiedzi
+        """
+        if self._tokens is None:
+            tokens = 0
+        else:
+            # Zapytanie większe niż cały limit czeka na pełny kubełek, a nie w nieskończoność
+            tokens = min(tokens, self._tokens.capacity)
+
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._queue:
+                while True:
+                    wait = self._requests.wait_time(1)
+                    if self._tokens is not None:
+                        wait = max(wait, self._tokens.wait_time(tokens))
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+
+                self._requests.take(1)
+                if self._tokens is not None:
+                    self._tokens.take(tokens)
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.total_wait += waited
+        if waited > 1:
+            logger.info(f"Wywołanie {self.model} czekało {waited:.1f} s na limit zapytań")
+        return RateLimitSlot(self, tokens)
+
+    def _settle(self, reserved_tokens, actual_tokens):
+        if self._tokens is not None:
+            self._tokens.give_back(reserved_tokens - actual_tokens)
+
+    def stats(self):
+        return {
+            "model": self.model,
+            "requests_available": int(self._requests.level),
+            "tokens_available": int(self._tokens.level) if self._tokens is not None else None,
+            "waiting": self.waiting,
+            "total_wait": round(self.total_wait, 2)
+        }
+
+_limiters = {}
+
+def get_rate_limiter(model):
+    """Zwraca limiter dla modelu (tworzony przy pierwszym użyciu)"""
+    limiter = _limiters.get(model)
+    if limiter is None:
+        limits = MODEL_RATE_LIMITS.get(model, MODEL_RATE_LIMITS["default"])
+        limiter = ModelRateLimiter(model, limits["rpm"], limits.get("tpm"))
+        _limiters[model] = limiter
+    return limiter
+
+async def acquire_rate_limit(model, tokens=0):
+    """Rezerwuje miejsce na wywołanie modelu - skrót dla get_rate_limiter(model).acquire()"""
+    return await get_rate_limiter(model).acquire(tokens)
+
+def estimate_prompt_tokens(messages, model):
+    """
+    Szacuje liczbę tokenów promptu wysyłanego do OpenAI
+
+    Args:
+        messages (list): Wiadomości w formacie OpenAI (treść jako tekst lub lista części)
+        model (str): Nazwa modelu
+
+    Returns:
+        int: Liczba tokenów
+    """
+    tokens = TOKENS_PER_REPLY
+    for message in messages:
+        tokens += TOKENS_PER_MESSAGE
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    tokens += count_tokens(part.get("text"), model)
+                elif part.get("type") == "image_url":
+                    low = part.get("image_url", {}).get("detail") == "low"
+                    tokens += IMAGE_LOW_DETAIL_TOKENS if low else IMAGE_TOKENS_ESTIMATE
+        else:
+            tokens += count_tokens(content, model)
+    return tokens
+
+def estimate_request_tokens(messages, model, max_tokens=None):
+    """Szacuje tokeny wywołania: prompt oraz odpowiedź (max_tokens lub typowa długość)"""
+    completion = max_tokens if max_tokens is not None else OPENAI_COMPLETION_TOKENS_ESTIMATE
+    return estimate_prompt_tokens(messages, model) + completion
+
+def _limiter_stats():
+    """Zwraca stan limiterów wszystkich używanych modeli"""
+    return [limiter.stats() for limiter in _limiters.values()]
+
+register_stats("rate_limits", _limiter_stats)
@@ -0,0 +1,164 @@
+"""
+Pamięć podręczna wyników analizy i tłumaczenia plików
+Wynik wywołania modelu dla tego samego pliku (file_unique_id z Telegrama lub skrót
+zawartości), trybu, języka docelowego i modelu jest zapamiętywany, aby ponowne
+przesłanie pliku lub przycisk "przetłumacz" nie uruchamiały modelu drugi raz.
+
+Dwa poziomy: pamięć procesu (LRU o ograniczonej liczbie wpisów) oraz opcjonalny
+katalog na dysku (RESULT_CACHE_DIR) z usuwaniem najdawniej używanych plików po
+przekroczeniu limitu rozmiaru.
+"""
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import RESULT_CACHE_SIZE, RESULT_CACHE_DIR, RESULT_CACHE_DISK_MAX_BYTES
+from utils.disk_lru import DiskLRU
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+class DiskCache(DiskLRU):
+    """
+    Katalog z wynikami w plikach JSON, ograniczony łącznym rozmiarem
+
+    Args:
+        directory (str): Katalog na pliki
+        max_bytes (int): Maksymalny łączny rozmiar plików
+    """
+
+    def __init__(self, directory, max_bytes):
+        super().__init__(directory, max_bytes, ".json")
+
+    def get(self, key):
+        try:
+            stream = self.open(key)
+            if stream is None:
+                return None
+            with stream:
+                return json.load(stream)["value"]
+        except Exception as e:
+            logger.warning(f"Uszkodzony wpis pamięci podręcznej wyników {key}: {e}")
+            return None
+
+    def set(self, key, value):
+        data = json.dumps({"value": value, "created": time.time()}, ensure_ascii=False).encode("utf-8")
+        self.write(key, io.BytesIO(data))
+
+class ResultCache:
+    """
+    Dwupoziomowa pamięć podręczna wyników: LRU w pamięci i opcjonalnie dysk
+
+    Args:
+        max_size (int): Maksymalna liczba wpisów w pamięci
+        directory (str, optional): Katalog poziomu dyskowego; None wyłącza dysk
+        max_bytes (int): Limit rozmiaru poziomu dyskowego
+    """
+
+    def __init__(self, max_size, directory=None, max_bytes=0):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if directory:
+            try:
+                self.disk = DiskCache(directory, max_bytes)
+            except Exception as e:
+                logger.error(f"Nie udało się przygotować katalogu pamięci podręcznej wyników {directory}: {e}")
+
+    def get(self, key):
+        """Zwraca zapamiętany wynik lub None"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            value = self.disk.get(key) if self.disk else None
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.disk_hits += 1
+            self._remember(key, value)
+            return value
+
+    def set(self, key, value):
+        """Zapisuje wynik na obu poziomach"""
+        with self._lock:
+            self._remember(key, value)
+            if self.disk:
+                try:
+                    self.disk.set(key, value)
+                except Exception as e:
+                    logger.error(f"Błąd zapisu pamięci podręcznej wyników na dysk: {e}")
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """Zwraca statystyki trafień"""
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "disk_bytes": self.disk.total_bytes if self.disk else 0,
+                "hit_ratio": round((self.hits + self.disk_hits) / total, 3) if total else 0.0
+            }
+
+# Wspólna instancja dla całego procesu
+_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_DIR, RESULT_CACHE_DISK_MAX_BYTES)
+register_stats("result_cache", _cache.stats)
+
+def make_result_key(content, kind, mode, target_language, model, file_id=None, extension=""):
+    """
+    Tworzy klucz wyniku dla pliku i parametrów wywołania
+
+    Args:
+        content (bytes or file): Zawartość pliku lub otwarty plik binarny (używane, gdy brak file_id)
+        kind (str): Rodzaj operacji, np. 'image' lub 'document'
+        mode (str): Tryb: 'analyze' lub 'translate'
+        target_language (str): Język docelowy
+        model (str): Model OpenAI
+        file_id (str, optional): file_unique_id z Telegrama - ten sam dla tego samego pliku
+        extension (str, optional): Rozszerzenie pliku (wpływa na sposób przygotowania zapytania)
+
+    Returns:
+        str: Klucz (skrót SHA-256)
+    """
+    source = f"tg:{file_id}" if file_id else f"sha256:{_content_digest(content)}"
+    raw = "|".join((source, kind, mode, target_language or "", model, extension or ""))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _content_digest(content):
+    """Skrót SHA-256 zawartości - plik jest czytany fragmentami, bez kopiowania całości do pamięci"""
+    if hasattr(content, "read"):
+        position = content.tell()
+        content.seek(0)
+        digest = hashlib.file_digest(content, "sha256").hexdigest()
+        content.seek(position)
+        return digest
+    return hashlib.sha256(content).hexdigest()
+
+def get_cached_result(key):
+    """Zwraca zapamiętany wynik dla klucza lub None"""
+    return _cache.get(key)
+
+def cache_result(key, value):
+    """Zapamiętuje wynik dla klucza"""
+    if value:
+        _cache.set(key, value)
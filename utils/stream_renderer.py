@@ -0,0 +1,210 @@
+"""
+Wyświetlanie odpowiedzi strumieniowej w wiadomości Telegrama
+Fragmenty odpowiedzi trafiają do bufora, a edycje wiadomości wykonuje osobne zadanie:
+najwyżej jedna edycja w toku na wiadomość, odstęp między edycjami wynika z limitów
+Telegrama (dla czatu i dla całego bota) oraz z obserwowanego czasu edycji. Edycje,
+które nie zmieniają tekstu, są pomijane, a tekst dłuższy niż limit wiadomości
+przechodzi do kolejnej wiadomości.
+
+Edycje pośrednie są wysyłane bez formatowania (niedomknięty Markdown powoduje błąd
+Telegrama), a ostatnia edycja każdej wiadomości - z Markdown i awaryjnie bez niego.
+"""
+import asyncio
+import logging
+import time
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+from utils.telegram_scheduler import outbound_priority, PRIORITY_HIGH, PRIORITY_LOW
+from config import (
+    STREAM_EDIT_INTERVAL, STREAM_EDIT_INTERVAL_GROUP,
+    STREAM_GLOBAL_EDITS_PER_SECOND, STREAM_MESSAGE_LIMIT
+)
+
+logger = logging.getLogger(__name__)
+
+CURSOR = "▌"
+
+# Wagi średniej kroczącej czasu edycji
+LATENCY_SMOOTHING = 0.3
+
+# Aktywne renderery (do podziału globalnego limitu edycji) i najbliższy dozwolony czas edycji w czacie
+_active = set()
+_chat_next_edit = {}
+
+def _split_position(text, limit):
+    """Miejsce podziału tekstu przed limitem - preferowany koniec linii, potem spacja"""
+    cut = text.rfind("\n", 0, limit)
+    if cut > limit // 2:
+        return cut + 1
+    cut = text.rfind(" ", 0, limit)
+    if cut > limit // 2:
+        return cut + 1
+    return limit
+
+class StreamRenderer:
+    """
+    Renderer odpowiedzi strumieniowej dla jednej odpowiedzi bota
+
+    Args:
+        message: Wiadomość Telegrama, którą renderer będzie edytował (np. "Generuję odpowiedź...")
+        reply_markup (optional): Klawiatura wyświetlana w trakcie generowania (np. przycisk "Stop"),
+            usuwana przy ostatecznej edycji wiadomości
+    """
+
+    def __init__(self, message, reply_markup=None):
+        self._message = message
+        self._reply_markup = reply_markup
+        self._chat_id = message.chat_id
+        self._base_interval = STREAM_EDIT_INTERVAL if message.chat.type == "private" else STREAM_EDIT_INTERVAL_GROUP
+        self._done = []       # tekst wiadomości zakończonych po przekroczeniu limitu
+        self._segment = ""    # tekst bieżącej wiadomości
+        self._pending = []    # fragmenty jeszcze niewyświetlone
+        self._shown = None    # (tekst, markdown) ostatniej udanej edycji bieżącej wiadomości
+        self._latency = None
+        self._last_edit = 0.0
+        self._wake = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task = None
+        self.edits = 0
+        self.messages = [message]
+
+    @property
+    def text(self):
+        """Pełny tekst odpowiedzi (również fragmenty jeszcze niewyświetlone)"""
+        return "".join(self._done) + self._segment + "".join(self._pending)
+
+    @property
+    def current_message(self):
+        """Wiadomość, do której trafia bieżący tekst"""
+        return self._message
+
+    def feed(self, chunk):
+        """Dodaje fragment odpowiedzi - nie czeka na edycję wiadomości"""
+        if not chunk:
+            return
+        self._pending.append(chunk)
+        if self._task is None:
+            _active.add(self)
+            self._task = asyncio.create_task(self._run())
+        self._wake.set()
+
+    async def finish(self):
+        """Czeka na edycję w toku i wyświetla ostateczny tekst (z Markdown)"""
+        await self._stop()
+        await self._absorb()
+        if self._segment.strip():
+            await self._edit(self._segment, markdown=True, final=True)
+
+    async def fail(self, text):
+        """Przerywa renderowanie i zastępuje bieżącą wiadomość podanym tekstem"""
+        await self._stop()
+        await self._edit(text, markdown=False, final=True)
+
+    async def _stop(self):
+        self._closing.set()
+        self._wake.set()
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"Błąd zadania renderowania odpowiedzi: {e}")
+        _active.discard(self)
+
+        # Nie trzymaj wpisów czatów, w których limit już minął
+        if _chat_next_edit.get(self._chat_id, 0.0) < time.monotonic():
+            _chat_next_edit.pop(self._chat_id, None)
+
+    def _interval(self):
+        """Odstęp między edycjami tej wiadomości"""
+        global_share = len(_active) / STREAM_GLOBAL_EDITS_PER_SECOND
+        latency = 2 * self._latency if self._latency is not None else 0.0
+        return max(self._base_interval, global_share, latency)
+
+    async def _run(self):
+        while not self._closing.is_set():
+            await self._wake.wait()
+            self._wake.clear()
+
+            now = time.monotonic()
+            next_edit = max(self._last_edit + self._interval(), _chat_next_edit.get(self._chat_id, 0.0))
+            if next_edit > now:
+                try:
+                    await asyncio.wait_for(self._closing.wait(), timeout=next_edit - now)
+                except asyncio.TimeoutError:
+                    pass
+            if self._closing.is_set():
+                # Ostateczną edycję wykonuje finish()
+                return
+
+            await self._absorb()
+            await self._edit(self._segment + CURSOR, markdown=False)
+
+    async def _absorb(self):
+        """Przenosi fragmenty z bufora do bieżącej wiadomości, zaczynając nową po przekroczeniu limitu"""
+        if self._pending:
+            self._segment += "".join(self._pending)
+            self._pending.clear()
+
+        while len(self._segment) > STREAM_MESSAGE_LIMIT:
+            cut = _split_position(self._segment, STREAM_MESSAGE_LIMIT)
+            head, self._segment = self._segment[:cut], self._segment[cut:]
+            await self._edit(head, markdown=True, final=True)
+            self._done.append(head)
+
+            try:
+                with outbound_priority(PRIORITY_HIGH):
+                    self._message = await self._message.chat.send_message(CURSOR, reply_markup=self._reply_markup)
+                self.messages.append(self._message)
+                self._shown = (CURSOR, False)
+            except Exception as e:
+                logger.error(f"Nie udało się wysłać wiadomości z kontynuacją odpowiedzi: {e}")
+
+    async def _edit(self, text, markdown, final=False):
+        """Edytuje bieżącą wiadomość; edycje pośrednie są pomijane przy błędach"""
+        if self._shown == (text, markdown):
+            return
+
+        retry_after = None
+        started = time.monotonic()
+        try:
+            # Edycje pośrednie ustępują w kolejce Bot API odpowiedziom końcowym
+            reply_markup = None if final else self._reply_markup
+            with outbound_priority(PRIORITY_HIGH if final else PRIORITY_LOW):
+                if markdown:
+                    try:
+                        await self._message.edit_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+                    except BadRequest as e:
+                        if "not modified" in str(e):
+                            raise
+                        # Niepoprawny Markdown - wyślij bez formatowania
+                        await self._message.edit_text(text, reply_markup=reply_markup)
+                else:
+                    await self._message.edit_text(text, reply_markup=reply_markup)
+            self._shown = (text, markdown)
+            self.edits += 1
+        except RetryAfter as e:
+            retry_after = float(e.retry_after)
+            _chat_next_edit[self._chat_id] = time.monotonic() + retry_after
+            logger.warning(f"Limit edycji Telegrama w czacie {self._chat_id} - przerwa {retry_after} s")
+        except BadRequest as e:
+            if "not modified" in str(e):
+                self._shown = (text, markdown)
+            else:
+                logger.warning(f"Błąd edycji wiadomości z odpowiedzią: {e}")
+        except Exception as e:
+            logger.warning(f"Błąd edycji wiadomości z odpowiedzią: {e}")
+        finally:
+            finished = time.monotonic()
+            latency = finished - started
+            self._latency = latency if self._latency is None else (
+                LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self._latency
+            )
+            self._last_edit = finished
+            _chat_next_edit[self._chat_id] = max(
+                _chat_next_edit.get(self._chat_id, 0.0), started + self._base_interval
+            )
+
+        # Edycji ostatecznej nie można pominąć - ponów po przerwie wskazanej przez Telegram
+        if retry_after is not None and final:
+            await asyncio.sleep(retry_after)
+            await self._edit(text, markdown, final)
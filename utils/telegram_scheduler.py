@@ -0,0 +1,230 @@
+"""
+Wspólny harmonogram wychodzących wywołań Bot API
+Wszystkie wywołania wysyłające lub edytujące wiadomości przechodzą przez jedną kolejkę
+z priorytetami (BaseRateLimiter z python-telegram-bot), która pilnuje globalnego limitu
+bota i limitów pojedynczych czatów. Odpowiedzi końcowe i potwierdzenia płatności mają
+pierwszeństwo przed pośrednimi edycjami odpowiedzi strumieniowej.
+
+Po błędzie RetryAfter (flood wait) wstrzymywany jest tylko dany czat, a wywołanie jest
+ponawiane po przerwie - z wyjątkiem edycji pośrednich, które i tak zastąpi kolejna edycja.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE, TELEGRAM_CHAT_BURST
+)
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Priorytety - niższa wartość jest obsługiwana wcześniej
+PRIORITY_HIGH = 0      # potwierdzenia płatności, odpowiedzi końcowe
+PRIORITY_NORMAL = 1    # zwykłe wiadomości i menu
+PRIORITY_LOW = 2       # pośrednie edycje odpowiedzi strumieniowej
+
+# Metody podlegające limitom wysyłania wiadomości
+SCHEDULED_PREFIXES = ("send", "edit", "copy", "forward")
+UNSCHEDULED_METHODS = {"sendChatAction"}
+HIGH_PRIORITY_METHODS = {"sendInvoice", "answerPreCheckoutQuery", "answerShippingQuery"}
+
+_priority = contextvars.ContextVar("outbound_priority", default=None)
+
+@contextmanager
+def outbound_priority(priority):
+    """
+    Ustawia priorytet wywołań Bot API wykonywanych w bloku
+
+    Przykład:
+        with outbound_priority(PRIORITY_HIGH):
+            await query.edit_message_text(...)
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class _Bucket:
+    """Kubełek tokenów: `rate` na sekundę, maksymalnie `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def ready_at(self, now):
+        """Najbliższy moment, w którym można wysłać wywołanie"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        ready = now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+        return max(ready, self.blocked_until)
+
+    def take(self):
+        self.tokens -= 1
+
+def _is_group(chat_id):
+    if isinstance(chat_id, int):
+        return chat_id < 0
+    return str(chat_id).startswith(("-", "@"))
+
+class OutboundScheduler(BaseRateLimiter):
+    """
+    Kolejka wywołań z priorytetami oraz limitami globalnym i czatów
+
+    Kolejne wywołanie jest wybierane według priorytetu i kolejności przybycia spośród
+    czatów, które mogą już wysyłać - wstrzymany czat nie blokuje pozostałych.
+    """
+
+    def __init__(self):
+        self._global = _Bucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self._chats = {}
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._wake = None
+        self._task = None
+        self.granted = 0
+        self.flood_waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def initialize(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Wywołania oczekujące w chwili zamykania wysyłamy bez limitów
+        for entry in self._waiting:
+            if not entry[-1].done():
+                entry[-1].set_result(None)
+        self._waiting.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            rate = TELEGRAM_GROUP_RATE if _is_group(chat_id) else TELEGRAM_CHAT_RATE
+            bucket = self._chats[chat_id] = _Bucket(rate, TELEGRAM_CHAT_BURST)
+        return bucket
+
+    async def _acquire(self, chat_id, priority):
+        if self._task is None:
+            # Harmonogram nie został uruchomiony (np. bot użyty poza aplikacją)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._sequence), chat_id, future))
+        self._wake.set()
+
+        started = time.monotonic()
+        await future
+        waited = time.monotonic() - started
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    async def _dispatch(self):
+        while True:
+            self._wake.clear()
+            now = time.monotonic()
+            next_ready = None
+
+            if self._waiting:
+                # Pomijamy wywołania anulowane przez wywołujących; posortowana lista jest kopcem
+                self._waiting = sorted(entry for entry in self._waiting if not entry[-1].done())
+                global_ready = self._global.ready_at(now)
+                chosen = None
+                for entry in self._waiting:
+                    chat_id = entry[2]
+                    ready = global_ready if chat_id is None else max(global_ready, self._chat_bucket(chat_id).ready_at(now))
+                    if ready <= now:
+                        chosen = entry
+                        break
+                    next_ready = ready if next_ready is None else min(next_ready, ready)
+
+                if chosen is not None:
+                    self._waiting.remove(chosen)
+                    self._global.take()
+                    if chosen[2] is not None:
+                        self._chat_bucket(chosen[2]).take()
+                    self.granted += 1
+                    chosen[-1].set_result(None)
+                    continue
+
+            timeout = max(0.0, next_ready - now) if next_ready is not None else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            self._forget_idle_chats()
+
+    def _forget_idle_chats(self):
+        """Usuwa limity czatów, które od dawna niczego nie wysyłały"""
+        if len(self._chats) < 10000:
+            return
+        now = time.monotonic()
+        active = {entry[2] for entry in self._waiting}
+        for chat_id in [c for c, b in self._chats.items() if c not in active and now - b.updated > 60 and b.blocked_until < now]:
+            del self._chats[chat_id]
+
+    def _flood_wait(self, chat_id, retry_after):
+        """Wstrzymuje czat (lub całego bota, gdy wywołanie nie dotyczy czatu) na czas wskazany przez Telegram"""
+        self.flood_waits += 1
+        bucket = self._global if chat_id is None else self._chat_bucket(chat_id)
+        bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+        if self._wake is not None:
+            self._wake.set()
+        logger.warning(f"Flood wait {retry_after} s dla czatu {chat_id}")
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in UNSCHEDULED_METHODS or not endpoint.startswith(SCHEDULED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get("chat_id")
+        priority = rate_limit_args if rate_limit_args is not None else _priority.get()
+        if priority is None:
+            priority = PRIORITY_HIGH if endpoint in HIGH_PRIORITY_METHODS else PRIORITY_NORMAL
+
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._flood_wait(chat_id, float(e.retry_after))
+                if priority >= PRIORITY_LOW:
+                    raise
+
+    def stats(self):
+        """Zwraca statystyki kolejki"""
+        waiting = [entry for entry in self._waiting if not entry[-1].done()]
+        return {
+            "queue_depth": len(waiting),
+            "queue_by_priority": {
+                priority: sum(1 for entry in waiting if entry[0] == priority)
+                for priority in (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+            },
+            "granted": self.granted,
+            "flood_waits": self.flood_waits,
+            "avg_wait": round(self.total_wait / self.granted, 3) if self.granted else 0.0,
+            "max_wait": round(self.max_wait, 3),
+            "blocked_chats": sum(1 for bucket in self._chats.values() if bucket.blocked_until > time.monotonic())
+        }
+
+# Wspólna instancja dla całego procesu
+outbound_scheduler = OutboundScheduler()
+register_stats("telegram_outbound", outbound_scheduler.stats)
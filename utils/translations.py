@@ -62,6 +62,9 @@ translations = {
         "file_too_large": "Plik jest zbyt duży. Maksymalny rozmiar to 25MB.",
         "analyzing_file": "Analizuję plik, proszę czekać...",
         "analyzing_photo": "Analizuję zdjęcie, proszę czekać...",
+        "document_progress_analyzing": "Analizuję dokument częściami: {done} z {total}...",
+        "document_progress_translating": "Tłumaczę dokument częściami: {done} z {total}...",
+        "document_progress_merging": "Łączę wyniki analizy części dokumentu...",
         "file_analysis": "Analiza pliku",
         "photo_analysis": "Analiza zdjęcia",
         
@@ -191,18 +194,27 @@ translations = {
         "onboarding_next": "Dalej ➡️",
         "onboarding_back": "⬅️ Wstecz",
         "onboarding_finish_button": "🏁 Zakończ przewodnik",
-        "onboarding_analysis": "🔍 **Analiza dokumentów i zdjęć**\n\nBot może analizować przesłane przez Ciebie dokumenty i zdjęcia. Dodatkowo oferuje funkcję tłumaczenia!\n\nWystarczy przesłać plik lub zdjęcie, a bot dokona ich analizy. Możesz również:\n• Użyć komendy /translate wysyłając zdjęcie z tekstem\n• Użyć przycisku \"Przetłumacz tekst z tego zdjęcia\" pod analizą\n• Dla dokumentów PDF - przetłumaczyć pierwszy akapit\n\nKoszty: Analiza zdjęcia - 8 kredytów, dokumentu - 5 kredytów, tłumaczenie - 8 kredytów.",
+        "onboarding_analysis": "🔍 **Analiza dokumentów i zdjęć**\n\nBot może analizować przesłane przez Ciebie dokumenty i zdjęcia. Dodatkowo oferuje funkcję tłumaczenia!\n\nWystarczy przesłać plik lub zdjęcie, a bot dokona ich analizy. Możesz również:\n• Użyć komendy /translate wysyłając zdjęcie z tekstem\n• Użyć przycisku \"Przetłumacz tekst z tego zdjęcia\" pod analizą\n• Dla dokumentów PDF - przetłumaczyć cały dokument do nowego pliku PDF\n\nKoszty: Analiza zdjęcia - 8 kredytów, dokumentu - 5 kredytów, tłumaczenie - 8 kredytów.",
         "onboarding_referral": "👥 **Program referencyjny**\n\nZapraszaj znajomych i zyskuj dodatkowe kredyty! Za każdą osobę, która skorzysta z Twojego kodu polecającego, otrzymasz bonus.\n\nSposób działania:\n• Każdy użytkownik ma swój unikalny kod referencyjny w formacie REF + ID\n• Za każdą osobę, która użyje Twojego kodu, otrzymujesz 50 kredytów\n• Nowy użytkownik otrzymuje bonus 25 kredytów na start\n\nZachęcaj znajomych do korzystania z bota i zyskuj darmowe kredyty!",
 
         # Dla PDF polskiego
         "not_pdf_file": "Plik nie jest w formacie PDF. Proszę przesłać plik PDF.",
-        "translating_pdf": "Tłumaczę pierwszy akapit z pliku PDF, proszę czekać...",
-        "pdf_translation_result": "Wynik tłumaczenia pierwszego akapitu",
+        "translating_pdf": "Tłumaczę plik PDF, proszę czekać...",
+        "pdf_translation_result": "Przetłumaczony plik PDF",
+        "pdf_translation_progress": "Tłumaczę plik PDF: strona {done} z {total}...",
+        "pdf_translation_done": "Przetłumaczono plik PDF ({pages} str.). Koszt: {credits} kredytów.",
+        "pdf_translation_failed": "Tłumaczenie przerwane na stronie {page}: {error}\n\nPrzetłumaczone strony ({done} z {total}) zostały zapisane - wznowienie obejmie tylko pozostałe. Pobrano {credits} kredytów.",
+        "pdf_resume_button": "🔄 Wznów tłumaczenie",
+        "pdf_too_many_pages": "Plik PDF ma {pages} stron - można przetłumaczyć najwyżej {limit}.",
+        "pdf_no_text": "Nie znaleziono tekstu w pliku PDF (np. zeskanowane strony).",
+        "pdf_credits_needed": "Tłumaczenie {pages} stron kosztuje {credits} kredytów - masz za mało kredytów.",
+        "document_credits_needed": "Dokument jest długi ({parts} części) - jego przetworzenie kosztuje {credits} kredytów, a masz za mało kredytów.",
+        "pdf_resend": "Nie znaleziono pliku - prześlij plik PDF ponownie z komentarzem /translate.",
         "original_text": "Oryginalny tekst",
         "translated_text": "Przetłumaczony tekst",
         "pdf_translation_error": "Błąd podczas tłumaczenia pliku PDF",
-        "translate_pdf_command": "Aby przetłumaczyć pierwszy akapit z pliku PDF, prześlij plik PDF z komentarzem /translate",
-        "pdf_translate_button": "🔄 Przetłumacz pierwszy akapit",
+        "translate_pdf_command": "Aby przetłumaczyć plik PDF, prześlij go z komentarzem /translate",
+        "pdf_translate_button": "🔄 Przetłumacz PDF",
         "translating_document": "Tłumaczę dokument, proszę czekać...",
         "subscription_expired_short": "Niewystarczająca liczba kredytów",
         "translate_first_paragraph": "Przetłumacz pierwszy akapit",
@@ -235,6 +247,15 @@ translations = {
         "current_balance": "Aktualny stan kredytów",
         "buy_more_credits": "Kup więcej kredytów",
         "credit_history": "Historia transakcji",
+        "page_older": "⬅️ Starsze",
+        "page_newer": "Nowsze ➡️",
+        "credit_history_all": "📜 Pełna historia transakcji",
+        "too_many_requests": "⏳ Masz już kilka wiadomości w kolejce. Poczekaj na odpowiedzi, zanim wyślesz kolejne.",
+        "server_busy": "⏳ Bot jest teraz mocno obciążony. Spróbuj ponownie za chwilę.",
+        "reply_superseded": "⏹ Przerwano - odpowiadam na nowszą wiadomość.",
+        "stop_generation_btn": "⏹ Zatrzymaj",
+        "reply_stopped": "⏹ Zatrzymano.",
+        "generation_already_finished": "Odpowiedź jest już zakończona.",
         "credits_analytics": "Analiza wykorzystania kredytów",
 
         # Nowe tłumaczenia do obsługi trybów
@@ -431,6 +452,9 @@ translations = {
         "file_too_large": "The file is too large. Maximum size is 25MB.",
         "analyzing_file": "Analyzing file, please wait...",
         "analyzing_photo": "Analyzing photo, please wait...",
+        "document_progress_analyzing": "Analyzing the document in parts: {done} of {total}...",
+        "document_progress_translating": "Translating the document in parts: {done} of {total}...",
+        "document_progress_merging": "Combining the analyses of the document parts...",
         "file_analysis": "File analysis",
         "photo_analysis": "Photo analysis",
         
@@ -560,18 +584,27 @@ translations = {
         "onboarding_next": "Next ➡️",
         "onboarding_back": "⬅️ Back",
         "onboarding_finish_button": "🏁 Finish guide",
-        "onboarding_analysis": "🔍 **Document and Photo Analysis**\n\nThe bot can analyze documents and photos you send. It also offers translation functionality!\n\nJust upload a file or photo, and the bot will analyze it. You can also:\n• Use the /translate command when sending an image with text\n• Use the \"Translate text from this image\" button under analysis\n• For PDF documents - translate the first paragraph\n\nCosts: Photo analysis - 8 credits, document analysis - 5 credits, translation - 8 credits.",
+        "onboarding_analysis": "🔍 **Document and Photo Analysis**\n\nThe bot can analyze documents and photos you send. It also offers translation functionality!\n\nJust upload a file or photo, and the bot will analyze it. You can also:\n• Use the /translate command when sending an image with text\n• Use the \"Translate text from this image\" button under analysis\n• For PDF documents - translate the whole document into a new PDF file\n\nCosts: Photo analysis - 8 credits, document analysis - 5 credits, translation - 8 credits.",
         "onboarding_referral": "👥 **Referral Program**\n\nInvite friends and earn additional credits! For each person who uses your referral code, you'll receive a bonus.\n\nHow it works:\n• Each user has a unique referral code in the format REF + ID\n• For each person who uses your code, you receive 50 credits\n• New users receive a 25 credit bonus to start\n\nEncourage your friends to use the bot and earn free credits!",
 
         # Dla PDF angielskiego
         "not_pdf_file": "The file is not in PDF format. Please upload a PDF file.",
-        "translating_pdf": "Translating the first paragraph from the PDF file, please wait...",
-        "pdf_translation_result": "Translation result of the first paragraph",
+        "translating_pdf": "Translating the PDF file, please wait...",
+        "pdf_translation_result": "Translated PDF file",
+        "pdf_translation_progress": "Translating the PDF file: page {done} of {total}...",
+        "pdf_translation_done": "The PDF file has been translated ({pages} pages). Cost: {credits} credits.",
+        "pdf_translation_failed": "Translation stopped at page {page}: {error}\n\nTranslated pages ({done} of {total}) have been saved - resuming will cover only the remaining ones. Charged {credits} credits.",
+        "pdf_resume_button": "🔄 Resume translation",
+        "pdf_too_many_pages": "The PDF file has {pages} pages - at most {limit} can be translated.",
+        "pdf_no_text": "No text found in the PDF file (e.g. scanned pages).",
+        "pdf_credits_needed": "Translating {pages} pages costs {credits} credits - you do not have enough credits.",
+        "document_credits_needed": "The document is long ({parts} parts) - processing it costs {credits} credits and you do not have enough credits.",
+        "pdf_resend": "File not found - please send the PDF file again with the /translate comment.",
         "original_text": "Original text",
         "translated_text": "Translated text",
         "pdf_translation_error": "Error while translating the PDF file",
-        "translate_pdf_command": "To translate the first paragraph from a PDF file, upload a PDF file with the /translate comment",
-        "pdf_translate_button": "🔄 Translate first paragraph",
+        "translate_pdf_command": "To translate a PDF file, upload it with the /translate comment",
+        "pdf_translate_button": "🔄 Translate PDF",
         "translating_document": "Translating document, please wait...",
         "subscription_expired_short": "Insufficient credits",
         "translate_first_paragraph": "Translate first paragraph",
@@ -604,6 +637,15 @@ translations = {
         "current_balance": "Current credit balance",
         "buy_more_credits": "Buy more credits",
         "credit_history": "Transaction history",
+        "page_older": "⬅️ Older",
+        "page_newer": "Newer ➡️",
+        "credit_history_all": "📜 Full transaction history",
+        "too_many_requests": "⏳ You already have several messages in the queue. Please wait for the replies before sending more.",
+        "server_busy": "⏳ The bot is under heavy load right now. Please try again in a moment.",
+        "reply_superseded": "⏹ Interrupted - answering your newer message.",
+        "stop_generation_btn": "⏹ Stop",
+        "reply_stopped": "⏹ Stopped.",
+        "generation_already_finished": "The reply has already finished.",
         "credits_analytics": "Credit usage analytics",
         
         # Nowe tłumaczenia do obsługi trybów
@@ -801,6 +843,9 @@ translations = {
         "file_too_large": "Файл слишком большой. Максимальный размер 25MB.",
         "analyzing_file": "Анализирую файл, пожалуйста, подождите...",
         "analyzing_photo": "Анализирую фото, пожалуйста, подождите...",
+        "document_progress_analyzing": "Анализирую документ по частям: {done} из {total}...",
+        "document_progress_translating": "Перевожу документ по частям: {done} из {total}...",
+        "document_progress_merging": "Объединяю результаты анализа частей документа...",
         "file_analysis": "Анализ файла",
         "photo_analysis": "Анализ фото",
         
@@ -930,18 +975,27 @@ translations = {
         "onboarding_next": "Далее ➡️",
         "onboarding_back": "⬅️ Назад",
         "onboarding_finish_button": "🏁 Завершить руководство",
-        "onboarding_analysis": "🔍 **Анализ документов и фотографий**\n\nБот может анализировать отправленные вами документы и фотографии. Также он предлагает функцию перевода!\n\nПросто загрузите файл или фото, и бот проведет их анализ. Вы также можете:\n• Использовать команду /translate при отправке изображения с текстом\n• Использовать кнопку \"Перевести текст с этого изображения\" под анализом\n• Для документов PDF - перевести первый абзац\n\nСтоимость: Анализ фото - 8 кредитов, анализ документа - 5 кредитов, перевод - 8 кредитов.",
+        "onboarding_analysis": "🔍 **Анализ документов и фотографий**\n\nБот может анализировать отправленные вами документы и фотографии. Также он предлагает функцию перевода!\n\nПросто загрузите файл или фото, и бот проведет их анализ. Вы также можете:\n• Использовать команду /translate при отправке изображения с текстом\n• Использовать кнопку \"Перевести текст с этого изображения\" под анализом\n• Для документов PDF - перевести весь документ в новый файл PDF\n\nСтоимость: Анализ фото - 8 кредитов, анализ документа - 5 кредитов, перевод - 8 кредитов.",
         "onboarding_referral": "👥 **Реферальная программа**\n\nПриглашайте друзей и получайте дополнительные кредиты! За каждого человека, который воспользуется вашим реферальным кодом, вы получите бонус.\n\nКак это работает:\n• У каждого пользователя есть уникальный реферальный код в формате REF + ID\n• За каждого человека, который использует ваш код, вы получаете 50 кредитов\n• Новый пользователь получает бонус в 25 кредитов для начала\n\nПриглашайте друзей пользоваться ботом и получайте бесплатные кредиты!",
 
         # PDF rosyjski
         "not_pdf_file": "Файл не в формате PDF. Пожалуйста, загрузите файл PDF.",
-        "translating_pdf": "Перевожу первый абзац из файла PDF, пожалуйста, подождите...",
-        "pdf_translation_result": "Результат перевода первого абзаца",
+        "translating_pdf": "Перевожу файл PDF, пожалуйста, подождите...",
+        "pdf_translation_result": "Переведённый файл PDF",
+        "pdf_translation_progress": "Перевожу файл PDF: страница {done} из {total}...",
+        "pdf_translation_done": "Файл PDF переведён ({pages} стр.). Стоимость: {credits} кредитов.",
+        "pdf_translation_failed": "Перевод прерван на странице {page}: {error}\n\nПереведённые страницы ({done} из {total}) сохранены - при возобновлении будут переведены только оставшиеся. Списано {credits} кредитов.",
+        "pdf_resume_button": "🔄 Возобновить перевод",
+        "pdf_too_many_pages": "В файле PDF {pages} страниц - можно перевести не более {limit}.",
+        "pdf_no_text": "В файле PDF не найден текст (например, отсканированные страницы).",
+        "pdf_credits_needed": "Перевод {pages} страниц стоит {credits} кредитов - у вас недостаточно кредитов.",
+        "document_credits_needed": "Документ длинный ({parts} частей) - его обработка стоит {credits} кредитов, а у вас недостаточно кредитов.",
+        "pdf_resend": "Файл не найден - отправьте файл PDF ещё раз с комментарием /translate.",
         "original_text": "Оригинальный текст",
         "translated_text": "Переведенный текст",
         "pdf_translation_error": "Ошибка при переводе файла PDF",
-        "translate_pdf_command": "Чтобы перевести первый абзац из файла PDF, загрузите файл PDF с комментарием /translate",
-        "pdf_translate_button": "🔄 Перевести первый абзац",
+        "translate_pdf_command": "Чтобы перевести файл PDF, загрузите его с комментарием /translate",
+        "pdf_translate_button": "🔄 Перевести PDF",
         "translating_document": "Перевожу документ, пожалуйста, подождите...",
         "subscription_expired_short": "Недостаточно кредитов",
         "translate_first_paragraph": "Перевести первый абзац",
@@ -974,6 +1028,15 @@ translations = {
         "current_balance": "Текущий баланс кредитов",
         "buy_more_credits": "Купить больше кредитов",
         "credit_history": "История транзакций",
+        "page_older": "⬅️ Старые",
+        "page_newer": "Новые ➡️",
+        "credit_history_all": "📜 Полная история транзакций",
+        "too_many_requests": "⏳ У вас уже несколько сообщений в очереди. Дождитесь ответов, прежде чем отправлять новые.",
+        "server_busy": "⏳ Бот сейчас сильно загружен. Попробуйте ещё раз через минуту.",
+        "reply_superseded": "⏹ Прервано - отвечаю на более новое сообщение.",
+        "stop_generation_btn": "⏹ Стоп",
+        "reply_stopped": "⏹ Остановлено.",
+        "generation_already_finished": "Ответ уже завершён.",
         "credits_analytics": "Аналитика использования кредитов",
         
         # Nowe tłumaczenia do obsługi trybów
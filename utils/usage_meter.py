@@ -0,0 +1,157 @@
+"""
+Pomiar zużycia tokenów OpenAI i wycena wiadomości według tokenów
+Każde wywołanie modelu zgłasza liczbę tokenów promptu i odpowiedzi - z pola usage
+odpowiedzi API (w odpowiedzi strumieniowej z ostatniego fragmentu, o który prosimy
+przez stream_options.include_usage), a gdy API go nie zwróciło (np. strumień przerwany
+przyciskiem "Stop") - z lokalnego liczenia tokenów. Sumy zużycia na model są dostępne
+w statystykach i pozwalają dobrać MAX_CONTEXT_MESSAGES oraz domyślne modele.
+"""
+import logging
+import math
+import threading
+from config import CREDIT_COSTS, CREDIT_PRICING, TOKEN_CREDIT_RATES, TOKEN_CREDIT_MIN_CHARGE
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+def usage_from_response(response):
+    """
+    Zwraca zużycie tokenów z odpowiedzi lub fragmentu odpowiedzi strumieniowej
+
+    Returns:
+        dict: Słownik z kluczami prompt_tokens i completion_tokens lub None, jeśli odpowiedź go nie zawiera
+    """
+    usage = getattr(response, "usage", None)
+    if not usage:
+        return None
+
+    # SDK bez obsługi stream_options zostawia pole usage fragmentu jako zwykły słownik
+    if isinstance(usage, dict):
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    else:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+
+    if prompt_tokens is None or completion_tokens is None:
+        return None
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+def add_call_usage(call_info, usage):
+    """
+    Dolicza zużycie wywołania do call_info['usage'] - suma wszystkich wywołań modelu,
+    z których powstał jeden wynik (np. części długiego dokumentu)
+
+    Args:
+        call_info (dict): Słownik przekazany przez wywołującego lub None
+        usage (dict): Słownik z kluczami prompt_tokens i completion_tokens lub None
+    """
+    if call_info is None or not usage:
+        return
+    total = call_info.setdefault("usage", {"prompt_tokens": 0, "completion_tokens": 0})
+    total["prompt_tokens"] += usage["prompt_tokens"]
+    total["completion_tokens"] += usage["completion_tokens"]
+
+def charged_tokens(call_info):
+    """
+    Zwraca zużycie tokenów z call_info jako argumenty ledger_deduct / deduct_user_credits
+
+    Returns:
+        dict: prompt_tokens i completion_tokens (None, gdy wynik pochodził z pamięci podręcznej)
+    """
+    usage = (call_info or {}).get("usage") or {}
+    return {"prompt_tokens": usage.get("prompt_tokens"), "completion_tokens": usage.get("completion_tokens")}
+
+class UsageMeter:
+    """Sumy zużycia tokenów na model od uruchomienia bota"""
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, prompt_tokens, completion_tokens, estimated=False):
+        """
+        Dolicza zużycie jednego wywołania
+
+        Args:
+            model (str): Model, który wygenerował odpowiedź
+            prompt_tokens (int): Tokeny promptu
+            completion_tokens (int): Tokeny odpowiedzi
+            estimated (bool): Czy liczby pochodzą z lokalnego szacunku zamiast z API
+        """
+        with self._lock:
+            entry = self._models.setdefault(model, {
+                "calls": 0,
+                "estimated_calls": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0
+            })
+            entry["calls"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            if estimated:
+                entry["estimated_calls"] += 1
+
+    def stats(self):
+        """Zwraca zużycie na model wraz ze średnimi na wywołanie"""
+        with self._lock:
+            return {
+                model: dict(
+                    entry,
+                    avg_prompt_tokens=round(entry["prompt_tokens"] / entry["calls"]),
+                    avg_completion_tokens=round(entry["completion_tokens"] / entry["calls"])
+                )
+                for model, entry in self._models.items()
+            }
+
+# Wspólna instancja dla całego procesu
+_meter = UsageMeter()
+register_stats("token_usage", _meter.stats)
+
+def record_usage(model, usage):
+    """
+    Dolicza zużycie wywołania do statystyk
+
+    Args:
+        model (str): Model, który wygenerował odpowiedź
+        usage (dict): Słownik z kluczami prompt_tokens, completion_tokens i opcjonalnie estimated
+    """
+    if not usage:
+        return
+    _meter.record(model, usage["prompt_tokens"], usage["completion_tokens"], usage.get("estimated", False))
+
+def credits_for_usage(model, prompt_tokens, completion_tokens):
+    """
+    Wycenia wywołanie w kredytach według TOKEN_CREDIT_RATES
+
+    Args:
+        model (str): Model, który wygenerował odpowiedź
+        prompt_tokens (int): Tokeny promptu
+        completion_tokens (int): Tokeny odpowiedzi
+
+    Returns:
+        int: Liczba kredytów (co najmniej TOKEN_CREDIT_MIN_CHARGE) lub None, gdy rozliczanie
+             według tokenów jest wyłączone albo model nie ma stawki - wtedy obowiązuje stała cena
+    """
+    if CREDIT_PRICING != "tokens":
+        return None
+
+    rates = TOKEN_CREDIT_RATES.get(model)
+    if rates is None:
+        logger.warning(f"Brak stawki za tokeny dla modelu {model} - używam stałej ceny")
+        return None
+
+    cost = (prompt_tokens * rates["prompt"] + completion_tokens * rates["completion"]) / 1000
+    return max(TOKEN_CREDIT_MIN_CHARGE, math.ceil(cost))
+
+def document_credits(base_cost, parts):
+    """
+    Wycenia analizę lub tłumaczenie dokumentu
+
+    Args:
+        base_cost (int): Cena dokumentu mieszczącego się w jednym zapytaniu
+        parts (int): Liczba części z prepare_document - każda część ponad pierwszą
+                     kosztuje CREDIT_COSTS["document_part"]
+
+    Returns:
+        int: Liczba kredytów
+    """
+    return base_cost + max(0, parts - 1) * CREDIT_COSTS["document_part"]
@@ -0,0 +1,247 @@
+"""
+Kolejki zadań użytkowników
+Każdy użytkownik ma własną "ścieżkę": najwyżej USER_MAX_CONCURRENT handlerów wywołujących
+model naraz, kolejne czekają w kolejności przybycia (najwyżej USER_MAX_QUEUED), a nadmiarowe
+są odrzucane. Sprawdzenie salda i pobranie kredytów odbywa się więc po kolei, bez okna,
+w którym kilka równoległych wiadomości przechodzi kontrolę salda przed pierwszym obciążeniem.
+
+Opcjonalnie (USER_SUPERSEDE_REPLIES) nowa wiadomość tekstowa przerywa odpowiedź, która
+jest jeszcze generowana dla poprzedniej wiadomości tego użytkownika. Generowanie można też
+przerwać przyciskiem "Stop" (stop_generation).
+"""
+import asyncio
+import contextvars
+import functools
+import itertools
+import logging
+from collections import deque
+from config import USER_MAX_CONCURRENT, USER_MAX_QUEUED
+from utils.translations import get_text
+from utils.user_utils import get_user_language
+from utils.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Powody przerwania zadania
+SUPERSEDED = "superseded"
+STOPPED = "stopped"
+
+_current_ticket = contextvars.ContextVar("user_lane_ticket", default=None)
+_ticket_ids = itertools.count(1)
+
+class LaneFull(Exception):
+    """Kolejka użytkownika jest pełna"""
+
+class _Ticket:
+    """Jedno zadanie w ścieżce użytkownika"""
+
+    def __init__(self, task, supersedable):
+        self.id = next(_ticket_ids)
+        self.task = task
+        self.supersedable = supersedable
+        self.interruptible = True
+        self.cancel_reason = None
+
+    def cancel(self, reason):
+        """Przerywa zadanie, jeśli jest jeszcze w fazie, którą można przerwać"""
+        if self.cancel_reason is not None or not self.interruptible:
+            return False
+        self.cancel_reason = reason
+        self.task.cancel()
+        return True
+
+class _Lane:
+    def __init__(self):
+        self.active = set()
+        self.waiting = deque()
+
+class UserLanes:
+    """
+    Ścieżki wykonania użytkowników
+
+    Args:
+        max_concurrent (int): Maksymalna liczba jednocześnie wykonywanych zadań użytkownika
+        max_queued (int): Maksymalna liczba zadań oczekujących w kolejce użytkownika
+    """
+
+    def __init__(self, max_concurrent, max_queued):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max_queued
+        self._lanes = {}
+        self.rejected = 0
+        self.superseded = 0
+        self.stopped = 0
+
+    async def acquire(self, user_id, ticket, supersede=False):
+        """
+        Czeka na miejsce w ścieżce użytkownika
+
+        Args:
+            user_id (int): ID użytkownika
+            ticket (_Ticket): Zadanie
+            supersede (bool): Czy przerwać odpowiedzi generowane dla wcześniejszych wiadomości
+
+        Raises:
+            LaneFull: Gdy kolejka użytkownika jest pełna
+        """
+        lane = self._lanes.setdefault(user_id, _Lane())
+
+        if supersede:
+            for other in list(lane.active):
+                if other.supersedable and other.cancel(SUPERSEDED):
+                    self.superseded += 1
+
+        if len(lane.active) < self.max_concurrent and not lane.waiting:
+            lane.active.add(ticket)
+            return
+
+        if len(lane.waiting) >= self.max_queued:
+            self.rejected += 1
+            self._forget_if_idle(user_id, lane)
+            raise LaneFull()
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (ticket, future)
+        lane.waiting.append(entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if entry in lane.waiting:
+                lane.waiting.remove(entry)
+            elif future.done() and not future.cancelled():
+                # Miejsce zostało już przydzielone - oddaj je kolejnemu zadaniu
+                self.release(user_id, ticket)
+            raise
+
+    def stop(self, user_id, ticket_id):
+        """
+        Przerywa wykonywane zadanie użytkownika o podanym ID
+
+        Returns:
+            bool: True, jeśli zadanie było aktywne i zostało przerwane
+        """
+        lane = self._lanes.get(user_id)
+        if lane is None:
+            return False
+        for ticket in lane.active:
+            if ticket.id == ticket_id and ticket.cancel(STOPPED):
+                self.stopped += 1
+                return True
+        return False
+
+    def release(self, user_id, ticket):
+        """Zwalnia miejsce w ścieżce i uruchamia kolejne oczekujące zadanie"""
+        lane = self._lanes.get(user_id)
+        if lane is None:
+            return
+        lane.active.discard(ticket)
+
+        while lane.waiting and len(lane.active) < self.max_concurrent:
+            next_ticket, future = lane.waiting.popleft()
+            if future.done():
+                continue
+            lane.active.add(next_ticket)
+            future.set_result(None)
+
+        self._forget_if_idle(user_id, lane)
+
+    def _forget_if_idle(self, user_id, lane):
+        if not lane.active and not lane.waiting:
+            self._lanes.pop(user_id, None)
+
+    def stats(self):
+        """Zwraca statystyki ścieżek"""
+        return {
+            "users": len(self._lanes),
+            "active": sum(len(lane.active) for lane in self._lanes.values()),
+            "waiting": sum(len(lane.waiting) for lane in self._lanes.values()),
+            "rejected": self.rejected,
+            "superseded": self.superseded,
+            "stopped": self.stopped
+        }
+
+# Wspólna instancja dla całego procesu
+_lanes = UserLanes(USER_MAX_CONCURRENT, USER_MAX_QUEUED)
+register_stats("user_lanes", _lanes.stats)
+
+def user_lane(supersede=False, supersedable=False):
+    """
+    Dekorator handlera wykonującego go w ścieżce użytkownika
+
+    Args:
+        supersede (bool): Nowe wywołanie przerywa odpowiedzi generowane dla wcześniejszych wiadomości
+        supersedable (bool): Wywołanie może zostać przerwane przez nowszą wiadomość
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context, *args, **kwargs):
+            user = update.effective_user
+            if user is None:
+                return await handler(update, context, *args, **kwargs)
+
+            ticket = _Ticket(asyncio.current_task(), supersedable)
+            try:
+                await _lanes.acquire(user.id, ticket, supersede)
+            except LaneFull:
+                logger.warning(f"Kolejka użytkownika {user.id} jest pełna - pomijam aktualizację")
+                if update.effective_message:
+                    await update.effective_message.reply_text(
+                        get_text("too_many_requests", get_user_language(context, user.id))
+                    )
+                return
+
+            token = _current_ticket.set(ticket)
+            try:
+                return await handler(update, context, *args, **kwargs)
+            except asyncio.CancelledError:
+                # Przerwanie przez nowszą wiadomość lub przycisk "Stop" nie jest błędem
+                if get_cancel_reason() is None:
+                    raise
+            finally:
+                _current_ticket.reset(token)
+                _lanes.release(user.id, ticket)
+        return wrapper
+    return decorator
+
+def get_cancel_reason():
+    """
+    Zwraca powód przerwania bieżącego zadania (SUPERSEDED, STOPPED) lub None
+
+    Wywoływane w obsłudze asyncio.CancelledError - jeśli zwraca powód, anulowanie zostało
+    wycofane i handler może dokończyć sprzątanie (np. wyświetlić częściową odpowiedź).
+    None oznacza anulowanie z innej przyczyny (np. zamykanie bota) - należy je przekazać dalej.
+    """
+    ticket = _current_ticket.get()
+    if ticket is None or ticket.cancel_reason is None:
+        return None
+    task = asyncio.current_task()
+    if task is not None and task.cancelling():
+        task.uncancel()
+    return ticket.cancel_reason
+
+def end_interruptible():
+    """
+    Kończy fazę, w której zadanie można przerwać (np. po zakończeniu generowania odpowiedzi),
+    aby nowsza wiadomość lub przycisk "Stop" nie przerwały zapisu i pobrania kredytów
+    """
+    ticket = _current_ticket.get()
+    if ticket is not None:
+        ticket.interruptible = False
+
+def current_task_id():
+    """Zwraca ID bieżącego zadania w ścieżce użytkownika (do przycisku "Stop") lub None"""
+    ticket = _current_ticket.get()
+    return ticket.id if ticket is not None else None
+
+def stop_generation(user_id, task_id):
+    """
+    Przerywa generowanie odpowiedzi uruchomione w ścieżce użytkownika
+
+    Args:
+        user_id (int): ID użytkownika (tylko właściciel może zatrzymać swoją odpowiedź)
+        task_id (int): ID zadania z przycisku "Stop"
+
+    Returns:
+        bool: True, jeśli generowanie zostało przerwane
+    """
+    return _lanes.stop(user_id, task_id)